@@ -11,10 +11,15 @@ from app_config import (
     load_settings as app_config_load_settings,
     load_rules as app_config_load_rules
 )
-from database import init_conflict_db
+from database import init_conflict_db, get_db_connection, mark_interrupted_runs
+from log_storage import upgrade_legacy_log_partitions
 from hydrus_interface import call_hydrus_api # For initial service fetch
 from views import views_bp # Import the Blueprint from views.py
-from scheduler_tasks import scheduler, schedule_rules_job as schedule_job_from_tasks_module
+from engine_worker import start_engine_worker
+from scheduler_tasks import (
+    scheduler, schedule_rules_job as schedule_job_from_tasks_module,
+    schedule_override_gc_job, schedule_log_maintenance_job, register_scheduler_listeners
+)
 
 # --- Global App Variable (Flask instance) ---
 # This will be configured by create_app function.
@@ -65,11 +70,20 @@ def create_app():
     try:
         logger.info("Attempting to initialize database...")
         init_conflict_db() # From database.py
+        # Month partition files of the text log schema are converted once the main tables are compact
+        partition_conn = get_db_connection()
+        try:
+            upgrade_legacy_log_partitions(partition_conn)
+        finally:
+            partition_conn.close()
         logger.info("Database initialization process completed.")
     except Exception as e:
         logger.fatal(f"FATAL: Failed to initialize database: {e}. Application cannot start.", exc_info=True)
         sys.exit(1) # Exit if DB initialization fails
 
+    # The background execution log writer belongs to the engine worker, which does all rule and
+    # maintenance writes (see engine_worker.py); the web process only queues jobs.
+
     # --- Register Blueprints (contains all the routes) ---
     app.register_blueprint(views_bp)
     logger.info("Views blueprint registered.")
@@ -77,6 +91,7 @@ def create_app():
     # --- Initialize Scheduler ---
     # The scheduler instance is imported from scheduler_tasks.py
     scheduler.init_app(app)
+    register_scheduler_listeners() # Flushes queued log writes when the scheduler shuts down
     logger.info("APScheduler initialized with Flask app.")
 
     return app
@@ -132,6 +147,15 @@ if __name__ == '__main__':
             logger.info("Flask reloader detected: Scheduler WILL be started by this main process.")
     
     if run_scheduler_process:
+        # Runs left 'in_progress' in run_progress were cut short by the last shutdown; the rules job
+        # resumes them. Done before the scheduler starts, while no run of this process exists yet.
+        progress_conn = get_db_connection()
+        try:
+            mark_interrupted_runs(progress_conn)
+        finally:
+            progress_conn.close()
+        # Rule runs are executed by the engine worker; the routes and the rules job only queue them
+        start_engine_worker(app_instance)
         logger.info("Starting APScheduler...")
         scheduler.start() # Start the scheduler imported from scheduler_tasks
         logger.info("APScheduler started.")
@@ -139,6 +163,8 @@ if __name__ == '__main__':
         with app_instance.app_context():
             logger.info("Performing initial scheduling of rules job...")
             schedule_job_from_tasks_module(app_instance) # Pass the app_instance
+            schedule_override_gc_job(app_instance)
+            schedule_log_maintenance_job(app_instance)
     else:
         logger.info("Scheduler not started by this process (likely due to Flask reloader or configuration).")
 
@@ -149,6 +175,6 @@ if __name__ == '__main__':
         host='127.0.0.1',
         port=5556,
         debug=APP_DEBUG_MODE, # Use the debug mode from app_instance.config
-        threaded=True, # Good for dev with scheduler
+        threaded=True, # Requests only queue rule runs (see engine_worker.py); they never wait for one
         use_reloader=APP_DEBUG_MODE # Controlled by APP_DEBUG_MODE
     )
\ No newline at end of file
@@ -16,6 +16,8 @@ DEFAULT_SETTINGS = {
     'api_address': 'http://localhost:45869',
     'api_key': '',
     'rule_interval_seconds': 0,
+    'rule_interval_adaptive': False, # Back off from rule_interval_seconds when runs find nothing to do
+    'rule_interval_max_seconds': 3600, # Longest delay between runs in adaptive mode
     'last_viewed_threshold_seconds': 3600,
     'secret_key': None,
     'show_run_notifications': True,
@@ -23,9 +25,27 @@ DEFAULT_SETTINGS = {
     'theme': 'Default',
     'available_themes': ['Default'],
     'butler_name': 'Hydrus Butler',
-    'log_overridden_actions': False
+    'log_overridden_actions': False,
+    'override_gc_interval_hours': 24,
+    'override_ttl_days': 0,
+    'log_maintenance_interval_hours': 24,
+    'log_retention_days': 0, # 0 = keep raw execution logs forever (daily rollups are always kept)
+    'log_retention_archive': True, # Move expired raw logs to db/log_partitions/archive/ instead of deleting them
+    'log_batch_size': 500, # Rows per executemany chunk when writing file_action_details
+    'async_log_writer': True, # Write execution logs from a background thread (takes effect on restart)
+    'log_writer_queue_size': 10000, # Max queued log statements before rule execution blocks (backpressure)
+    'log_query_cache_entries': 256, # Cached /logs/search counts and pages (0 disables the cache)
+    'rule_execution_workers': 1, # Rules that don't conflict run concurrently on up to this many threads (1 = one at a time; more needs async_log_writer)
+    'library_change_probe': True, # Skip scheduled rule executions that can't find new work (see library_probe.py)
+    'library_change_probe_max_skip_seconds': 3600, # Run every due rule at least this often, whatever the probe says
+    'library_change_probe_count_files': False, # Count the files of probed services, so rules that files leaving a service affect can be skipped too (lists every file ID of each, every tick)
+    'run_time_budget_seconds': 0, # Stop a run after this long and leave the rest to the next run (0 = no limit)
+    'rule_time_budget_seconds': 0, # Same for each rule of a run (0 = no limit)
+    'engine_worker_mode': 'process' # Where rule runs execute: 'process' or 'thread' (see engine_worker.py; takes effect on restart)
 }
 
+ENGINE_WORKER_MODES = ('process', 'thread')
+
 def _discover_themes():
     """Scans for available themes in the static/css directory."""
     available_themes_discovered = []
@@ -107,6 +127,63 @@ def load_settings():
         logger.warning("Invalid value for last_viewed_threshold_seconds. Using default.")
         final_settings['last_viewed_threshold_seconds'] = DEFAULT_SETTINGS['last_viewed_threshold_seconds']
 
+    for int_setting_name in ('rule_interval_max_seconds', 'library_change_probe_max_skip_seconds', 'override_gc_interval_hours',
+                             'override_ttl_days', 'log_maintenance_interval_hours', 'log_retention_days',
+                             'run_time_budget_seconds', 'rule_time_budget_seconds'):
+        try:
+            final_settings[int_setting_name] = max(0, int(final_settings.get(int_setting_name, DEFAULT_SETTINGS[int_setting_name])))
+        except (ValueError, TypeError):
+            logger.warning(f"Invalid value for {int_setting_name}. Using default.")
+            final_settings[int_setting_name] = DEFAULT_SETTINGS[int_setting_name]
+
+    try:
+        final_settings['log_batch_size'] = max(1, int(final_settings.get('log_batch_size', DEFAULT_SETTINGS['log_batch_size'])))
+    except (ValueError, TypeError):
+        logger.warning("Invalid value for log_batch_size. Using default.")
+        final_settings['log_batch_size'] = DEFAULT_SETTINGS['log_batch_size']
+
+    try:
+        final_settings['log_writer_queue_size'] = max(1, int(final_settings.get('log_writer_queue_size', DEFAULT_SETTINGS['log_writer_queue_size'])))
+    except (ValueError, TypeError):
+        logger.warning("Invalid value for log_writer_queue_size. Using default.")
+        final_settings['log_writer_queue_size'] = DEFAULT_SETTINGS['log_writer_queue_size']
+
+    try:
+        final_settings['rule_execution_workers'] = max(1, int(final_settings.get('rule_execution_workers', DEFAULT_SETTINGS['rule_execution_workers'])))
+    except (ValueError, TypeError):
+        logger.warning("Invalid value for rule_execution_workers. Using default.")
+        final_settings['rule_execution_workers'] = DEFAULT_SETTINGS['rule_execution_workers']
+
+    try:
+        final_settings['log_query_cache_entries'] = max(0, int(final_settings.get('log_query_cache_entries', DEFAULT_SETTINGS['log_query_cache_entries'])))
+    except (ValueError, TypeError):
+        logger.warning("Invalid value for log_query_cache_entries. Using default.")
+        final_settings['log_query_cache_entries'] = DEFAULT_SETTINGS['log_query_cache_entries']
+
+    if not isinstance(final_settings.get('library_change_probe'), bool):
+        logger.warning("Invalid value for library_change_probe. Using default.")
+        final_settings['library_change_probe'] = DEFAULT_SETTINGS['library_change_probe']
+
+    if not isinstance(final_settings.get('library_change_probe_count_files'), bool):
+        logger.warning("Invalid value for library_change_probe_count_files. Using default.")
+        final_settings['library_change_probe_count_files'] = DEFAULT_SETTINGS['library_change_probe_count_files']
+
+    if not isinstance(final_settings.get('rule_interval_adaptive'), bool):
+        logger.warning("Invalid value for rule_interval_adaptive. Using default.")
+        final_settings['rule_interval_adaptive'] = DEFAULT_SETTINGS['rule_interval_adaptive']
+
+    if not isinstance(final_settings.get('log_retention_archive'), bool):
+        logger.warning("Invalid value for log_retention_archive. Using default.")
+        final_settings['log_retention_archive'] = DEFAULT_SETTINGS['log_retention_archive']
+
+    if not isinstance(final_settings.get('async_log_writer'), bool):
+        logger.warning("Invalid value for async_log_writer. Using default.")
+        final_settings['async_log_writer'] = DEFAULT_SETTINGS['async_log_writer']
+
+    if final_settings.get('engine_worker_mode') not in ENGINE_WORKER_MODES:
+        logger.warning(f"Invalid value for engine_worker_mode (expected one of {', '.join(ENGINE_WORKER_MODES)}). Using default.")
+        final_settings['engine_worker_mode'] = DEFAULT_SETTINGS['engine_worker_mode']
+
     if not isinstance(final_settings.get('show_run_notifications'), bool):
         logger.warning("Invalid value for show_run_notifications. Using default.")
         final_settings['show_run_notifications'] = DEFAULT_SETTINGS['show_run_notifications']
@@ -141,7 +218,9 @@ def load_settings():
         settings.get('theme') != final_settings['theme'] or # If theme was reset
         'show_run_all_notifications' not in settings or # If new setting missing
         'butler_name' not in settings or final_settings['butler_name'] != settings.get('butler_name') or # Sanitized or new
-        'log_overridden_actions' not in settings 
+        'log_overridden_actions' not in settings or
+        'override_gc_interval_hours' not in settings or 'override_ttl_days' not in settings or
+        'log_maintenance_interval_hours' not in settings or 'log_retention_days' not in settings
     )
 
     if should_save_file:
@@ -204,11 +283,24 @@ def save_settings_to_file(submitted_settings_data, current_app_config):
         logger.warning("Invalid value for last_viewed_threshold_seconds during save. Keeping existing or default.")
         settings_to_save['last_viewed_threshold_seconds'] = settings_on_disk.get('last_viewed_threshold_seconds', DEFAULT_SETTINGS['last_viewed_threshold_seconds'])
         
+    for int_setting_name in ('rule_interval_max_seconds', 'override_gc_interval_hours', 'override_ttl_days', 'log_maintenance_interval_hours', 'log_retention_days',
+                             'run_time_budget_seconds', 'rule_time_budget_seconds'):
+        try:
+            submitted_value = submitted_settings_data.get(int_setting_name)
+            if submitted_value is not None:
+                settings_to_save[int_setting_name] = max(0, int(submitted_value))
+            # If not submitted, settings_to_save keeps the value from settings_on_disk
+        except (ValueError, TypeError):
+            logger.warning(f"Invalid value for {int_setting_name} during save. Keeping existing or default.")
+            settings_to_save[int_setting_name] = settings_on_disk.get(int_setting_name, DEFAULT_SETTINGS[int_setting_name])
+
     # Boolean checkbox values
     # request.form.get('checkbox_name') in views.py returns "on" if checked, None if unchecked.
     settings_to_save['show_run_notifications'] = submitted_settings_data.get('show_run_notifications') is not None
     settings_to_save['show_run_all_notifications'] = submitted_settings_data.get('show_run_all_notifications') is not None
     settings_to_save['log_overridden_actions'] = submitted_settings_data.get('log_overridden_actions') is not None
+    settings_to_save['log_retention_archive'] = submitted_settings_data.get('log_retention_archive') is not None
+    settings_to_save['rule_interval_adaptive'] = submitted_settings_data.get('rule_interval_adaptive') is not None
     
     # Ensure 'secret_key' and 'available_themes' are preserved from the on-disk load
     settings_to_save['secret_key'] = settings_on_disk.get('secret_key') # Should always be there after load_settings
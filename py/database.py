@@ -2,19 +2,36 @@ import os
 import sqlite3
 import json
 import uuid
-from datetime import datetime
+import hashlib
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
 import logging
 
+from log_writer import submit_write, submit_write_many
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-DB_DIR = os.path.join(BASE_DIR, 'db')
+# HYDRUS_BUTLER_DB_DIR puts the database (and its log partitions) elsewhere, e.g. a scratch directory for the tests
+DB_DIR = os.environ.get('HYDRUS_BUTLER_DB_DIR') or os.path.join(BASE_DIR, 'db')
 CONFLICT_DB_FILE = os.path.join(DB_DIR, 'conflict_overrides.db')
 
-def init_conflict_db():
+# Indexes of older schema versions that a composite index now covers (see query_plan_audit.py)
+REPLACED_INDEXES = (
+    "idx_overrides_winning_rule_id",          # -> idx_overrides_winning_rule_cover
+    "idx_overrides_file_hash_action",         # Duplicated the overrides primary key
+    "idx_rule_versions_rule_id",              # -> idx_rule_versions_rule_id_timestamp
+    "idx_execution_runs_start_time",          # -> idx_execution_runs_start_time_run_id
+    "idx_file_action_details_rule_exec_id",   # -> idx_file_action_details_rule_exec_id_timestamp
+    "idx_file_action_details_file_hash",      # -> idx_file_action_details_file_hash_timestamp
+    "idx_engine_jobs_status",                 # -> idx_engine_jobs_queue
+)
+
+def init_conflict_db(db_file=CONFLICT_DB_FILE):
     """
-    Initializes the database:
+    Initializes the database (db_file defaults to the app database; query_plan_audit.py passes a scratch file):
     - Creates the database directory if it doesn't exist.
     - Creates tables for conflict overrides and detailed execution logging,
       reflecting the new importance and rule action type logic.
@@ -23,13 +40,19 @@ def init_conflict_db():
     logger.info("--- Initializing/Verifying Database (with importance logic) ---")
     conn = None
     try:
-        if not os.path.exists(DB_DIR):
-            os.makedirs(DB_DIR)
-            logger.info(f"Created database directory: {DB_DIR}")
+        db_dir = os.path.dirname(db_file)
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+            logger.info(f"Created database directory: {db_dir}")
 
-        conn = sqlite3.connect(CONFLICT_DB_FILE)
+        # Unpooled: the schema setup connection is closed for real at the end. Also switches the file to WAL.
+        conn = _open_configured_connection(db_file)
         cursor = conn.cursor()
 
+        # Log tables of the older text schema are renamed out of the way here and copied into the
+        # compact tables below (see _copy_legacy_log_tables)
+        legacy_log_tables = _set_aside_legacy_log_tables(conn)
+
         # --- 1. Conflict Overrides Table ---
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS overrides (
@@ -44,38 +67,51 @@ def init_conflict_db():
                 PRIMARY KEY (file_hash, action_type, action_key)
             )
         ''')
+        # Covers remove_overrides_for_rule and the grouping/deletes of remove_stale_rule_overrides without
+        # touching the table. Lookups by (file_hash, action_type, action_key) use the primary key.
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_overrides_winning_rule_id
-            ON overrides (winning_rule_id)
+            CREATE INDEX IF NOT EXISTS idx_overrides_winning_rule_cover
+            ON overrides (winning_rule_id, action_type, action_key, winning_rule_importance, winning_rule_action_type)
         ''')
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_overrides_file_hash_action
-            ON overrides (file_hash, action_type, action_key)
-        ''')
+            CREATE INDEX IF NOT EXISTS idx_overrides_timestamp
+            ON overrides (timestamp)
+        ''') # Used by the override garbage collector's TTL expiry
         logger.info("Table 'overrides' initialized/verified.")
 
         # --- 2. Rule Versions Table ---
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS rule_versions (
-                rule_version_id TEXT PRIMARY KEY,
+                rule_version_key INTEGER PRIMARY KEY, -- Compact key referenced by rule_executions_in_run
+                rule_version_id TEXT NOT NULL UNIQUE,
                 rule_id TEXT NOT NULL,
                 rule_name_at_version TEXT NOT NULL,
                 importance_at_version INTEGER NOT NULL, -- This field stores the importance of the rule at the time of this version
                 conditions_json_at_version TEXT NOT NULL,
                 action_json_at_version TEXT NOT NULL,
-                version_timestamp TEXT NOT NULL
+                version_timestamp TEXT NOT NULL,
+                content_hash TEXT -- rule_version_content_hash() of importance, conditions and action
             )
         ''')
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_rule_versions_rule_id
-            ON rule_versions (rule_id)
-        ''')
+            CREATE INDEX IF NOT EXISTS idx_rule_versions_rule_id_timestamp
+            ON rule_versions (rule_id, version_timestamp)
+        ''') # Also serves "newest version of a rule" lookups
+        cursor.execute("PRAGMA table_info(rule_versions)")
+        rule_version_hashes_missing = 'content_hash' not in {row[1] for row in cursor.fetchall()}
+        if rule_version_hashes_missing:
+            cursor.execute("ALTER TABLE rule_versions ADD COLUMN content_hash TEXT")
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_rule_versions_rule_id_content_hash
+            ON rule_versions (rule_id, content_hash)
+        ''') # get_or_create_active_rule_version lookups; rows not hashed yet (NULL) don't collide
         logger.info("Table 'rule_versions' initialized/verified.")
 
         # --- 3. Execution Runs Table ---
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS execution_runs (
-                run_id TEXT PRIMARY KEY,
+                run_key INTEGER PRIMARY KEY,         -- Compact key referenced by rule_executions_in_run
+                run_id TEXT NOT NULL UNIQUE,
                 run_type TEXT NOT NULL,
                 start_time TEXT NOT NULL,
                 end_time TEXT,
@@ -84,9 +120,9 @@ def init_conflict_db():
             )
         ''')
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_execution_runs_start_time
-            ON execution_runs (start_time)
-        ''')
+            CREATE INDEX IF NOT EXISTS idx_execution_runs_start_time_run_id
+            ON execution_runs (start_time, run_id)
+        ''') # Time range + keyset order of the general runs log, tiebreaker included
         cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_execution_runs_run_type
             ON execution_runs (run_type)
@@ -94,95 +130,811 @@ def init_conflict_db():
         logger.info("Table 'execution_runs' initialized/verified.")
 
         # --- 4. Rule Executions In Run Table ---
+        # Compact log schema: parents are referenced by integer keys, times are UTC epoch milliseconds
+        # and statuses are log_codes codes (see "Compact Log Schema" below). The views convert them back.
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS rule_executions_in_run (
-                rule_execution_id TEXT PRIMARY KEY,
-                run_id TEXT NOT NULL,
+                rule_execution_key INTEGER PRIMARY KEY, -- Compact key referenced by file_action_details
+                rule_execution_id TEXT NOT NULL UNIQUE,
+                run_key INTEGER NOT NULL,
                 rule_id TEXT NOT NULL,
-                rule_version_id TEXT NOT NULL,
+                rule_version_key INTEGER NOT NULL,
                 execution_order_in_run INTEGER,
-                start_time TEXT NOT NULL,
-                end_time TEXT,
-                status TEXT NOT NULL,
+                start_time_ms INTEGER NOT NULL,
+                end_time_ms INTEGER,
+                status_code INTEGER NOT NULL,
                 matched_search_count INTEGER,
                 eligible_for_action_count INTEGER,
                 actions_attempted_count INTEGER,
                 actions_succeeded_count INTEGER,
                 summary_message_from_logic TEXT,
                 details_json_from_logic TEXT,
-                FOREIGN KEY (run_id) REFERENCES execution_runs (run_id) ON DELETE CASCADE,
-                FOREIGN KEY (rule_version_id) REFERENCES rule_versions (rule_version_id) ON DELETE RESTRICT
+                FOREIGN KEY (run_key) REFERENCES execution_runs (run_key) ON DELETE CASCADE,
+                FOREIGN KEY (rule_version_key) REFERENCES rule_versions (rule_version_key) ON DELETE RESTRICT
             )
         ''')
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_rule_executions_run_id
-            ON rule_executions_in_run (run_id)
+            CREATE INDEX IF NOT EXISTS idx_rule_executions_run_key
+            ON rule_executions_in_run (run_key)
         ''')
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_rule_executions_rule_id_version_id
-            ON rule_executions_in_run (rule_id, rule_version_id)
+            CREATE INDEX IF NOT EXISTS idx_rule_executions_rule_id_version_key
+            ON rule_executions_in_run (rule_id, rule_version_key)
         ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_rule_executions_rule_id_start_time
+            ON rule_executions_in_run (rule_id, start_time_ms)
+        ''') # /logs/search by rule_id: filter, time range and default sort (the key is the implicit rowid suffix)
         logger.info("Table 'rule_executions_in_run' initialized/verified.")
 
-        # --- 5. File Action Details Table ---
+        # --- 5. Action Parameters Table ---
+        # Content-addressed store for the action parameters JSON of file_action_details rows.
+        # Every file of an execution usually shares the same parameters, so each row only keeps an id.
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS file_action_details (
-                log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                rule_execution_id TEXT NOT NULL,
-                file_hash TEXT NOT NULL,
+            CREATE TABLE IF NOT EXISTS action_parameters (
+                action_parameters_id INTEGER PRIMARY KEY,
+                params_hash TEXT NOT NULL UNIQUE,     -- sha256 hex digest of params_json
+                params_json TEXT NOT NULL
+            )
+        ''')
+        logger.info("Table 'action_parameters' initialized/verified.")
+
+        # Statuses and action types of the compact log tables, as small integer codes
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_codes (
+                code INTEGER PRIMARY KEY,
+                code_name TEXT NOT NULL UNIQUE        -- e.g. "success", "skipped_recent_view", "add_tags"
+            )
+        ''')
+        logger.info("Table 'log_codes' initialized/verified.")
+
+        # --- 6. File Action Details Table ---
+        cursor.execute(FILE_ACTION_DETAILS_TABLE_SQL.format(table_name="file_action_details"))
+        # The log search filters on the rule execution or file_hash and orders by action time; with the
+        # time in the index (and log_id as the implicit rowid suffix) pages are read in index order.
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_file_action_details_rule_exec_key_time
+            ON file_action_details (rule_execution_key, action_time_ms)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_file_action_details_file_hash_time
+            ON file_action_details (file_hash, action_time_ms)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_file_action_details_action_time
+            ON file_action_details (action_time_ms)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_file_action_details_skip_aggregates
+            ON file_action_details (aggregated_file_count) WHERE aggregated_file_count IS NOT NULL
+        ''') # Lets the file hash search visit only aggregate rows when looking inside packed hash lists
+        logger.info("Table 'file_action_details' initialized/verified.")
+
+        if legacy_log_tables:
+            _copy_legacy_log_tables(conn, legacy_log_tables)
+        if rule_version_hashes_missing or "rule_versions" in legacy_log_tables:
+            _backfill_rule_version_hashes(conn)
+        _rule_version_id_cache.clear() # Cached ids may belong to another database file
+
+        # --- 7. Log Rollups and Maintenance State (see log_storage.py) ---
+        # Daily summaries that outlive raw log retention. Days are UTC 'YYYY-MM-DD'.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS daily_rule_execution_rollups (
+                day TEXT NOT NULL,
+                rule_id TEXT NOT NULL,
+                rule_version_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                execution_count INTEGER NOT NULL,
+                matched_search_count INTEGER NOT NULL,
+                eligible_for_action_count INTEGER NOT NULL,
+                actions_attempted_count INTEGER NOT NULL,
+                actions_succeeded_count INTEGER NOT NULL,
+                PRIMARY KEY (day, rule_id, rule_version_id, status)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS daily_file_action_rollups (
+                day TEXT NOT NULL,
+                rule_id TEXT NOT NULL,
                 action_type_performed TEXT NOT NULL,
-                action_parameters_json_at_exec TEXT NOT NULL,
                 status TEXT NOT NULL,
-                error_message TEXT,
-                override_info_json TEXT,
-                action_timestamp TEXT NOT NULL,
-                FOREIGN KEY (rule_execution_id) REFERENCES rule_executions_in_run (rule_execution_id) ON DELETE CASCADE
+                file_count INTEGER NOT NULL,
+                PRIMARY KEY (day, rule_id, action_type_performed, status)
             )
         ''')
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_file_action_details_rule_exec_id
-            ON file_action_details (rule_execution_id)
+            CREATE TABLE IF NOT EXISTS log_maintenance_state (
+                state_key TEXT PRIMARY KEY,
+                state_value TEXT NOT NULL
+            )
         ''')
+        logger.info("Log rollup tables initialized/verified.")
+
+        # --- 8. Full-Text Indexes for the Log Search ---
+        _init_log_search_fts(conn)
+
+        # --- 9. Hourly Rule Statistics (see rule_stats.py) ---
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rule_stats_hourly'")
+        rule_stats_table_is_new = cursor.fetchone() is None
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_file_action_details_file_hash
-            ON file_action_details (file_hash)
+            CREATE TABLE IF NOT EXISTS rule_stats_hourly (
+                hour TEXT NOT NULL,                  -- UTC 'YYYY-MM-DDTHH' of the execution start
+                rule_id TEXT NOT NULL,
+                rule_version_id TEXT NOT NULL,
+                status TEXT NOT NULL,                -- Final rule_executions_in_run status
+                execution_count INTEGER NOT NULL,
+                files_matched INTEGER NOT NULL,
+                files_eligible INTEGER NOT NULL,
+                files_attempted INTEGER NOT NULL,
+                files_succeeded INTEGER NOT NULL,
+                files_skipped INTEGER NOT NULL,      -- Recently viewed + lost to a higher-importance override
+                total_duration_ms INTEGER NOT NULL,
+                max_duration_ms INTEGER NOT NULL,
+                PRIMARY KEY (hour, rule_id, rule_version_id, status)
+            )
         ''')
+        if rule_stats_table_is_new:
+            _backfill_rule_stats_hourly(conn)
+        logger.info("Table 'rule_stats_hourly' initialized/verified.")
+
+        # --- 10. Run Progress Checkpoints (see start_run_progress) ---
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_file_action_details_action_timestamp
-            ON file_action_details (action_timestamp)
+            CREATE TABLE IF NOT EXISTS run_progress (
+                run_id TEXT PRIMARY KEY,
+                run_type TEXT NOT NULL,
+                rule_ids_json TEXT NOT NULL,          -- Rule ids in running order, fixed when the run starts
+                rules_completed INTEGER NOT NULL,     -- How many of them finished and were committed
+                last_completed_rule_id TEXT,
+                status TEXT NOT NULL,                 -- 'in_progress' or 'interrupted' (left by an earlier process)
+                resume_count INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            )
         ''')
-        logger.info("Table 'file_action_details' initialized/verified.")
+        logger.info("Table 'run_progress' initialized/verified.")
+
+        # --- 11. Last Scheduled Run per Rule (rules with their own 'interval_seconds'/'cron') ---
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rule_last_runs (
+                rule_id TEXT PRIMARY KEY,
+                last_run_time_ms INTEGER NOT NULL,    -- Start of the scheduled run that last ran the rule (epoch ms)
+                inputs_hash TEXT,                     -- rule_version_content_hash() of the rule as it ran
+                needs_rerun INTEGER NOT NULL DEFAULT 0 -- 1 if that execution left work behind (failed, recently viewed files)
+            )
+        ''')
+        cursor.execute("PRAGMA table_info(rule_last_runs)")
+        rule_last_runs_columns = {row[1] for row in cursor.fetchall()}
+        if 'inputs_hash' not in rule_last_runs_columns:
+            cursor.execute("ALTER TABLE rule_last_runs ADD COLUMN inputs_hash TEXT")
+        if 'needs_rerun' not in rule_last_runs_columns:
+            cursor.execute("ALTER TABLE rule_last_runs ADD COLUMN needs_rerun INTEGER NOT NULL DEFAULT 0")
+        logger.info("Table 'rule_last_runs' initialized/verified.")
+
+        # --- 12. Scheduler State (library change probe, see library_probe.py) ---
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduler_state (
+                state_key TEXT PRIMARY KEY,
+                state_value TEXT NOT NULL
+            )
+        ''')
+        logger.info("Table 'scheduler_state' initialized/verified.")
+
+        # --- 13. Engine Job Queue (rule runs taken by the engine worker, see engine_worker.py) ---
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS engine_jobs (
+                job_key INTEGER PRIMARY KEY,          -- Queue order
+                job_id TEXT NOT NULL UNIQUE,
+                job_type TEXT NOT NULL,               -- 'scheduled_all', 'manual_all', 'manual_single' or a maintenance job (see ENGINE_JOB_PRIORITIES)
+                priority INTEGER NOT NULL DEFAULT 0,  -- ENGINE_JOB_PRIORITIES[job_type]: lower is taken first
+                rule_id TEXT,                         -- Rule of a 'manual_single' job
+                status TEXT NOT NULL,                 -- 'queued', 'running', 'completed', 'failed', 'cancelled' or 'interrupted'
+                enqueued_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                worker_pid INTEGER,
+                result_json TEXT,                     -- What the job returned (see engine_worker.run_engine_job)
+                cancel_requested INTEGER NOT NULL DEFAULT 0 -- 1 once cancelling the running job was asked for
+            )
+        ''')
+        cursor.execute("PRAGMA table_info(engine_jobs)")
+        engine_jobs_columns = {row[1] for row in cursor.fetchall()}
+        if 'cancel_requested' not in engine_jobs_columns:
+            cursor.execute("ALTER TABLE engine_jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+        if 'priority' not in engine_jobs_columns:
+            cursor.execute("ALTER TABLE engine_jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            for job_type, priority in ENGINE_JOB_PRIORITIES.items():
+                cursor.execute("UPDATE engine_jobs SET priority = ? WHERE job_type = ?", (priority, job_type))
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_engine_jobs_queue ON engine_jobs (status, priority, job_key)")
+        logger.info("Table 'engine_jobs' initialized/verified.")
+
+        # --- 14. Indexes Replaced by Composite Ones Above ---
+        for replaced_index in REPLACED_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {replaced_index}")
 
         conn.commit()
-        logger.info(f"Database schema initialized/verified at {CONFLICT_DB_FILE}")
+        logger.info(f"Database schema initialized/verified at {db_file}")
     except sqlite3.Error as e:
         logger.critical(f"CRITICAL ERROR initializing/verifying database schema: {e}")
         if conn:
             conn.rollback()
         raise
     except OSError as e:
-        logger.critical(f"CRITICAL ERROR creating database directory {DB_DIR}: {e}")
+        logger.critical(f"CRITICAL ERROR creating database directory for {db_file}: {e}")
         raise
     finally:
         if conn:
             conn.close()
         logger.info("--- Finished Initializing/Verifying Database ---")
 
+def _backfill_rule_version_hashes(conn):
+    """
+    Sets content_hash on rule_versions rows that have none (databases created before the column,
+    or just copied from the text log schema). When a rule has several identical versions, only the
+    newest gets the hash, as get_or_create_active_rule_version used to return the newest of them.
+    Runs inside the caller's transaction.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT rule_version_key, importance_at_version, conditions_json_at_version, action_json_at_version
+        FROM rule_versions WHERE content_hash IS NULL
+        ORDER BY version_timestamp DESC, rule_version_key DESC
+    ''')
+    # One row at a time, newest first: OR IGNORE then skips the older duplicates of a hashed version
+    for rule_version_key, importance, conditions_json, action_json in cursor.fetchall():
+        conn.execute(
+            "UPDATE OR IGNORE rule_versions SET content_hash = ? WHERE rule_version_key = ?",
+            (rule_version_content_hash(importance, conditions_json, action_json), rule_version_key)
+        )
+
+def _backfill_rule_stats_hourly(conn):
+    """
+    Fills a newly created rule_stats_hourly from the existing logs: finished raw executions, plus the
+    daily rollups for days whose raw rows may already be gone (put in each day's first hour, without
+    skip counts or durations, which the daily rollups don't have). Runs inside the caller's transaction.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT state_value FROM log_maintenance_state WHERE state_key = 'rollup_watermark_day'")
+    row = cursor.fetchone()
+    watermark_day = row[0] if row else None
+    cursor.execute('''
+        INSERT INTO rule_stats_hourly (
+            hour, rule_id, rule_version_id, status, execution_count, files_matched, files_eligible,
+            files_attempted, files_succeeded, files_skipped, total_duration_ms, max_duration_ms
+        )
+        SELECT strftime('%Y-%m-%dT%H', rei.start_time_ms / 1000, 'unixepoch'), rei.rule_id, rv.rule_version_id,
+               status.code_name, COUNT(*),
+               SUM(COALESCE(rei.matched_search_count, 0)), SUM(COALESCE(rei.eligible_for_action_count, 0)),
+               SUM(COALESCE(rei.actions_attempted_count, 0)), SUM(COALESCE(rei.actions_succeeded_count, 0)),
+               SUM(CASE WHEN json_valid(rei.details_json_from_logic) THEN
+                       COALESCE(json_extract(rei.details_json_from_logic, '$.files_skipped_due_to_recent_view'), 0)
+                       + COALESCE(json_extract(rei.details_json_from_logic, '$.files_skipped_due_to_override'), 0)
+                   ELSE 0 END),
+               SUM(MAX(0, rei.end_time_ms - rei.start_time_ms)), MAX(MAX(0, rei.end_time_ms - rei.start_time_ms))
+        FROM rule_executions_in_run rei
+        JOIN rule_versions rv ON rv.rule_version_key = rei.rule_version_key
+        JOIN log_codes status ON status.code = rei.status_code
+        WHERE rei.end_time_ms IS NOT NULL AND rei.start_time_ms >= ?
+        GROUP BY 1, 2, 3, 4
+    ''', (iso_to_epoch_ms(watermark_day + "T00:00:00Z") if watermark_day else 0,))
+    backfilled = cursor.rowcount
+    if watermark_day:
+        cursor.execute('''
+            INSERT OR IGNORE INTO rule_stats_hourly (
+                hour, rule_id, rule_version_id, status, execution_count, files_matched, files_eligible,
+                files_attempted, files_succeeded, files_skipped, total_duration_ms, max_duration_ms
+            )
+            SELECT day || 'T00', rule_id, rule_version_id, status, execution_count, matched_search_count,
+                   eligible_for_action_count, actions_attempted_count, actions_succeeded_count, 0, 0, 0
+            FROM daily_rule_execution_rollups
+            WHERE day < ?
+        ''', (watermark_day,))
+        backfilled += cursor.rowcount
+    if backfilled:
+        logger.info(f"Backfilled {backfilled} rule_stats_hourly rows from existing execution logs.")
+
+FILE_ACTION_DETAILS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        rule_execution_key INTEGER NOT NULL,    -- rule_executions_in_run.rule_execution_key
+        file_hash TEXT NOT NULL,
+        action_type_code INTEGER NOT NULL,      -- log_codes.code of the action type performed
+        action_parameters_id INTEGER NOT NULL,  -- References action_parameters; resolve with a join
+        status_code INTEGER NOT NULL,           -- log_codes.code
+        error_message TEXT,
+        override_info_json TEXT,
+        action_time_ms INTEGER NOT NULL,        -- UTC epoch milliseconds
+        aggregated_file_count INTEGER,          -- Skip aggregates only: number of files the row stands for
+        aggregated_file_hashes BLOB,            -- Skip aggregates only: sorted 32-byte binary hashes, concatenated
+        FOREIGN KEY (rule_execution_key) REFERENCES rule_executions_in_run (rule_execution_key) ON DELETE CASCADE,
+        FOREIGN KEY (action_parameters_id) REFERENCES action_parameters (action_parameters_id) ON DELETE RESTRICT
+    )
+'''
+
+# Column order of file_action_details; log month partitions (log_storage.py) are read with this list.
+FILE_ACTION_DETAILS_COLUMNS = (
+    "log_id", "rule_execution_key", "file_hash", "action_type_code", "action_parameters_id",
+    "status_code", "error_message", "override_info_json", "action_time_ms",
+    "aggregated_file_count", "aggregated_file_hashes"
+)
+
+# --- Compact Log Schema ---
+# The log tables written per rule execution and per file keep their rows small: rule_executions_in_run
+# and file_action_details reference their parents by INTEGER keys (the UUIDs are only stored in
+# execution_runs, rule_versions and rule_executions_in_run itself), store times as INTEGER UTC epoch
+# milliseconds and statuses/action types as codes of the log_codes table. Writers pass names and UUIDs
+# and let the INSERT resolve them with indexed subqueries (the LOG_CODE_SQL fragment, after queuing
+# LOG_CODE_INSERT_SQL), the same way action parameters are resolved by hash. Readers select the
+# compact columns and convert them with epoch_ms_to_iso() and get_log_code_names().
+LOG_CODE_INSERT_SQL = "INSERT OR IGNORE INTO log_codes (code_name) VALUES (?)"
+LOG_CODE_SQL = "(SELECT code FROM log_codes WHERE code_name = ?)"
+_EPOCH = datetime(1970, 1, 1)
+
+def epoch_ms(dt):
+    """Naive UTC datetime -> integer epoch milliseconds."""
+    return (dt - _EPOCH) // timedelta(milliseconds=1)
+
+def iso_to_epoch_ms(iso_string):
+    """ISO 8601 timestamp ('...Z', an offset, or naive UTC) -> integer epoch milliseconds."""
+    dt = datetime.fromisoformat(iso_string[:-1] if iso_string.endswith("Z") else iso_string)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return epoch_ms(dt)
+
+def epoch_ms_to_iso(milliseconds):
+    """Integer epoch milliseconds -> 'YYYY-MM-DDTHH:MM:SS.mmmZ'. None stays None."""
+    if milliseconds is None:
+        return None
+    return (_EPOCH + timedelta(milliseconds=milliseconds)).isoformat(timespec="milliseconds") + "Z"
+
+def submit_log_codes(db_conn, code_names):
+    """Queues the log_codes rows for code_names; must be submitted before rows that use LOG_CODE_SQL."""
+    submit_write_many(db_conn, LOG_CODE_INSERT_SQL, [(name,) for name in sorted(set(code_names))])
+
+def get_log_code_names(db_conn):
+    """{code: name} of all log codes. The table holds one row per distinct status/action type."""
+    return {row[0]: row[1] for row in db_conn.execute("SELECT code, code_name FROM log_codes").fetchall()}
+
+# --- Full-Text Indexes for /logs/search ---
+# log_search_term used to be a LIKE '%term%' over large text/JSON columns, i.e. a full scan per column.
+# These FTS5 tables use the trigram tokenizer, so a MATCH on a quoted phrase is a case-insensitive
+# substring match just like the LIKE was (partial file hashes included). They are external-content
+# tables: only the index is stored, the text stays in the logged table. Triggers keep them in sync with
+# inserts, the end-of-rule UPDATE of rule executions and the deletes done by log maintenance. Rows moved
+# to month partition files leave the index, so searches that attach partitions fall back to LIKE.
+# Only TEXT values are indexed: compressed execution details (a BLOB, see encode_execution_details)
+# would only add binary noise to the trigram index and can never match anyway.
+LOG_SEARCH_FTS_INDEXES = (
+    # (fts table, content table, content rowid column, indexed columns)
+    ("file_action_details_fts", "file_action_details", "log_id", ("file_hash", "error_message")),
+    ("action_parameters_fts", "action_parameters", "action_parameters_id", ("params_json",)),
+    ("rule_versions_fts", "rule_versions", "rule_version_key", ("rule_name_at_version",)),
+    ("rule_executions_fts", "rule_executions_in_run", "rule_execution_key", ("summary_message_from_logic", "details_json_from_logic")),
+)
+LOG_SEARCH_FTS_MIN_TERM_LENGTH = 3 # The trigram tokenizer cannot match shorter terms
+
+def _log_search_fts_values(prefix, columns):
+    """SQL values of the indexed columns (prefix 'new.', 'old.' or ''): the column if it holds TEXT, else NULL."""
+    return ", ".join(f"CASE WHEN typeof({prefix}{column}) = 'text' THEN {prefix}{column} END" for column in columns)
+
+def _fill_log_search_fts(cursor, fts_table, content_table, rowid_column, columns):
+    """Empties an FTS5 log search table and indexes the TEXT values of every content table row again."""
+    # Not the FTS5 'rebuild' command: it would index the content columns as they are, BLOBs included
+    cursor.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('delete-all')")
+    cursor.execute(f'''
+        INSERT INTO {fts_table} (rowid, {", ".join(columns)})
+        SELECT {rowid_column}, {_log_search_fts_values("", columns)} FROM {content_table}
+    ''')
+
+def _init_log_search_fts(conn):
+    """Creates the FTS5 log search tables and their sync triggers. New tables are filled from existing rows."""
+    cursor = conn.cursor()
+    for fts_table, content_table, rowid_column, columns in LOG_SEARCH_FTS_INDEXES:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,))
+        is_new = cursor.fetchone() is None
+        # Triggers from before only TEXT was indexed are replaced, and the index refilled without the BLOBs
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (f"{fts_table}_ai",))
+        trigger_row = cursor.fetchone()
+        if trigger_row and "typeof(" not in trigger_row[0]:
+            for trigger_suffix in ("ai", "ad", "au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {fts_table}_{trigger_suffix}")
+            is_new = True
+        column_list = ", ".join(columns)
+        try:
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                    {column_list}, content='{content_table}', content_rowid='{rowid_column}', tokenize='trigram'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            # e.g. SQLite built without FTS5 or older than 3.34 (no trigram tokenizer)
+            logger.warning(f"Full-text log search index '{fts_table}' unavailable ({e}). Log search will use LIKE.")
+            continue
+        new_values = _log_search_fts_values("new.", columns)
+        old_values = _log_search_fts_values("old.", columns)
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {content_table} BEGIN
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.{rowid_column}, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {content_table} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.{rowid_column}, {old_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON {content_table} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.{rowid_column}, {old_values});
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.{rowid_column}, {new_values});
+            END
+        ''')
+        if is_new:
+            logger.info(f"Building full-text log search index '{fts_table}' from existing '{content_table}' rows...")
+            _fill_log_search_fts(cursor, fts_table, content_table, rowid_column, columns)
+    logger.info("Full-text log search indexes initialized/verified.")
+
+def rebuild_log_search_indexes(db_conn):
+    """Re-reads every indexed column into the FTS5 log search tables. Returns False on error."""
+    try:
+        for fts_table, content_table, rowid_column, columns in LOG_SEARCH_FTS_INDEXES:
+            if log_search_fts_available(db_conn, fts_table):
+                _fill_log_search_fts(db_conn.cursor(), fts_table, content_table, rowid_column, columns)
+        db_conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error rebuilding full-text log search indexes: {e}")
+        db_conn.rollback()
+        return False
+
+def log_search_fts_available(db_conn, fts_table):
+    """True if the given FTS5 log search table exists in the main database."""
+    row = db_conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)).fetchone()
+    return row is not None
+
+def log_search_match_phrase(search_term):
+    """
+    FTS5 MATCH expression equivalent to LIKE '%search_term%', or None when the index can't answer it:
+    terms shorter than three characters, and terms with a '%' wildcard. An '_' is matched literally,
+    which is what searches for JSON keys like 'destination_service_keys' mean anyway.
+    """
+    if len(search_term) < LOG_SEARCH_FTS_MIN_TERM_LENGTH or "%" in search_term:
+        return None
+    return '"' + search_term.replace('"', '""') + '"'
+
+# Skipped files are not logged one row per file. Each rule execution writes one aggregate row per
+# skip status holding the file count and the packed hash list (see FileActionLogWriter.log_skip).
+# Aggregate rows use this placeholder in the NOT NULL file_hash column.
+SKIP_AGGREGATE_FILE_HASH = "*"
+
+def pack_file_hashes(file_hashes):
+    """Sorted hex SHA256 hashes -> concatenated 32-byte binary form. Raises ValueError for non-SHA256 hex."""
+    packed = []
+    for file_hash in sorted(set(file_hashes)):
+        raw = bytes.fromhex(file_hash)
+        if len(raw) != 32:
+            raise ValueError(f"Not a SHA256 hash: {file_hash}")
+        packed.append(raw)
+    return b"".join(packed)
+
+def unpack_file_hashes(packed_hashes, limit=None):
+    """Inverse of pack_file_hashes. Returns at most `limit` hex hashes if given."""
+    if not packed_hashes:
+        return []
+    count = len(packed_hashes) // 32
+    if limit is not None:
+        count = min(count, limit)
+    return [packed_hashes[i * 32:(i + 1) * 32].hex() for i in range(count)]
+
+# rule_executions_in_run.details_json_from_logic holds JSON text, or for large details a BLOB of this
+# marker followed by the zlib-compressed JSON. Compressed details are not matched by log_search_term.
+EXECUTION_DETAILS_ZLIB_MARKER = b"zlib1:"
+EXECUTION_DETAILS_COMPRESS_MIN_BYTES = 4096 # Smaller details stay plain (searchable) JSON text
+
+def encode_execution_details(details_json):
+    """Stored form of an execution's details JSON: the text itself, or the marked zlib BLOB if large."""
+    if len(details_json) < EXECUTION_DETAILS_COMPRESS_MIN_BYTES:
+        return details_json
+    return EXECUTION_DETAILS_ZLIB_MARKER + zlib.compress(details_json.encode('utf-8'))
+
+def decode_execution_details(stored_details):
+    """
+    Inverse of encode_execution_details, returning the parsed details (None for NULL). Text not
+    parsing as JSON and unknown BLOB formats come back as an error dict with a preview instead.
+    """
+    if stored_details is None:
+        return None
+    if isinstance(stored_details, (bytes, memoryview)):
+        stored_details = bytes(stored_details)
+        if not stored_details.startswith(EXECUTION_DETAILS_ZLIB_MARKER):
+            return {"error": "Unknown details storage format", "raw_value_preview": stored_details[:16].hex()}
+        try:
+            stored_details = zlib.decompress(stored_details[len(EXECUTION_DETAILS_ZLIB_MARKER):]).decode('utf-8')
+        except (zlib.error, UnicodeDecodeError) as e:
+            return {"error": f"Failed to decompress details: {e}"}
+    try:
+        return json.loads(stored_details)
+    except json.JSONDecodeError:
+        return {"error": "Failed to parse JSON content", "raw_value_preview": stored_details[:100]}
+
+def action_parameters_hash(action_parameters_json):
+    """Content hash used as the dedup key of the action_parameters table."""
+    return hashlib.sha256(action_parameters_json.encode('utf-8')).hexdigest()
+
+# Log tables of the text log schema (UUID references, ISO timestamps and text statuses in every row),
+# in parent-first order. Databases created before the compact log schema are upgraded in place.
+LEGACY_LOG_TABLES = ("rule_versions", "execution_runs", "rule_executions_in_run", "file_action_details")
+LEGACY_LOG_FTS_TABLES = ("rule_versions_fts", "rule_executions_fts", "file_action_details_fts")
+
+def _set_aside_legacy_log_tables(conn):
+    """
+    Renames the log tables of a text-schema database to '<table>_legacy' so init_conflict_db creates
+    the compact tables under the original names. Their indexes, triggers and full-text indexes are
+    dropped (init_conflict_db recreates and rebuilds them for the compact tables).
+    Returns the list of renamed tables; empty for new or already compact databases.
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(execution_runs)")
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    if not existing_columns or 'run_key' in existing_columns:
+        return []
+
+    existing_tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+    legacy_tables = [table for table in LEGACY_LOG_TABLES if table in existing_tables]
+    logger.info(f"Upgrading log tables {', '.join(legacy_tables)} to the compact log schema...")
+    table_placeholders = ", ".join("?" for _ in legacy_tables)
+    schema_objects = cursor.execute(f'''
+        SELECT type, name FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({table_placeholders})
+    ''', legacy_tables).fetchall()
+    for object_type, object_name in schema_objects:
+        cursor.execute(f"DROP {object_type.upper()} IF EXISTS {object_name}")
+    for fts_table in LEGACY_LOG_FTS_TABLES:
+        if fts_table in existing_tables:
+            cursor.execute(f"DROP TABLE {fts_table}")
+    for table in legacy_tables:
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+    return legacy_tables
+
+def _copy_legacy_log_tables(conn, legacy_tables):
+    """
+    Copies the rows of the tables renamed by _set_aside_legacy_log_tables into the compact tables and
+    drops the legacy tables. UUID references are resolved to the new integer keys, ISO timestamps
+    converted to epoch milliseconds and statuses/action types registered in log_codes. log_id values are
+    kept. Rows whose parent row no longer exists (never shown by the log views either) are not copied.
+    Also covers databases created before the action_parameters table (inline 'action_parameters_json_at_exec')
+    and before skip aggregates. Runs inside the caller's transaction.
+    """
+    cursor = conn.cursor()
+    conn.create_function("iso_to_epoch_ms", 1, lambda iso: iso_to_epoch_ms(iso) if iso else None, deterministic=True)
+    copied_counts = {}
+
+    if "rule_versions" in legacy_tables:
+        cursor.execute('''
+            INSERT INTO rule_versions (
+                rule_version_id, rule_id, rule_name_at_version, importance_at_version,
+                conditions_json_at_version, action_json_at_version, version_timestamp
+            )
+            SELECT rule_version_id, rule_id, rule_name_at_version, importance_at_version,
+                   conditions_json_at_version, action_json_at_version, version_timestamp
+            FROM rule_versions_legacy ORDER BY rowid
+        ''')
+        copied_counts["rule_versions"] = cursor.rowcount
+
+    if "execution_runs" in legacy_tables:
+        cursor.execute('''
+            INSERT INTO execution_runs (run_id, run_type, start_time, end_time, status, summary_message)
+            SELECT run_id, run_type, start_time, end_time, status, summary_message
+            FROM execution_runs_legacy ORDER BY start_time
+        ''')
+        copied_counts["execution_runs"] = cursor.rowcount
+
+    if "rule_executions_in_run" in legacy_tables:
+        cursor.execute("INSERT OR IGNORE INTO log_codes (code_name) SELECT DISTINCT status FROM rule_executions_in_run_legacy")
+        cursor.execute('''
+            INSERT INTO rule_executions_in_run (
+                rule_execution_id, run_key, rule_id, rule_version_key, execution_order_in_run,
+                start_time_ms, end_time_ms, status_code,
+                matched_search_count, eligible_for_action_count, actions_attempted_count, actions_succeeded_count,
+                summary_message_from_logic, details_json_from_logic
+            )
+            SELECT old.rule_execution_id, er.run_key, old.rule_id, rv.rule_version_key, old.execution_order_in_run,
+                   iso_to_epoch_ms(old.start_time), iso_to_epoch_ms(old.end_time), lc.code,
+                   old.matched_search_count, old.eligible_for_action_count, old.actions_attempted_count, old.actions_succeeded_count,
+                   old.summary_message_from_logic, old.details_json_from_logic
+            FROM rule_executions_in_run_legacy old
+            JOIN execution_runs er ON er.run_id = old.run_id
+            JOIN rule_versions rv ON rv.rule_version_id = old.rule_version_id
+            JOIN log_codes lc ON lc.code_name = old.status
+            ORDER BY old.start_time
+        ''')
+        copied_counts["rule_executions_in_run"] = cursor.rowcount
+
+    if "file_action_details" in legacy_tables:
+        cursor.execute("PRAGMA table_info(file_action_details_legacy)")
+        legacy_columns = {row[1] for row in cursor.fetchall()}
+        if 'action_parameters_json_at_exec' in legacy_columns:
+            # Created before the action_parameters table: deduplicate the inline parameters on the way
+            conn.create_function("action_parameters_hash", 1, action_parameters_hash, deterministic=True)
+            cursor.execute('''
+                INSERT OR IGNORE INTO action_parameters (params_hash, params_json)
+                SELECT action_parameters_hash(action_parameters_json_at_exec), action_parameters_json_at_exec
+                FROM (SELECT DISTINCT action_parameters_json_at_exec FROM file_action_details_legacy)
+            ''')
+            params_join = "JOIN action_parameters ap ON ap.params_hash = action_parameters_hash(old.action_parameters_json_at_exec)"
+            params_column = "ap.action_parameters_id"
+        else:
+            params_join, params_column = "", "old.action_parameters_id"
+        if 'aggregated_file_count' in legacy_columns:
+            aggregate_columns = "old.aggregated_file_count, old.aggregated_file_hashes"
+        else:
+            aggregate_columns = "NULL, NULL" # Created before skip aggregates
+        cursor.execute('''
+            INSERT OR IGNORE INTO log_codes (code_name)
+            SELECT status FROM file_action_details_legacy UNION SELECT action_type_performed FROM file_action_details_legacy
+        ''')
+        cursor.execute(f'''
+            INSERT INTO file_action_details (
+                log_id, rule_execution_key, file_hash, action_type_code, action_parameters_id, status_code,
+                error_message, override_info_json, action_time_ms, aggregated_file_count, aggregated_file_hashes
+            )
+            SELECT old.log_id, rei.rule_execution_key, old.file_hash, action_code.code, {params_column}, status_code.code,
+                   old.error_message, old.override_info_json, iso_to_epoch_ms(old.action_timestamp), {aggregate_columns}
+            FROM file_action_details_legacy old
+            JOIN rule_executions_in_run rei ON rei.rule_execution_id = old.rule_execution_id
+            JOIN log_codes action_code ON action_code.code_name = old.action_type_performed
+            JOIN log_codes status_code ON status_code.code_name = old.status
+            {params_join}
+            ORDER BY old.log_id
+        ''')
+        copied_counts["file_action_details"] = cursor.rowcount
+
+    for table in reversed(legacy_tables):
+        legacy_count = cursor.execute(f"SELECT COUNT(*) FROM {table}_legacy").fetchone()[0]
+        if legacy_count != copied_counts.get(table, 0):
+            logger.warning(f"Compact log schema upgrade: {legacy_count - copied_counts.get(table, 0)} of {legacy_count} '{table}' rows referenced missing parent rows and were not copied.")
+        cursor.execute(f"DROP TABLE {table}_legacy")
+    logger.info(f"Compact log schema upgrade complete: {copied_counts}")
+
+# --- Connection Manager ---
+# Every connection is opened with the same tuning:
+# - journal_mode=WAL (persistent, set once per database file): readers never wait for the engine's
+#   write transactions and the engine never waits for readers.
+# - synchronous=NORMAL: in WAL mode this only risks the last commits on power loss, never corruption.
+# - cache_size / mmap_size: a larger page cache and memory-mapped reads for the log queries.
+# - temp_store=MEMORY: sorts and temp b-trees of the log search stay off disk.
+#
+# Connections are pooled per thread and per mode. get_db_connection() hands out the calling thread's
+# writable connection, get_db_read_connection() a separate query_only one for the views. close() on
+# a pooled connection returns it to the pool instead of closing it: an open transaction is rolled
+# back (same as closing would do) and ATTACHed log partitions are detached. If the thread's pooled
+# connection is already checked out (nested use), a dedicated connection is returned instead and
+# close() really closes it. Pooled connections die with their thread.
+SQLITE_CACHE_SIZE_KIB = 64 * 1024 # Per connection; passed as a negative cache_size (KiB instead of pages)
+SQLITE_MMAP_SIZE_BYTES = 256 * 1024 * 1024
+SQLITE_BUSY_TIMEOUT_SECONDS = 15
+
+_thread_connection_pool = threading.local()
+_wal_enabled_db_files = set()
+_wal_lock = threading.Lock()
+
+def _enable_wal(conn, db_file):
+    """Switches db_file to WAL once per process. journal_mode is stored in the file, so this is cheap after the first time."""
+    if db_file in _wal_enabled_db_files:
+        return
+    with _wal_lock:
+        if db_file in _wal_enabled_db_files:
+            return
+        journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if str(journal_mode).lower() != "wal":
+            logger.warning(f"Could not switch {db_file} to WAL (journal_mode is '{journal_mode}'). Readers may block on writes.")
+        _wal_enabled_db_files.add(db_file)
+
+def _open_configured_connection(db_file, read_only=False):
+    """Opens a new, unpooled connection with the standard pragmas applied."""
+    conn = sqlite3.connect(db_file, timeout=SQLITE_BUSY_TIMEOUT_SECONDS)
+    conn.row_factory = sqlite3.Row # Access columns by name
+    _enable_wal(conn, db_file)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{int(SQLITE_CACHE_SIZE_KIB)}")
+    conn.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE_BYTES)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+class PooledConnection:
+    """
+    Proxy around a pooled sqlite3.Connection. Everything except close() is passed through,
+    so callers use it exactly like the connection itself.
+    """
+    def __init__(self, raw_conn, pool_key=None):
+        self._raw_conn = raw_conn
+        self._pool_key = pool_key # None for a dedicated (nested) connection
+        self._released = False
+
+    def __getattr__(self, name):
+        if self._released:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(self._raw_conn, name)
+
+    def __enter__(self):
+        return self._raw_conn.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._raw_conn.__exit__(exc_type, exc_value, traceback)
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        if self._pool_key is None:
+            self._raw_conn.close()
+            return
+        pool = getattr(_thread_connection_pool, "connections", {})
+        try:
+            if self._raw_conn.in_transaction:
+                self._raw_conn.rollback()
+            for row in self._raw_conn.execute("PRAGMA database_list").fetchall():
+                if row[1] not in ("main", "temp"):
+                    self._raw_conn.execute(f"DETACH DATABASE {row[1]}")
+        except sqlite3.Error as e:
+            # Don't hand a connection in an unknown state to the next user.
+            logger.warning(f"Discarding pooled database connection after reset failed: {e}")
+            pool.pop(self._pool_key, None)
+            self._raw_conn.close()
+            return
+        checked_out = getattr(_thread_connection_pool, "checked_out", set())
+        checked_out.discard(self._pool_key)
+
+def _get_pooled_connection(db_file, read_only):
+    pool_key = (db_file, read_only)
+    if not hasattr(_thread_connection_pool, "connections"):
+        _thread_connection_pool.connections = {}
+        _thread_connection_pool.checked_out = set()
+    if pool_key in _thread_connection_pool.checked_out:
+        return PooledConnection(_open_configured_connection(db_file, read_only=read_only))
+    raw_conn = _thread_connection_pool.connections.get(pool_key)
+    if raw_conn is None:
+        raw_conn = _open_configured_connection(db_file, read_only=read_only)
+        _thread_connection_pool.connections[pool_key] = raw_conn
+    _thread_connection_pool.checked_out.add(pool_key)
+    return PooledConnection(raw_conn, pool_key)
+
 def get_db_connection(db_file=CONFLICT_DB_FILE):
-    """Establishes and returns a database connection."""
+    """Returns the calling thread's pooled, writable connection. close() returns it to the pool."""
     try:
-        conn = sqlite3.connect(db_file)
-        conn.row_factory = sqlite3.Row # Access columns by name
-        return conn
+        return _get_pooled_connection(db_file, read_only=False)
     except sqlite3.Error as e:
         logger.error(f"Error connecting to database {db_file}: {e}")
         raise
 
+def get_db_read_connection(db_file=CONFLICT_DB_FILE):
+    """
+    Returns the calling thread's pooled query_only connection, for the views.
+    In WAL mode it reads the last committed state and never waits on a running rule execution.
+    """
+    try:
+        return _get_pooled_connection(db_file, read_only=True)
+    except sqlite3.Error as e:
+        logger.error(f"Error connecting to database {db_file} (read-only): {e}")
+        raise
+
+# (rule_id, content_hash) -> rule_version_id of versions known to be committed to the database.
+# Versions are never deleted, so entries stay valid; init_conflict_db clears the map. A version
+# created (or only seen) inside an open transaction is not cached: if that transaction rolled back,
+# the cache would keep an id with no row behind it for the rest of the process.
+_rule_version_id_cache = {}
+
+def rule_version_content_hash(importance, conditions_json, action_json):
+    """Identity of a rule version: importance plus the sort_keys JSON of its conditions and action."""
+    return hashlib.sha256(f"{importance}\n{conditions_json}\n{action_json}".encode('utf-8')).hexdigest()
+
 def get_or_create_active_rule_version(db_conn, rule_dict):
     """
     Gets the rule_version_id for the given rule_dict.
     If an identical version exists, its ID is returned. Otherwise, a new version is created.
     Uses 'importance_number' (from rule_dict's 'priority' field) for versioning.
+    Versions are looked up by content hash, first in _rule_version_id_cache (no query at all for
+    unchanged rules), then through the (rule_id, content_hash) index. Only committed versions are
+    cached; a new one is cached by a later call, once the caller has committed it.
     """
     if not rule_dict or not isinstance(rule_dict, dict):
         logger.error("Invalid rule_dict provided to get_or_create_active_rule_version.")
@@ -218,34 +970,51 @@ def get_or_create_active_rule_version(db_conn, rule_dict):
         logger.error(f"Error serializing conditions/action for rule '{rule_name}' (ID: {rule_id}): {e}")
         return None
 
+    # A version is defined by id, conditions, action and importance (the name is an attribute of it)
+    content_hash = rule_version_content_hash(current_importance_number, conditions_json, action_json)
+    cache_key = (rule_id, content_hash)
+    cached_version_id = _rule_version_id_cache.get(cache_key)
+    if cached_version_id:
+        return cached_version_id
+
     cursor = db_conn.cursor()
-    # Query must also check importance_at_version if it's part of what defines a "version"
-    # For now, assuming version is defined by id, conditions, action. Importance is an attribute of that version.
-    cursor.execute('''
-        SELECT rule_version_id FROM rule_versions
-        WHERE rule_id = ? AND conditions_json_at_version = ? AND action_json_at_version = ? AND importance_at_version = ?
-        ORDER BY version_timestamp DESC LIMIT 1
-    ''', (rule_id, conditions_json, action_json, current_importance_number))
+    cursor.execute(
+        "SELECT rule_version_id FROM rule_versions WHERE rule_id = ? AND content_hash = ?",
+        (rule_id, content_hash)
+    )
     existing_version = cursor.fetchone()
 
     if existing_version:
+        if not db_conn.in_transaction: # Otherwise it may be this connection's own uncommitted row
+            _rule_version_id_cache[cache_key] = existing_version['rule_version_id']
         return existing_version['rule_version_id']
-    else:
-        new_rule_version_id = str(uuid.uuid4())
-        current_timestamp_iso = datetime.utcnow().isoformat() + "Z"
-        
-        logger.info(f"Creating new version for rule '{rule_name}' (ID: {rule_id}, Imp: {current_importance_number}). New Version ID: {new_rule_version_id}")
+
+    new_rule_version_id = str(uuid.uuid4())
+    current_timestamp_iso = datetime.utcnow().isoformat() + "Z"
+
+    logger.info(f"Creating new version for rule '{rule_name}' (ID: {rule_id}, Imp: {current_importance_number}). New Version ID: {new_rule_version_id}")
+    try:
         cursor.execute('''
             INSERT INTO rule_versions (
                 rule_version_id, rule_id, rule_name_at_version, importance_at_version,
-                conditions_json_at_version, action_json_at_version, version_timestamp
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                conditions_json_at_version, action_json_at_version, version_timestamp, content_hash
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             new_rule_version_id, rule_id, str(rule_name), current_importance_number,
-            conditions_json, action_json, current_timestamp_iso
+            conditions_json, action_json, current_timestamp_iso, content_hash
         ))
-        return new_rule_version_id
-    return None # Fallback
+    except sqlite3.IntegrityError:
+        # Another connection committed the same version first (the unique index waited for it)
+        cursor.execute(
+            "SELECT rule_version_id FROM rule_versions WHERE rule_id = ? AND content_hash = ?",
+            (rule_id, content_hash)
+        )
+        existing_version = cursor.fetchone()
+        if not existing_version:
+            logger.error(f"Could not create or find a version of rule '{rule_name}' (ID: {rule_id}).")
+            return None
+        new_rule_version_id = existing_version['rule_version_id']
+    return new_rule_version_id
 
 def set_conflict_override(db_conn, file_hash, action_type, action_key_param, # Renamed param for clarity
                           winning_rule_id, winning_rule_importance, winning_rule_action_type_str,
@@ -268,8 +1037,9 @@ def set_conflict_override(db_conn, file_hash, action_type, action_key_param, # R
         return False # Or raise an error
 
     try:
-        cursor = db_conn.cursor()
-        cursor.execute('''
+        # Queued on the background log writer when it is running; rule execution flushes the writer
+        # at the end of each rule, so later rules read the committed override.
+        submit_write(db_conn, '''
             INSERT OR REPLACE INTO overrides 
             (file_hash, action_type, action_key, winning_rule_id, 
              winning_rule_importance, winning_rule_action_type, 
@@ -381,6 +1151,440 @@ def remove_specific_override(db_conn, file_hash, action_type, action_key=None):
         logger.error(f"DB error in remove_specific_override for {file_hash}, {action_type}, {action_key}: {e}")
         return -1
 
+# --- Override Garbage Collection Helpers ---
+
+def get_override_hashes_page(db_conn, after_hash=None, limit=256):
+    """
+    Returns up to `limit` distinct file hashes from the 'overrides' table, in ascending order,
+    starting strictly after `after_hash`. Used to walk the table in pages without OFFSET,
+    so rows deleted from earlier pages do not shift later ones.
+    """
+    try:
+        cursor = db_conn.cursor()
+        cursor.execute('''
+            SELECT DISTINCT file_hash FROM overrides
+            WHERE file_hash > ?
+            ORDER BY file_hash ASC
+            LIMIT ?
+        ''', (after_hash or "", limit))
+        return [row[0] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"DB error in get_override_hashes_page after '{after_hash}': {e}")
+        return None
+
+def remove_overrides_for_hashes(db_conn, file_hashes):
+    """Removes every conflict override (all action types/keys) for the given file hashes."""
+    if not file_hashes:
+        return 0
+    try:
+        cursor = db_conn.cursor()
+        cursor.executemany('DELETE FROM overrides WHERE file_hash = ?', [(h,) for h in file_hashes])
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"DB error in remove_overrides_for_hashes for {len(file_hashes)} hashes: {e}")
+        return -1
+
+def remove_stale_rule_overrides(db_conn, rules):
+    """
+    Removes overrides whose winning rule no longer matches the current rule definitions:
+    - the winning rule no longer exists,
+    - its importance (UI 'priority') changed,
+    - its action type no longer matches (e.g. 'add_to' became 'force_in'),
+    - or, for rating overrides, the rule now targets a different rating service.
+    Rules edited through the UI already have their overrides cleared by `remove_overrides_for_rule`;
+    this catches rules.json edits made outside the UI.
+
+    Returns: int count of removed rows, or -1 on error.
+    """
+    rules_by_id = {r.get('id'): r for r in rules if isinstance(r, dict) and r.get('id')}
+    try:
+        cursor = db_conn.cursor()
+        cursor.execute('''
+            SELECT winning_rule_id, action_type, action_key, winning_rule_importance, winning_rule_action_type
+            FROM overrides
+            GROUP BY winning_rule_id, action_type, action_key, winning_rule_importance, winning_rule_action_type
+        ''')
+        override_groups = cursor.fetchall()
+
+        stale_groups = []
+        for win_id, action_type, action_key, win_importance, win_action_type in override_groups:
+            rule = rules_by_id.get(win_id)
+            is_valid = False
+            if rule:
+                rule_action = rule.get('action') or {}
+                rule_action_type = rule_action.get('type')
+                try:
+                    rule_importance = int(rule.get('priority', 1))
+                except (ValueError, TypeError):
+                    rule_importance = 1
+                if rule_importance == win_importance:
+                    if action_type == 'placement':
+                        is_valid = rule_action_type in ('add_to', 'force_in') and rule_action_type == win_action_type
+                    elif action_type == 'rating':
+                        is_valid = rule_action_type == 'modify_rating' and rule_action.get('rating_service_key') == action_key
+            if not is_valid:
+                stale_groups.append((win_id, action_type, action_key, win_importance, win_action_type))
+
+        if not stale_groups:
+            return 0
+        cursor.executemany('''
+            DELETE FROM overrides
+            WHERE winning_rule_id = ? AND action_type = ? AND action_key IS ?
+                  AND winning_rule_importance = ? AND winning_rule_action_type = ?
+        ''', stale_groups)
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"DB error in remove_stale_rule_overrides: {e}")
+        return -1
+
+def expire_overrides_older_than(db_conn, cutoff_dt):
+    """Removes overrides whose timestamp is older than `cutoff_dt` (naive UTC datetime)."""
+    cutoff_iso = cutoff_dt.isoformat() + "Z"
+    try:
+        cursor = db_conn.cursor()
+        cursor.execute('DELETE FROM overrides WHERE timestamp < ?', (cutoff_iso,))
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"DB error in expire_overrides_older_than for cutoff {cutoff_iso}: {e}")
+        return -1
+
+def get_db_space_stats(db_conn):
+    """
+    Returns page-level size information for the database file:
+    {'page_size', 'page_count', 'freelist_count', 'file_size_bytes', 'free_bytes'}.
+    Freed pages are reused by later writes; a VACUUM is needed to shrink the file itself.
+    """
+    try:
+        cursor = db_conn.cursor()
+        page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+        page_count = cursor.execute('PRAGMA page_count').fetchone()[0]
+        freelist_count = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+        return {
+            "page_size": page_size, "page_count": page_count, "freelist_count": freelist_count,
+            "file_size_bytes": page_size * page_count, "free_bytes": page_size * freelist_count
+        }
+    except sqlite3.Error as e:
+        logger.error(f"DB error in get_db_space_stats: {e}")
+        return None
+
+# --- Run Progress Checkpoints ---
+# A "run all rules" run (scheduled or manual) commits after every rule and records its progress in
+# run_progress: the rule ids in running order, fixed at the start, and how many of them are done.
+# Rows are deleted when the run ends. A row still there at startup belongs to a run that the process
+# did not finish (crash, restart); mark_interrupted_runs() flags it and the rules job resumes it with
+# the next rule, under the same run_id, instead of redoing the whole run. A rule that was interrupted
+# midway is run again from its search, which no longer matches the files it had already handled.
+
+def start_run_progress(db_conn, run_id, run_type, rule_ids):
+    """Records the start of a run over rule_ids (in running order) and commits. Returns False on error."""
+    try:
+        db_conn.execute('''
+            INSERT OR REPLACE INTO run_progress (
+                run_id, run_type, rule_ids_json, rules_completed, last_completed_rule_id, status, resume_count, updated_at
+            ) VALUES (?, ?, ?, 0, NULL, 'in_progress', 0, ?)
+        ''', (run_id, run_type, json.dumps(list(rule_ids)), datetime.utcnow().isoformat() + "Z"))
+        db_conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error recording progress start of run {run_id}: {e}")
+        return False
+
+def checkpoint_run_progress(db_conn, run_id, rules_completed, last_completed_rule_id):
+    """
+    Records that the first rules_completed rules of the run are done and commits. Call it after the
+    rule's own writes are committed (execute_single_rule flushes the log writer at the end of a rule).
+    """
+    try:
+        db_conn.execute('''
+            UPDATE run_progress SET rules_completed = ?, last_completed_rule_id = ?, updated_at = ?
+            WHERE run_id = ?
+        ''', (rules_completed, last_completed_rule_id, datetime.utcnow().isoformat() + "Z", run_id))
+        db_conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error checkpointing progress of run {run_id}: {e}")
+        return False
+
+def finish_run_progress(db_conn, run_id):
+    """Removes the progress row of a run that ended (successfully or not) and commits."""
+    try:
+        db_conn.execute("DELETE FROM run_progress WHERE run_id = ?", (run_id,))
+        db_conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error removing progress row of run {run_id}: {e}")
+        return False
+
+def mark_interrupted_runs(db_conn):
+    """
+    Flags every run still 'in_progress' as 'interrupted'. Call once at startup, before the scheduler
+    starts: no run of this process can be running yet. Returns the number of runs flagged.
+    """
+    try:
+        cursor = db_conn.execute("UPDATE run_progress SET status = 'interrupted' WHERE status = 'in_progress'")
+        db_conn.commit()
+        if cursor.rowcount:
+            logger.warning(f"{cursor.rowcount} run(s) did not finish before the last shutdown. They will be resumed by the rules job.")
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Error flagging interrupted runs: {e}")
+        return 0
+
+def list_unfinished_runs(db_conn):
+    """Progress rows of runs not finished yet (running or interrupted), oldest first."""
+    try:
+        rows = db_conn.execute("SELECT * FROM run_progress ORDER BY updated_at").fetchall()
+        return [dict(row) for row in rows]
+    except sqlite3.Error as e:
+        logger.error(f"Error listing unfinished runs: {e}")
+        return []
+
+def claim_interrupted_run(db_conn):
+    """
+    Takes the oldest interrupted run for resuming: sets it back to 'in_progress', closes its rule
+    executions left without an end (status 'interrupted') and commits. Returns the progress row as a
+    dict with 'rule_ids' (the parsed rule_ids_json), or None if there is nothing to resume.
+    """
+    try:
+        row = db_conn.execute('''
+            SELECT * FROM run_progress WHERE status = 'interrupted' ORDER BY updated_at LIMIT 1
+        ''').fetchone()
+        if row is None:
+            return None
+        progress = dict(row)
+        progress['rule_ids'] = json.loads(progress['rule_ids_json'])
+        now = datetime.utcnow()
+        db_conn.execute('''
+            UPDATE run_progress SET status = 'in_progress', resume_count = resume_count + 1, updated_at = ?
+            WHERE run_id = ?
+        ''', (now.isoformat() + "Z", progress['run_id']))
+        db_conn.execute(LOG_CODE_INSERT_SQL, ("interrupted",))
+        db_conn.execute(f'''
+            UPDATE rule_executions_in_run SET end_time_ms = ?, status_code = {LOG_CODE_SQL},
+                summary_message_from_logic = 'Interrupted: the process ended before the rule finished. The run was resumed.'
+            WHERE run_key = (SELECT run_key FROM execution_runs WHERE run_id = ?) AND end_time_ms IS NULL
+        ''', (epoch_ms(now), "interrupted", progress['run_id']))
+        db_conn.commit()
+        progress['resume_count'] += 1
+        return progress
+    except (sqlite3.Error, ValueError) as e: # ValueError: unreadable rule_ids_json
+        logger.error(f"Error claiming an interrupted run for resuming: {e}")
+        db_conn.rollback()
+        return None
+
+# --- Per-Rule Schedules ---
+# The scheduled rules job only runs rules that are due (see scheduler_tasks.is_rule_due). When a
+# scheduled run has executed a rule, the run's start time is stored here, so after a restart rules
+# are not all due at once.
+
+def get_rule_last_run_times(db_conn):
+    """{rule_id: last_run_time_ms} for every rule the scheduler has run. Empty dict on error."""
+    try:
+        return {row['rule_id']: row['last_run_time_ms'] for row in db_conn.execute("SELECT rule_id, last_run_time_ms FROM rule_last_runs")}
+    except sqlite3.Error as e:
+        logger.error(f"Error reading last run times of rules: {e}")
+        return {}
+
+def get_rule_last_run_states(db_conn):
+    """{rule_id: row dict (last_run_time_ms, inputs_hash, needs_rerun)} for every rule the scheduler has run."""
+    try:
+        return {row['rule_id']: dict(row) for row in db_conn.execute("SELECT * FROM rule_last_runs")}
+    except sqlite3.Error as e:
+        logger.error(f"Error reading last runs of rules: {e}")
+        return {}
+
+def record_rule_last_run(db_conn, rule_id, run_time_ms, inputs_hash=None, needs_rerun=False):
+    """
+    Stores the time a scheduled run ran rule_id (epoch ms), the hash of the rule as it ran and whether
+    the execution left work behind (see library_probe.py), and commits. Returns False on error.
+    """
+    try:
+        db_conn.execute('''
+            INSERT INTO rule_last_runs (rule_id, last_run_time_ms, inputs_hash, needs_rerun) VALUES (?, ?, ?, ?)
+            ON CONFLICT (rule_id) DO UPDATE SET last_run_time_ms = excluded.last_run_time_ms,
+                inputs_hash = excluded.inputs_hash, needs_rerun = excluded.needs_rerun
+        ''', (rule_id, run_time_ms, inputs_hash, int(bool(needs_rerun))))
+        db_conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error recording last run time of rule {rule_id}: {e}")
+        return False
+
+# --- Engine Job Queue ---
+# Rule runs are queued in engine_jobs by the web process and executed by the engine worker (see
+# engine_worker.py) by priority, then oldest first: a user waiting on one rule is served before a
+# manual run of all rules, and that before a scheduled run. A run of all rules also gives way to
+# queued jobs of higher priority between two of its rules (see engine_worker.JobYieldPoint).
+# The scheduled maintenance jobs (override GC and log maintenance) are queued here too, last in
+# line, so that the worker is the one process writing rule, override and log rows.
+# A job goes 'queued' -> 'running' -> 'completed' or 'failed'; a job still 'running' when a worker starts was cut short by the previous worker and is
+# set to 'interrupted' (the run itself is resumed through run_progress). A queued job that is
+# cancelled goes straight to 'cancelled'; a running one gets cancel_requested, which the worker polls
+# to stop the run at its next check (see rule_processing.RunStopToken). Finished jobs are kept for
+# a few days so their result can still be fetched.
+
+ENGINE_JOB_PRIORITIES = {'manual_single': 0, 'manual_all': 1, 'scheduled_all': 2,
+                         'maintenance_override_gc': 3, 'maintenance_log_storage': 3}
+
+def _engine_job_from_row(row):
+    job = dict(row)
+    job['result'] = json.loads(job.pop('result_json')) if job.get('result_json') else None
+    return job
+
+def enqueue_engine_job(db_conn, job_type, rule_id=None, unless_pending_types=None):
+    """
+    Queues a job and commits. Returns its job_id, False if a job of one of unless_pending_types is
+    already queued or running (checked in the same statement), or None on error.
+    """
+    job_id = str(uuid.uuid4())
+    pending_types = list(unless_pending_types or [])
+    try:
+        cursor = db_conn.execute(f'''
+            INSERT INTO engine_jobs (job_id, job_type, priority, rule_id, status, enqueued_at)
+            SELECT ?, ?, ?, ?, 'queued', ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM engine_jobs WHERE status IN ('queued', 'running')
+                AND job_type IN ({", ".join("?" * len(pending_types)) or "NULL"})
+            )
+        ''', (job_id, job_type, ENGINE_JOB_PRIORITIES.get(job_type, max(ENGINE_JOB_PRIORITIES.values())), rule_id,
+              datetime.utcnow().isoformat() + "Z", *pending_types))
+        db_conn.commit()
+        return job_id if cursor.rowcount else False
+    except sqlite3.Error as e:
+        logger.error(f"Error queueing engine job '{job_type}': {e}")
+        db_conn.rollback()
+        return None
+
+def claim_next_engine_job(db_conn, worker_pid, below_priority=None):
+    """
+    Sets the next queued job (highest priority, then oldest) to 'running' for worker_pid and commits.
+    With below_priority, only a job with a lower priority number is taken. Returns it as a dict, or None.
+    """
+    try:
+        row = db_conn.execute('''
+            SELECT * FROM engine_jobs WHERE status = 'queued' AND priority < ? ORDER BY priority, job_key LIMIT 1
+        ''', (below_priority if below_priority is not None else max(ENGINE_JOB_PRIORITIES.values()) + 1,)).fetchone()
+        if row is None:
+            return None
+        started_at = datetime.utcnow().isoformat() + "Z"
+        cursor = db_conn.execute('''
+            UPDATE engine_jobs SET status = 'running', started_at = ?, worker_pid = ?
+            WHERE job_key = ? AND status = 'queued'
+        ''', (started_at, worker_pid, row['job_key']))
+        db_conn.commit()
+        if not cursor.rowcount:
+            return None
+        job = _engine_job_from_row(row)
+        job.update(status='running', started_at=started_at, worker_pid=worker_pid)
+        return job
+    except sqlite3.Error as e:
+        logger.error(f"Error claiming the next engine job: {e}")
+        db_conn.rollback()
+        return None
+
+def has_queued_engine_job(db_conn, below_priority):
+    """True if a job with a lower priority number than below_priority is queued. False if not, or on error."""
+    try:
+        return db_conn.execute('''
+            SELECT 1 FROM engine_jobs WHERE status = 'queued' AND priority < ? LIMIT 1
+        ''', (below_priority,)).fetchone() is not None
+    except sqlite3.Error as e:
+        logger.error(f"Error looking for queued engine jobs: {e}")
+        return False
+
+def finish_engine_job(db_conn, job_id, status, result):
+    """Stores the final status and result (JSON-serializable) of a job and commits. Returns False on error."""
+    try:
+        db_conn.execute('''
+            UPDATE engine_jobs SET status = ?, finished_at = ?, result_json = ? WHERE job_id = ?
+        ''', (status, datetime.utcnow().isoformat() + "Z", json.dumps(result), job_id))
+        db_conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error storing the result of engine job {job_id}: {e}")
+        return False
+
+def request_engine_job_cancel(db_conn, job_id):
+    """
+    Cancels a job and commits. Returns 'cancelled' for a queued job (it never runs), 'cancel_requested'
+    for a running one (the worker stops it), or None if the job is unknown, already finished or on error.
+    """
+    try:
+        cursor = db_conn.execute('''
+            UPDATE engine_jobs SET status = 'cancelled', finished_at = ?, result_json = ?
+            WHERE job_id = ? AND status = 'queued'
+        ''', (datetime.utcnow().isoformat() + "Z",
+              json.dumps({"http_status": 200, "payload": {"success": False, "cancelled": True, "message": "Cancelled before it started."}}),
+              job_id))
+        outcome = 'cancelled' if cursor.rowcount else None
+        if outcome is None:
+            cursor = db_conn.execute('''
+                UPDATE engine_jobs SET cancel_requested = 1 WHERE job_id = ? AND status = 'running'
+            ''', (job_id,))
+            outcome = 'cancel_requested' if cursor.rowcount else None
+        db_conn.commit()
+        return outcome
+    except sqlite3.Error as e:
+        logger.error(f"Error cancelling engine job {job_id}: {e}")
+        db_conn.rollback()
+        return None
+
+def is_engine_job_cancel_requested(db_conn, job_id):
+    """True once cancelling the (running) job was asked for. False if not, or on error."""
+    try:
+        row = db_conn.execute("SELECT cancel_requested FROM engine_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+    except sqlite3.Error as e:
+        logger.error(f"Error reading the cancel flag of engine job {job_id}: {e}")
+        return False
+
+def get_engine_job(db_conn, job_id):
+    """The job as a dict ('result' holds the parsed result_json), or None if unknown or on error."""
+    try:
+        row = db_conn.execute("SELECT * FROM engine_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return _engine_job_from_row(row) if row else None
+    except (sqlite3.Error, ValueError) as e: # ValueError: unreadable result_json
+        logger.error(f"Error reading engine job {job_id}: {e}")
+        return None
+
+def list_pending_engine_jobs(db_conn):
+    """Queued and running jobs, in queue order (priority, then oldest). Empty list on error."""
+    try:
+        rows = db_conn.execute('''
+            SELECT * FROM engine_jobs WHERE status IN ('queued', 'running') ORDER BY priority, job_key
+        ''').fetchall()
+        return [_engine_job_from_row(row) for row in rows]
+    except (sqlite3.Error, ValueError) as e:
+        logger.error(f"Error listing pending engine jobs: {e}")
+        return []
+
+def interrupt_running_engine_jobs(db_conn, message):
+    """
+    Sets every 'running' job to 'interrupted' with message as its result and commits. Call when a
+    worker starts, before it takes jobs. Returns the number of jobs interrupted.
+    """
+    try:
+        cursor = db_conn.execute('''
+            UPDATE engine_jobs SET status = 'interrupted', finished_at = ?, result_json = ? WHERE status = 'running'
+        ''', (datetime.utcnow().isoformat() + "Z", json.dumps({"http_status": 500, "payload": {"success": False, "message": message}})))
+        db_conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Error flagging interrupted engine jobs: {e}")
+        return 0
+
+def prune_engine_jobs(db_conn, finished_before_dt):
+    """Deletes jobs that finished before finished_before_dt (naive UTC) and commits. Returns the number deleted."""
+    try:
+        cursor = db_conn.execute('''
+            DELETE FROM engine_jobs WHERE status NOT IN ('queued', 'running') AND finished_at < ?
+        ''', (finished_before_dt.isoformat() + "Z",))
+        db_conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Error pruning finished engine jobs: {e}")
+        return 0
+
 def log_file_action_detail(db_conn, rule_execution_id, file_hash,
                            action_type_performed, action_parameters_json,
                            status, error_message=None, override_info_json=None,
@@ -390,21 +1594,214 @@ def log_file_action_detail(db_conn, rule_execution_id, file_hash,
         logger.error(f"Missing critical params in log_file_action_detail. RuleExecID: {rule_execution_id}, FileHash: {file_hash}, ActionType: {action_type_performed}")
         return
 
-    action_timestamp_iso = (timestamp_dt if timestamp_dt else datetime.utcnow()).isoformat() + "Z"
+    action_time_ms = epoch_ms(timestamp_dt if timestamp_dt else datetime.utcnow())
+    params_hash = action_parameters_hash(action_parameters_json)
     try:
         cursor = db_conn.cursor()
-        cursor.execute('''
-            INSERT INTO file_action_details (
-                rule_execution_id, file_hash, action_type_performed,
-                action_parameters_json_at_exec, status, error_message,
-                override_info_json, action_timestamp
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        cursor.execute(ACTION_PARAMETERS_INSERT_SQL, (params_hash, action_parameters_json))
+        cursor.executemany(LOG_CODE_INSERT_SQL, [(action_type_performed,), (status,)])
+        cursor.execute(FILE_ACTION_DETAIL_INSERT_SQL, (
             rule_execution_id, file_hash, action_type_performed,
-            action_parameters_json, status, error_message,
-            override_info_json, action_timestamp_iso
+            params_hash, status, error_message,
+            override_info_json, action_time_ms
         ))
     except sqlite3.Error as e:
         logger.error(f"DB Error in log_file_action_detail for RuleExecID {rule_execution_id}, File {file_hash}: {e}")
     except Exception as e_gen:
-        logger.error(f"General Error in log_file_action_detail for RuleExecID {rule_execution_id}, File {file_hash}: {e_gen}")
\ No newline at end of file
+        logger.error(f"General Error in log_file_action_detail for RuleExecID {rule_execution_id}, File {file_hash}: {e_gen}")
+
+ACTION_PARAMETERS_INSERT_SQL = '''
+    INSERT OR IGNORE INTO action_parameters (params_hash, params_json) VALUES (?, ?)
+'''
+
+RULE_EXECUTION_KEY_SQL = "(SELECT rule_execution_key FROM rule_executions_in_run WHERE rule_execution_id = ?)"
+ACTION_PARAMETERS_ID_SQL = "(SELECT action_parameters_id FROM action_parameters WHERE params_hash = ?)"
+
+SKIP_AGGREGATE_INSERT_SQL = f'''
+    INSERT INTO file_action_details (
+        rule_execution_key, file_hash, action_type_code,
+        action_parameters_id, status_code, error_message,
+        override_info_json, action_time_ms, aggregated_file_count, aggregated_file_hashes
+    ) VALUES ({RULE_EXECUTION_KEY_SQL}, ?, {LOG_CODE_SQL}, {ACTION_PARAMETERS_ID_SQL}, {LOG_CODE_SQL}, ?, ?, ?, ?, ?)
+'''
+
+# The rule execution UUID, the action parameters (by content hash) and the status/action type names are
+# resolved to their integer keys in the INSERT itself, so writers never need a round trip to learn them
+# (ACTION_PARAMETERS_INSERT_SQL and LOG_CODE_INSERT_SQL must run first).
+FILE_ACTION_DETAIL_INSERT_SQL = f'''
+    INSERT INTO file_action_details (
+        rule_execution_key, file_hash, action_type_code,
+        action_parameters_id, status_code, error_message,
+        override_info_json, action_time_ms
+    ) VALUES ({RULE_EXECUTION_KEY_SQL}, ?, {LOG_CODE_SQL}, {ACTION_PARAMETERS_ID_SQL}, {LOG_CODE_SQL}, ?, ?, ?)
+'''
+
+class FileActionLogWriter:
+    """
+    Buffers file_action_details rows for one rule execution and writes them with
+    `executemany` in chunks of `batch_size`, instead of one INSERT per file.
+
+    The buffer is flushed automatically whenever it reaches `batch_size` rows.
+    Skipped files go through log_skip() and are written as one aggregate row per skip status.
+    Callers must call finalize() when the rule execution ends (including on error paths),
+    otherwise buffered rows and skip aggregates are lost.
+    When the background log writer is running, chunks are handed to it instead of being
+    executed on db_conn (see log_writer.py).
+    """
+    def __init__(self, db_conn, rule_execution_id, batch_size=500):
+        self.db_conn = db_conn
+        self.rule_execution_id = rule_execution_id
+        self.batch_size = max(1, int(batch_size))
+        self.pending_rows = []
+        self.rows_written = 0
+        self.action_parameters_by_hash = {} # params_hash -> JSON not yet written to action_parameters
+        self._params_hash_cache = {} # params JSON -> params_hash
+        self.pending_code_names = set() # Statuses/action types not yet written to log_codes by this writer
+        self._known_code_names = set()
+        self.skip_aggregates = {} # status -> accumulated skip aggregate, written by finalize()
+
+    def _params_hash_for(self, action_parameters_json):
+        # Almost every row of an execution carries the same parameters JSON, so hash it once per distinct string
+        params_hash = self._params_hash_cache.get(action_parameters_json)
+        if params_hash is None:
+            params_hash = action_parameters_hash(action_parameters_json)
+            self._params_hash_cache[action_parameters_json] = params_hash
+            self.action_parameters_by_hash[params_hash] = action_parameters_json
+        return params_hash
+
+    def _note_code_names(self, *code_names):
+        for code_name in code_names:
+            if code_name not in self._known_code_names:
+                self._known_code_names.add(code_name)
+                self.pending_code_names.add(code_name)
+
+    def log(self, file_hash, action_type_performed, action_parameters_json,
+            status, error_message=None, override_info_json=None, timestamp_dt=None):
+        """Queues the details of an action performed (or attempted) on a single file."""
+        if not all([self.rule_execution_id, file_hash, action_type_performed]) or action_parameters_json is None:
+            logger.error(f"Missing critical params in FileActionLogWriter.log. RuleExecID: {self.rule_execution_id}, FileHash: {file_hash}, ActionType: {action_type_performed}")
+            return
+        action_time_ms = epoch_ms(timestamp_dt if timestamp_dt else datetime.utcnow())
+        params_hash = self._params_hash_for(action_parameters_json)
+        self._note_code_names(action_type_performed, status)
+        self.pending_rows.append((
+            self.rule_execution_id, file_hash, action_type_performed,
+            params_hash, status, error_message,
+            override_info_json, action_time_ms
+        ))
+        if len(self.pending_rows) >= self.batch_size:
+            self.flush()
+
+    def log_skip(self, file_hash, status, action_parameters_json, override_info=None):
+        """
+        Records a skipped file into the aggregate for `status` (e.g. "skipped_recent_view").
+        override_info (dict with winning_rule_id/importance/action_type) is tallied per winning rule.
+        """
+        if not file_hash or not status:
+            return
+        aggregate = self.skip_aggregates.get(status)
+        if aggregate is None:
+            aggregate = self.skip_aggregates[status] = {
+                "action_parameters_json": action_parameters_json, "file_hashes": [],
+                "winning_rules": {}, "first_timestamp": datetime.utcnow()
+            }
+        aggregate["file_hashes"].append(file_hash)
+        if override_info:
+            winner_key = (override_info.get("winning_rule_id"), override_info.get("winning_rule_importance"), override_info.get("winning_rule_action_type"))
+            aggregate["winning_rules"][winner_key] = aggregate["winning_rules"].get(winner_key, 0) + 1
+
+    def _write_pending_action_parameters(self):
+        # Must be queued/executed before the detail rows that reference these hashes and code names
+        if self.action_parameters_by_hash:
+            try:
+                submit_write_many(self.db_conn, ACTION_PARAMETERS_INSERT_SQL, list(self.action_parameters_by_hash.items()))
+                self.action_parameters_by_hash = {}
+            except sqlite3.Error as e:
+                logger.error(f"FileActionLogWriter for RuleExecID {self.rule_execution_id}: Could not store action parameters: {e}")
+        if self.pending_code_names:
+            try:
+                submit_log_codes(self.db_conn, self.pending_code_names)
+                self.pending_code_names = set()
+            except sqlite3.Error as e:
+                logger.error(f"FileActionLogWriter for RuleExecID {self.rule_execution_id}: Could not store log codes: {e}")
+
+    def finalize(self):
+        """
+        Writes one aggregate row per skip status, then flushes everything still buffered.
+        Hashes that cannot be packed (not SHA256 hex) are logged as ordinary per-file rows instead.
+        Returns: int number of file_action_details rows written/queued by this call.
+        """
+        aggregate_rows = []
+        for status, aggregate in self.skip_aggregates.items():
+            params_hash = self._params_hash_for(aggregate["action_parameters_json"])
+            packable, unpackable = [], []
+            for file_hash in aggregate["file_hashes"]:
+                (packable if len(file_hash) == 64 else unpackable).append(file_hash)
+            try:
+                packed_hashes = pack_file_hashes(packable)
+            except ValueError:
+                packed_hashes, unpackable = b"", aggregate["file_hashes"]
+            for file_hash in unpackable:
+                self.log(file_hash, "skip_action", aggregate["action_parameters_json"], status)
+            if not packed_hashes:
+                continue
+            override_info_json = None
+            if aggregate["winning_rules"]:
+                override_info_json = json.dumps({"winning_rules": [
+                    {"winning_rule_id": win_id, "winning_rule_importance": win_importance,
+                     "winning_rule_action_type": win_action_type, "file_count": count}
+                    for (win_id, win_importance, win_action_type), count in aggregate["winning_rules"].items()
+                ]})
+            self._note_code_names("skip_action", status)
+            aggregate_rows.append((
+                self.rule_execution_id, SKIP_AGGREGATE_FILE_HASH, "skip_action",
+                params_hash, status, None, override_info_json,
+                epoch_ms(aggregate["first_timestamp"]),
+                len(packed_hashes) // 32, packed_hashes
+            ))
+        self.skip_aggregates = {}
+
+        written = self.flush()
+        if aggregate_rows and self.db_conn:
+            self._write_pending_action_parameters()
+            try:
+                submit_write_many(self.db_conn, SKIP_AGGREGATE_INSERT_SQL, aggregate_rows)
+                written += len(aggregate_rows)
+                self.rows_written += len(aggregate_rows)
+            except sqlite3.Error as e:
+                logger.error(f"FileActionLogWriter for RuleExecID {self.rule_execution_id}: Could not write {len(aggregate_rows)} skip aggregate rows: {e}")
+        return written
+
+    def flush(self):
+        """
+        Writes (or queues on the background log writer) all buffered rows. A single bad row cannot
+        drop the rest of its chunk: a chunk that fails on the background writer is applied row by row
+        there (see BackgroundLogWriter._write_transaction). Written inline, a failed chunk keeps none
+        of its rows (see submit_write_many) and they are retried one by one here.
+        Returns: int number of rows written/queued by this call.
+        """
+        if not self.pending_rows:
+            return 0
+        if not self.db_conn:
+            logger.error(f"FileActionLogWriter for RuleExecID {self.rule_execution_id}: No DB connection, dropping {len(self.pending_rows)} buffered rows.")
+            self.pending_rows = []
+            return 0
+
+        rows_to_write, self.pending_rows = self.pending_rows, []
+        written = 0
+        self._write_pending_action_parameters()
+        for i in range(0, len(rows_to_write), self.batch_size):
+            chunk = rows_to_write[i : i + self.batch_size]
+            try:
+                submit_write_many(self.db_conn, FILE_ACTION_DETAIL_INSERT_SQL, chunk)
+                written += len(chunk)
+            except sqlite3.Error as e:
+                logger.warning(f"FileActionLogWriter for RuleExecID {self.rule_execution_id}: Chunk of {len(chunk)} rows failed ({e}). Retrying individually...")
+                for row in chunk:
+                    try:
+                        submit_write(self.db_conn, FILE_ACTION_DETAIL_INSERT_SQL, row)
+                        written += 1
+                    except sqlite3.Error as e_row:
+                        logger.error(f"DB Error in FileActionLogWriter for RuleExecID {self.rule_execution_id}, File {row[1]}: {e_row}")
+        self.rows_written += written
+        return written
\ No newline at end of file
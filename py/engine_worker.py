@@ -0,0 +1,694 @@
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import signal
+import logging
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from app_config import SETTINGS_FILE, load_settings, load_rules
+from database import (
+    get_db_connection, get_db_read_connection, mark_interrupted_runs,
+    start_run_progress, checkpoint_run_progress, finish_run_progress,
+    claim_next_engine_job, finish_engine_job, get_engine_job, list_pending_engine_jobs,
+    interrupt_running_engine_jobs, prune_engine_jobs, is_engine_job_cancel_requested,
+    has_queued_engine_job, ENGINE_JOB_PRIORITIES
+)
+from log_writer import start_log_writer, stop_log_writer, submit_write, flush_log_writer
+from rule_processing import execute_single_rule, execute_rules_in_conflict_order, _ensure_available_services, RunStopToken
+
+logger = logging.getLogger(__name__)
+
+# --- Engine Worker ---
+# Rule runs are jobs in the engine_jobs table (see database.py): 'scheduled_all' (queued by the rules
+# job of the scheduler), 'manual_all' (/run_all_rules_manual) and 'manual_single' (/run_rule/<id>).
+# The scheduler's maintenance jobs are queued as MAINTENANCE_JOB_TYPES. The web process only queues
+# jobs and reads their status (/engine_jobs/<job_id>); the engine worker takes them one at a time, by
+# priority (manual_single, then manual_all, then scheduled_all, then maintenance) and then oldest
+# first, and stores what each returned on its row. A run of all rules doesn't hold the worker until
+# it ends: between two rules it runs the queued jobs of higher priority (see JobYieldPoint).
+# The worker is thus the one process writing runs, overrides and logs: a long maintenance write
+# (e.g. moving rows into a log partition) never holds the database lock against a rule run and its
+# log writer. It also owns the log writer: the web process only starts one for a worker thread.
+# 'engine_worker_mode' in settings.json decides where the worker runs (takes effect on restart):
+#   - 'process' (default): app.py starts it as a child process, so a big run doesn't compete with UI
+#     requests for the GIL. It can also be stopped and started on its own: python engine_worker.py
+#   - 'thread': a thread of the web process (e.g. when debugging).
+# One worker per database: a worker that starts flags jobs and runs left 'running' as interrupted.
+# The worker writes a heartbeat every ENGINE_WORKER_HEARTBEAT_SECONDS. The web process supervises the
+# worker it started: one that exited or whose heartbeat went stale is stopped, its running jobs are
+# flagged as interrupted and a new one is started. Waits on a job (wait_for_engine_job, and the
+# browser's poll of /engine_jobs/<job_id>) give up when the worker stops responding.
+# Each job runs with a RunStopToken (see rule_processing.py) built from the time budget settings and
+# cancelled when /engine_jobs/<job_id>/cancel sets the job's cancel_requested flag, which a watcher
+# thread polls while the job runs.
+# Stopping the worker (SIGTERM in process mode, which is what the web process sends when it exits)
+# stops the running job at its next check, like a cancel; the job ends as 'interrupted' and its run is
+# left for the next one. The worker then flushes its log writer and exits.
+
+RUN_ALL_JOB_TYPES = ('scheduled_all', 'manual_all') # At most one of these is queued or running at a time
+MAINTENANCE_JOB_TYPES = ('maintenance_override_gc', 'maintenance_log_storage') # Queued by the scheduler's maintenance jobs
+
+ENGINE_WORKER_POLL_SECONDS = 1.0 # Idle wait between looks at the queue (also used by wait_for_engine_job)
+ENGINE_WORKER_HEARTBEAT_SECONDS = 15
+ENGINE_WORKER_STATE_KEY = 'engine_worker' # scheduler_state row with the worker's pid and heartbeat
+ENGINE_JOB_RETENTION_DAYS = 7 # Finished jobs (and their results) are deleted after this long
+ENGINE_WORKER_STOP_TIMEOUT_SECONDS = 60 # Time a stopping worker process gets to end its job and flush its logs
+ENGINE_WORKER_STALE_SECONDS = 3 * ENGINE_WORKER_HEARTBEAT_SECONDS # A worker silent for this long is not responding
+ENGINE_JOB_MAX_WAIT_SECONDS = 24 * 3600 # Default bound of wait_for_engine_job, for a worker that responds but never finishes
+
+_engine_worker_process = None
+_engine_worker_stopping = threading.Event() # Set when the web process exits: the supervisor no longer restarts the worker
+
+
+def _run_manual_single_rule(app, rule_id, stop_token=None):
+    """Runs one rule as a 'manual_single' run. Returns (response payload, HTTP status)."""
+    run_start_time = datetime.utcnow()
+    run_id = str(uuid.uuid4())
+    run_type = "manual_single"
+    rule_name_log = f"Rule ID {rule_id}"
+    logger.info(f"\n--- Manual Single Rule Run: Run ID {run_id[:8]} for {rule_name_log} ---")
+
+    db_conn = None
+    overall_run_status = "started"
+    run_summary = f"Manual run for {rule_name_log} (ID {run_id[:8]}) started."
+    exec_result_response = {}
+
+    with app.app_context():
+        try:
+            db_conn = get_db_connection()
+            submit_write(db_conn, "INSERT INTO execution_runs (run_id, run_type, start_time, status, summary_message) VALUES (?, ?, ?, ?, ?)",
+                         (run_id, run_type, run_start_time.isoformat() + "Z", overall_run_status, run_summary))
+            db_conn.commit()
+
+            # Rules are read from the file: it is the one copy the web process and the worker share
+            rules_in_system = load_rules() # This loads from file and sorts
+            rule_to_run = next((r for r in rules_in_system if r.get('id') == rule_id), None)
+
+            if not rule_to_run:
+                run_summary = f"Rule ID {rule_id} not found in current rules. Manual run aborted."
+                overall_run_status = "failed_early_rule_not_found"
+                # exec_result_response will be built in finally or if error caught by general Exception
+            else:
+                rule_name_log = rule_to_run.get('name', rule_id) # Update rule_name_log
+                settings = app.config.get('HYDRUS_SETTINGS', {})
+                if not settings.get('api_address') or not settings.get('api_key'):
+                     run_summary = f"Hydrus API not configured. Manual run for '{rule_name_log}' aborted."
+                     overall_run_status = "failed_early_config"
+                     raise Exception(run_summary)
+
+                if not _ensure_available_services(app.config, f"Manual_Single_Run_{rule_id[:8]}"):
+                    run_summary = f"Could not fetch Hydrus services. Manual run for '{rule_name_log}' aborted."
+                    overall_run_status = "failed_early_services"
+                    raise Exception(run_summary)
+
+                exec_result_response = execute_single_rule(
+                    app.config, db_conn, rule_to_run,
+                    run_id, 1, is_manual_run=True, # is_manual_run=True bypasses override checks for this specific rule
+                    stop_token=stop_token
+                )
+                if exec_result_response.get('success') and exec_result_response.get('stop_reason'):
+                    overall_run_status = f"stopped_{exec_result_response['stop_reason']}"
+                    run_summary = f"Manual run for '{rule_name_log}' stopped early. Rule: {exec_result_response.get('message','Stopped')}"
+                elif exec_result_response.get('success'):
+                    overall_run_status = "completed_ok"
+                    run_summary = f"Manual run for '{rule_name_log}' complete. Rule: {exec_result_response.get('message','OK')}"
+                else:
+                    overall_run_status = "completed_with_rule_failures"
+                    run_summary = f"Manual run for '{rule_name_log}' failed. Rule: {exec_result_response.get('message','Failed')}"
+                db_conn.commit()
+                logger.info(f"Manual Single Run (ID {run_id[:8]}): Rule execution DB changes committed.")
+
+        except Exception as e:
+            logger.error(f"Global error in manual single rule run for {rule_name_log}: {e}", exc_info=True)
+            # Update run_summary if it was still the initial "started" message
+            if "started" in run_summary and overall_run_status == "started":
+                 run_summary = f"Manual run for '{rule_name_log}' failed globally: {str(e)}"
+            # Update overall_run_status if it hasn't been set to a more specific failure
+            if overall_run_status == "started":
+                overall_run_status = "failed_global_error"
+
+            if db_conn: db_conn.rollback() # Rollback any partial DB changes from this try block
+
+            # Ensure exec_result_response is populated for the response payload
+            if not exec_result_response:
+                exec_result_response = {"success": False, "message": run_summary, "rule_id": rule_id,
+                                        "details": {"critical_error_in_view": str(e)}}
+            elif "message" not in exec_result_response or not exec_result_response["message"]:
+                exec_result_response["message"] = run_summary
+        finally:
+            run_end_time = datetime.utcnow()
+            if db_conn:
+                try:
+                    # Ensure summary reflects the most accurate state before DB update
+                    if "message" in exec_result_response and exec_result_response["message"] and "Rule:" not in run_summary:
+                         run_summary = f"Manual run for '{rule_name_log}' outcome. Rule: {exec_result_response.get('message', 'Final state unknown')}"
+                    elif "started" in run_summary and overall_run_status != "started": # Generic update if specific exec_result_response message not available
+                         run_summary = f"Manual run for '{rule_name_log}' finished with status: {overall_run_status}."
+
+                    submit_write(db_conn, "UPDATE execution_runs SET end_time = ?, status = ?, summary_message = ? WHERE run_id = ?",
+                                 (run_end_time.isoformat() + "Z", overall_run_status, run_summary, run_id))
+                    db_conn.commit()
+                    flush_log_writer() # Make the run's log rows visible before the job is reported finished
+                except Exception as e_final_db:
+                    logger.error(f"CRITICAL: Failed to update final status for manual single run {run_id}: {e_final_db}")
+                finally:
+                    db_conn.close()
+            logger.info(f"--- Manual Single Rule Run: Finished Run ID {run_id[:8]} ---")
+
+    # Ensure these keys are always present in the response payload
+    exec_result_response["overall_run_id_for_log"] = run_id
+    exec_result_response["overall_run_status_for_log"] = overall_run_status
+    if "success" not in exec_result_response: # Should be set by execute_single_rule or error handling
+        exec_result_response["success"] = False
+    if "message" not in exec_result_response:
+        exec_result_response["message"] = run_summary
+    if "rule_id" not in exec_result_response:
+         exec_result_response["rule_id"] = rule_id
+
+    http_status = 200
+    if overall_run_status == "failed_early_rule_not_found": http_status = 404
+    elif overall_run_status.startswith("failed"): http_status = 500
+    elif not exec_result_response.get("success", False): http_status = 500 # If rule execution itself failed
+
+    return exec_result_response, http_status
+
+
+def _run_manual_all_rules(app, stop_token=None, yield_point=None):
+    """Runs every rule as a 'manual_all' run. Returns (response payload, HTTP status)."""
+    run_start_time = datetime.utcnow()
+    run_id = str(uuid.uuid4())
+    run_type = "manual_all"
+    logger.info(f"\n--- Manual 'Run All Rules' Run: Run ID {run_id[:8]} ---")
+
+    db_conn = None
+    overall_run_status = "started"
+    run_summary = f"Manual 'Run All Rules' ({run_id[:8]}) started."
+    all_individual_results = []
+
+    with app.app_context():
+        try:
+            db_conn = get_db_connection()
+            submit_write(db_conn, "INSERT INTO execution_runs (run_id, run_type, start_time, status, summary_message) VALUES (?, ?, ?, ?, ?)",
+                         (run_id, run_type, run_start_time.isoformat() + "Z", overall_run_status, run_summary))
+            db_conn.commit()
+
+            # Rules are read from the file (execution-sorted): it is the one copy the web process and the worker share
+            rules_to_run = load_rules()
+
+            settings = app.config.get('HYDRUS_SETTINGS',{})
+            if not settings.get('api_address') or not settings.get('api_key'):
+                 run_summary = f"Hydrus API not configured. Manual 'Run All' aborted."
+                 overall_run_status = "failed_early_config"
+                 raise Exception(run_summary) # Caught by general handler below
+
+            if not rules_to_run:
+                run_summary = "No rules defined. Manual 'Run All' completed without processing."
+                overall_run_status = "completed_no_rules"
+            else:
+                if not _ensure_available_services(app.config, f"Manual_Run_All_{run_id[:8]}"):
+                    run_summary = f"Could not fetch Hydrus services. Manual 'Run All' aborted."
+                    overall_run_status = "failed_early_services"
+                    raise Exception(run_summary) # Caught by general handler below
+
+                logger.info(f"Manual 'Run All' (ID {run_id[:8]}): Processing {len(rules_to_run)} rules in their execution order.")
+                # Checkpointed per rule so the scheduler can finish the run if the process stops midway
+                start_run_progress(db_conn, run_id, run_type, [rule.get('id') for rule in rules_to_run])
+                total_processed_rules = 0
+                total_failed_rules = 0
+                critical_errors_in_loop = 0
+                rules_not_started = 0
+                rules_stopped_early = 0
+                files_deferred = 0
+                results_by_position = {} # Rules that don't conflict run concurrently and finish in any order
+
+                # For 'Run All Rules' (manual or scheduled), is_manual_run should be False
+                # so that override logic fully applies between rules in the run.
+                for position, rule_instance, result, e_exec, checkpoint in execute_rules_in_conflict_order(
+                    app.config, db_conn, list(enumerate(rules_to_run)), run_id, is_manual_run=False,
+                    max_workers=settings.get('rule_execution_workers', 1), stop_token=stop_token,
+                    yield_point=yield_point
+                ):
+                    rule_name_log = rule_instance.get('name', rule_instance.get('id', 'Unnamed Rule'))
+                    if e_exec is None and result.get('not_started'):
+                        rules_not_started += 1
+                        results_by_position[position] = result
+                        continue
+                    total_processed_rules += 1
+                    if e_exec is None:
+                        results_by_position[position] = result
+                        if result.get('stop_reason'):
+                            rules_stopped_early += 1
+                            files_deferred += result.get('files_deferred') or 0
+                        if not result.get('success'):
+                            total_failed_rules +=1
+                            if result.get("details", {}).get("critical_error"): # Check if execute_single_rule reported a critical error
+                                critical_errors_in_loop +=1
+                    else: # Exception raised by execute_single_rule itself
+                        total_failed_rules +=1
+                        critical_errors_in_loop +=1
+                        err_msg = f"CRITICAL unhandled error processing rule '{rule_name_log}' in manual run all: {str(e_exec)}"
+                        logger.error(err_msg, exc_info=e_exec)
+                        results_by_position[position] = {
+                            "success": False, "message": err_msg,
+                            "rule_id": rule_instance.get('id'), "rule_name": rule_name_log,
+                            "details":{"critical_error_in_view_loop": str(e_exec)}
+                        }
+                    db_conn.commit()
+                    if checkpoint:
+                        checkpoint_run_progress(db_conn, run_id, *checkpoint)
+                all_individual_results.extend(results_by_position[position] for position in sorted(results_by_position))
+
+                run_stop_reason = stop_token.stop_reason() if stop_token is not None else None
+                if critical_errors_in_loop > 0:
+                    overall_run_status = "completed_with_critical_rule_errors"
+                elif total_failed_rules > 0:
+                    overall_run_status = "completed_with_rule_failures"
+                elif run_stop_reason:
+                    overall_run_status = f"stopped_{run_stop_reason}" # stopped_cancelled or stopped_run_time_budget
+                else:
+                    overall_run_status = "completed_ok"
+
+                run_summary = f"Manual 'Run All' ({run_id[:8]}) {overall_run_status}. Processed {total_processed_rules} rules, {total_failed_rules} had issues ({critical_errors_in_loop} critical)."
+                if rules_not_started or rules_stopped_early:
+                    run_summary += (f" Stopped early: {rules_stopped_early} rule(s) stopped midway ({files_deferred} files deferred), "
+                                    f"{rules_not_started} not started; the remaining work is left to the next run.")
+
+            if db_conn: db_conn.commit() # Commit all rule execution details logged by execute_single_rule
+            logger.info(f"Manual 'Run All' (ID {run_id[:8]}): All rule execution DB changes committed.")
+
+        except Exception as e: # Catches exceptions from setup (API check, service fetch) or unexpected issues
+            logger.error(f"Global error in manual 'Run All' (Run ID {run_id[:8]}): {e}", exc_info=True)
+            if "started" in run_summary and overall_run_status == "started": # If error happened before more specific summary
+                run_summary = f"Manual 'Run All' ({run_id[:8]}) failed globally: {str(e)}"
+            if overall_run_status == "started": # If status not updated by more specific failure
+                overall_run_status = "failed_global_error"
+
+            if db_conn: db_conn.rollback() # Rollback any partial DB changes from this try block
+        finally:
+            run_end_time = datetime.utcnow()
+            if db_conn:
+                try:
+                    submit_write(db_conn, "UPDATE execution_runs SET end_time = ?, status = ?, summary_message = ? WHERE run_id = ?",
+                                 (run_end_time.isoformat() + "Z", overall_run_status, run_summary, run_id))
+                    db_conn.commit()
+                    flush_log_writer() # Make the run's log rows visible before the job is reported finished
+                    finish_run_progress(db_conn, run_id)
+                except Exception as e_final_db:
+                    logger.error(f"CRITICAL: Failed to update final status for manual 'Run All' {run_id}: {e_final_db}")
+                finally:
+                    db_conn.close()
+            logger.info(f"--- Manual 'Run All Rules' Run: Finished Run ID {run_id[:8]} ---")
+
+    response_payload = {
+        "success": overall_run_status.startswith(("completed", "stopped")) and not "error" in overall_run_status and not "failure" in overall_run_status,
+        "message": run_summary, "run_id_for_log": run_id,
+        "results_per_rule": all_individual_results
+    }
+    http_status = 200
+    if overall_run_status.startswith("failed") or "error" in overall_run_status or "failure" in overall_run_status:
+        http_status = 500
+
+    return response_payload, http_status
+
+
+def run_engine_job(app, job, stop_token=None, yield_point=None):
+    """
+    Executes a claimed job. Returns (final status, result). The result of a manual job is
+    {"http_status": ..., "payload": ...}, the response its route used to return; the result of a
+    scheduled job is {"files_acted_on": ...} (None if no rule was processed), for the adaptive interval;
+    the result of a maintenance job is {"run_status": ..., "message": ...}, as logged to execution_runs.
+    A job whose stop_token was cancelled ends as 'cancelled' (with the result of what it did), or as
+    'interrupted' if it was stopped because the worker is shutting down.
+    yield_point (a JobYieldPoint) lets a run of all rules give way to jobs of higher priority.
+    """
+    from scheduler_tasks import _run_all_rules, _run_override_gc, _run_log_maintenance # scheduler_tasks imports this module lazily
+    if job['job_type'] == 'scheduled_all':
+        status, result = 'completed', {"files_acted_on": _run_all_rules(app, stop_token=stop_token, yield_point=yield_point)}
+    elif job['job_type'] in MAINTENANCE_JOB_TYPES:
+        run_maintenance = _run_override_gc if job['job_type'] == 'maintenance_override_gc' else _run_log_maintenance
+        run_status, message = run_maintenance(app)
+        status, result = ('completed' if run_status.startswith('completed') else 'failed'), {"run_status": run_status, "message": message}
+    else:
+        if job['job_type'] == 'manual_all':
+            payload, http_status = _run_manual_all_rules(app, stop_token=stop_token, yield_point=yield_point)
+        elif job['job_type'] == 'manual_single':
+            payload, http_status = _run_manual_single_rule(app, job['rule_id'], stop_token=stop_token)
+        else:
+            return 'failed', {"http_status": 400, "payload": {"success": False, "message": f"Unknown job type '{job['job_type']}'."}}
+        status, result = ('completed' if http_status < 400 else 'failed'), {"http_status": http_status, "payload": payload}
+    if stop_token is not None and stop_token.stop_reason() == 'cancelled':
+        status = 'cancelled'
+    elif stop_token is not None and stop_token.stop_reason() == 'shutdown':
+        status = 'interrupted'
+    return status, result
+
+
+def _watch_for_cancel(job_id, stop_token, job_done, stop_event):
+    """
+    Cancels stop_token once the job's cancel_requested flag is set, or with the 'shutdown' reason once
+    the worker's stop_event is set. Returns when job_done is set.
+    """
+    while not job_done.wait(ENGINE_WORKER_POLL_SECONDS):
+        if stop_event.is_set():
+            logger.info(f"Engine worker: Stopping job {job_id[:8]} because the worker is shutting down.")
+            stop_token.cancel("shutdown")
+            return
+        db_conn = get_db_read_connection()
+        try:
+            cancel_requested = is_engine_job_cancel_requested(db_conn, job_id)
+        finally:
+            db_conn.close()
+        if cancel_requested:
+            logger.info(f"Engine worker: Cancelling job {job_id[:8]} as requested; it stops at its next check.")
+            stop_token.cancel()
+            return
+
+
+class JobYieldPoint:
+    """
+    Lets a running job give way to queued jobs of higher priority (a lower priority number). The rule
+    loop of a run of all rules (execute_rules_in_conflict_order) asks waiting() between two rules, when
+    none of its rules is executing, and calls run_waiting() if so: the worker then runs those jobs on
+    the spot and the run carries on with its next rule. Overrides stay consistent: the run is paused
+    between rules with everything it did committed, the jobs that cut in are complete runs of their own
+    (a 'manual_single' job bypasses overrides for its rule as it always did, and its actions are
+    committed before the run resumes and looks at overrides again), and the run's rules still execute
+    in their order. The paused time is added to the run's time budget.
+    """
+    def __init__(self, app, job, stop_token, worker_state, stop_event):
+        self.app = app
+        self.job = job
+        self.stop_token = stop_token
+        self.worker_state = worker_state
+        self.stop_event = stop_event
+        self.priority = job.get('priority', ENGINE_JOB_PRIORITIES.get(job['job_type'], max(ENGINE_JOB_PRIORITIES.values())))
+
+    def waiting(self):
+        """True if a job of higher priority is queued."""
+        db_conn = get_db_read_connection()
+        try:
+            return has_queued_engine_job(db_conn, self.priority)
+        finally:
+            db_conn.close()
+
+    def run_waiting(self):
+        """Runs queued jobs of higher priority until there are none left. Returns how many ran."""
+        paused_at = time.monotonic()
+        jobs_run = 0
+        while not self.stop_event.is_set():
+            db_conn = get_db_connection()
+            try:
+                job = claim_next_engine_job(db_conn, os.getpid(), below_priority=self.priority)
+            finally:
+                db_conn.close()
+            if job is None:
+                break
+            if not jobs_run:
+                logger.info(f"Engine worker: Pausing job {self.job['job_id'][:8]} ({self.job['job_type']}) between rules for queued jobs of higher priority.")
+            _run_claimed_job(self.app, job, self.worker_state, self.stop_event)
+            jobs_run += 1
+        if jobs_run:
+            paused_seconds = time.monotonic() - paused_at
+            self.stop_token.extend(paused_seconds) # The pause doesn't count against the run's time budget
+            logger.info(f"Engine worker: Resuming job {self.job['job_id'][:8]} after {jobs_run} job(s) ({paused_seconds:.1f}s).")
+        return jobs_run
+
+
+def _run_claimed_job(app, job, worker_state, stop_event):
+    """Runs a claimed job with its stop token and cancel watcher, and stores how it ended."""
+    outer_job_id = worker_state.get("current_job_id") # Set when the job cuts into a run of all rules
+    worker_state["current_job_id"] = job['job_id']
+    rule_suffix = f", rule {job['rule_id']}" if job.get('rule_id') else ""
+    logger.info(f"Engine worker: Starting job {job['job_id'][:8]} ({job['job_type']}{rule_suffix}).")
+    settings = app.config.get('HYDRUS_SETTINGS', {})
+    stop_token = RunStopToken(settings.get('run_time_budget_seconds', 0), settings.get('rule_time_budget_seconds', 0))
+    job_done = threading.Event()
+    threading.Thread(target=_watch_for_cancel, args=(job['job_id'], stop_token, job_done, stop_event),
+                     name="EngineJobCancelWatch", daemon=True).start()
+    try:
+        status, result = run_engine_job(app, job, stop_token=stop_token, yield_point=JobYieldPoint(app, job, stop_token, worker_state, stop_event))
+    except Exception as e:
+        logger.error(f"Engine worker: Job {job['job_id'][:8]} failed: {e}", exc_info=True)
+        status, result = 'failed', {"http_status": 500, "payload": {"success": False, "message": f"The engine worker failed to run the job: {e}"}}
+    finally:
+        job_done.set()
+    worker_state["current_job_id"] = outer_job_id
+    db_conn = get_db_connection()
+    try:
+        finish_engine_job(db_conn, job['job_id'], status, result)
+    finally:
+        db_conn.close()
+    logger.info(f"Engine worker: Job {job['job_id'][:8]} {status}.")
+
+
+def _reload_settings_if_changed(app, settings_mtime):
+    """
+    Reloads settings.json into app.config when it changed since settings_mtime (the web process saves
+    it, the worker reads it). Returns the new modification time.
+    """
+    try:
+        current_mtime = os.path.getmtime(SETTINGS_FILE)
+    except OSError:
+        return settings_mtime
+    if current_mtime == settings_mtime:
+        return settings_mtime
+    previous_settings = app.config.get('HYDRUS_SETTINGS', {})
+    app.config['HYDRUS_SETTINGS'] = load_settings()
+    if (previous_settings.get('api_address'), previous_settings.get('api_key')) != (
+            app.config['HYDRUS_SETTINGS'].get('api_address'), app.config['HYDRUS_SETTINGS'].get('api_key')):
+        app.config['AVAILABLE_SERVICES'] = [] # Fetched again from the new address by the next run
+    return current_mtime
+
+
+def _write_worker_heartbeat(worker_state):
+    db_conn = get_db_connection()
+    try:
+        worker_state["heartbeat_at"] = datetime.utcnow().isoformat() + "Z"
+        db_conn.execute("INSERT OR REPLACE INTO scheduler_state (state_key, state_value) VALUES (?, ?)",
+                        (ENGINE_WORKER_STATE_KEY, json.dumps(worker_state)))
+        db_conn.commit()
+    except Exception as e:
+        logger.warning(f"Engine worker: Could not write heartbeat: {e}")
+    finally:
+        db_conn.close()
+
+
+def _heartbeat_loop(worker_state, stop_event):
+    while not stop_event.is_set():
+        _write_worker_heartbeat(worker_state)
+        stop_event.wait(ENGINE_WORKER_HEARTBEAT_SECONDS)
+
+
+def engine_worker_loop(app, stop_event):
+    """
+    Takes queued jobs one at a time (highest priority first) until stop_event is set. A job that is
+    running when stop_event is set is finished first.
+    """
+    worker_pid = os.getpid()
+    db_conn = get_db_connection()
+    try:
+        # Nothing else runs jobs on this database (one worker per database): what is left running was
+        # cut short by the previous worker. Its run is resumed by the rules job (see run_progress).
+        mark_interrupted_runs(db_conn)
+        interrupted_count = interrupt_running_engine_jobs(
+            db_conn, "The engine worker stopped before the job finished. A run of all rules is resumed by the next scheduled run.")
+        if interrupted_count:
+            logger.warning(f"Engine worker: {interrupted_count} job(s) left running by the previous worker flagged as interrupted.")
+        prune_engine_jobs(db_conn, datetime.utcnow() - timedelta(days=ENGINE_JOB_RETENTION_DAYS))
+    finally:
+        db_conn.close()
+
+    worker_state = {"pid": worker_pid, "started_at": datetime.utcnow().isoformat() + "Z", "current_job_id": None}
+    threading.Thread(target=_heartbeat_loop, args=(worker_state, stop_event), name="EngineWorkerHeartbeat", daemon=True).start()
+    logger.info(f"Engine worker (pid {worker_pid}): Waiting for jobs.")
+
+    settings_mtime = os.path.getmtime(SETTINGS_FILE) if os.path.exists(SETTINGS_FILE) else None
+    last_prune = time.monotonic()
+    while not stop_event.is_set():
+        db_conn = get_db_connection()
+        try:
+            job = claim_next_engine_job(db_conn, worker_pid)
+        finally:
+            db_conn.close()
+        if job is None:
+            if time.monotonic() - last_prune > 3600:
+                prune_conn = get_db_connection()
+                try:
+                    prune_engine_jobs(prune_conn, datetime.utcnow() - timedelta(days=ENGINE_JOB_RETENTION_DAYS))
+                finally:
+                    prune_conn.close()
+                last_prune = time.monotonic()
+            stop_event.wait(ENGINE_WORKER_POLL_SECONDS)
+            continue
+
+        settings_mtime = _reload_settings_if_changed(app, settings_mtime)
+        _run_claimed_job(app, job, worker_state, stop_event)
+
+
+def start_engine_worker(app):
+    """
+    Starts the engine worker as configured by 'engine_worker_mode' (see the module comment).
+    Call once, from the process that runs the scheduler.
+    """
+    settings = app.config.get('HYDRUS_SETTINGS', {})
+    mode = settings.get('engine_worker_mode', 'process')
+    if mode == 'process':
+        atexit.register(_stop_engine_worker_process)
+    elif settings.get('async_log_writer', True):
+        # A worker process starts its own (see __main__); a worker thread shares the web process's
+        start_log_writer(get_db_connection, max_queue_size=settings.get('log_writer_queue_size', 10000))
+    else:
+        logger.info("Background execution log writer disabled in settings. Execution logs are written inline.")
+    worker = _spawn_engine_worker(app, mode)
+    threading.Thread(target=_supervise_engine_worker, args=(app, mode, worker), name="EngineWorkerSupervisor", daemon=True).start()
+
+
+def _spawn_engine_worker(app, mode):
+    """Starts a worker thread or process. Returns the thread, or the Popen of the process."""
+    global _engine_worker_process
+    if mode == 'thread':
+        worker = threading.Thread(target=engine_worker_loop, args=(app, threading.Event()), name="EngineWorker", daemon=True)
+        worker.start()
+        logger.info("Engine worker started on a thread of the web process.")
+        return worker
+    _engine_worker_process = subprocess.Popen([sys.executable, os.path.abspath(__file__)])
+    logger.info(f"Engine worker started as process {_engine_worker_process.pid}.")
+    return _engine_worker_process
+
+
+def _supervise_engine_worker(app, mode, worker):
+    """
+    Restarts the worker when it has exited or, for a process, when its heartbeat has been stale for
+    ENGINE_WORKER_STALE_SECONDS (it is killed first). Its running jobs are flagged as interrupted right
+    away, so waits on them end and a new run of all rules can be queued. A worker thread can't be
+    stopped from outside: only one that has died is replaced.
+    """
+    started_at = time.monotonic()
+    while not _engine_worker_stopping.wait(ENGINE_WORKER_HEARTBEAT_SECONDS):
+        if mode == 'thread':
+            exited, reason = not worker.is_alive(), "the worker thread died"
+        else:
+            exited, reason = worker.poll() is not None, f"the worker process exited with code {worker.returncode}"
+        stale = False
+        if not exited and mode == 'process' and time.monotonic() - started_at > ENGINE_WORKER_STALE_SECONDS:
+            db_conn = get_db_read_connection()
+            try:
+                stale = not is_engine_worker_alive(db_conn)
+            finally:
+                db_conn.close()
+            reason = f"its heartbeat is older than {ENGINE_WORKER_STALE_SECONDS}s"
+        if not exited and not stale:
+            continue
+        if _engine_worker_stopping.is_set():
+            return
+        logger.error(f"Engine worker is not responding ({reason}). Restarting it.")
+        if stale:
+            worker.kill()
+            worker.wait()
+        db_conn = get_db_connection()
+        try:
+            mark_interrupted_runs(db_conn)
+            interrupt_running_engine_jobs(
+                db_conn, "The engine worker stopped responding before the job finished. A run of all rules is resumed by the next scheduled run.")
+        finally:
+            db_conn.close()
+        worker = _spawn_engine_worker(app, mode)
+        started_at = time.monotonic()
+
+
+def _stop_engine_worker_process():
+    _engine_worker_stopping.set()
+    if _engine_worker_process is None or _engine_worker_process.poll() is not None:
+        return
+    logger.info(f"Stopping engine worker process {_engine_worker_process.pid}...")
+    _engine_worker_process.terminate() # The worker stops its job and flushes its log writer (see __main__)
+    try:
+        _engine_worker_process.wait(timeout=ENGINE_WORKER_STOP_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        logger.warning(f"Engine worker process {_engine_worker_process.pid} did not stop in {ENGINE_WORKER_STOP_TIMEOUT_SECONDS}s. Killing it.")
+        _engine_worker_process.kill()
+
+
+def wait_for_engine_job(job_id, poll_seconds=ENGINE_WORKER_POLL_SECONDS, timeout_seconds=ENGINE_JOB_MAX_WAIT_SECONDS):
+    """
+    Blocks until the job has finished and returns it (None if it disappeared). Gives up, returning the
+    job as it stands ('queued' or 'running'), when timeout_seconds have passed or when the worker has
+    not been responding for ENGINE_WORKER_STALE_SECONDS (time for the supervisor to restart it).
+    Not for request threads.
+    """
+    wait_started = time.monotonic()
+    silent_since = None
+    while True:
+        db_conn = get_db_read_connection()
+        try:
+            job = get_engine_job(db_conn, job_id)
+            worker_alive = is_engine_worker_alive(db_conn)
+        finally:
+            db_conn.close()
+        if job is None or job['status'] not in ('queued', 'running'):
+            return job
+        now = time.monotonic()
+        silent_since = None if worker_alive else (silent_since or now)
+        if silent_since is not None and now - silent_since >= ENGINE_WORKER_STALE_SECONDS:
+            logger.warning(f"Stopped waiting for engine job {job_id[:8]} ({job['status']}): the engine worker is not responding.")
+            return job
+        if timeout_seconds is not None and now - wait_started >= timeout_seconds:
+            logger.warning(f"Stopped waiting for engine job {job_id[:8]} ({job['status']}) after {timeout_seconds}s.")
+            return job
+        time.sleep(poll_seconds)
+
+
+def is_engine_worker_alive(db_conn):
+    """True if the worker's heartbeat (see ENGINE_WORKER_STATE_KEY) is less than ENGINE_WORKER_STALE_SECONDS old."""
+    row = db_conn.execute("SELECT state_value FROM scheduler_state WHERE state_key = ?", (ENGINE_WORKER_STATE_KEY,)).fetchone()
+    worker_state = json.loads(row[0]) if row else None
+    if not worker_state or not worker_state.get('heartbeat_at'):
+        return False
+    heartbeat_age = datetime.utcnow() - datetime.fromisoformat(worker_state['heartbeat_at'].rstrip('Z'))
+    return heartbeat_age.total_seconds() < ENGINE_WORKER_STALE_SECONDS
+
+
+def get_engine_status(db_conn):
+    """Queued/running jobs and the worker's last heartbeat (see ENGINE_WORKER_STATE_KEY)."""
+    row = db_conn.execute("SELECT state_value FROM scheduler_state WHERE state_key = ?", (ENGINE_WORKER_STATE_KEY,)).fetchone()
+    worker_state = json.loads(row[0]) if row else None
+    worker_alive = is_engine_worker_alive(db_conn)
+    pending_jobs = [{name: job[name] for name in ('job_id', 'job_type', 'priority', 'rule_id', 'status', 'enqueued_at', 'started_at', 'cancel_requested')}
+                    for job in list_pending_engine_jobs(db_conn)]
+    return {"worker": worker_state, "worker_alive": worker_alive, "pending_jobs": pending_jobs}
+
+
+def create_engine_app():
+    """Flask app holding the configuration of a standalone worker (no routes, no scheduler)."""
+    app = Flask(__name__)
+    app.config['HYDRUS_SETTINGS'] = load_settings()
+    app.config['AUTOMATION_RULES'] = load_rules()
+    app.config['AVAILABLE_SERVICES'] = [] # Fetched by the first run
+    return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - engine_worker - %(name)s - %(levelname)s - %(message)s')
+    worker_stop_event = threading.Event()
+    # SIGTERM (sent by the web process when it exits or restarts the worker) stops the loop instead of
+    # killing the process outright, so the job in progress ends cleanly and the writes still queued
+    # for the log writer are committed below. Installed first, so that it also covers startup.
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker_stop_event.set())
+    engine_app = create_engine_app()
+    # The web app creates and upgrades the database (app.py); the worker only uses it
+    if engine_app.config['HYDRUS_SETTINGS'].get('async_log_writer', True):
+        start_log_writer(get_db_connection, max_queue_size=engine_app.config['HYDRUS_SETTINGS'].get('log_writer_queue_size', 10000))
+    try:
+        engine_worker_loop(engine_app, worker_stop_event)
+        logger.info("Engine worker: Stopped.")
+    except KeyboardInterrupt:
+        logger.info("Engine worker: Interrupted. Stopping.")
+    finally:
+        stop_log_writer(timeout=30)
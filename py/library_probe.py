@@ -0,0 +1,219 @@
+import json
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+
+from hydrus_interface import call_hydrus_api
+from database import rule_version_content_hash, get_rule_last_run_states
+
+logger = logging.getLogger(__name__)
+
+# --- Library Change Probe ---
+# Most scheduled ticks find nothing to do, yet every rule still pays for a recently-viewed search and
+# its main search. Before a scheduled run, a few cheap searches take a "signature" of the library.
+# Each is a one-file search sorted by time, so its cost doesn't grow with the library:
+#   - the newest imported file and the newest archived file,
+#   - the newest file in the trash,
+#   - the newest file in each file service that the probed rules search or move files into.
+# These see files arriving somewhere, not files leaving a service (or the trash) when nothing newer
+# arrives. Rules that such a change can give work are therefore never skipped (see the list below).
+# With 'library_change_probe_count_files' the signature also holds the number of files in the trash
+# and in each of those services, which sees files leaving too, so these rules can be skipped as well.
+# Counting lists every file ID of each service, on every tick: on a large library this can cost
+# more than the rule searches the probe would skip.
+# The signature of the last run is kept in scheduler_state. A rule is skipped when the signature is
+# unchanged and nothing else could give it new work:
+#   - all its conditions are visible to the probe (file services, inbox/archive, file properties set
+#     at import; tags, ratings, URLs, notes and pasted searches are not). Without the file counts,
+#     neither are conditions a file comes to match by leaving a service or the trash ("not in
+#     service X", "not trashed", "deleted", "not local"), nor add_to/force_in actions (a file
+#     removed from a destination service is new work for them),
+#   - it is unchanged since it last ran and that execution left nothing behind (no failure, no files
+#     held back because they were recently viewed),
+#   - the last run acted on no files (its tag/rating changes could be inputs of other rules),
+#   - a full run happened less than 'library_change_probe_max_skip_seconds' ago (this bounds how late
+#     changes the probe can't see are picked up).
+# Skipped ticks are only counted in scheduler_state; they don't add execution_runs rows.
+
+LIBRARY_PROBE_STATE_KEY = 'library_probe'
+LIBRARY_PROBE_SKIPS_STATE_KEY = 'library_probe_skips'
+
+# Hydrus search_files 'file_sort_type' values used by the probe
+HYDRUS_SORT_IMPORT_TIME = 2
+HYDRUS_SORT_ARCHIVE_TIME = 19
+
+HYDRUS_TRASH_SERVICE_TYPE = 14
+
+# Boolean condition operators whose value only changes through inbox/archive, trash/deletion or import
+PROBE_VISIBLE_BOOLEAN_OPERATORS = (
+    'inbox', 'archive', 'local', 'trashed', 'deleted', 'has_duration', 'has_audio', 'has_exif',
+    'has_embedded_metadata', 'has_icc_profile', 'has_transparency',
+)
+# (operator, value) of boolean conditions that a file comes to match by leaving a service or the trash
+PROBE_REMOVAL_BOOLEAN_CONDITIONS = (('local', False), ('trashed', False), ('deleted', True))
+
+
+def _condition_visible_to_probe(condition, sees_removals):
+    condition_type = condition.get('type')
+    if condition_type == 'or_group':
+        return all(isinstance(nested, dict) and _condition_visible_to_probe(nested, sees_removals) for nested in condition.get('conditions') or [])
+    if condition_type == 'boolean':
+        if not sees_removals and (condition.get('operator'), condition.get('value')) in PROBE_REMOVAL_BOOLEAN_CONDITIONS:
+            return False
+        return condition.get('operator') in PROBE_VISIBLE_BOOLEAN_OPERATORS
+    if condition_type == 'file_service':
+        return sees_removals or condition.get('operator') == 'is_in'
+    return condition_type in ('filesize', 'filetype')
+
+
+def rule_visible_to_probe(rule, sees_removals=False):
+    """
+    True if the library probe can see every change that could give the rule new work.
+    sees_removals: the signature holds file counts ('library_change_probe_count_files'), so it also
+    sees files leaving a service or the trash.
+    """
+    if not sees_removals and (rule.get('action') or {}).get('type') in ('add_to', 'force_in'):
+        return False
+    return all(isinstance(condition, dict) and _condition_visible_to_probe(condition, sees_removals) for condition in rule.get('conditions') or [])
+
+
+def rule_inputs_hash(rule):
+    """Hash of what a rule does (importance, conditions, action), as used for rule versions."""
+    try:
+        importance = int(rule.get('priority', 1))
+    except (ValueError, TypeError):
+        importance = 1
+    return rule_version_content_hash(importance, json.dumps(rule.get('conditions', []), sort_keys=True),
+                                     json.dumps(rule.get('action', {}), sort_keys=True))
+
+
+def _probed_service_keys(rules):
+    """File service keys the rules search (file_service conditions) or move files into."""
+    service_keys = set()
+    def add_condition_keys(condition):
+        if condition.get('type') == 'or_group':
+            for nested in condition.get('conditions') or []:
+                if isinstance(nested, dict):
+                    add_condition_keys(nested)
+        elif condition.get('type') == 'file_service' and isinstance(condition.get('value'), str):
+            service_keys.add(condition['value'])
+    for rule in rules:
+        for condition in rule.get('conditions') or []:
+            if isinstance(condition, dict):
+                add_condition_keys(condition)
+        action = rule.get('action') or {}
+        if action.get('type') in ('add_to', 'force_in'):
+            service_keys.update(key for key in action.get('destination_service_keys') or [] if isinstance(key, str))
+    return sorted(service_keys)
+
+
+def _search_file_ids(api_address, api_key, predicates, **extra_params):
+    params = {'tags': json.dumps(predicates), 'return_hashes': json.dumps(False), 'return_file_ids': json.dumps(True)}
+    params.update({name: json.dumps(value) if not isinstance(value, str) else value for name, value in extra_params.items()})
+    result, _ = call_hydrus_api(api_address, api_key, '/get_files/search_files', params=params)
+    if not result.get("success"):
+        raise RuntimeError(result.get('message', 'API error'))
+    return result.get('data', {}).get('file_ids', [])
+
+
+def probe_library_state(app_config, rules):
+    """
+    Takes the library signature for rules (see the module comment). Returns a dict, or None if a
+    probe search failed (the caller then runs everything).
+    """
+    settings = app_config.get('HYDRUS_SETTINGS', {})
+    api_address, api_key = settings.get('api_address'), settings.get('api_key')
+    if not api_address:
+        return None
+    try:
+        signature = {}
+        for name, sort_type in (("newest_import", HYDRUS_SORT_IMPORT_TIME), ("newest_archived", HYDRUS_SORT_ARCHIVE_TIME)):
+            predicates = ["system:everything", "system:limit=1"] + (["system:archive"] if name == "newest_archived" else [])
+            file_ids = _search_file_ids(api_address, api_key, predicates, file_sort_type=sort_type, file_sort_asc=False)
+            signature[name] = file_ids[0] if file_ids else None
+        trash_service = next((service for service in app_config.get('AVAILABLE_SERVICES') or []
+                              if service.get('type') == HYDRUS_TRASH_SERVICE_TYPE), None)
+        probed_service_keys = ([trash_service['service_key']] if trash_service else []) + _probed_service_keys(rules)
+        signature["service_newest"] = {}
+        for service_key in probed_service_keys:
+            file_ids = _search_file_ids(api_address, api_key, ["system:everything", "system:limit=1"], file_service_key=service_key,
+                                        file_sort_type=HYDRUS_SORT_IMPORT_TIME, file_sort_asc=False)
+            signature["service_newest"][service_key] = file_ids[0] if file_ids else None
+        if settings.get('library_change_probe_count_files', False): # Lists every file ID (see the module comment)
+            signature["service_counts"] = {
+                service_key: len(_search_file_ids(api_address, api_key, ["system:everything"], file_service_key=service_key))
+                for service_key in probed_service_keys
+            }
+        return signature
+    except RuntimeError as e:
+        logger.warning(f"Library change probe failed ({e}). Running rules without it.")
+        return None
+
+
+def _get_probe_state(db_conn):
+    row = db_conn.execute("SELECT state_value FROM scheduler_state WHERE state_key = ?", (LIBRARY_PROBE_STATE_KEY,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def select_rules_to_run(app_config, db_conn, rules, now):
+    """
+    Probes the library and splits the due rules (in running order) into (rules_to_run, skipped_rules).
+    Also returns the signature to store with save_probe_result() after the run (None if the probe is
+    off or failed, in which case every rule runs).
+    """
+    settings = app_config.get('HYDRUS_SETTINGS', {})
+    if not settings.get('library_change_probe', True) or not rules:
+        return rules, [], None
+    sees_removals = settings.get('library_change_probe_count_files', False)
+    if not any(rule_visible_to_probe(rule, sees_removals) for rule in rules):
+        return rules, [], None # No rule could be skipped; spare the probe searches
+    signature = probe_library_state(app_config, rules)
+    if signature is None:
+        return rules, [], None
+    state = _get_probe_state(db_conn)
+    max_skip = timedelta(seconds=settings.get('library_change_probe_max_skip_seconds', 3600))
+    if (not state or state.get('signature') != signature or state.get('last_run_acted')
+            or not state.get('last_full_run_at') or now - datetime.fromisoformat(state['last_full_run_at'].rstrip('Z')) >= max_skip):
+        return rules, [], signature
+    last_runs = get_rule_last_run_states(db_conn)
+    rules_to_run, skipped_rules = [], []
+    for rule in rules:
+        last_run = last_runs.get(rule.get('id'))
+        if (rule_visible_to_probe(rule, sees_removals) and last_run and not last_run['needs_rerun']
+                and last_run['inputs_hash'] == rule_inputs_hash(rule)):
+            skipped_rules.append(rule)
+        else:
+            rules_to_run.append(rule)
+    return rules_to_run, skipped_rules, signature
+
+
+def save_probe_result(db_conn, signature, run_time, full_run, files_acted_on):
+    """Stores the signature a run started from (and whether it ran every due rule) and commits."""
+    try:
+        state = _get_probe_state(db_conn) or {}
+        state['signature'] = signature
+        state['probed_at'] = run_time.isoformat() + "Z"
+        state['last_run_acted'] = bool(files_acted_on)
+        if full_run:
+            state['last_full_run_at'] = run_time.isoformat() + "Z"
+        db_conn.execute("INSERT OR REPLACE INTO scheduler_state (state_key, state_value) VALUES (?, ?)",
+                        (LIBRARY_PROBE_STATE_KEY, json.dumps(state)))
+        db_conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Error saving the library change probe result: {e}")
+
+
+def record_probe_skip(db_conn, skip_time):
+    """Counts a scheduled tick skipped because the library was unchanged (one state row, no run row)."""
+    try:
+        row = db_conn.execute("SELECT state_value FROM scheduler_state WHERE state_key = ?", (LIBRARY_PROBE_SKIPS_STATE_KEY,)).fetchone()
+        skips = json.loads(row[0]) if row else {"skipped_ticks": 0}
+        skips["skipped_ticks"] += 1
+        skips["last_skipped_at"] = skip_time.isoformat() + "Z"
+        db_conn.execute("INSERT OR REPLACE INTO scheduler_state (state_key, state_value) VALUES (?, ?)",
+                        (LIBRARY_PROBE_SKIPS_STATE_KEY, json.dumps(skips)))
+        db_conn.commit()
+        return skips["skipped_ticks"]
+    except sqlite3.Error as e:
+        logger.error(f"Error recording a library change probe skip: {e}")
+        return None
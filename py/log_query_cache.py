@@ -0,0 +1,98 @@
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from database import CONFLICT_DB_FILE
+
+logger = logging.getLogger(__name__)
+
+# --- Result Cache for the Log Views ---
+# /logs/search runs a COUNT over the whole filtered result set before reading a page, and paging back
+# and forth or re-opening the logs page repeats identical work. This LRU cache keeps counts and pages
+# keyed by the normalized query.
+#
+# Invalidation uses SQLite's PRAGMA data_version on a dedicated probe connection. The value changes
+# whenever any other connection (the engine, the log writer, log maintenance, another process)
+# commits to the database, and reading it costs no I/O beyond the WAL index header. The probe never
+# writes, so every commit counts. data_version values are only comparable on the same connection,
+# which is why one shared probe is used instead of the pooled per-thread read connections.
+#
+# Entries are stamped with the version read BEFORE their query ran: a commit that lands while the
+# query runs makes the entry look stale on the next lookup, never the other way round.
+
+_cache_instance = None
+_cache_instance_lock = threading.Lock()
+
+
+class LogQueryCache:
+    """Thread-safe LRU of query key -> result, invalidated as a whole when the database changes."""
+    def __init__(self, db_file, max_entries=256):
+        self.db_file = db_file
+        self.max_entries = max(0, int(max_entries))
+        self.entries = OrderedDict() # key -> (data_version, value)
+        self.lock = threading.Lock()
+        self.probe_conn = None
+        self.hits = 0
+        self.misses = 0
+
+    def current_version(self):
+        """The probe's data_version, or None when it can't be read (caching is then skipped)."""
+        if self.max_entries == 0:
+            return None
+        with self.lock:
+            try:
+                if self.probe_conn is None:
+                    self.probe_conn = sqlite3.connect(self.db_file, check_same_thread=False)
+                return self.probe_conn.execute("PRAGMA data_version").fetchone()[0]
+            except sqlite3.Error as e:
+                logger.warning(f"Log query cache: could not read data_version ({e}). Caching skipped.")
+                if self.probe_conn is not None:
+                    try:
+                        self.probe_conn.close()
+                    except sqlite3.Error:
+                        pass
+                    self.probe_conn = None
+                return None
+
+    def get(self, key, version):
+        """Cached value for key if it was computed at this data version, else None."""
+        if version is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != version:
+                del self.entries[key] # Computed before the last commit
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, version):
+        if version is None or self.max_entries == 0:
+            return
+        with self.lock:
+            self.entries[key] = (version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def get_log_query_cache(max_entries=256):
+    """Returns the process-wide log query cache, resizing it if the configured size changed."""
+    global _cache_instance
+    with _cache_instance_lock:
+        if _cache_instance is None:
+            _cache_instance = LogQueryCache(CONFLICT_DB_FILE, max_entries=max_entries)
+        elif _cache_instance.max_entries != max(0, int(max_entries)):
+            _cache_instance.max_entries = max(0, int(max_entries))
+            _cache_instance.clear()
+        return _cache_instance
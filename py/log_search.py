@@ -0,0 +1,367 @@
+import json
+import base64
+from datetime import datetime
+from urllib.parse import unquote
+
+from database import pack_file_hashes, log_search_fts_available, log_search_match_phrase, iso_to_epoch_ms
+
+# --- /logs/search Query Builder ---
+# Turns the /logs/search request arguments into the count and page SQL. Shared by the route in
+# views.py and by query_plan_audit.py, which checks the plans of every query shape built here.
+# Rows come back in the compact log schema (see database.py): file action and rule execution times are
+# epoch milliseconds and statuses/action types log_codes codes, under the field names of the API; the
+# route converts them for the response.
+
+APPROXIMATE_COUNT_CAP = 10000 # count_mode=approximate stops counting matches here
+
+# --- Keyset Pagination for /logs/search ---
+# Pages are addressed by continuation cursors instead of OFFSET, so a deep page costs the same as the
+# first one. A cursor holds the sort key values of the last row of a page ("after", for Next) or of the
+# first row ("before", for Previous), plus the sort and search type it was made for. Every sort ends
+# with the table's primary key as tiebreaker so the order is total. OFFSET is only used for jump-to-page.
+
+def _encode_log_cursor(search_type, sort_by, direction, key_values):
+    payload = json.dumps({"t": search_type, "s": sort_by, "d": direction, "k": key_values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_log_cursor(token, search_type, sort_by, key_count):
+    """Returns (direction, key_values). Raises ValueError for a malformed cursor or one made for another query."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("utf-8"))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed cursor: {e}")
+    if not isinstance(payload, dict) or payload.get("d") not in ("after", "before"):
+        raise ValueError("Malformed cursor.")
+    if payload.get("t") != search_type or payload.get("s") != sort_by:
+        raise ValueError("Cursor belongs to a different search or sort order. Start again from the first page.")
+    key_values = payload.get("k")
+    if not isinstance(key_values, list) or len(key_values) != key_count:
+        raise ValueError("Malformed cursor.")
+    return payload["d"], key_values
+
+def _keyset_condition(sort_columns, key_values, direction):
+    """
+    WHERE condition selecting the rows after (or before) key_values in the order given by sort_columns,
+    a list of (sql expression, 'ASC'/'DESC'). A row value comparison when all columns sort the same way
+    (SQLite turns it into an index range), else the expanded OR form so mixed sort directions work.
+    Returns (sql, params).
+    """
+    sort_directions = {sort_dir for _, sort_dir in sort_columns}
+    if len(sort_directions) == 1:
+        forward = (sort_directions.pop() == "ASC") == (direction == "after")
+        expressions = ", ".join(expression for expression, _ in sort_columns)
+        placeholders = ", ".join("?" * len(sort_columns))
+        return f"(({expressions}) {'>' if forward else '<'} ({placeholders}))", list(key_values)
+    or_terms, params = [], []
+    for i, (expression, sort_dir) in enumerate(sort_columns):
+        forward = (sort_dir == "ASC") == (direction == "after")
+        and_terms = [f"{prev_expression} = ?" for prev_expression, _ in sort_columns[:i]]
+        and_terms.append(f"{expression} {'>' if forward else '<'} ?")
+        or_terms.append("(" + " AND ".join(and_terms) + ")")
+        params.extend(key_values[:i + 1])
+    return "(" + " OR ".join(or_terms) + ")", params
+
+# --- Selected Fields ---
+# Select items of each kind of log row, "<expression> [AS <field name>]". fields= in the search args
+# narrows them to the named fields; the list views ask for fields=summary, which leaves out the large
+# JSON columns of LOG_HEAVY_FIELDS, and load those per row from /logs/entry/<id> when it is expanded.
+FILE_ACTION_LOG_FIELDS = [
+    "fad.log_id", "rei.rule_execution_id", "fad.file_hash", "fad.action_type_code AS action_type_performed",
+    "ap.params_json AS action_parameters_json_at_exec", "fad.status_code AS status", "fad.error_message",
+    "fad.override_info_json", "fad.action_time_ms AS action_timestamp", "fad.aggregated_file_count",
+    "fad.aggregated_file_hashes", "er.run_id", "rei.rule_id", "rv.rule_version_id", "rv.rule_name_at_version",
+    "rv.importance_at_version AS rule_importance_at_version", "er.run_type",
+]
+RULE_EXECUTION_LOG_FIELDS = [
+    "rei.rule_execution_id", "er.run_id", "rei.rule_id", "rv.rule_version_id", "rei.execution_order_in_run",
+    "rei.start_time_ms AS start_time", "rei.end_time_ms AS end_time", "rei.status_code AS status",
+    "rei.matched_search_count", "rei.eligible_for_action_count",
+    "rei.actions_attempted_count", "rei.actions_succeeded_count", "rei.summary_message_from_logic",
+    "rei.details_json_from_logic", "rv.rule_name_at_version", "rv.importance_at_version AS rule_importance_at_version", "er.run_type",
+]
+RULE_VERSION_CONTENT_FIELDS = ["rv.conditions_json_at_version", "rv.action_json_at_version"]
+RUN_LOG_FIELDS = ["er.run_id", "er.run_type", "er.start_time", "er.end_time", "er.status", "er.summary_message"]
+LOG_HEAVY_FIELDS = {"details_json_from_logic", "conditions_json_at_version", "action_json_at_version"}
+# Always selected: what /logs/entry/<id> takes as the id of the row
+LOG_IDENTITY_FIELDS = {"log_id", "rule_execution_id", "run_id"}
+
+RULE_EXECUTION_LOG_FROM = """ FROM rule_executions_in_run rei JOIN rule_versions rv ON rei.rule_version_key = rv.rule_version_key
+                             JOIN execution_runs er ON rei.run_key = er.run_key """
+RUN_LOG_FROM = "FROM execution_runs er"
+
+def _file_action_log_from(fad_source):
+    return f""" FROM {fad_source} fad JOIN rule_executions_in_run rei ON fad.rule_execution_key = rei.rule_execution_key
+                             JOIN action_parameters ap ON fad.action_parameters_id = ap.action_parameters_id
+                             JOIN rule_versions rv ON rei.rule_version_key = rv.rule_version_key
+                             JOIN execution_runs er ON rei.run_key = er.run_key """
+
+def _log_field_name(select_item):
+    return select_item.split(" AS ")[-1].split(".")[-1]
+
+def _project_log_fields(select_items, fields_arg):
+    """
+    The select_items named by fields_arg (comma-separated field names, 'summary' for every field but
+    LOG_HEAVY_FIELDS), in their original order, plus the identity field. All of them if fields_arg is
+    empty. Names of other search types' fields are ignored; unknown names raise ValueError.
+    """
+    if not fields_arg:
+        return select_items
+    known_names = {_log_field_name(item) for item in (FILE_ACTION_LOG_FIELDS + RULE_EXECUTION_LOG_FIELDS
+                                                      + RULE_VERSION_CONTENT_FIELDS + RUN_LOG_FIELDS)}
+    wanted_names = set(LOG_IDENTITY_FIELDS)
+    for name in (part.strip() for part in fields_arg.split(",")):
+        if name == "summary":
+            wanted_names.update(_log_field_name(item) for item in select_items if _log_field_name(item) not in LOG_HEAVY_FIELDS)
+        elif name in known_names:
+            wanted_names.add(name)
+        elif name:
+            raise ValueError(f"Unknown field '{name}'. Use 'summary' or names from: {', '.join(sorted(known_names))}.")
+    return [item for item in select_items if _log_field_name(item) in wanted_names]
+
+# --- /logs/entry/<id> ---
+# One log row with every field, by the id shown for it in the search results
+LOG_ENTRY_TYPES = ("file_action", "rule_execution", "run")
+
+def build_log_entry_query(entry_type, fad_source="file_action_details"):
+    """SQL selecting one log row of entry_type (see LOG_ENTRY_TYPES) by its id, the single parameter."""
+    if entry_type == "file_action":
+        return f"SELECT {', '.join(FILE_ACTION_LOG_FIELDS)} {_file_action_log_from(fad_source)} WHERE fad.log_id = ?"
+    if entry_type == "rule_execution":
+        return (f"SELECT {', '.join(RULE_EXECUTION_LOG_FIELDS + RULE_VERSION_CONTENT_FIELDS)} {RULE_EXECUTION_LOG_FROM}"
+                " WHERE rei.rule_execution_id = ?")
+    if entry_type == "run":
+        return f"SELECT {', '.join(RUN_LOG_FIELDS)} {RUN_LOG_FROM} WHERE er.run_id = ?"
+    raise ValueError(f"Unknown log entry type '{entry_type}'. Use one of: {', '.join(LOG_ENTRY_TYPES)}.")
+
+def build_log_search_query(db_conn, args, start_iso, end_iso, fad_source="file_action_details"):
+    """
+    Builds the /logs/search queries from request-style args (a Flask MultiDict or a plain dict).
+    db_conn is only used to check which full-text indexes exist. fad_source is the FROM source for
+    file_action_details (the table itself, or the UNION ALL over attached month partitions).
+    Raises ValueError for invalid arguments, e.g. a malformed or foreign cursor or an unknown field.
+
+    Returns a dict with search_type, query_params_resp (echoed to the client), sort_by, sort_columns
+    (including the primary key tiebreaker), limit, offset, count_mode, cursor_direction, reverse_page,
+    count_sql/count_params, page_sql/page_params and export_sql/export_params. The page query fetches
+    limit + 1 rows and selects the sort key values as _sort_key_N. The export query (/logs/export)
+    selects every matching row in sort order, without paging, cursor or sort key columns.
+    """
+    limit = int(args.get('limit', 100)); offset = int(args.get('offset', 0))
+    limit = max(1, min(limit, 1000)); offset = max(0, offset)
+    sort_by = args.get('sort_by', 'timestamp_desc')
+    cursor_token = args.get('cursor') # Keyset continuation token; takes precedence over offset
+    count_mode = args.get('count_mode', 'exact') # 'approximate' caps the count at APPROXIMATE_COUNT_CAP
+    if count_mode not in ('exact', 'approximate'):
+        count_mode = 'exact'
+
+    # Sorts are lists of (column, direction); the primary key tiebreaker is appended below.
+    # Status sorts go by status name (codes are numbered in order of first use).
+    fad_status_name = "(SELECT code_name FROM log_codes WHERE code = fad.status_code)"
+    rei_status_name = "(SELECT code_name FROM log_codes WHERE code = rei.status_code)"
+    allowed_sorts_fad = {
+        "timestamp_desc": [("fad.action_time_ms", "DESC")], "timestamp_asc": [("fad.action_time_ms", "ASC")],
+        "rule_name_asc": [("rv.rule_name_at_version", "ASC"), ("fad.action_time_ms", "DESC")],
+        "rule_name_desc": [("rv.rule_name_at_version", "DESC"), ("fad.action_time_ms", "DESC")],
+        "status_asc": [(fad_status_name, "ASC"), ("fad.action_time_ms", "DESC")],
+        "status_desc": [(fad_status_name, "DESC"), ("fad.action_time_ms", "DESC")],
+    }
+    allowed_sorts_rei = {
+        "timestamp_desc": [("rei.start_time_ms", "DESC")], "timestamp_asc": [("rei.start_time_ms", "ASC")],
+        "rule_name_asc": [("rv.rule_name_at_version", "ASC"), ("rei.start_time_ms", "DESC")],
+        "rule_name_desc": [("rv.rule_name_at_version", "DESC"), ("rei.start_time_ms", "DESC")],
+        "status_asc": [(rei_status_name, "ASC"), ("rei.start_time_ms", "DESC")],
+        "status_desc": [(rei_status_name, "DESC"), ("rei.start_time_ms", "DESC")],
+    }
+    sort_columns, tiebreak_column = [], ""
+    file_hash_q = args.get('file_hash'); rule_id_q = args.get('rule_id')
+    run_id_q = args.get('run_id'); rule_exec_id_q = args.get('rule_execution_id')
+    status_filter = args.get('status_filter')
+    # Use unquote for search terms that might be URL encoded
+    log_search_term_q = unquote(args.get('log_search_term', '')).strip()
+
+    base_fields, base_from_join = [], ""
+    where_clauses, query_params = [], []
+    search_type_resp, query_params_resp = "general", {} # query_params_resp is for the response, not SQL
+
+    # --- Query Building Logic ---
+    if file_hash_q:
+        search_type_resp = "file_hash"; query_params_resp["file_hash"] = file_hash_q
+        base_fields = FILE_ACTION_LOG_FIELDS
+        base_from_join = _file_action_log_from(fad_source)
+        # Skipped files are stored as per-execution aggregates with a packed hash list; look inside those too
+        packed_hash_q = None
+        try:
+            packed_hash_q = pack_file_hashes([file_hash_q.lower()])
+        except ValueError:
+            pass
+        if packed_hash_q:
+            # Row ids from the two index lookups (hash index, skip aggregate partial index). A plain OR lets
+            # the planner walk the timestamp index instead, reading every row of the range.
+            where_clauses.append(f"""fad.log_id IN (
+                SELECT log_id FROM {fad_source} WHERE file_hash = ?
+                UNION ALL SELECT log_id FROM {fad_source} WHERE aggregated_file_count IS NOT NULL AND instr(aggregated_file_hashes, ?) % 32 = 1)""")
+            query_params.extend([file_hash_q, packed_hash_q])
+        else:
+            where_clauses.append("fad.file_hash = ?"); query_params.append(file_hash_q)
+        if not status_filter or "skip_action" not in status_filter.lower(): # Default: Exclude skips for direct file hash search unless specified
+             where_clauses.append("fad.action_type_code IS NOT (SELECT code FROM log_codes WHERE code_name = 'skip_action')")
+        sort_columns = allowed_sorts_fad.get(sort_by, [("fad.action_time_ms", "DESC")]); tiebreak_column = "fad.log_id"
+
+    elif rule_exec_id_q:
+        search_type_resp = "rule_execution_id_details"; query_params_resp["rule_execution_id"] = rule_exec_id_q
+        base_fields = FILE_ACTION_LOG_FIELDS
+        base_from_join = _file_action_log_from(fad_source)
+        where_clauses.append("fad.rule_execution_key = (SELECT rule_execution_key FROM rule_executions_in_run WHERE rule_execution_id = ?)")
+        query_params.append(rule_exec_id_q)
+        sort_columns = allowed_sorts_fad.get(sort_by, [("fad.action_time_ms", "ASC")]) # Often chronological for details
+        tiebreak_column = "fad.log_id"
+
+    elif rule_id_q:
+        search_type_resp = "rule_id_executions"; query_params_resp["rule_id"] = rule_id_q
+        base_fields = RULE_EXECUTION_LOG_FIELDS + RULE_VERSION_CONTENT_FIELDS
+        base_from_join = RULE_EXECUTION_LOG_FROM
+        where_clauses.append("rei.rule_id = ?"); query_params.append(rule_id_q)
+        sort_columns = allowed_sorts_rei.get(sort_by, [("rei.start_time_ms", "DESC")]); tiebreak_column = "rei.rule_execution_key"
+
+    elif run_id_q:
+        search_type_resp = "run_id_details"; query_params_resp["run_id"] = run_id_q
+        base_fields = RULE_EXECUTION_LOG_FIELDS
+        base_from_join = RULE_EXECUTION_LOG_FROM
+        where_clauses.append("rei.run_key = (SELECT run_key FROM execution_runs WHERE run_id = ?)"); query_params.append(run_id_q)
+        # For a specific run's details, sort by execution order within that run.
+        # COALESCE keeps the keyset comparison NULL-safe; NULLs sorted first before as well.
+        sort_columns = [("COALESCE(rei.execution_order_in_run, -1)", "ASC"), ("rei.start_time_ms", "ASC")]
+        tiebreak_column = "rei.rule_execution_key"
+    else: # General recent execution_runs (top-level overview)
+        search_type_resp = "general_runs"; query_params_resp["message"] = "Recent execution runs."
+        base_fields = RUN_LOG_FIELDS
+        base_from_join = RUN_LOG_FROM
+        sort_columns = [("er.start_time", "DESC")]; tiebreak_column = "er.run_id" # Default sort for general runs
+
+    # Determine timestamp and status columns based on the primary table being queried
+    # execution_runs keeps ISO timestamps and status names; the compact tables store epoch ms and codes
+    ts_col_for_filter = "er.start_time"; status_col_for_filter = "er.status" # Defaults for general_runs
+    to_ts_param = lambda iso: iso
+    if search_type_resp in ["file_hash", "rule_execution_id_details"]:
+        ts_col_for_filter = "fad.action_time_ms"; status_col_for_filter = "fad.status_code"; to_ts_param = iso_to_epoch_ms
+    elif search_type_resp in ["rule_id_executions", "run_id_details"]:
+        ts_col_for_filter = "rei.start_time_ms"; status_col_for_filter = "rei.status_code"; to_ts_param = iso_to_epoch_ms
+
+    # Apply time range filters
+    if start_iso != (datetime.min.isoformat()+"Z"): # Not 'all time'
+        where_clauses.append(f"{ts_col_for_filter} >= ?"); query_params.append(to_ts_param(start_iso))
+    query_params_resp["start_date_used"] = start_iso if start_iso != (datetime.min.isoformat()+"Z") else "all_time"
+
+    where_clauses.append(f"{ts_col_for_filter} <= ?"); query_params.append(to_ts_param(end_iso))
+    query_params_resp["end_date_used"] = end_iso
+
+    # Apply status filters
+    if status_filter:
+        statuses = [s.strip().lower() for s in status_filter.split(',') if s.strip()]
+        if statuses:
+            placeholders = ', '.join(['?'] * len(statuses))
+            if status_col_for_filter == "er.status":
+                where_clauses.append(f"LOWER(er.status) IN ({placeholders})")
+            else:
+                where_clauses.append(f"{status_col_for_filter} IN (SELECT code FROM log_codes WHERE LOWER(code_name) IN ({placeholders}))")
+            query_params.extend(statuses)
+            query_params_resp["status_filter"] = statuses
+
+    # Apply log_search_term filter.
+    # Uses the FTS5 trigram indexes (see LOG_SEARCH_FTS_INDEXES in database.py) when the term allows it,
+    # otherwise a LIKE search on the relevant text fields.
+    if log_search_term_q:
+        query_params_resp["log_search_term"] = log_search_term_q
+        search_term_like = f"%{log_search_term_q}%"
+        search_term_match = log_search_match_phrase(log_search_term_q)
+        text_search_clauses = []
+        search_mode = "like"
+
+        def add_text_search(like_columns, fts_table, row_id_expr):
+            # One indexed lookup when the FTS table can answer it, else a LIKE per column.
+            nonlocal search_mode
+            if search_term_match and log_search_fts_available(db_conn, fts_table):
+                text_search_clauses.append(f"{row_id_expr} IN (SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH ?)")
+                query_params.append(search_term_match)
+                search_mode = "fts"
+            else:
+                for column in like_columns:
+                    text_search_clauses.append(f"{column} LIKE ?")
+                    query_params.append(search_term_like)
+
+        if search_type_resp in ["file_hash", "rule_execution_id_details"]:
+            if fad_source == "file_action_details":
+                add_text_search(["fad.file_hash", "fad.error_message"], "file_action_details_fts", "fad.log_id")
+            else: # Rows in attached month partitions are not in the full-text index
+                for column in ["fad.file_hash", "fad.error_message"]:
+                    text_search_clauses.append(f"{column} LIKE ?"); query_params.append(search_term_like)
+            add_text_search(["ap.params_json"], "action_parameters_fts", "ap.action_parameters_id")
+            add_text_search(["rv.rule_name_at_version"], "rule_versions_fts", "rv.rule_version_key")
+        elif search_type_resp in ["rule_id_executions", "run_id_details", "general_runs"]: # general_runs uses er table
+            # For rule_id_executions and run_id_details
+            if base_from_join.lstrip().startswith("FROM rule_executions_in_run"):
+                add_text_search(["rei.summary_message_from_logic", "rei.details_json_from_logic"], "rule_executions_fts", "rei.rule_execution_key")
+                add_text_search(["rv.rule_name_at_version"], "rule_versions_fts", "rv.rule_version_key")
+            # For general_runs
+            elif base_from_join.lstrip().startswith("FROM execution_runs"):
+                text_search_clauses.append("er.summary_message LIKE ?")
+                query_params.append(search_term_like)
+
+        if text_search_clauses:
+            where_clauses.append(f"({' OR '.join(text_search_clauses)})")
+        query_params_resp["log_search_mode"] = search_mode
+
+    base_fields = ", ".join(_project_log_fields(base_fields, args.get('fields')))
+
+    # Full sort order, ending with the primary key so every row has a unique position
+    sort_columns = sort_columns + [(tiebreak_column, sort_columns[-1][1])]
+    cursor_direction = None
+    if cursor_token:
+        cursor_direction, cursor_key_values = _decode_log_cursor(cursor_token, search_type_resp, sort_by, len(sort_columns))
+
+    # Construct final queries
+    # The sort key values are selected too (as _sort_key_N) to build the cursors of the returned page.
+    sort_key_fields = ", ".join(f"{expression} AS _sort_key_{i}" for i, (expression, _) in enumerate(sort_columns))
+    full_query_sql = f"SELECT {base_fields}, {sort_key_fields} {base_from_join}"
+    where_condition_sql = (" WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
+    # Every join goes from the primary table to a parent row by its key, so each primary row appears once
+    # and COUNT(*) needs no DISTINCT (which would sort all matches in a temp b-tree).
+    if count_mode == 'approximate':
+        # Stops after APPROXIMATE_COUNT_CAP + 1 matches instead of visiting the whole result set
+        count_query_sql = (f"SELECT COUNT(*) as total_records FROM (SELECT 1 {base_from_join}"
+                           f"{where_condition_sql} LIMIT {APPROXIMATE_COUNT_CAP + 1})")
+    else:
+        count_query_sql = f"SELECT COUNT(*) as total_records {base_from_join}{where_condition_sql}"
+
+    page_where_clauses, page_params = list(where_clauses), list(query_params)
+    if cursor_direction:
+        keyset_sql, keyset_params = _keyset_condition(sort_columns, cursor_key_values, cursor_direction)
+        page_where_clauses.append(keyset_sql); page_params.extend(keyset_params)
+    if page_where_clauses:
+        full_query_sql += " WHERE " + " AND ".join(page_where_clauses)
+
+    export_query_sql = (f"SELECT {base_fields} {base_from_join}{where_condition_sql} ORDER BY "
+                        + ", ".join(f"{expression} {sort_dir}" for expression, sort_dir in sort_columns))
+
+    # A "before" page is read backwards from the cursor and flipped afterwards.
+    reverse_page = cursor_direction == "before"
+    order_by_clause = ", ".join(
+        f"{expression} {('DESC' if sort_dir == 'ASC' else 'ASC') if reverse_page else sort_dir}"
+        for expression, sort_dir in sort_columns
+    )
+    # One extra row tells whether there is another page in the reading direction.
+    if cursor_direction:
+        full_query_sql += f" ORDER BY {order_by_clause} LIMIT ?"
+        page_params.append(limit + 1)
+    else: # First page or jump-to-page
+        full_query_sql += f" ORDER BY {order_by_clause} LIMIT ? OFFSET ?"
+        page_params.extend([limit + 1, offset])
+
+    return {
+        "search_type": search_type_resp, "query_params_resp": query_params_resp,
+        "sort_by": sort_by, "sort_columns": sort_columns, "limit": limit, "offset": offset,
+        "count_mode": count_mode, "cursor_direction": cursor_direction, "reverse_page": reverse_page,
+        "count_sql": count_query_sql, "count_params": tuple(query_params), # query_params built so far are for WHERE
+        "page_sql": full_query_sql, "page_params": tuple(page_params),
+        "export_sql": export_query_sql, "export_params": tuple(query_params),
+    }
@@ -0,0 +1,458 @@
+import os
+import re
+import shutil
+import sqlite3
+import logging
+from datetime import datetime, timedelta, date
+
+from database import DB_DIR, FILE_ACTION_DETAILS_COLUMNS, iso_to_epoch_ms, epoch_ms_to_iso
+
+logger = logging.getLogger(__name__)
+
+# --- Time-Partitioned Log Storage ---
+# The main database only keeps "hot" raw detail: file_action_details rows of the current month
+# (plus anything not rolled up yet). Maintenance moves older raw rows into one SQLite file per
+# month under db/log_partitions/ (logs_YYYY_MM.db), which the log views ATTACH only when the
+# requested time range touches that month.
+#
+# Before raw rows leave the main database, every complete day is rolled up into two small summary
+# tables in the main database (per rule / per status), so statistics keep working after retention:
+#   - daily_rule_execution_rollups: rule_executions_in_run counts/sums per day, rule version and status
+#   - daily_file_action_rollups:   file_action_details row counts per day, rule, action type and status
+# 'rollup_watermark_day' in log_maintenance_state is the first day that is NOT rolled up yet.
+# The per-rule chart stats don't use these; they read rule_stats_hourly (see rule_stats.py), which
+# is written at the end of every rule execution and is not affected by retention.
+#
+# Retention ('log_retention_days', 0 = keep forever) then drops raw detail older than N days, or
+# moves it to db/log_partitions/archive/ when 'log_retention_archive' is on. It works in whole
+# months: the cutoff is rounded down to the start of its month, so a month partition file and the
+# rule executions and runs its rows reference are expired together (raw detail is kept for N to
+# N+31 days). Expiring executions by day while their month partition stayed live would leave
+# detail rows pointing at executions that are gone, and the log views would silently drop them.
+#
+# Partition files hold file_action_details rows in the compact log schema (see database.py): they
+# reference rule executions of the main database by rule_execution_key and carry epoch ms times and
+# log_codes codes. Partition files of the older text schema are converted at startup by
+# upgrade_legacy_log_partitions(); archive files keep the columns they were written with.
+
+LOG_PARTITION_DIR = os.path.join(DB_DIR, 'log_partitions')
+LOG_ARCHIVE_DIR = os.path.join(LOG_PARTITION_DIR, 'archive')
+_PARTITION_FILE_PATTERN = re.compile(r'^logs_(\d{4})_(\d{2})\.db$')
+
+# Indexes created in partition/archive files, per table: (index_name, columns, unique)
+_PARTITION_INDEXES = {
+    "file_action_details": [
+        ("idx_part_fad_log_id", "log_id", True),
+        ("idx_part_fad_rule_exec_key_time", "rule_execution_key, action_time_ms", False),
+        ("idx_part_fad_file_hash_time", "file_hash, action_time_ms", False),
+        ("idx_part_fad_action_time", "action_time_ms", False),
+    ],
+    "rule_executions_in_run": [
+        ("idx_part_rei_rule_execution_key", "rule_execution_key", True),
+        ("idx_part_rei_start_time_ms", "start_time_ms", False),
+    ],
+    "execution_runs": [
+        ("idx_part_er_run_id", "run_id", True),
+    ],
+}
+# Partition indexes superseded by the ones above (older index layouts and the text log schema);
+# dropped when a file is next written to
+_REPLACED_PARTITION_INDEXES = (
+    "idx_part_fad_rule_exec_id", "idx_part_fad_file_hash", "idx_part_fad_rule_exec_id_timestamp",
+    "idx_part_fad_file_hash_timestamp", "idx_part_fad_action_timestamp", "idx_part_rei_start_time",
+)
+
+
+def _month_key(iso_string):
+    """'2025-03-14T...' -> '2025_03'. Works for ISO dates and timestamps."""
+    return iso_string[:7].replace('-', '_')
+
+
+def _month_bounds(month_key):
+    """'2025_03' -> ('2025-03-01', '2025-04-01') as ISO date strings (end exclusive)."""
+    year, month = int(month_key[:4]), int(month_key[5:7])
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+
+def _day_start_ms(day_iso):
+    """'2025-03-14' (or a full ISO timestamp) -> epoch ms, for comparisons with the compact *_ms columns."""
+    return iso_to_epoch_ms(day_iso if "T" in day_iso else day_iso + "T00:00:00Z")
+
+
+def _month_of_ms_sql(column):
+    """SQL expression for the 'YYYY-MM' month of an epoch ms column."""
+    return f"strftime('%Y-%m', {column} / 1000, 'unixepoch')"
+
+
+def log_partition_path(month_key, archived=False):
+    return os.path.join(LOG_ARCHIVE_DIR if archived else LOG_PARTITION_DIR, f"logs_{month_key}.db")
+
+
+def list_log_partition_months():
+    """Month keys ('YYYY_MM') of the partition files currently in db/log_partitions/, oldest first."""
+    if not os.path.isdir(LOG_PARTITION_DIR):
+        return []
+    months = []
+    for filename in os.listdir(LOG_PARTITION_DIR):
+        match = _PARTITION_FILE_PATTERN.match(filename)
+        if match:
+            months.append(f"{match.group(1)}_{match.group(2)}")
+    return sorted(months)
+
+
+def _table_columns(db_conn, schema, table):
+    return [row[1] for row in db_conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+
+def _get_state(db_conn, state_key):
+    row = db_conn.execute("SELECT state_value FROM log_maintenance_state WHERE state_key = ?", (state_key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(db_conn, state_key, state_value):
+    db_conn.execute("INSERT OR REPLACE INTO log_maintenance_state (state_key, state_value) VALUES (?, ?)", (state_key, state_value))
+
+
+def get_rollup_watermark_day(db_conn):
+    """First day (ISO 'YYYY-MM-DD') that is not covered by the daily rollups yet, or None if nothing was rolled up."""
+    return _get_state(db_conn, 'rollup_watermark_day')
+
+
+# --- Read Side: Attaching Partitions ---
+
+def attach_log_partitions_for_range(db_conn, start_iso, end_iso):
+    """
+    ATTACHes the month partitions overlapping [start_iso, end_iso] to db_conn and returns a FROM-clause
+    source for file_action_details covering the main table plus those partitions.
+
+    Returns: (source_sql, attached_month_keys, skipped_month_keys)
+      source_sql is 'file_action_details' when no partition is needed, otherwise a UNION ALL subquery
+      with the same columns. Months beyond SQLite's attach limit are skipped (oldest first) and reported.
+    db_conn must not be inside a transaction (ATTACH restriction); call this before running queries.
+    """
+    start_key, end_key = _month_key(start_iso), _month_key(end_iso)
+    months = [m for m in list_log_partition_months() if start_key <= m <= end_key]
+    skipped = []
+    max_attached = db_conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(months) > max_attached:
+        skipped, months = months[:-max_attached], months[-max_attached:]
+        logger.warning(f"Log query spans {len(months) + len(skipped)} month partitions but only {max_attached} can be attached. Skipping {len(skipped)} oldest.")
+
+    column_list = ", ".join(FILE_ACTION_DETAILS_COLUMNS)
+    selects = [f"SELECT {column_list} FROM main.file_action_details"]
+    attached = []
+    for month_key in months:
+        alias = f"log_{month_key}"
+        try:
+            db_conn.execute(f"ATTACH DATABASE ? AS {alias}", (log_partition_path(month_key),))
+        except sqlite3.Error as e:
+            logger.error(f"Could not attach log partition {month_key}: {e}")
+            skipped.append(month_key)
+            continue
+        partition_columns = set(_table_columns(db_conn, alias, "file_action_details"))
+        if not partition_columns:
+            continue # Empty partition file
+        if "action_time_ms" not in partition_columns:
+            # Text log schema; upgrade_legacy_log_partitions() converts it at the next startup
+            logger.warning(f"Log partition {month_key} has not been converted to the compact log schema yet. Skipping it.")
+            db_conn.execute(f"DETACH DATABASE {alias}")
+            skipped.append(month_key)
+            continue
+        # Older partition files may predate newer columns; fill those with NULL.
+        select_exprs = [col if col in partition_columns else f"NULL AS {col}" for col in FILE_ACTION_DETAILS_COLUMNS]
+        selects.append(f"SELECT {', '.join(select_exprs)} FROM {alias}.file_action_details")
+        attached.append(month_key)
+
+    if len(selects) == 1:
+        return "file_action_details", attached, skipped
+    return "(" + " UNION ALL ".join(selects) + ")", attached, skipped
+
+
+# --- Write Side: Rollups, Partitioning and Retention ---
+
+def _roll_up_days(db_conn, from_day, until_day):
+    """Rolls up raw rows with timestamps in [from_day, until_day) into the daily rollup tables."""
+    day_bounds_ms = (_day_start_ms(from_day), _day_start_ms(until_day))
+    # The rollups keep rule version UUIDs and status/action type names
+    db_conn.execute('''
+        INSERT OR REPLACE INTO daily_rule_execution_rollups (
+            day, rule_id, rule_version_id, status, execution_count, matched_search_count,
+            eligible_for_action_count, actions_attempted_count, actions_succeeded_count
+        )
+        SELECT date(rei.start_time_ms / 1000, 'unixepoch'), rei.rule_id, rv.rule_version_id, status_code.code_name, COUNT(*),
+               SUM(COALESCE(rei.matched_search_count, 0)), SUM(COALESCE(rei.eligible_for_action_count, 0)),
+               SUM(COALESCE(rei.actions_attempted_count, 0)), SUM(COALESCE(rei.actions_succeeded_count, 0))
+        FROM rule_executions_in_run rei
+        JOIN rule_versions rv ON rei.rule_version_key = rv.rule_version_key
+        JOIN log_codes status_code ON rei.status_code = status_code.code
+        WHERE rei.start_time_ms >= ? AND rei.start_time_ms < ?
+        GROUP BY 1, 2, 3, 4
+    ''', day_bounds_ms)
+    db_conn.execute('''
+        INSERT OR REPLACE INTO daily_file_action_rollups (day, rule_id, action_type_performed, status, file_count)
+        SELECT date(fad.action_time_ms / 1000, 'unixepoch'), rei.rule_id, action_code.code_name, status_code.code_name,
+               SUM(COALESCE(fad.aggregated_file_count, 1)) -- Skip aggregates stand for many files
+        FROM file_action_details fad
+        JOIN rule_executions_in_run rei ON fad.rule_execution_key = rei.rule_execution_key
+        JOIN log_codes action_code ON fad.action_type_code = action_code.code
+        JOIN log_codes status_code ON fad.status_code = status_code.code
+        WHERE fad.action_time_ms >= ? AND fad.action_time_ms < ?
+        GROUP BY 1, 2, 3, 4
+    ''', day_bounds_ms)
+
+
+def _move_rows_to_file(db_conn, target_path, table, where_sql, params):
+    """
+    Moves rows of main.<table> matching where_sql into <table> of the SQLite file at target_path
+    (created if needed, with missing columns added). Copy and delete share one commit, but in WAL
+    mode a commit across ATTACHed files is not atomic: a crash can leave the rows in both files.
+    The move is idempotent instead. Every moved table has a unique key in the target (see
+    _PARTITION_INDEXES) and the copy is INSERT OR IGNORE, so running it again copies nothing twice
+    and only deletes the leftovers from the main table.
+    Returns: number of rows removed from the main table.
+    """
+    if not any(unique for _, _, unique in _PARTITION_INDEXES.get(table, [])):
+        raise ValueError(f"Cannot move {table} rows: no unique key in _PARTITION_INDEXES to keep the move idempotent.")
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    db_conn.commit() # ATTACH/DETACH are not allowed inside a transaction
+    db_conn.execute("ATTACH DATABASE ? AS log_target", (target_path,))
+    try:
+        db_conn.execute(f"CREATE TABLE IF NOT EXISTS log_target.{table} AS SELECT * FROM main.{table} WHERE 0")
+        main_columns = _table_columns(db_conn, "main", table)
+        target_columns = set(_table_columns(db_conn, "log_target", table))
+        for column in main_columns:
+            if column not in target_columns:
+                db_conn.execute(f"ALTER TABLE log_target.{table} ADD COLUMN {column}")
+        for index_name, index_columns, unique in _PARTITION_INDEXES.get(table, []):
+            db_conn.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS log_target.{index_name} ON {table} ({index_columns})")
+        for index_name in _REPLACED_PARTITION_INDEXES:
+            db_conn.execute(f"DROP INDEX IF EXISTS log_target.{index_name}")
+
+        column_list = ", ".join(main_columns)
+        db_conn.execute(f"INSERT OR IGNORE INTO log_target.{table} ({column_list}) SELECT {column_list} FROM main.{table} WHERE {where_sql}", params)
+        moved = db_conn.execute(f"DELETE FROM main.{table} WHERE {where_sql}", params).rowcount
+        db_conn.commit()
+        return moved
+    except sqlite3.Error:
+        db_conn.rollback()
+        raise
+    finally:
+        db_conn.execute("DETACH DATABASE log_target")
+
+
+def _expire_rows_by_month(db_conn, table, timestamp_column, cutoff_iso, archive, extra_where="", extra_params=(), time_in_ms=False):
+    """
+    Deletes (or archives per month) main.<table> rows with timestamp_column < cutoff_iso. Returns rows removed.
+    time_in_ms: timestamp_column holds epoch ms (compact log tables) instead of ISO text.
+    """
+    to_time_param = _day_start_ms if time_in_ms else (lambda iso: iso)
+    month_sql = _month_of_ms_sql(timestamp_column) if time_in_ms else f"substr({timestamp_column}, 1, 7)"
+    base_where = f"{timestamp_column} < ?{extra_where}"
+    base_params = (to_time_param(cutoff_iso),) + tuple(extra_params)
+    if not archive:
+        removed = db_conn.execute(f"DELETE FROM {table} WHERE {base_where}", base_params).rowcount
+        db_conn.commit()
+        return removed
+
+    removed = 0
+    month_rows = db_conn.execute(f"SELECT DISTINCT {month_sql} FROM {table} WHERE {base_where}", base_params).fetchall()
+    for (month_prefix,) in month_rows:
+        month_key = _month_key(month_prefix)
+        month_start, month_end = (to_time_param(bound) for bound in _month_bounds(month_key))
+        removed += _move_rows_to_file(
+            db_conn, log_partition_path(month_key, archived=True), table,
+            f"{base_where} AND {timestamp_column} >= ? AND {timestamp_column} < ?",
+            base_params + (month_start, month_end)
+        )
+    return removed
+
+
+def run_log_maintenance(db_conn, retention_days=0, archive_expired=True, now=None):
+    """
+    Rolls up complete days, moves raw file_action_details of past months into month partition files
+    and applies the retention policy. Safe to run repeatedly; every phase commits on its own.
+
+    Returns: dict report with counts, 'errors' and 'notes' lists.
+    """
+    now = now or datetime.utcnow()
+    today = now.date()
+    report = {
+        "days_rolled_up": 0, "rollup_watermark_day": None,
+        "partitioned_months": [], "detail_rows_partitioned": 0,
+        "partitions_archived": 0, "partitions_deleted": 0,
+        "expired_detail_rows": 0, "expired_rule_executions": 0, "expired_runs": 0,
+        "errors": [], "notes": []
+    }
+
+    # 1. Roll up every complete day up to (excluding) yesterday. Yesterday is left alone so that runs
+    #    crossing midnight and queued log writes have landed before the day is summarised.
+    rollup_until_day = (today - timedelta(days=1)).isoformat()
+    watermark_day = get_rollup_watermark_day(db_conn)
+    if watermark_day is None:
+        earliest_ms = db_conn.execute('''
+            SELECT MIN(time_ms) FROM (
+                SELECT MIN(start_time_ms) AS time_ms FROM rule_executions_in_run
+                UNION ALL SELECT MIN(action_time_ms) FROM file_action_details
+            )
+        ''').fetchone()[0]
+        earliest = epoch_ms_to_iso(earliest_ms)[:10] if earliest_ms is not None else None
+        watermark_day = min(earliest, rollup_until_day) if earliest else rollup_until_day
+    if watermark_day < rollup_until_day:
+        try:
+            _roll_up_days(db_conn, watermark_day, rollup_until_day)
+            report["days_rolled_up"] = (date.fromisoformat(rollup_until_day) - date.fromisoformat(watermark_day)).days
+            watermark_day = rollup_until_day
+        except sqlite3.Error as e:
+            db_conn.rollback()
+            report["errors"].append(f"Rollup failed: {e}")
+            logger.error(f"Log maintenance: rollup of {watermark_day}..{rollup_until_day} failed: {e}", exc_info=True)
+            return report
+    _set_state(db_conn, 'rollup_watermark_day', watermark_day)
+    db_conn.commit()
+    report["rollup_watermark_day"] = watermark_day
+
+    # 2. Move raw detail of past months (only days already rolled up) into month partition files.
+    move_before_day = min(today.replace(day=1).isoformat(), watermark_day)
+    move_before_ms = _day_start_ms(move_before_day)
+    month_rows = db_conn.execute(
+        f"SELECT DISTINCT {_month_of_ms_sql('action_time_ms')} FROM file_action_details WHERE action_time_ms < ?",
+        (move_before_ms,)
+    ).fetchall()
+    for (month_prefix,) in month_rows:
+        month_key = _month_key(month_prefix)
+        month_start, month_end = _month_bounds(month_key)
+        try:
+            moved = _move_rows_to_file(
+                db_conn, log_partition_path(month_key), "file_action_details",
+                "action_time_ms >= ? AND action_time_ms < ? AND action_time_ms < ?",
+                (_day_start_ms(month_start), _day_start_ms(month_end), move_before_ms)
+            )
+            report["detail_rows_partitioned"] += moved
+            report["partitioned_months"].append(month_key)
+        except sqlite3.Error as e:
+            report["errors"].append(f"Partitioning {month_key} failed: {e}")
+            logger.error(f"Log maintenance: moving {month_key} rows to their partition failed: {e}", exc_info=True)
+
+    # 3. Retention.
+    if retention_days <= 0:
+        report["notes"].append("Retention disabled (log_retention_days is 0); raw logs are kept.")
+        return report
+
+    # Never expire raw rows that are not covered by the rollups yet. Whole months only (see the
+    # module comment): rows of the cutoff's own month stay until the whole month is past it.
+    cutoff_day = min((now - timedelta(days=retention_days)).date().isoformat(), watermark_day)
+    cutoff_day = date.fromisoformat(cutoff_day).replace(day=1).isoformat()
+    # Rule executions get one more day: one started just before midnight can have detail rows in the
+    # next month's partition, which stays live for another month.
+    execution_cutoff_day = (date.fromisoformat(cutoff_day) - timedelta(days=1)).isoformat()
+
+    # 3a. Whole month partitions past the cutoff.
+    for month_key in list_log_partition_months():
+        if _month_bounds(month_key)[1] > cutoff_day:
+            continue
+        source_path = log_partition_path(month_key)
+        try:
+            if archive_expired:
+                target_path = log_partition_path(month_key, archived=True)
+                os.makedirs(LOG_ARCHIVE_DIR, exist_ok=True)
+                if os.path.exists(target_path):
+                    # Rows of this month were archived before (e.g. by 3b); merge instead of overwriting.
+                    merge_conn = sqlite3.connect(target_path)
+                    try:
+                        merge_conn.execute("ATTACH DATABASE ? AS log_source", (source_path,))
+                        merge_conn.execute("CREATE TABLE IF NOT EXISTS main.file_action_details AS SELECT * FROM log_source.file_action_details WHERE 0")
+                        target_columns = set(_table_columns(merge_conn, "main", "file_action_details"))
+                        for column in _table_columns(merge_conn, "log_source", "file_action_details"):
+                            if column not in target_columns:
+                                merge_conn.execute(f"ALTER TABLE main.file_action_details ADD COLUMN {column}")
+                        column_list = ", ".join(_table_columns(merge_conn, "log_source", "file_action_details"))
+                        merge_conn.execute(f"INSERT OR IGNORE INTO main.file_action_details ({column_list}) SELECT {column_list} FROM log_source.file_action_details")
+                        merge_conn.commit()
+                        merge_conn.execute("DETACH DATABASE log_source")
+                    finally:
+                        merge_conn.close()
+                    os.remove(source_path)
+                else:
+                    shutil.move(source_path, target_path)
+                report["partitions_archived"] += 1
+            else:
+                os.remove(source_path)
+                report["partitions_deleted"] += 1
+        except (OSError, sqlite3.Error) as e:
+            report["errors"].append(f"Expiring partition {month_key} failed: {e}")
+            logger.error(f"Log maintenance: expiring partition {month_key} failed: {e}", exc_info=True)
+
+    # 3b. Raw rows still in the main database that are past the cutoff.
+    try:
+        report["expired_detail_rows"] = _expire_rows_by_month(
+            db_conn, "file_action_details", "action_time_ms", cutoff_day, archive_expired, time_in_ms=True)
+        report["expired_rule_executions"] = _expire_rows_by_month(
+            db_conn, "rule_executions_in_run", "start_time_ms", execution_cutoff_day, archive_expired, time_in_ms=True)
+        report["expired_runs"] = _expire_rows_by_month(
+            db_conn, "execution_runs", "start_time", cutoff_day, archive_expired,
+            extra_where=" AND end_time IS NOT NULL AND run_key NOT IN (SELECT run_key FROM rule_executions_in_run)")
+    except sqlite3.Error as e:
+        db_conn.rollback()
+        report["errors"].append(f"Retention failed: {e}")
+        logger.error(f"Log maintenance: retention failed: {e}", exc_info=True)
+
+    return report
+
+
+# --- Upgrade: Partitions of the Text Log Schema ---
+
+def upgrade_legacy_log_partitions(db_conn):
+    """
+    Converts month partition files written before the compact log schema (ISO 'action_timestamp', UUID
+    'rule_execution_id', status/action type names) to the compact file_action_details columns, resolving
+    rule execution keys and log codes against the main database. Called at startup after init_conflict_db;
+    a no-op once every partition is converted. Archive files are left as they are.
+    Returns: number of partition files converted.
+    """
+    converted = 0
+    for month_key in list_log_partition_months():
+        db_conn.commit() # ATTACH/DETACH are not allowed inside a transaction
+        db_conn.execute("ATTACH DATABASE ? AS log_legacy", (log_partition_path(month_key),))
+        try:
+            legacy_columns = set(_table_columns(db_conn, "log_legacy", "file_action_details"))
+            if "action_timestamp" not in legacy_columns:
+                continue # Empty or already compact
+            db_conn.create_function("iso_to_epoch_ms", 1, lambda iso: iso_to_epoch_ms(iso) if iso else None, deterministic=True)
+            if "aggregated_file_count" in legacy_columns:
+                aggregate_columns = "old.aggregated_file_count, old.aggregated_file_hashes"
+            else:
+                aggregate_columns = "NULL, NULL" # Written before skip aggregates
+            db_conn.execute('''
+                INSERT OR IGNORE INTO main.log_codes (code_name)
+                SELECT status FROM log_legacy.file_action_details UNION SELECT action_type_performed FROM log_legacy.file_action_details
+            ''')
+            db_conn.execute("CREATE TABLE log_legacy.file_action_details_compact AS SELECT * FROM main.file_action_details WHERE 0")
+            copied = db_conn.execute(f'''
+                INSERT INTO log_legacy.file_action_details_compact ({", ".join(FILE_ACTION_DETAILS_COLUMNS)})
+                SELECT old.log_id, rei.rule_execution_key, old.file_hash, action_code.code, old.action_parameters_id,
+                       status_code.code, old.error_message, old.override_info_json, iso_to_epoch_ms(old.action_timestamp),
+                       {aggregate_columns}
+                FROM log_legacy.file_action_details old
+                JOIN main.rule_executions_in_run rei ON rei.rule_execution_id = old.rule_execution_id
+                JOIN main.log_codes action_code ON action_code.code_name = old.action_type_performed
+                JOIN main.log_codes status_code ON status_code.code_name = old.status
+                ORDER BY old.log_id
+            ''').rowcount
+            legacy_count = db_conn.execute("SELECT COUNT(*) FROM log_legacy.file_action_details").fetchone()[0]
+            db_conn.execute("DROP TABLE log_legacy.file_action_details") # Also drops its indexes
+            db_conn.execute("ALTER TABLE log_legacy.file_action_details_compact RENAME TO file_action_details")
+            for index_name, index_columns, unique in _PARTITION_INDEXES["file_action_details"]:
+                db_conn.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS log_legacy.{index_name} ON file_action_details ({index_columns})")
+            db_conn.commit()
+            converted += 1
+            if copied != legacy_count:
+                logger.warning(f"Log partition {month_key}: {legacy_count - copied} of {legacy_count} rows referenced missing rule executions and were not converted.")
+            logger.info(f"Converted log partition {month_key} ({copied} rows) to the compact log schema.")
+        except sqlite3.Error as e:
+            db_conn.rollback()
+            logger.error(f"Could not convert log partition {month_key} to the compact log schema: {e}", exc_info=True)
+        finally:
+            db_conn.execute("DETACH DATABASE log_legacy")
+    return converted
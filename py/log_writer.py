@@ -0,0 +1,287 @@
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- Background Writer for Execution Logging ---
+# Execution bookkeeping (execution_runs, rule_executions_in_run, file_action_details and the
+# override rows written during a run) is handed to a single writer thread through a bounded queue.
+# The rule-execution thread only enqueues statements and goes back to issuing Hydrus API calls,
+# while the writer drains the queue and commits everything it picked up in one transaction.
+#
+# - Backpressure: when the queue is full, submitters block until the writer catches up.
+# - Barriers: flush_log_writer() waits until everything queued before it has been committed.
+#   Rule execution calls it at the end of every rule so the next rule sees committed overrides.
+# - Shutdown: stop_log_writer() drains the queue, commits and closes the writer connection.
+#   It runs at interpreter exit and when the scheduler shuts down.
+#
+# When no writer is running (not started, disabled in settings, or the thread died), the helpers
+# below execute statements directly on the caller's connection, which is the old inline behaviour.
+
+_ITEM_EXECUTE = "execute"
+_ITEM_EXECUTE_MANY = "execute_many"
+_ITEM_BARRIER = "barrier"
+_ITEM_STOP = "stop"
+
+_writer_instance = None
+_writer_lock = threading.Lock()
+
+
+def _is_locked_error(error):
+    """True for the errors SQLite raises while another connection holds the write lock."""
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error).lower() or "busy" in str(error).lower())
+
+
+class BackgroundLogWriter:
+    """
+    Owns its own SQLite connection (created inside the writer thread) and applies queued
+    statements in large transactions. Statement errors are logged and never raised to submitters.
+    """
+    def __init__(self, connection_factory, max_queue_size=10000, max_items_per_transaction=500,
+                 locked_retry_seconds=30.0):
+        self.connection_factory = connection_factory
+        self.max_items_per_transaction = max(1, int(max_items_per_transaction))
+        self.locked_retry_seconds = locked_retry_seconds
+        self.work_queue = queue.Queue(maxsize=max(1, int(max_queue_size)))
+        self.thread = threading.Thread(target=self._run, name="execution-log-writer", daemon=True)
+        self.stopping = False
+        # Counters, mostly for diagnostics in the logs.
+        self.statements_written = 0
+        self.statements_failed = 0
+        self.transactions_committed = 0
+        self.backpressure_waits = 0
+
+    def start(self):
+        self.thread.start()
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def _put(self, item):
+        """Enqueues an item, blocking while the queue is full (backpressure). Returns False if the writer is gone."""
+        try:
+            self.work_queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        self.backpressure_waits += 1
+        wait_started = time.monotonic()
+        logger.debug(f"Log writer queue full ({self.work_queue.maxsize} items). Waiting for the writer to catch up...")
+        while self.is_alive():
+            try:
+                self.work_queue.put(item, timeout=0.5)
+                waited = time.monotonic() - wait_started
+                if waited > 5:
+                    logger.warning(f"Log writer backpressure: submitter blocked for {waited:.1f}s on a full queue.")
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def submit(self, sql, params=()):
+        return self._put((_ITEM_EXECUTE, sql, params))
+
+    def submit_many(self, sql, rows):
+        return self._put((_ITEM_EXECUTE_MANY, sql, rows))
+
+    def flush(self, timeout=None):
+        """Blocks until every item queued before this call is committed. Returns False on timeout or dead writer."""
+        if not self.is_alive():
+            return False
+        barrier_event = threading.Event()
+        if not self._put((_ITEM_BARRIER, barrier_event, None)):
+            return False
+        wait_started = time.monotonic()
+        while not barrier_event.wait(0.5):
+            if not self.is_alive():
+                return False
+            if timeout is not None and time.monotonic() - wait_started >= timeout:
+                logger.warning(f"Log writer flush timed out after {timeout}s with ~{self.work_queue.qsize()} items still queued.")
+                return False
+        return True
+
+    def stop(self, timeout=30.0):
+        """Drains the queue, commits, closes the writer connection and ends the thread."""
+        if not self.is_alive():
+            return True
+        self.stopping = True
+        self._put((_ITEM_STOP, None, None))
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logger.error(f"Log writer did not stop within {timeout}s; ~{self.work_queue.qsize()} queued items may be lost.")
+            return False
+        return True
+
+    def _run(self):
+        try:
+            db_conn = self.connection_factory()
+        except Exception as e:
+            logger.error(f"Log writer could not open its database connection: {e}. Writer thread exiting.", exc_info=True)
+            return
+        logger.info("Execution log writer thread started.")
+        try:
+            stop_requested = False
+            while not stop_requested:
+                items = [self.work_queue.get()]
+                # Drain whatever else is already waiting so it all lands in one transaction.
+                while len(items) < self.max_items_per_transaction:
+                    try:
+                        items.append(self.work_queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                statements = [item for item in items if item[0] in (_ITEM_EXECUTE, _ITEM_EXECUTE_MANY)]
+                if statements:
+                    self._write_transaction(db_conn, statements)
+
+                for kind, payload, _ in items:
+                    if kind == _ITEM_BARRIER:
+                        payload.set()
+                    elif kind == _ITEM_STOP:
+                        stop_requested = True
+        except Exception as e:
+            logger.error(f"Log writer thread crashed: {e}", exc_info=True)
+        finally:
+            try:
+                db_conn.close()
+            except sqlite3.Error:
+                pass
+            logger.info(f"Execution log writer thread stopped. Statements written: {self.statements_written}, "
+                        f"failed: {self.statements_failed}, transactions: {self.transactions_committed}, "
+                        f"backpressure waits: {self.backpressure_waits}.")
+
+    def _write_transaction(self, db_conn, statements):
+        """Applies statements in one transaction, retrying while the database is locked by another connection."""
+        retry_deadline = time.monotonic() + self.locked_retry_seconds
+        while True:
+            try:
+                for kind, sql, params in statements:
+                    if kind == _ITEM_EXECUTE_MANY:
+                        db_conn.executemany(sql, params)
+                    else:
+                        db_conn.execute(sql, params)
+                db_conn.commit()
+                self.transactions_committed += 1
+                self.statements_written += len(statements)
+                return
+            except sqlite3.Error as e:
+                db_conn.rollback()
+                if _is_locked_error(e):
+                    if time.monotonic() < retry_deadline and not self.stopping:
+                        time.sleep(0.2)
+                        continue
+                    logger.warning(f"Log writer: database stayed locked; writing {len(statements)} statements one by one.")
+                else:
+                    logger.warning(f"Log writer: batch of {len(statements)} statements failed ({e}). Retrying individually...")
+                break
+
+        # Fallback: isolate the bad row(s) so the rest of the batch is still persisted. An executemany
+        # item is split into its rows, otherwise one bad row would drop a whole chunk of them.
+        for kind, sql, params in statements:
+            for row in (params if kind == _ITEM_EXECUTE_MANY else [params]):
+                self._write_single(db_conn, sql, row)
+
+    def _write_single(self, db_conn, sql, row):
+        """
+        Executes and commits one row. A row is only dropped for an error of its own: while the
+        database is locked by another connection it is retried, however long that takes.
+        """
+        locked_since = None
+        while True:
+            try:
+                db_conn.execute(sql, row)
+                db_conn.commit()
+                self.statements_written += 1
+                return
+            except sqlite3.Error as e:
+                db_conn.rollback()
+                if not _is_locked_error(e):
+                    self.statements_failed += 1
+                    logger.error(f"Log writer: dropping statement after error: {e}. SQL: {sql.strip()[:120]}")
+                    return
+                now = time.monotonic()
+                if locked_since is None:
+                    locked_since = now
+                elif now - locked_since >= self.locked_retry_seconds:
+                    logger.warning(f"Log writer: database locked for {now - locked_since:.0f}s; still retrying (~{self.work_queue.qsize()} items queued).")
+                    locked_since = now
+                time.sleep(0.2)
+
+
+def start_log_writer(connection_factory, max_queue_size=10000):
+    """Starts the process-wide log writer thread if it is not already running. Returns the writer."""
+    global _writer_instance
+    with _writer_lock:
+        if _writer_instance is not None and _writer_instance.is_alive():
+            return _writer_instance
+        _writer_instance = BackgroundLogWriter(connection_factory, max_queue_size=max_queue_size)
+        _writer_instance.start()
+        logger.info(f"Execution log writer started (queue size {max_queue_size}).")
+        return _writer_instance
+
+
+def get_active_log_writer():
+    """Returns the running log writer, or None if execution logging is currently inline."""
+    writer = _writer_instance
+    if writer is not None and writer.is_alive() and not writer.stopping:
+        return writer
+    return None
+
+
+def submit_write(db_conn, sql, params=()):
+    """
+    Queues one statement on the background writer, or executes it on db_conn when no writer is running.
+    Inline execution raises sqlite3.Error like a normal cursor.execute would.
+    """
+    writer = get_active_log_writer()
+    if writer is not None and writer.submit(sql, params):
+        return
+    db_conn.execute(sql, params)
+
+
+def submit_write_many(db_conn, sql, rows):
+    """
+    executemany counterpart of submit_write. Executed inline, it is all-or-nothing like a statement
+    applied by the writer: executemany on its own leaves the rows before a failing one in the open
+    transaction, and a caller retrying the rows one by one would then write them twice.
+    """
+    writer = get_active_log_writer()
+    if writer is not None and writer.submit_many(sql, rows):
+        return
+    if not db_conn.in_transaction:
+        db_conn.execute("BEGIN") # The transaction the INSERTs would have opened; the savepoint must not be the outermost one
+    db_conn.execute("SAVEPOINT submit_write_many")
+    try:
+        db_conn.executemany(sql, rows)
+    except sqlite3.Error:
+        db_conn.execute("ROLLBACK TO submit_write_many")
+        db_conn.execute("RELEASE submit_write_many")
+        raise
+    db_conn.execute("RELEASE submit_write_many")
+
+
+def flush_log_writer(timeout=None):
+    """Waits until queued writes are committed. Returns True when there is nothing left pending."""
+    writer = get_active_log_writer()
+    if writer is None:
+        return True
+    return writer.flush(timeout)
+
+
+def stop_log_writer(timeout=30.0):
+    """Flushes and stops the log writer. Safe to call more than once."""
+    global _writer_instance
+    with _writer_lock:
+        writer = _writer_instance
+        _writer_instance = None
+    if writer is None:
+        return True
+    logger.info("Stopping execution log writer (flushing queued writes)...")
+    return writer.stop(timeout)
+
+
+atexit.register(stop_log_writer)
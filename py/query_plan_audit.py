@@ -0,0 +1,350 @@
+import os
+import re
+import sys
+import uuid
+import random
+import shutil
+import logging
+import sqlite3
+import tempfile
+import argparse
+from datetime import datetime, timedelta
+
+from database import (
+    init_conflict_db, _open_configured_connection, pack_file_hashes,
+    get_conflict_override, remove_overrides_for_rule, remove_specific_override,
+    get_override_hashes_page, remove_overrides_for_hashes, remove_stale_rule_overrides,
+    expire_overrides_older_than, epoch_ms
+)
+from log_search import build_log_search_query, build_log_entry_query, _encode_log_cursor, LOG_ENTRY_TYPES
+from rule_stats import get_files_processed_per_rule, get_rule_stats_timeseries
+
+logger = logging.getLogger(__name__)
+
+# --- Query Plan Audit ---
+# Guards the log and override queries against plan regressions. Builds a scratch database with the
+# app's schema, fills it with synthetic runs, executions, file actions, overrides and hourly stats,
+# runs ANALYZE, and then checks EXPLAIN QUERY PLAN of:
+#   - every /logs/search query shape (search type x sort x filters x time range x page kind x count mode),
+#     built by log_search.build_log_search_query exactly as the route builds them,
+#   - the /logs/entry/<id> lookups of log_search.build_log_entry_query,
+#   - the statistics queries of rule_stats.py,
+#   - the override lookups and clean-ups of database.py (their SQL is captured while they run).
+# A plan step fails the audit when it scans one of the large tables (SCAN without a search key) or
+# sorts through a temporary b-tree, unless the step is listed in ALLOWED_PLAN_STEPS with the reason it
+# is acceptable. A search also fails when it doesn't look up its filter column through an index
+# (EXPECTED_SEARCH_STEPS). Run it after changing a query or an index:
+#
+#     python query_plan_audit.py [--executions N] [--verbose]
+#
+# Exits with status 1 when a plan regressed. Rows in attached month partitions are not covered; they
+# are searched through the same column indexes (see _PARTITION_INDEXES in log_storage.py).
+
+# Tables that grow with usage, by the names and aliases the queries use for them
+LARGE_TABLES = {
+    "file_action_details", "fad", "rule_executions_in_run", "rei", "execution_runs", "er",
+    "overrides", "rule_stats_hourly", "s", "action_parameters", "ap",
+}
+
+# (shape name prefix, plan step substring, reason). A step matching both is accepted.
+ALLOWED_PLAN_STEPS = [
+    ("search/file_hash/", "MULTI-INDEX OR",
+     "The hash lookup ORs the hash index with the skip-aggregate partial index; both are index searches."),
+    ("search/file_hash/", "USE TEMP B-TREE FOR ORDER BY",
+     "Rows of the two OR branches are merged by sorting; bounded by one file's history and the skip aggregates."),
+    ("search/run_id_details/", "USE TEMP B-TREE FOR ORDER BY",
+     "A run's executions are sorted by execution order; bounded by the number of rules."),
+    ("stats/", "USE TEMP B-TREE FOR GROUP BY",
+     "Groups the hourly rows of the requested range; one row per rule, version, status and hour."),
+    ("stats/", "USE TEMP B-TREE FOR ORDER BY",
+     "Orders the grouped result (one row per rule or per rule and day), not the scanned rows."),
+    ("stats/", "SCAN s",
+     "All-time statistics read every hourly row; the table holds one row per rule and hour, not per execution."),
+    ("overrides/remove_stale_rule_overrides", "SCAN overrides USING COVERING INDEX idx_overrides_winning_rule_cover",
+     "Lists every distinct winning rule/action group; reads only the covering index, in group order."),
+]
+
+# Each search type must find its rows through an index on its filter column, not just any index
+# (a time range index alone would still read every row of the range)
+EXPECTED_SEARCH_STEPS = {
+    "general_runs": r"SEARCH er USING (COVERING )?INDEX idx_execution_runs_start_time_run_id ",
+    "rule_id_executions": r"SEARCH rei USING (COVERING )?INDEX \S+ \(rule_id=\?",
+    "run_id_details": r"SEARCH rei USING (COVERING )?INDEX \S+ \(run_key=\?",
+    "file_hash": r"SEARCH (fad|file_action_details) USING (COVERING )?INDEX \S+ \(file_hash=\?", # In the log_id subquery
+    "rule_execution_id_details": r"SEARCH fad USING (COVERING )?INDEX \S+ \(rule_execution_key=\?",
+}
+
+# Sorts that cannot follow an index and sort the filtered rows, with the reason that is acceptable
+SORTS_NEEDING_TEMP_BTREE = {
+    "rule_name_asc": "The rule name lives in rule_versions; the filtered rows are sorted after the join.",
+    "rule_name_desc": "The rule name lives in rule_versions; the filtered rows are sorted after the join.",
+    "status_asc": "Status sorts order the already filtered rows (one file, execution, rule or run).",
+    "status_desc": "Status sorts order the already filtered rows (one file, execution, rule or run).",
+}
+
+AUDIT_NOW = datetime(2024, 6, 1, 12, 0, 0) # Fixed clock so the synthetic time ranges are reproducible
+
+
+def _iso(dt):
+    return dt.isoformat() + "Z"
+
+
+def _random_hash(rng):
+    return "%064x" % rng.getrandbits(256)
+
+
+def _populate(conn, executions, files_per_execution, seed=1):
+    """Fills the scratch database with synthetic, realistically distributed log and override rows."""
+    rng = random.Random(seed)
+    rule_ids = [f"rule-{i:02d}" for i in range(12)]
+    rule_versions = {}
+    for rule_index, rule_id in enumerate(rule_ids):
+        rule_versions[rule_id] = []
+        for version in range(3): # A few edits per rule
+            rule_version_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            cursor = conn.execute(
+                "INSERT INTO rule_versions (rule_version_id, rule_id, rule_name_at_version, importance_at_version, "
+                "conditions_json_at_version, action_json_at_version, version_timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (rule_version_id, rule_id, f"Rule {rule_index} v{version}", rule_index % 5 + 1, "[]",
+                 '{"type": "add_tags"}', _iso(AUDIT_NOW - timedelta(days=90 - version * 30)))
+            )
+            rule_versions[rule_id].append((rule_version_id, cursor.lastrowid))
+    log_codes = {}
+    for code_name in ("add_tags", "skip_action", "success", "failure", "skipped_recent_view",
+                      "success_completed", "completed_with_errors", "failed_search"):
+        log_codes[code_name] = conn.execute("INSERT INTO log_codes (code_name) VALUES (?)", (code_name,)).lastrowid
+    params_ids = []
+    for i in range(20):
+        cursor = conn.execute("INSERT INTO action_parameters (params_hash, params_json) VALUES (?, ?)",
+                              (f"{i:064x}", f'{{"tags_to_add": ["audit tag {i}"]}}'))
+        params_ids.append(cursor.lastrowid)
+
+    file_pool = [_random_hash(rng) for _ in range(max(1000, executions))]
+    runs = max(1, executions // len(rule_ids))
+    fad_rows, rei_rows, run_rows, stats = [], [], [], {}
+    for run_index in range(runs):
+        run_start = AUDIT_NOW - timedelta(minutes=(runs - run_index) * 90)
+        run_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        run_key = run_index + 1
+        run_rows.append((run_key, run_id, rng.choice(["scheduled_all", "scheduled_all", "manual_single_rule"]),
+                         _iso(run_start), _iso(run_start + timedelta(minutes=2)), "completed_ok",
+                         f"Run {run_index} processed {len(rule_ids)} rules."))
+        for order, rule_id in enumerate(rule_ids):
+            rule_execution_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            rule_execution_key = len(rei_rows) + 1
+            rule_version_id, rule_version_key = rule_versions[rule_id][min(2, run_index * 3 // runs)]
+            exec_start = run_start + timedelta(seconds=order * 5)
+            status = rng.choice(["success_completed"] * 8 + ["completed_with_errors", "failed_search"])
+            files = rng.sample(file_pool, files_per_execution)
+            succeeded = 0
+            for file_index, file_hash in enumerate(files):
+                file_status = rng.choice(["success"] * 9 + ["failure"])
+                succeeded += file_status == "success"
+                fad_rows.append((rule_execution_key, file_hash, log_codes["add_tags"], rng.choice(params_ids), log_codes[file_status],
+                                 None if file_status == "success" else "Hydrus API error: timeout",
+                                 None, epoch_ms(exec_start + timedelta(milliseconds=file_index * 40)), None, None))
+            skipped = sorted(rng.sample(file_pool, 5))
+            fad_rows.append((rule_execution_key, skipped[0], log_codes["skip_action"], params_ids[0], log_codes["skipped_recent_view"],
+                             None, None, epoch_ms(exec_start), len(skipped), pack_file_hashes(skipped)))
+            rei_rows.append((rule_execution_key, rule_execution_id, run_key, rule_id, rule_version_key, order, epoch_ms(exec_start),
+                             epoch_ms(exec_start + timedelta(seconds=4)), log_codes[status], files_per_execution * 2,
+                             files_per_execution, files_per_execution, succeeded,
+                             f"Tagged {succeeded} files", '{"search_result_count": 40}'))
+            bucket = stats.setdefault((_iso(exec_start)[:13], rule_id, rule_version_id, status), [0] * 8)
+            for i, value in enumerate((1, files_per_execution * 2, files_per_execution, files_per_execution,
+                                       succeeded, len(skipped), 4000, 4000)):
+                bucket[i] = max(bucket[i], value) if i == 7 else bucket[i] + value
+
+    conn.executemany("INSERT INTO execution_runs VALUES (?, ?, ?, ?, ?, ?, ?)", run_rows)
+    conn.executemany("INSERT INTO rule_executions_in_run VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rei_rows)
+    conn.executemany('''
+        INSERT INTO file_action_details (rule_execution_key, file_hash, action_type_code, action_parameters_id,
+            status_code, error_message, override_info_json, action_time_ms, aggregated_file_count, aggregated_file_hashes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', fad_rows)
+    conn.executemany("INSERT INTO rule_stats_hourly VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     [key + tuple(values) for key, values in stats.items()])
+
+    override_rows = []
+    for file_hash in file_pool:
+        winner = rng.choice(rule_ids)
+        override_rows.append((file_hash, "placement", "", winner, 3, "add_to", None, _iso(AUDIT_NOW - timedelta(days=rng.randint(0, 60)))))
+        if rng.random() < 0.3:
+            override_rows.append((file_hash, "rating", "rating-service", rng.choice(rule_ids), 2, "modify_rating", "5",
+                                  _iso(AUDIT_NOW - timedelta(days=rng.randint(0, 60)))))
+    conn.executemany("INSERT INTO overrides VALUES (?, ?, ?, ?, ?, ?, ?, ?)", override_rows)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    return {
+        "rule_ids": rule_ids, "file_pool": file_pool,
+        "run_id": run_rows[len(run_rows) // 2][1], "rule_execution_id": rei_rows[len(rei_rows) // 2][1],
+        "fad_rows": len(fad_rows), "rei_rows": len(rei_rows), "run_rows": len(run_rows), "override_rows": len(override_rows),
+    }
+
+
+def _explain(conn, sql, params=()):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+
+def _problem_steps(shape_name, plan_steps, sort_by=None):
+    """Plan steps of shape_name that are neither index searches nor allowed. Returns [(step, reason)]."""
+    problems = []
+    for step in plan_steps:
+        scanned = re.match(r"SCAN (\S+)", step)
+        is_problem = ("USE TEMP B-TREE" in step or
+                      (scanned and scanned.group(1) in LARGE_TABLES and "VIRTUAL TABLE" not in step) or
+                      ("MULTI-INDEX OR" in step))
+        if not is_problem:
+            continue
+        allowed = any(shape_name.startswith(name_prefix) and step_text in step
+                      for name_prefix, step_text, _reason in ALLOWED_PLAN_STEPS)
+        if not allowed and sort_by in SORTS_NEEDING_TEMP_BTREE:
+            allowed = "USE TEMP B-TREE FOR ORDER BY" in step
+        if not allowed:
+            problems.append(step)
+    return problems
+
+
+def _search_shapes(sample):
+    """Yields (shape name, args, start_iso, end_iso) for every /logs/search query shape."""
+    search_types = {
+        "general_runs": {},
+        "rule_id_executions": {"rule_id": sample["rule_ids"][3]},
+        "run_id_details": {"run_id": sample["run_id"]},
+        "file_hash": {"file_hash": sample["file_pool"][7]},
+        "rule_execution_id_details": {"rule_execution_id": sample["rule_execution_id"]},
+    }
+    filters = {
+        "no_filter": {},
+        "status": {"status_filter": "success,failure"},
+        "term_fts": {"log_search_term": "timeout"},
+        "term_like": {"log_search_term": "v1"}, # Shorter than the trigram minimum
+    }
+    time_ranges = {
+        "week": (_iso(AUDIT_NOW - timedelta(days=7)), _iso(AUDIT_NOW)),
+        "all": (datetime.min.isoformat() + "Z", _iso(AUDIT_NOW)),
+    }
+    for type_name, type_args in search_types.items():
+        sorts = ["timestamp_desc"] if type_name in ("general_runs", "run_id_details") else \
+            ["timestamp_desc", "timestamp_asc", "rule_name_asc", "rule_name_desc", "status_asc", "status_desc"]
+        for sort_by in sorts:
+            for filter_name, filter_args in filters.items():
+                for range_name, (start_iso, end_iso) in time_ranges.items():
+                    for count_mode in ("exact", "approximate"):
+                        args = dict(type_args, sort_by=sort_by, count_mode=count_mode, **filter_args)
+                        yield f"search/{type_name}/{sort_by}/{filter_name}/{range_name}/{count_mode}", args, start_iso, end_iso
+
+
+def audit(conn, sample, verbose=False):
+    """Returns the list of failures as (shape name, sql, problem steps)."""
+    failures, checked = [], 0
+
+    def check(shape_name, sql, params, sort_by=None):
+        nonlocal checked
+        checked += 1
+        plan_steps = _explain(conn, sql, params)
+        problems = _problem_steps(shape_name, plan_steps, sort_by)
+        if shape_name.startswith("search/"):
+            expected_step = EXPECTED_SEARCH_STEPS[shape_name.split("/")[1]]
+            if not any(re.match(expected_step, step) for step in plan_steps):
+                problems.append(f"no step matching /{expected_step}/")
+        if verbose or problems:
+            print(f"{'FAIL' if problems else 'ok  '} {shape_name}")
+            for step in plan_steps:
+                print(f"       {'!! ' if step in problems else '   '}{step}")
+        if problems:
+            failures.append((shape_name, sql, problems))
+
+    # 1. /logs/search: count, first page and both cursor directions of every shape
+    for shape_name, args, start_iso, end_iso in _search_shapes(sample):
+        query = build_log_search_query(conn, args, start_iso, end_iso)
+        check(f"{shape_name}/count", query["count_sql"], query["count_params"], args["sort_by"])
+        check(f"{shape_name}/first_page", query["page_sql"], query["page_params"], args["sort_by"])
+        conn.row_factory = sqlite3.Row
+        row = conn.execute(query["page_sql"], query["page_params"]).fetchone()
+        conn.row_factory = None
+        if row is None:
+            continue # No row to make a cursor from; same SQL shape as a page of another sample
+        key_values = [row[f"_sort_key_{i}"] for i in range(len(query["sort_columns"]))]
+        for direction in ("after", "before"):
+            cursor_args = dict(args, cursor=_encode_log_cursor(query["search_type"], query["sort_by"], direction, key_values))
+            cursor_query = build_log_search_query(conn, cursor_args, start_iso, end_iso)
+            check(f"{shape_name}/cursor_{direction}", cursor_query["page_sql"], cursor_query["page_params"], args["sort_by"])
+
+    # /logs/entry/<id>: one row by its id (the values don't change the plan)
+    for entry_type in LOG_ENTRY_TYPES:
+        check(f"entry/{entry_type}", build_log_entry_query(entry_type), (1 if entry_type == "file_action" else "id",))
+
+    # 2. Statistics and 3. override queries: capture the statements the functions run, then explain them.
+    #    Everything runs in a transaction that is rolled back, so the deletes leave the sample intact.
+    start_iso, end_iso = _iso(AUDIT_NOW - timedelta(days=7)), _iso(AUDIT_NOW)
+    rules = [{"id": rule_id, "priority": 3, "action": {"type": "add_to"}} for rule_id in sample["rule_ids"][:6]]
+    captured_calls = [
+        ("stats/files_processed_per_rule/week", lambda: get_files_processed_per_rule(conn, start_iso, end_iso)),
+        ("stats/files_processed_per_rule/all", lambda: get_files_processed_per_rule(conn, start_iso, end_iso, all_time=True)),
+        ("stats/rule_timeseries/week", lambda: get_rule_stats_timeseries(conn, start_iso, end_iso)),
+        ("stats/rule_timeseries/all", lambda: get_rule_stats_timeseries(conn, start_iso, end_iso, all_time=True)),
+        ("stats/rule_timeseries/one_rule", lambda: get_rule_stats_timeseries(conn, start_iso, end_iso, rule_id=sample["rule_ids"][2])),
+        ("overrides/get_conflict_override", lambda: get_conflict_override(conn, sample["file_pool"][5], "placement")),
+        ("overrides/remove_overrides_for_rule", lambda: remove_overrides_for_rule(conn, sample["rule_ids"][4])),
+        ("overrides/remove_specific_override", lambda: remove_specific_override(conn, sample["file_pool"][6], "rating", "rating-service")),
+        ("overrides/get_override_hashes_page", lambda: get_override_hashes_page(conn, sample["file_pool"][8], limit=256)),
+        ("overrides/remove_overrides_for_hashes", lambda: remove_overrides_for_hashes(conn, sample["file_pool"][9:12])),
+        ("overrides/remove_stale_rule_overrides", lambda: remove_stale_rule_overrides(conn, rules)),
+        ("overrides/expire_overrides_older_than", lambda: expire_overrides_older_than(conn, AUDIT_NOW - timedelta(days=30))),
+    ]
+    conn.row_factory = sqlite3.Row # The database helpers read rows by column name
+    for shape_name, call in captured_calls:
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            call()
+        finally:
+            conn.set_trace_callback(None)
+        seen = set()
+        for statement in statements:
+            normalized = re.sub(r"'[^']*'|\b\d+\b", "?", statement).strip()
+            if not re.match(r"(SELECT|DELETE|UPDATE|WITH)\b", normalized, re.IGNORECASE) or normalized in seen:
+                continue # Transaction control, or a repeat of an executemany statement
+            seen.add(normalized)
+            check(shape_name, statement, ())
+    conn.row_factory = None
+    conn.rollback()
+    return failures, checked
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the query plans of the log and override queries.")
+    parser.add_argument("--executions", type=int, default=3000, help="Synthetic rule executions to generate (default 3000)")
+    parser.add_argument("--files-per-execution", type=int, default=12, help="File actions per execution (default 12)")
+    parser.add_argument("--verbose", action="store_true", help="Print the plan of every query, not only failures")
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    scratch_dir = tempfile.mkdtemp(prefix="query_plan_audit_")
+    try:
+        db_file = os.path.join(scratch_dir, "audit.db")
+        init_conflict_db(db_file)
+        conn = _open_configured_connection(db_file)
+        try:
+            sample = _populate(conn, options.executions, options.files_per_execution)
+            print(f"Sample: {sample['run_rows']} runs, {sample['rei_rows']} rule executions, "
+                  f"{sample['fad_rows']} file actions, {sample['override_rows']} overrides.")
+            failures, checked = audit(conn, sample, verbose=options.verbose)
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    if failures:
+        print(f"\n{len(failures)} of {checked} query plans regressed:")
+        for shape_name, sql, problems in failures:
+            print(f"  {shape_name}: {'; '.join(problems)}")
+        return 1
+    print(f"All {checked} query plans use indexes as expected.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
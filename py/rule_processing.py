@@ -1,18 +1,27 @@
 import json
 import uuid
 import math
+import time
+import threading
 import traceback
 from datetime import datetime, timedelta
 from urllib.parse import unquote
 import logging
 import sqlite3 # Added for specific exception handling in execute_single_rule
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from hydrus_interface import call_hydrus_api
 from database import (
+    get_db_connection,
     get_or_create_active_rule_version,
     get_conflict_override, set_conflict_override, # TODO: Update signatures/behavior of these functions
-    log_file_action_detail
+    FileActionLogWriter,
+    get_override_hashes_page, remove_overrides_for_hashes, remove_stale_rule_overrides,
+    expire_overrides_older_than, get_db_space_stats,
+    LOG_CODE_SQL, submit_log_codes, epoch_ms, encode_execution_details
 )
+from log_writer import submit_write, flush_log_writer, get_active_log_writer
+from rule_stats import record_rule_execution_stats
 # We'll need to pass app_config or specific settings to functions that need them.
 
 logger = logging.getLogger(__name__)
@@ -30,6 +39,9 @@ logger = logging.getLogger(__name__)
 #    based on their original order (e.g., in rules.json, lower index first).
 # This means less important rules run first, allowing more important rules to override their effects if they
 # target the same file for a conflicting action. The "last word" belongs to the most important rule.
+# Rules that can't interact (no shared override domain, tag/rating service or file services read by
+# their searches) may run at the same time; the order above only binds rules that conflict
+# (see build_rule_conflict_graph).
 
 # Importance number:
 # This is a value provided by the user (UI field: 'priority', default: 1).
@@ -48,6 +60,13 @@ def _get_rule_by_id(rule_id_to_find, rules_list):
         return None
     return next((rule for rule in rules_list if isinstance(rule, dict) and rule.get('id') == rule_id_to_find), None)
 
+# Stored execution details are bounded: per-file lists of the action results are replaced by counts
+# (every file has its own file_action_details row with its outcome and errors), and if the JSON is
+# still larger than EXECUTION_DETAILS_MAX_BYTES its longest lists are cut to a preview.
+EXECUTION_DETAILS_MAX_BYTES = 64 * 1024
+EXECUTION_DETAILS_LIST_PREVIEW = 20 # Items kept of a list cut to fit the cap
+SPILLED_ACTION_RESULT_KEYS = ("files_fully_successful", "files_with_errors", "files_with_some_errors")
+
 def create_default_details():
     """Creates a dictionary with default values for rule execution details."""
     return {
@@ -61,6 +80,53 @@ def create_default_details():
         "critical_error_traceback_summary": None,
     }
 
+def _details_for_storage(final_details, rule_execution_id):
+    """
+    Bounded copy of an execution's final_details, as JSON text for details_json_from_logic.
+    final_details itself (returned to the caller of execute_single_rule) is left unchanged.
+    """
+    stored_details = dict(final_details)
+    stored_results, rating_summary, spilled = [], None, False
+    for result in final_details.get("action_processing_results", []):
+        if result.get("action_type") == "modify_rating" and "hash" in result:
+            # One result per file; folded into a single summary entry
+            if rating_summary is None:
+                rating_summary = {"action_type": "modify_rating", "files_attempted": 0, "files_succeeded": 0, "files_failed": 0}
+                stored_results.append(rating_summary)
+            rating_summary["files_attempted"] += 1
+            rating_summary["files_succeeded" if result.get("success") else "files_failed"] += 1
+            spilled = True
+            continue
+        result = dict(result)
+        for key in SPILLED_ACTION_RESULT_KEYS:
+            if isinstance(result.get(key), (list, dict)):
+                result[f"{key}_count"] = len(result.pop(key))
+                spilled = True
+        stored_results.append(result)
+    stored_details["action_processing_results"] = stored_results
+    if spilled:
+        stored_details["per_file_results"] = {"logged_in": "file_action_details", "rule_execution_id": rule_execution_id}
+
+    details_json = json.dumps(stored_details)
+    if len(details_json) <= EXECUTION_DETAILS_MAX_BYTES:
+        return details_json
+    # Still too large (e.g. thousands of metadata errors): cut the longest lists first
+    original_size = len(details_json)
+    list_keys = sorted((key for key, value in stored_details.items() if isinstance(value, list)),
+                       key=lambda key: len(json.dumps(stored_details[key])), reverse=True)
+    for key in list_keys:
+        if len(stored_details[key]) > EXECUTION_DETAILS_LIST_PREVIEW:
+            stored_details[f"{key}_omitted_count"] = len(stored_details[key]) - EXECUTION_DETAILS_LIST_PREVIEW
+            stored_details[key] = stored_details[key][:EXECUTION_DETAILS_LIST_PREVIEW]
+            details_json = json.dumps(stored_details)
+            if len(details_json) <= EXECUTION_DETAILS_MAX_BYTES:
+                return details_json
+    # Last resort: keep the scalar fields only, long strings cut short
+    stored_details = {key: value[:1000] if isinstance(value, str) else value
+                      for key, value in stored_details.items() if not isinstance(value, (list, dict))}
+    stored_details["details_truncated_from_bytes"] = original_size
+    return json.dumps(stored_details)
+
 def is_critical_warning(warning_message):
     """Determines if a translation warning is critical."""
     msg_lower = warning_message.lower()
@@ -128,8 +194,82 @@ def _ensure_available_services(app_config, rule_name_for_log):
     app_config['AVAILABLE_SERVICES'] = []
     return []
 
-def _fetch_metadata_for_hashes(app_config, rule_name_for_log, hashes_list, batch_size=256):
-    """Fetches metadata for file hashes in batches."""
+# --- Cooperative Run Stop (cancellation and time budgets) ---
+# A run carries a RunStopToken, checked before each rule starts, between the API batches of
+# _batch_api_call_with_retry and _fetch_metadata_for_hashes and in the per-file loops of
+# execute_single_rule. A stop never interrupts a call in flight: the work not started yet is left
+# ("deferred") for the next run, and what was done is logged and sets its overrides as usual.
+# A token stops when:
+#   - cancel() is called (the engine worker does this for /engine_jobs/<job_id>/cancel, and with the
+#     'shutdown' reason when it is asked to stop),
+#   - the run's time budget ('run_time_budget_seconds') is used up,
+#   - for one rule execution, the rule's time budget ('rule_time_budget_seconds') is used up.
+# Once stopped, a token stays stopped.
+STOP_REASON_MESSAGES = {
+    "cancelled": "the run was cancelled",
+    "shutdown": "the engine worker was shut down",
+    "run_time_budget": "the run's time budget was used up",
+    "rule_time_budget": "the rule's time budget was used up",
+}
+
+class RunStopToken:
+    """Stop signal of one run. Thread-safe: the rules of a run running concurrently share it."""
+    def __init__(self, run_budget_seconds=0, rule_budget_seconds=0):
+        self._cancel_event = threading.Event()
+        self._cancel_reason = "cancelled"
+        self._run_deadline = time.monotonic() + run_budget_seconds if run_budget_seconds else None
+        self.rule_budget_seconds = rule_budget_seconds
+
+    def cancel(self, reason="cancelled"):
+        """Stops the run; reason is 'cancelled' or 'shutdown'. The first cancel() sets the reason."""
+        if not self._cancel_event.is_set():
+            self._cancel_reason = reason
+            self._cancel_event.set()
+
+    def extend(self, seconds):
+        """Moves the run's deadline back, e.g. by the time the run spent paused for other jobs."""
+        if self._run_deadline is not None:
+            self._run_deadline += seconds
+
+    def stop_reason(self):
+        """'cancelled', 'shutdown', 'run_time_budget' or None while the run may go on."""
+        if self._cancel_event.is_set():
+            return self._cancel_reason
+        if self._run_deadline is not None and time.monotonic() >= self._run_deadline:
+            return "run_time_budget"
+        return None
+
+    def for_rule(self):
+        """Token for one rule execution, started now: stops with the run or at the rule's time budget."""
+        return RuleStopToken(self)
+
+class RuleStopToken:
+    """Stop signal of one rule execution (see RunStopToken.for_rule)."""
+    def __init__(self, run_token):
+        self._run_token = run_token
+        self._deadline = time.monotonic() + run_token.rule_budget_seconds if run_token.rule_budget_seconds else None
+
+    def stop_reason(self):
+        reason = self._run_token.stop_reason()
+        if reason is None and self._deadline is not None and time.monotonic() >= self._deadline:
+            reason = "rule_time_budget"
+        return reason
+
+def _stop_reason(stop_token):
+    return stop_token.stop_reason() if stop_token is not None else None
+
+class _RuleStopped(Exception):
+    """Raised inside execute_single_rule when its token stops before any action was attempted."""
+    def __init__(self, reason, files_deferred):
+        super().__init__(reason)
+        self.reason = reason
+        self.files_deferred = files_deferred
+
+def _fetch_metadata_for_hashes(app_config, rule_name_for_log, hashes_list, batch_size=256, stop_token=None):
+    """
+    Fetches metadata for file hashes in batches. When stop_token stops, the hashes not fetched yet are
+    returned as one error entry with "deferred": True.
+    """
     all_files_metadata = []
     metadata_errors_list = []
     num_hashes = len(hashes_list)
@@ -148,6 +288,12 @@ def _fetch_metadata_for_hashes(app_config, rule_name_for_log, hashes_list, batch
 
 
     for i in range(0, num_hashes, batch_size):
+        stop_reason = _stop_reason(stop_token)
+        if stop_reason:
+            logger.info(f"Rule '{rule_name_for_log}': Metadata fetch stopped ({STOP_REASON_MESSAGES[stop_reason]}). {num_hashes - i} files deferred.")
+            metadata_errors_list.append({"message": f"Deferred: {STOP_REASON_MESSAGES[stop_reason]}.", "hashes_in_batch": hashes_list[i:],
+                                         "status_code": None, "deferred": True})
+            break
         batch_hashes = hashes_list[i : i + batch_size]
         params = {
             'hashes': json.dumps(batch_hashes),
@@ -164,10 +310,127 @@ def _fetch_metadata_for_hashes(app_config, rule_name_for_log, hashes_list, batch
             metadata_errors_list.append({"message": msg, "hashes_in_batch": batch_hashes, "status_code": status})
 
     logger.info(f"Rule '{rule_name_for_log}': Metadata fetch complete. Retrieved for {len(all_files_metadata)} of {num_hashes} files.")
-    if metadata_errors_list:
+    if any(not err.get("deferred") for err in metadata_errors_list):
         logger.warning(f"Rule '{rule_name_for_log}': {len(metadata_errors_list)} metadata fetch errors.")
     return all_files_metadata, metadata_errors_list
 
+def _find_hashes_missing_from_hydrus(app_config, rule_name_for_log, hashes_list, batch_size=256):
+    """
+    Checks which of the given hashes no longer correspond to a file in Hydrus.
+    A hash is considered missing if Hydrus does not know it (no metadata / null file_id)
+    or if the file is no longer current in any file service (i.e. fully deleted).
+
+    Hashes from batches whose metadata fetch failed are NOT reported as missing,
+    so a transient API error can never cause data to be dropped.
+
+    Returns: tuple (missing_hashes_set, unchecked_hashes_set)
+    """
+    if not hashes_list:
+        return set(), set()
+
+    fetched_meta, meta_errs = _fetch_metadata_for_hashes(app_config, rule_name_for_log, hashes_list, batch_size=batch_size)
+    unchecked_hashes = set()
+    for err in meta_errs:
+        unchecked_hashes.update(err.get("hashes_in_batch", []))
+
+    meta_map = {meta.get('hash'): meta for meta in fetched_meta if isinstance(meta, dict) and meta.get('hash')}
+    missing_hashes = set()
+    for h in hashes_list:
+        if h in unchecked_hashes:
+            continue
+        meta = meta_map.get(h)
+        if not meta or meta.get('file_id') is None:
+            missing_hashes.add(h)
+        elif not meta.get('file_services', {}).get('current'):
+            missing_hashes.add(h)
+    return missing_hashes, unchecked_hashes
+
+def garbage_collect_overrides(app_config, db_conn, rules, ttl_days=0, batch_size=256):
+    """
+    Removes conflict overrides that can no longer influence a rule run:
+    1. Overrides whose winning rule was deleted or no longer matches its current definition.
+    2. (Optional) Overrides older than `ttl_days`, if ttl_days > 0.
+    3. Overrides for files that no longer exist in Hydrus, checked in batches of `batch_size` hashes.
+
+    Commits after each phase and after each hash batch, so the write lock is never held
+    across Hydrus API calls.
+
+    Returns: dict report with per-phase removed row counts and reclaimed space.
+    """
+    report = {
+        "removed_stale_rule_overrides": 0,
+        "removed_expired_overrides": 0,
+        "removed_orphaned_file_overrides": 0,
+        "hashes_checked": 0,
+        "hashes_unchecked_due_to_errors": 0,
+        "total_rows_removed": 0,
+        "reclaimed_bytes": 0,
+        "errors": [],
+        "notes": []
+    }
+    space_before = get_db_space_stats(db_conn)
+
+    # Phase 1: Overrides from rules that were deleted or changed outside the UI
+    if rules:
+        removed = remove_stale_rule_overrides(db_conn, rules)
+        if removed == -1:
+            report["errors"].append("DB error removing overrides for stale rules.")
+            db_conn.rollback()
+        else:
+            report["removed_stale_rule_overrides"] = removed
+            db_conn.commit()
+    else:
+        # An empty rules list is more likely a load problem than an intent to wipe every override.
+        report["notes"].append("No rules loaded; skipped stale-rule check to avoid clearing all overrides.")
+
+    # Phase 2: TTL expiry
+    if ttl_days and ttl_days > 0:
+        removed = expire_overrides_older_than(db_conn, datetime.utcnow() - timedelta(days=ttl_days))
+        if removed == -1:
+            report["errors"].append("DB error expiring old overrides.")
+            db_conn.rollback()
+        else:
+            report["removed_expired_overrides"] = removed
+            db_conn.commit()
+
+    # Phase 3: Files no longer present in Hydrus
+    settings = app_config.get('HYDRUS_SETTINGS', {})
+    if not settings.get('api_address'):
+        report["notes"].append("Hydrus API address not configured; skipped orphaned file check.")
+    else:
+        last_hash = None
+        while True:
+            hashes_page = get_override_hashes_page(db_conn, last_hash, batch_size)
+            if hashes_page is None:
+                report["errors"].append("DB error reading override hashes.")
+                break
+            if not hashes_page:
+                break
+            last_hash = hashes_page[-1]
+
+            missing_hashes, unchecked_hashes = _find_hashes_missing_from_hydrus(app_config, "OverrideGC", hashes_page, batch_size=batch_size)
+            report["hashes_checked"] += len(hashes_page) - len(unchecked_hashes)
+            report["hashes_unchecked_due_to_errors"] += len(unchecked_hashes)
+            if missing_hashes:
+                removed = remove_overrides_for_hashes(db_conn, list(missing_hashes))
+                if removed == -1:
+                    report["errors"].append(f"DB error removing overrides for {len(missing_hashes)} orphaned hashes.")
+                    db_conn.rollback()
+                else:
+                    report["removed_orphaned_file_overrides"] += removed
+                    db_conn.commit()
+
+    report["total_rows_removed"] = (report["removed_stale_rule_overrides"] + report["removed_expired_overrides"]
+                                    + report["removed_orphaned_file_overrides"])
+    space_after = get_db_space_stats(db_conn)
+    if space_before and space_after:
+        report["reclaimed_bytes"] = max(0, space_after["free_bytes"] - space_before["free_bytes"])
+        report["db_file_size_bytes"] = space_after["file_size_bytes"]
+    logger.info(f"OverrideGC: Removed {report['total_rows_removed']} override rows "
+                f"(stale rules: {report['removed_stale_rule_overrides']}, expired: {report['removed_expired_overrides']}, "
+                f"orphaned files: {report['removed_orphaned_file_overrides']}). Reclaimed ~{report['reclaimed_bytes']} bytes.")
+    return report
+
 def _parse_time_range_for_logs(args):
     """
     Parses time frame parameters (e.g., '24h', '1w', custom 'start_date', 'end_date')
@@ -776,24 +1039,28 @@ def _batch_api_call_with_retry(app_config, endpoint, method, items_to_process, b
                                batch_payload_formatter, single_item_payload_formatter,
                                rule_name_for_log, action_description,
                                expected_success_status_codes=None, # Not used as call_hydrus_api handles success check
-                               timeout_per_call=120):
-    """Helper for batch API calls with individual retries."""
+                               timeout_per_call=120, stop_token=None):
+    """
+    Helper for batch API calls with individual retries. Items not sent because stop_token stopped
+    are returned in "deferred_items".
+    """
     settings = app_config.get('HYDRUS_SETTINGS', {})
     api_address = settings.get('api_address')
     api_key = settings.get('api_key')
 
     successful_items = []
     failed_items_with_errors = []
+    deferred_items = []
 
     if not items_to_process:
-        return {"successful_items": [], "failed_items_with_errors": []}
+        return {"successful_items": [], "failed_items_with_errors": [], "deferred_items": []}
 
     if not api_address:
         logger.error(f"Rule '{rule_name_for_log}': API address not set for batch API call '{action_description}'.")
         # Mark all items as failed if API address is missing
         for item in items_to_process:
             failed_items_with_errors.append((item, "API address not configured.", None))
-        return {"successful_items": [], "failed_items_with_errors": failed_items_with_errors}
+        return {"successful_items": [], "failed_items_with_errors": failed_items_with_errors, "deferred_items": []}
 
     logger.info(f"Rule '{rule_name_for_log}': Batch processing {len(items_to_process)} items for '{action_description}' (batch size {batch_size}).")
 
@@ -802,6 +1069,9 @@ def _batch_api_call_with_retry(app_config, endpoint, method, items_to_process, b
         batch_num = (i // batch_size) + 1
 
         if not batch_items: continue
+        if _stop_reason(stop_token):
+            deferred_items.extend(items_to_process[i:])
+            break
 
         batch_payload = batch_payload_formatter(batch_items)
         batch_result, batch_status = call_hydrus_api(
@@ -815,6 +1085,9 @@ def _batch_api_call_with_retry(app_config, endpoint, method, items_to_process, b
             batch_err_msg = batch_result.get('message', f"Unknown API error for batch {batch_num}")
             logger.warning(f"Rule '{rule_name_for_log}': Batch {batch_num} for '{action_description}' failed: {batch_err_msg}. Status: {batch_status}. Retrying individually...")
             for item_idx, single_item in enumerate(batch_items):
+                if _stop_reason(stop_token):
+                    deferred_items.extend(batch_items[item_idx:])
+                    break
                 single_payload = single_item_payload_formatter(single_item)
                 retry_result, retry_status = call_hydrus_api(
                     api_address, api_key, endpoint, method=method,
@@ -827,24 +1100,29 @@ def _batch_api_call_with_retry(app_config, endpoint, method, items_to_process, b
                     logger.warning(f"Rule '{rule_name_for_log}': Retry for item '{str(single_item)[:50]}' (batch {batch_num}) failed: {retry_err_msg}. Status: {retry_status}")
                     failed_items_with_errors.append((single_item, retry_err_msg, retry_status))
 
-    logger.info(f"Rule '{rule_name_for_log}': Batch '{action_description}' complete. Succeeded: {len(successful_items)}, Failed: {len(failed_items_with_errors)}.")
+    deferred_note = f", Deferred: {len(deferred_items)} ({STOP_REASON_MESSAGES[_stop_reason(stop_token)]})" if deferred_items else ""
+    logger.info(f"Rule '{rule_name_for_log}': Batch '{action_description}' complete. Succeeded: {len(successful_items)}, Failed: {len(failed_items_with_errors)}{deferred_note}.")
     if failed_items_with_errors:
         logger.debug(f"  Failed items/errors for '{action_description}': {failed_items_with_errors}")
-    return {"successful_items": successful_items, "failed_items_with_errors": failed_items_with_errors}
+    return {"successful_items": successful_items, "failed_items_with_errors": failed_items_with_errors, "deferred_items": deferred_items}
 
 # --- Action Performing Functions ---
 
-def _perform_action_add_to_files_batch(app_config, file_hashes, destination_service_keys, rule_name_for_log, batch_size=64):
-    """Performs 'add_to' action for files in batches."""
+def _perform_action_add_to_files_batch(app_config, file_hashes, destination_service_keys, rule_name_for_log, batch_size=64, stop_token=None):
+    """
+    Performs 'add_to' action for files in batches. Files not added to every destination because
+    stop_token stopped (and without errors) are returned in "files_deferred".
+    """
     if not file_hashes:
-        return {"success": True, "total_successful_migrations": 0, "total_failed_migrations": 0, "files_with_some_errors": {}, "overall_errors": []}
+        return {"success": True, "total_successful_migrations": 0, "total_failed_migrations": 0, "files_with_some_errors": {}, "files_deferred": [], "overall_errors": []}
     if not destination_service_keys:
-        return {"success": True, "total_successful_migrations": 0, "total_failed_migrations": 0, "files_with_some_errors": {}, "overall_errors": []}
+        return {"success": True, "total_successful_migrations": 0, "total_failed_migrations": 0, "files_with_some_errors": {}, "files_deferred": [], "overall_errors": []}
 
     overall_success_flag = True
     total_successful_migrations = 0
     total_failed_migrations = 0
     files_with_errors_map = {}
+    files_deferred = set()
     endpoint = '/add_files/migrate_files'
 
     for dest_key in destination_service_keys:
@@ -853,9 +1131,10 @@ def _perform_action_add_to_files_batch(app_config, file_hashes, destination_serv
             app_config, endpoint, 'POST', file_hashes, batch_size,
             lambda batch_h: {"hashes": batch_h, "file_service_key": dest_key},
             lambda single_h: {"hash": single_h, "file_service_key": dest_key},
-            rule_name_for_log, f"add files to service '{dest_key}'", timeout_per_call=180
+            rule_name_for_log, f"add files to service '{dest_key}'", timeout_per_call=180, stop_token=stop_token
         )
         total_successful_migrations += len(batch_results["successful_items"])
+        files_deferred.update(batch_results["deferred_items"])
         if batch_results["failed_items_with_errors"]:
             overall_success_flag = False
             total_failed_migrations += len(batch_results["failed_items_with_errors"])
@@ -863,18 +1142,21 @@ def _perform_action_add_to_files_batch(app_config, file_hashes, destination_serv
                 files_with_errors_map.setdefault(h, []).append({"destination_service_key": dest_key, "message": msg, "status_code": status})
 
     return {"success": overall_success_flag, "total_successful_migrations": total_successful_migrations,
-            "total_failed_migrations": total_failed_migrations, "files_with_some_errors": files_with_errors_map, "overall_errors": []}
+            "total_failed_migrations": total_failed_migrations, "files_with_some_errors": files_with_errors_map,
+            "files_deferred": sorted(files_deferred - files_with_errors_map.keys()), "overall_errors": []}
 
 
 def _perform_action_force_in_batch(app_config, files_metadata_list, rule_configured_destination_keys, # Changed from destination_service_keys
                                    all_local_service_keys_set, rule_name_for_log,
-                                   available_services_list, batch_size=64):
+                                   available_services_list, batch_size=64, stop_token=None):
     """Performs 'force_in' action in batches (copy, verify, delete).
     `rule_configured_destination_keys` are the destinations defined in this specific force_in rule.
+    Files whose phases were not all done because stop_token stopped are returned in "files_deferred":
+    they may have been copied, but are only deleted from other services once verified.
     """
     initial_candidates = len(files_metadata_list)
     if not files_metadata_list:
-        return {"success": True, "files_fully_successful": [], "files_with_errors": {}, "summary_counts": {"initial_candidates":0, "copied_phase_success_count":0, "verified_phase_success_count":0, "deleted_phase_success_count":0}, "overall_errors": []}
+        return {"success": True, "files_fully_successful": [], "files_with_errors": {}, "files_deferred": [], "summary_counts": {"initial_candidates":0, "copied_phase_success_count":0, "verified_phase_success_count":0, "deleted_phase_success_count":0}, "overall_errors": []}
 
     if not isinstance(rule_configured_destination_keys, list) or \
        not rule_configured_destination_keys or \
@@ -883,11 +1165,12 @@ def _perform_action_force_in_batch(app_config, files_metadata_list, rule_configu
                f"This is a critical safety violation. Aborting 'force_in' operation. "
                f"Keys provided: {rule_configured_destination_keys}")
         logger.critical(msg)
-        return {"success": False, "files_fully_successful": [], "files_with_errors": {},
+        return {"success": False, "files_fully_successful": [], "files_with_errors": {}, "files_deferred": [],
                 "summary_counts": {"initial_candidates": initial_candidates, "copied_phase_success_count": 0, "verified_phase_success_count": 0, "deleted_phase_success_count": 0},
                 "overall_errors": [msg]}
 
     files_with_errors_map = {}
+    files_deferred = set()
     candidate_hashes = [fm.get('hash') for fm in files_metadata_list if fm.get('hash')]
 
     # Phase 1: Copy
@@ -899,23 +1182,31 @@ def _perform_action_force_in_batch(app_config, files_metadata_list, rule_configu
             app_config, '/add_files/migrate_files', 'POST', list(hashes_copied_to_all_dests), batch_size,
             lambda bh: {"hashes": bh, "file_service_key": dest_key},
             lambda sh: {"hash": sh, "file_service_key": dest_key},
-            rule_name_for_log, f"ForceIn-Copy to '{dest_key}'", timeout_per_call=180
+            rule_name_for_log, f"ForceIn-Copy to '{dest_key}'", timeout_per_call=180, stop_token=stop_token
         )
+        for h in copy_results["deferred_items"]:
+            hashes_copied_to_all_dests.discard(h)
+            files_deferred.add(h)
         for h, msg, status in copy_results["failed_items_with_errors"]:
             hashes_copied_to_all_dests.discard(h)
             files_with_errors_map.setdefault(h, {"phase": "copy", "errors": []})["errors"].append({"service_key": dest_key, "message": f"Copy fail: {msg}", "status_code": status})
     copied_count = len(hashes_copied_to_all_dests)
     logger.info(f"Rule '{rule_name_for_log}': ForceIn - Phase 1 (Copy) complete. {copied_count} files potentially copied.")
     if not hashes_copied_to_all_dests:
-        return {"success": False, "files_fully_successful": [], "files_with_errors": files_with_errors_map, "summary_counts": {"initial_candidates":initial_candidates, "copied_phase_success_count":0, "verified_phase_success_count":0, "deleted_phase_success_count":0}, "overall_errors": ["No files copied."]}
+        return {"success": not files_with_errors_map, "files_fully_successful": [], "files_with_errors": files_with_errors_map, "files_deferred": sorted(files_deferred),
+                "summary_counts": {"initial_candidates":initial_candidates, "copied_phase_success_count":0, "verified_phase_success_count":0, "deleted_phase_success_count":0},
+                "overall_errors": ["No files copied."] if files_with_errors_map else []}
 
     # Phase 2: Verify
     logger.info(f"Rule '{rule_name_for_log}': ForceIn - Phase 2 (Verify) for {len(hashes_copied_to_all_dests)} files.")
-    fresh_meta, meta_errs = _fetch_metadata_for_hashes(app_config, rule_name_for_log, list(hashes_copied_to_all_dests))
+    fresh_meta, meta_errs = _fetch_metadata_for_hashes(app_config, rule_name_for_log, list(hashes_copied_to_all_dests), stop_token=stop_token)
     if meta_errs:
         for err in meta_errs:
             for h_err in err.get("hashes_in_batch", []):
-                if h_err in hashes_copied_to_all_dests:
+                if h_err in hashes_copied_to_all_dests and err.get("deferred"):
+                    hashes_copied_to_all_dests.discard(h_err) # Not verified, so not deleted from other services either
+                    files_deferred.add(h_err)
+                elif h_err in hashes_copied_to_all_dests:
                     hashes_copied_to_all_dests.discard(h_err) # Verification failed
                     files_with_errors_map.setdefault(h_err, {"phase": "verify", "errors": []})["errors"].append({"message": f"Meta fetch fail: {err.get('message')}", "status_code": err.get("status_code")})
 
@@ -933,7 +1224,9 @@ def _perform_action_force_in_batch(app_config, files_metadata_list, rule_configu
     verified_count = len(hashes_verified_in_all_dests)
     logger.info(f"Rule '{rule_name_for_log}': ForceIn - Phase 2 (Verify) complete. {verified_count} files verified.")
     if not hashes_verified_in_all_dests:
-         return {"success": False, "files_fully_successful": [], "files_with_errors": files_with_errors_map, "summary_counts": {"initial_candidates":initial_candidates, "copied_phase_success_count":copied_count, "verified_phase_success_count":0, "deleted_phase_success_count":0}, "overall_errors": ["No files verified."]}
+         return {"success": not files_with_errors_map, "files_fully_successful": [], "files_with_errors": files_with_errors_map, "files_deferred": sorted(files_deferred),
+                 "summary_counts": {"initial_candidates":initial_candidates, "copied_phase_success_count":copied_count, "verified_phase_success_count":0, "deleted_phase_success_count":0},
+                 "overall_errors": ["No files verified."] if files_with_errors_map else []}
 
     # Phase 3: Delete from other local services
     logger.info(f"Rule '{rule_name_for_log}': ForceIn - Phase 3 (Delete from others) for {len(hashes_verified_in_all_dests)} files.")
@@ -961,8 +1254,11 @@ def _perform_action_force_in_batch(app_config, files_metadata_list, rule_configu
             [h for h in hashes_on_service if h in hashes_deleted_successfully_from_extras], batch_size,
             lambda bh: {"hashes": bh, "file_service_key": service_key_del},
             lambda sh: {"hash": sh, "file_service_key": service_key_del},
-            rule_name_for_log, f"ForceIn-Delete from '{service_key_del}'", timeout_per_call=180
+            rule_name_for_log, f"ForceIn-Delete from '{service_key_del}'", timeout_per_call=180, stop_token=stop_token
         )
+        for h in delete_results["deferred_items"]:
+            hashes_deleted_successfully_from_extras.discard(h)
+            files_deferred.add(h)
         for h, msg, status in delete_results["failed_items_with_errors"]:
             hashes_deleted_successfully_from_extras.discard(h)
             files_with_errors_map.setdefault(h, {"phase": "delete", "errors": []})["errors"].append({"service_key": service_key_del, "message": f"Delete fail: {msg}", "status_code": status})
@@ -981,8 +1277,10 @@ def _perform_action_force_in_batch(app_config, files_metadata_list, rule_configu
     logger.info(f"Rule '{rule_name_for_log}': ForceIn - Phase 3 (Delete) complete. {deleted_phase_count} successful cleanups from other local services.")
     logger.info(f"Rule '{rule_name_for_log}': ForceIn - Overall: {len(files_fully_successful)} fully successful.")
 
-    final_success = (len(files_with_errors_map) == 0 and len(files_fully_successful) == initial_candidates)
+    files_deferred -= files_with_errors_map.keys()
+    final_success = (len(files_with_errors_map) == 0 and len(files_fully_successful) + len(files_deferred) == initial_candidates)
     return {"success": final_success, "files_fully_successful": files_fully_successful, "files_with_errors": files_with_errors_map,
+            "files_deferred": sorted(files_deferred),
             "summary_counts": {"initial_candidates":initial_candidates, "copied_phase_success_count":copied_count, "verified_phase_success_count":verified_count, "deleted_phase_success_count":deleted_phase_count},
             "overall_errors": []}
 
@@ -1132,12 +1430,14 @@ def _determine_file_action_status_based_on_override(
 
     return skip_file, log_override_details_for_skip
 
-def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_order_in_run, is_manual_run=False):
+def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_order_in_run, is_manual_run=False, stop_token=None):
     """
     Internal function to execute a single rule's logic.
     Orchestrates condition translation, file searching, action execution,
     manages conflict overrides based on importance, and logs details.
     Requires app_config for settings and db_conn for database operations.
+    stop_token (RunStopToken) stops the rule early; the files it did not get to are deferred to the
+    next run ("files_deferred" and "stop_reason" in the result).
     """
     rule_id = rule.get('id', 'unknown_rule_id_' + str(uuid.uuid4())[:8])
     rule_name = rule.get('name', rule_id)
@@ -1146,6 +1446,11 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
     rule_execution_id = str(uuid.uuid4())
 
     log_prefix = f"RuleExec ID {rule_execution_id[:8]} (Rule '{rule_name}', RunID {current_run_id[:8]})"
+    # Per-file log rows are buffered and written in chunks (skips as one aggregate row per reason);
+    # finalized in the 'finally' block below.
+    file_log_writer = FileActionLogWriter(db_conn, rule_execution_id,
+                                          batch_size=app_config.get('HYDRUS_SETTINGS', {}).get('log_batch_size', 500))
+    rule_stop_token = stop_token.for_rule() if stop_token is not None else None
     manual_run_log_str = "(Manual Run - Overrides Bypassed)" if is_manual_run else "(Run with Override Logic)"
     logger.info(f"{log_prefix}: Executing (Importance: {current_rule_importance}, Type: {rule.get('action',{}).get('type')}) {manual_run_log_str}")
 
@@ -1161,7 +1466,15 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
     files_skipped_due_to_recent_view = 0
     files_skipped_due_to_override = 0
     metadata_fetched_count = 0
+    files_deferred = 0
+    rule_stop_reason = None
 
+    def defer_files(file_hashes):
+        # Candidates the rule stopped before acting on: neither success nor failure, and no override is set
+        nonlocal files_deferred
+        for deferred_hash in file_hashes:
+            file_log_writer.log_skip(deferred_hash, "skipped_deferred", json.dumps({"reason": "deferred"}))
+        files_deferred += len(file_hashes)
 
     overall_rule_success_flag = True
     final_summary_message_str = f"Rule '{rule_name}' processing started."
@@ -1172,16 +1485,22 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
         active_rule_version_id = get_or_create_active_rule_version(db_conn, rule)
         if not active_rule_version_id:
             raise Exception(f"{log_prefix}: CRITICAL - Failed to get or create active rule version. Aborting.")
+        # Commit the (possibly new) rule version right away: this connection must not hold the
+        # write lock while the background log writer is committing this rule's log rows.
+        db_conn.commit()
 
-        cursor = db_conn.cursor()
-        cursor.execute('''
+        submit_log_codes(db_conn, ["started"])
+        submit_write(db_conn, f'''
             INSERT INTO rule_executions_in_run (
-                rule_execution_id, run_id, rule_id, rule_version_id, execution_order_in_run,
-                start_time, status
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                rule_execution_id, run_key, rule_id, rule_version_key, execution_order_in_run,
+                start_time_ms, status_code
+            ) VALUES (
+                ?, (SELECT run_key FROM execution_runs WHERE run_id = ?), ?,
+                (SELECT rule_version_key FROM rule_versions WHERE rule_version_id = ?), ?, ?, {LOG_CODE_SQL}
+            )
         ''', (
             rule_execution_id, current_run_id, rule_id, active_rule_version_id,
-            execution_order_in_run, rule_exec_start_time.isoformat() + "Z", "started"
+            execution_order_in_run, epoch_ms(rule_exec_start_time), "started"
         ))
 
         available_services = _ensure_available_services(app_config, rule_name)
@@ -1263,6 +1582,11 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
         # No 'tag_service_key' is added to search_api_params here,
         # so Hydrus will use its default (search all known tags).
 
+        # Nothing has been attempted before the actions, so a stop until then defers the whole rule: its
+        # search is redone next run and the deferred files are only counted.
+        if _stop_reason(rule_stop_token):
+            raise _RuleStopped(_stop_reason(rule_stop_token), 0)
+
         log_search_predicates_str = str(hydrus_predicates)
         logger.info(f"{log_prefix}: Searching Hydrus with predicates: {log_search_predicates_str} (tags evaluated against 'all known tags' by default).")
 
@@ -1279,7 +1603,7 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
             for h_view in matched_hashes_raw:
                 if h_view in recently_viewed_hashes_set:
                     files_skipped_due_to_recent_view += 1
-                    log_file_action_detail(db_conn, rule_execution_id, h_view, "skip_action", json.dumps({"reason": "recently_viewed"}), "skipped_recent_view")
+                    file_log_writer.log_skip(h_view, "skipped_recent_view", json.dumps({"reason": "recently_viewed"}))
                 else:
                     eligible_hashes_after_view.append(h_view)
         else:
@@ -1289,6 +1613,8 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
         candidate_files_for_action = []
         if not is_manual_run:
             for file_hash in eligible_hashes_after_view:
+                if _stop_reason(rule_stop_token):
+                    raise _RuleStopped(_stop_reason(rule_stop_token), len(eligible_hashes_after_view) - files_skipped_due_to_override)
                 should_skip, override_details_logged = _determine_file_action_status_based_on_override(
                     db_conn, file_hash, rule_id, current_rule_importance, current_rule_action_type,
                     rating_service_key_for_action, rating_value_for_action, log_prefix
@@ -1297,9 +1623,8 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
                     files_skipped_due_to_override += 1
                     if log_overridden_actions_setting:
                         logger.debug(f"{log_prefix}: File {file_hash} skipped due to override. Logging detail as per setting.")
-                        log_file_action_detail(db_conn, rule_execution_id, file_hash, "skip_action",
-                                               json.dumps({"reason": "override"}), "skipped_override",
-                                               override_info_json=json.dumps(override_details_logged) if override_details_logged else None)
+                        file_log_writer.log_skip(file_hash, "skipped_override", json.dumps({"reason": "override"}),
+                                                 override_info=override_details_logged)
                     else:
                         logger.debug(f"{log_prefix}: File {file_hash} skipped due to override. NOT logging detail as per setting.")
                 else:
@@ -1314,26 +1639,30 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
         items_for_action_loop = []
         if current_rule_action_type == 'force_in' and candidate_files_for_action:
             hashes_for_meta = [item[0] for item in candidate_files_for_action]
-            fetched_meta_list, meta_errs = _fetch_metadata_for_hashes(app_config, rule_name, hashes_for_meta)
-            final_details["metadata_errors"].extend(meta_errs)
+            fetched_meta_list, meta_errs = _fetch_metadata_for_hashes(app_config, rule_name, hashes_for_meta, stop_token=rule_stop_token)
+            final_details["metadata_errors"].extend(err for err in meta_errs if not err.get("deferred"))
             meta_map = {meta['hash']: meta for meta in fetched_meta_list}
             metadata_fetched_count = len(fetched_meta_list)
+            deferred_meta_hashes = {h for err in meta_errs if err.get("deferred") for h in err["hashes_in_batch"]}
 
             for file_hash, configured_keys_for_file in candidate_files_for_action:
                 if file_hash in meta_map:
                     items_for_action_loop.append((meta_map[file_hash], configured_keys_for_file))
+                elif file_hash in deferred_meta_hashes:
+                    defer_files([file_hash])
                 else:
                     action_params_for_log_failure = {"destination_service_keys": configured_keys_for_file, "error": "metadata_fetch_failed"}
-                    log_file_action_detail(db_conn, rule_execution_id, file_hash, current_rule_action_type,
-                                           json.dumps(action_params_for_log_failure), "failure",
-                                           error_message="Metadata fetch failed pre-action")
-            if not items_for_action_loop and hashes_for_meta:
+                    file_log_writer.log(file_hash, current_rule_action_type,
+                                        json.dumps(action_params_for_log_failure), "failure",
+                                        error_message="Metadata fetch failed pre-action")
+            if not items_for_action_loop and len(hashes_for_meta) > files_deferred:
                 overall_rule_success_flag = False
                 final_summary_message_str = f"{log_prefix}: Failed. Could not fetch metadata for any 'force_in' candidates."
         else:
             items_for_action_loop = candidate_files_for_action
 
         num_files_to_attempt_action_on = len(items_for_action_loop)
+        files_deferred_before_actions = files_deferred
 
         if overall_rule_success_flag and num_files_to_attempt_action_on > 0:
             logger.info(f"{log_prefix}: Attempting '{current_rule_action_type}' for {num_files_to_attempt_action_on} entries.")
@@ -1341,15 +1670,19 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
             if current_rule_action_type == 'add_to':
                 hashes_for_add = [item[0] for item in items_for_action_loop]
                 action_params_json = json.dumps({"destination_service_keys": rule_configured_destination_keys})
-                batch_add_result = _perform_action_add_to_files_batch(app_config, hashes_for_add, rule_configured_destination_keys, rule_name)
-                final_details["action_processing_results"].append({**batch_add_result, "action_type": "add_to"})
+                batch_add_result = _perform_action_add_to_files_batch(app_config, hashes_for_add, rule_configured_destination_keys, rule_name,
+                                                                      stop_token=rule_stop_token)
+                add_deferred_set = set(batch_add_result.pop('files_deferred', []))
+                final_details["action_processing_results"].append({**batch_add_result, "action_type": "add_to", "files_deferred_count": len(add_deferred_set)})
                 total_successful_add_to_operations = batch_add_result.get('total_successful_migrations',0)
 
                 for f_hash in hashes_for_add:
                     is_successful_for_file = f_hash not in batch_add_result.get('files_with_some_errors', {})
-                    if is_successful_for_file:
+                    if f_hash in add_deferred_set:
+                        defer_files([f_hash])
+                    elif is_successful_for_file:
                         total_files_added_successfully += 1
-                        log_file_action_detail(db_conn, rule_execution_id, f_hash, "add_to", action_params_json, "success")
+                        file_log_writer.log(f_hash, "add_to", action_params_json, "success")
                         if not is_manual_run:
                             should_set_override = True
                             existing_override = get_conflict_override(db_conn, f_hash, "placement", None)
@@ -1365,7 +1698,7 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
                                                       rule_id, current_rule_importance, 'add_to')
                     else:
                         errs = batch_add_result['files_with_some_errors'][f_hash]
-                        log_file_action_detail(db_conn, rule_execution_id, f_hash, "add_to", json.dumps({"destination_service_keys": rule_configured_destination_keys, "errors": errs}), "failure", str(errs[0]['message']) if errs else "Add_to failed")
+                        file_log_writer.log(f_hash, "add_to", json.dumps({"destination_service_keys": rule_configured_destination_keys, "errors": errs}), "failure", str(errs[0]['message']) if errs else "Add_to failed")
                 if not batch_add_result.get('success', True):
                     overall_rule_success_flag = False
 
@@ -1374,24 +1707,33 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
                 mode = 0 if current_rule_action_type == 'add_tags' else 1
                 hashes_for_tag_action = [item[0] for item in items_for_action_loop]
                 action_params_json = json.dumps({"tag_service_key": tag_service_key_for_action, "tags": tags_for_action, "mode": mode})
-                tag_res = _perform_action_manage_tags(app_config, hashes_for_tag_action, tag_service_key_for_action, tags_for_action, mode, rule_name)
-                final_details["action_processing_results"].append({**tag_res, "action_type": current_rule_action_type})
-                log_status = "success" if tag_res.get("success") else "failure"
-                log_err = None if tag_res.get("success") else tag_res.get("message")
-                for f_hash in hashes_for_tag_action:
-                     log_file_action_detail(db_conn, rule_execution_id, f_hash, current_rule_action_type, action_params_json, log_status, error_message=log_err)
-                if tag_res.get("success"):
-                    total_files_tag_action_success_on = tag_res.get("files_processed_count", len(hashes_for_tag_action))
-                else: overall_rule_success_flag = False
+                if _stop_reason(rule_stop_token):
+                    # One call for all the files: it is sent whole or not at all
+                    defer_files(hashes_for_tag_action)
+                else:
+                    tag_res = _perform_action_manage_tags(app_config, hashes_for_tag_action, tag_service_key_for_action, tags_for_action, mode, rule_name)
+                    final_details["action_processing_results"].append({**tag_res, "action_type": current_rule_action_type})
+                    log_status = "success" if tag_res.get("success") else "failure"
+                    log_err = None if tag_res.get("success") else tag_res.get("message")
+                    for f_hash in hashes_for_tag_action:
+                         file_log_writer.log(f_hash, current_rule_action_type, action_params_json, log_status, error_message=log_err)
+                    if tag_res.get("success"):
+                        total_files_tag_action_success_on = tag_res.get("files_processed_count", len(hashes_for_tag_action))
+                    else: overall_rule_success_flag = False
 
             elif current_rule_action_type == 'modify_rating':
                 action_params_json = json.dumps({"rating_service_key": rating_service_key_for_action, "rating_value": rating_value_for_action})
-                for file_hash, _ in items_for_action_loop:
+                for rating_index, (file_hash, _) in enumerate(items_for_action_loop):
+                    if _stop_reason(rule_stop_token):
+                        defer_files([h for h, _ in items_for_action_loop[rating_index:]])
+                        break
                     rating_res = _perform_action_modify_rating(app_config, file_hash, rating_service_key_for_action, rating_value_for_action, rule_name)
                     final_details["action_processing_results"].append({**rating_res, "hash":file_hash, "action_type": "modify_rating"})
                     log_status = "success" if rating_res.get("success") else "failure"
                     log_err = None if rating_res.get("success") else str(rating_res.get("errors",["Rating failed"])[0].get('message', 'Unknown'))
-                    log_file_action_detail(db_conn, rule_execution_id, file_hash, "modify_rating", action_params_json, log_status, error_message=log_err)
+                    # The stored execution details keep only counts of the per-file results; the full errors go here
+                    log_params_json = action_params_json if rating_res.get("success") else json.dumps({**json.loads(action_params_json), "errors": rating_res.get("errors")})
+                    file_log_writer.log(file_hash, "modify_rating", log_params_json, log_status, error_message=log_err)
                     if rating_res.get("success"):
                         total_files_rating_modified_successfully += 1
                         if not is_manual_run:
@@ -1415,12 +1757,15 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
 
                 all_local_keys_set = {s['service_key'] for s in available_services if isinstance(s,dict) and s.get('type') == 2 and 'service_key' in s}
                 batch_force_res = _perform_action_force_in_batch(app_config, meta_list_for_force_in, rule_configured_destination_keys,
-                                                                 all_local_keys_set, rule_name, available_services)
-                final_details["action_processing_results"].append({**batch_force_res, "action_type": "force_in", "configured_dest_keys_used": rule_configured_destination_keys})
+                                                                 all_local_keys_set, rule_name, available_services, stop_token=rule_stop_token)
+                force_deferred = batch_force_res.pop("files_deferred", [])
+                final_details["action_processing_results"].append({**batch_force_res, "action_type": "force_in", "configured_dest_keys_used": rule_configured_destination_keys,
+                                                                   "files_deferred_count": len(force_deferred)})
+                defer_files(force_deferred)
 
                 for f_hash_ok in batch_force_res.get("files_fully_successful", []):
                     total_files_forced_successfully +=1
-                    log_file_action_detail(db_conn, rule_execution_id, f_hash_ok, "force_in", action_params_json_force_in, "success")
+                    file_log_writer.log(f_hash_ok, "force_in", action_params_json_force_in, "success")
                     if not is_manual_run:
                         should_set_override = True
                         existing_override = get_conflict_override(db_conn, f_hash_ok, "placement", None)
@@ -1437,11 +1782,16 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
                 for f_hash_bad, err_detail in batch_force_res.get("files_with_errors", {}).items():
                     err_msg_short = f"Phase: {err_detail.get('phase')}, Errors: {str(err_detail.get('errors'))[:100]}"
                     log_params_with_failure = {**json.loads(action_params_json_force_in), "failure_details": err_detail}
-                    log_file_action_detail(db_conn, rule_execution_id, f_hash_bad, "force_in", json.dumps(log_params_with_failure), "failure", error_message=err_msg_short)
+                    file_log_writer.log(f_hash_bad, "force_in", json.dumps(log_params_with_failure), "failure", error_message=err_msg_short)
 
                 if not batch_force_res.get('success', True):
                     overall_rule_success_flag = False
 
+        if files_deferred:
+            num_files_to_attempt_action_on -= files_deferred - files_deferred_before_actions # Deferred files were not attempted
+            rule_stop_reason = _stop_reason(rule_stop_token) # A stopped token stays stopped
+            final_details["files_deferred"] = files_deferred
+            final_details["stop_reason"] = rule_stop_reason
         final_details["override_detail_logging_enabled"] = log_overridden_actions_setting
         if not log_overridden_actions_setting and files_skipped_due_to_override > 0:
             final_details["note_on_skipped_overrides"] = f"{files_skipped_due_to_override} files were skipped due to overrides; detailed logs for these skips were not recorded due to settings."
@@ -1465,10 +1815,21 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
                  final_summary_message_str = f"{log_prefix}: Failed. {final_details.get('critical_error')}"
             else:
                 final_summary_message_str = f"{log_prefix}: Failed before actions could be attempted. Check logs for rule_execution_id {rule_execution_id}."
+        if rule_stop_reason:
+            final_summary_message_str += f" Stopped early ({STOP_REASON_MESSAGES[rule_stop_reason]}): {files_deferred} files deferred to the next run."
 
 
         logger.info(f"{log_prefix} Final Summary: {final_summary_message_str}")
 
+    except _RuleStopped as stop:
+        rule_stop_reason = stop.reason
+        files_deferred = stop.files_deferred
+        final_details["files_deferred"] = files_deferred
+        final_details["stop_reason"] = rule_stop_reason
+        deferred_str = f"{files_deferred} files deferred" if files_deferred else "Deferred"
+        final_summary_message_str = f"{log_prefix}: Stopped before acting ({STOP_REASON_MESSAGES[rule_stop_reason]}). {deferred_str} to the next run."
+        logger.info(f"{log_prefix} Final Summary: {final_summary_message_str}")
+
     except Exception as main_exc:
         overall_rule_success_flag = False
         error_message_for_summary = str(main_exc)
@@ -1482,9 +1843,16 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
         final_details["critical_error_traceback_summary"] = traceback.format_exc(limit=3)
 
     finally:
+        try:
+            file_log_writer.finalize()
+        except Exception as e_flush:
+            logger.error(f"{log_prefix}: Error flushing buffered file action logs: {e_flush}", exc_info=True)
+
         db_status_log = "unknown_final"
         succeeded_actions_final_count = total_files_added_successfully + total_files_forced_successfully + total_files_tag_action_success_on + total_files_rating_modified_successfully
-        if overall_rule_success_flag:
+        if overall_rule_success_flag and rule_stop_reason:
+            db_status_log = f"stopped_{rule_stop_reason}" # stopped_cancelled, stopped_run_time_budget, stopped_rule_time_budget
+        elif overall_rule_success_flag:
             if succeeded_actions_final_count > 0 : db_status_log = "success_actions_processed"
             elif num_files_to_attempt_action_on > 0 and succeeded_actions_final_count == 0: db_status_log = "success_actions_attempted_none_succeeded"
             elif num_candidates_after_all_filters > 0 and num_files_to_attempt_action_on == 0:
@@ -1507,18 +1875,19 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
             else: db_status_log = "failure_unknown"
 
         try:
-            details_json_db = json.dumps(final_details)
+            details_json_db = encode_execution_details(_details_for_storage(final_details, rule_execution_id))
+            rule_exec_end_time = datetime.utcnow()
             if db_conn:
-                cursor = db_conn.cursor()
-                cursor.execute('''
+                submit_log_codes(db_conn, [db_status_log])
+                submit_write(db_conn, f'''
                     UPDATE rule_executions_in_run
-                    SET end_time = ?, status = ?, matched_search_count = ?,
+                    SET end_time_ms = ?, status_code = {LOG_CODE_SQL}, matched_search_count = ?,
                         eligible_for_action_count = ?, actions_attempted_count = ?,
                         actions_succeeded_count = ?, summary_message_from_logic = ?,
                         details_json_from_logic = ?
                     WHERE rule_execution_id = ?
                 ''', (
-                    datetime.utcnow().isoformat() + "Z", db_status_log,
+                    epoch_ms(rule_exec_end_time), db_status_log,
                     num_matched_files_by_search_raw,
                     num_candidates_after_all_filters,
                     num_files_to_attempt_action_on,
@@ -1527,6 +1896,14 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
                     details_json_db,
                     rule_execution_id
                 ))
+                if active_rule_version_id: # Otherwise no execution row was logged either
+                    record_rule_execution_stats(
+                        db_conn, rule_id, active_rule_version_id, db_status_log,
+                        rule_exec_start_time, rule_exec_end_time,
+                        num_matched_files_by_search_raw, num_candidates_after_all_filters,
+                        num_files_to_attempt_action_on, succeeded_actions_final_count,
+                        files_skipped_due_to_recent_view + files_skipped_due_to_override
+                    )
             else:
                 logger.error(f"{log_prefix}: DB connection was None, cannot perform final update to rule_executions_in_run.")
 
@@ -1535,6 +1912,11 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
         except Exception as e_final_generic:
              logger.error(f"{log_prefix}: Generic error during final UPDATE to rule_executions_in_run: {e_final_generic}", exc_info=True)
 
+        # Wait for the background log writer to commit this rule's rows (including overrides)
+        # before the next rule runs and reads overrides back.
+        if not flush_log_writer():
+            logger.warning(f"{log_prefix}: Background log writer did not confirm the flush at rule end.")
+
     return {
         "success": overall_rule_success_flag,
         "message": final_summary_message_str,
@@ -1551,5 +1933,202 @@ def execute_single_rule(app_config, db_conn, rule, current_run_id, execution_ord
         "files_rating_modified_successfully": total_files_rating_modified_successfully,
         "files_skipped_due_to_override": files_skipped_due_to_override,
         "files_skipped_due_to_recent_view": files_skipped_due_to_recent_view,
+        "files_deferred": files_deferred,
+        "stop_reason": rule_stop_reason,
         "details": final_details
     }
+
+
+# --- Concurrent Execution of Independent Rules ---
+# Two rules conflict when one of them writes something the other reads or writes: a conflict override
+# domain ('placement' for add_to/force_in, the rating service for modify_rating), a tag service, or
+# the file services that search predicates look at. Rules that conflict keep the running order (an
+# edge from the earlier to the later rule); rules that don't may run at the same time. Resources are
+# (kind, key) pairs; key "*" stands for every key of that kind and RULE_RESOURCE_ANY for everything.
+RULE_RESOURCE_ANY = ("*", "*")
+FILE_SERVICE_BOOLEAN_OPERATORS = ('local', 'trashed', 'deleted')
+
+def _rule_condition_reads(condition, reads):
+    """Adds the resources a rule condition's search predicate reads to the reads set."""
+    condition_type = condition.get('type')
+    if condition_type == 'or_group':
+        for nested_condition in condition.get('conditions') or []:
+            if isinstance(nested_condition, dict):
+                _rule_condition_reads(nested_condition, reads)
+    elif condition_type == 'tags' or (condition_type == 'boolean' and condition.get('operator') == 'has_tags'):
+        reads.add(("tags", "*")) # Tag searches run against "all known tags"
+    elif condition_type == 'rating':
+        reads.add(("rating", condition.get('service_key')))
+    elif condition_type == 'file_service' or (condition_type == 'boolean' and condition.get('operator') in FILE_SERVICE_BOOLEAN_OPERATORS):
+        reads.add(("files", "*"))
+    elif condition_type in ('boolean', 'filesize', 'filetype', 'url'):
+        pass # File properties no rule action changes (inbox/archive, size, type, URLs, ...)
+    else:
+        reads.add(RULE_RESOURCE_ANY) # paste_search and unknown types can search anything
+
+def _rule_resources(rule):
+    """(reads, writes): sets of the resources a rule's search reads and its action changes."""
+    reads, writes = set(), set()
+    for condition in rule.get('conditions') or []:
+        if isinstance(condition, dict):
+            _rule_condition_reads(condition, reads)
+    action = rule.get('action') or {}
+    action_type = action.get('type')
+    if action_type in ('add_to', 'force_in'):
+        writes.add(("files", "*")) # Also the 'placement' override domain, shared by all of them
+    elif action_type in ('add_tags', 'remove_tags'):
+        writes.add(("tags", action.get('tag_service_key')))
+    elif action_type == 'modify_rating':
+        writes.add(("rating", action.get('rating_service_key'))) # Also its 'rating' override domain
+    else:
+        writes.add(RULE_RESOURCE_ANY)
+    # The action's own exclusion predicates and metadata checks read what it writes
+    reads |= writes
+    return reads, writes
+
+def _resources_overlap(resources_a, resources_b):
+    for kind_a, key_a in resources_a:
+        for kind_b, key_b in resources_b:
+            if "*" in (kind_a, kind_b) or (kind_a == kind_b and (key_a == key_b or "*" in (key_a, key_b))):
+                return True
+    return False
+
+def build_rule_conflict_graph(rules):
+    """
+    For rules in running order, returns one set per rule with the indexes of the earlier rules it
+    conflicts with, i.e. the rules that must have finished before it starts.
+    """
+    resources = [_rule_resources(rule) for rule in rules]
+    predecessors = []
+    for later_index, (later_reads, later_writes) in enumerate(resources):
+        predecessors.append({
+            earlier_index for earlier_index, (earlier_reads, earlier_writes) in enumerate(resources[:later_index])
+            if _resources_overlap(earlier_writes, later_reads) or _resources_overlap(later_writes, earlier_reads)
+        })
+    return predecessors
+
+def _not_started_result(rule, stop_reason):
+    """exec_result yielded by execute_rules_in_conflict_order for a rule the stopped run did not start."""
+    return {
+        "success": True, "not_started": True, "stop_reason": stop_reason, "files_deferred": 0,
+        "message": f"Not started ({STOP_REASON_MESSAGES[stop_reason]}). Deferred to the next run.",
+        "rule_id": rule.get('id'), "rule_name": rule.get('name', rule.get('id')),
+        "files_action_attempted_on": 0, "details": {}
+    }
+
+def _execute_rule_on_thread_connection(app_config, rule, current_run_id, execution_order_in_run, is_manual_run, stop_token=None):
+    """Runs execute_single_rule in a worker thread on that thread's own pooled connection."""
+    db_conn = get_db_connection()
+    try:
+        result = execute_single_rule(app_config, db_conn, rule, current_run_id, execution_order_in_run, is_manual_run=is_manual_run,
+                                     stop_token=stop_token)
+        db_conn.commit()
+        return result
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        db_conn.close()
+
+def execute_rules_in_conflict_order(app_config, db_conn, run_plan, current_run_id, is_manual_run=False, max_workers=1, stop_token=None,
+                                    yield_point=None):
+    """
+    Executes the (position in the run, rule) pairs of run_plan, given in running order, and yields
+    (position, rule, exec_result, rule_error, checkpoint) as each rule finishes. rule_error is the
+    exception the rule raised (exec_result is then None). checkpoint is (rules_completed, rule_id) when
+    every rule of run_plan up to this one has finished (see database.checkpoint_run_progress), else None.
+
+    With max_workers > 1, a rule starts as soon as the earlier rules it conflicts with (see
+    build_rule_conflict_graph) have finished and fewer than max_workers rules are running, on a pool of
+    threads that each use their own connection; rules are yielded in the order they finish. Ready rules
+    wait here rather than in the pool's queue, so a stopped run still reports them as not started.
+    Parallel runs need the background log writer (see log_writer.py): without it each rule writes its
+    log rows on its own connection and keeps a write transaction open across its Hydrus API calls, so
+    concurrent rules would wait on each other until "database is locked". Rules then run one at a
+    time. With max_workers 1 rules run one after another on db_conn, as before.
+
+    Once stop_token (RunStopToken) stops, no further rule starts: rules already running stop at their
+    next check, and each rule not started is yielded with _not_started_result() and no checkpoint.
+
+    yield_point (engine_worker.JobYieldPoint) lets other work in at rule boundaries: when its waiting()
+    is true, no further rule starts until the running ones have finished, then run_waiting() is called
+    and the run goes on. The waiting work is thus held up by at most max_workers rules in flight (this
+    is checked, and logged, each time the run gives way). As with a restart, no rule of the run is
+    executing (or holding uncommitted writes) at that point, so the run's override decisions are
+    unaffected by where it paused.
+    """
+    log_prefix = f"Run ID {current_run_id[:8]}"
+    if max_workers > 1 and get_active_log_writer() is None:
+        logger.info(f"{log_prefix}: The log writer is not running; executing rules one at a time (rule_execution_workers is {max_workers}).")
+        max_workers = 1
+    if max_workers <= 1 or len(run_plan) <= 1:
+        for i, (position, rule) in enumerate(run_plan):
+            if yield_point is not None and not _stop_reason(stop_token) and yield_point.waiting():
+                yield_point.run_waiting()
+            stop_reason = _stop_reason(stop_token)
+            if stop_reason:
+                logger.info(f"{log_prefix}: Stopped ({STOP_REASON_MESSAGES[stop_reason]}). {len(run_plan) - i} rule(s) not started.")
+                for position, rule in run_plan[i:]:
+                    yield position, rule, _not_started_result(rule, stop_reason), None, None
+                return
+            logger.info(f"{log_prefix}: Executing Rule {i + 1}/{len(run_plan)}: '{rule.get('name', rule.get('id', 'Unnamed'))}'")
+            try:
+                exec_result, rule_error = execute_single_rule(app_config, db_conn, rule, current_run_id, position + 1, is_manual_run=is_manual_run,
+                                                              stop_token=stop_token), None
+            except Exception as e:
+                exec_result, rule_error = None, e
+            yield position, rule, exec_result, rule_error, (position + 1, rule.get('id'))
+        return
+
+    predecessors = build_rule_conflict_graph([rule for _, rule in run_plan])
+    independent_count = sum(1 for earlier in predecessors if not earlier)
+    logger.info(f"{log_prefix}: Executing {len(run_plan)} rules with up to {max_workers} at a time ({independent_count} have no conflicting earlier rule).")
+    finished = set()
+    started = set()
+    prefix_length = 0 # run_plan[:prefix_length] have all finished
+    finished_when_waiting = None # len(finished) when the yield point was first seen waiting
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rule-exec") as executor:
+        running = {}
+        while len(finished) < len(run_plan):
+            stop_reason = _stop_reason(stop_token)
+            if stop_reason and not running:
+                not_started = [plan_index for plan_index in range(len(run_plan)) if plan_index not in started]
+                logger.info(f"{log_prefix}: Stopped ({STOP_REASON_MESSAGES[stop_reason]}). {len(not_started)} rule(s) not started.")
+                for plan_index in not_started:
+                    position, rule = run_plan[plan_index]
+                    yield position, rule, _not_started_result(rule, stop_reason), None, None
+                return
+            yielding = not stop_reason and yield_point is not None and len(started) < len(run_plan) and yield_point.waiting()
+            if yielding and finished_when_waiting is None:
+                finished_when_waiting = len(finished)
+            if yielding and not running:
+                rules_waited_for = len(finished) - finished_when_waiting
+                finished_when_waiting = None
+                if rules_waited_for > max_workers:
+                    logger.warning(f"{log_prefix}: Waiting work was held up by {rules_waited_for} rules, more than the {max_workers} that can be in flight.")
+                if yield_point.run_waiting():
+                    logger.info(f"{log_prefix}: Gave way after {rules_waited_for} rule(s) in flight finished.")
+                    continue # Look at the stop token and the queue again
+                yielding = False
+            for plan_index, (position, rule) in enumerate(run_plan):
+                if stop_reason or yielding or len(running) >= max_workers:
+                    break # The ready rules left start on a later pass, once a running rule has finished
+                if plan_index not in started and predecessors[plan_index] <= finished:
+                    started.add(plan_index)
+                    logger.info(f"{log_prefix}: Starting Rule {plan_index + 1}/{len(run_plan)}: '{rule.get('name', rule.get('id', 'Unnamed'))}' ({len(running) + 1} running)")
+                    running[executor.submit(_execute_rule_on_thread_connection, app_config, rule,
+                                            current_run_id, position + 1, is_manual_run, stop_token)] = plan_index
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                plan_index = running.pop(future)
+                finished.add(plan_index)
+                position, rule = run_plan[plan_index]
+                try:
+                    exec_result, rule_error = future.result(), None
+                except Exception as e:
+                    exec_result, rule_error = None, e
+                checkpoint = None
+                while prefix_length < len(run_plan) and prefix_length in finished:
+                    prefix_length += 1
+                    checkpoint = (run_plan[prefix_length - 1][0] + 1, run_plan[prefix_length - 1][1].get('id'))
+                yield position, rule, exec_result, rule_error, checkpoint
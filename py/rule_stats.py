@@ -0,0 +1,97 @@
+import logging
+
+from log_writer import submit_write
+
+logger = logging.getLogger(__name__)
+
+# --- Hourly Rule Statistics ---
+# rule_stats_hourly holds one row per (UTC hour, rule, rule version, final status) with execution
+# counts, file counts and durations. Each rule execution adds itself to its row when it ends (through
+# the log writer, in the same transaction stream as the rule_executions_in_run update), so the stats
+# endpoints only read the bucketed rows of the requested range instead of aggregating raw executions.
+# The table is never expired by log retention. Hours are 'YYYY-MM-DDTHH', taken from the execution's
+# start time, so time ranges are hour-granular.
+
+SUCCESS_STATUS_FILTER = "(status LIKE 'success%' OR status LIKE 'completed%')"
+
+RULE_STATS_HOURLY_UPSERT_SQL = '''
+    INSERT INTO rule_stats_hourly (
+        hour, rule_id, rule_version_id, status, execution_count, files_matched, files_eligible,
+        files_attempted, files_succeeded, files_skipped, total_duration_ms, max_duration_ms
+    ) VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (hour, rule_id, rule_version_id, status) DO UPDATE SET
+        execution_count = execution_count + 1,
+        files_matched = files_matched + excluded.files_matched,
+        files_eligible = files_eligible + excluded.files_eligible,
+        files_attempted = files_attempted + excluded.files_attempted,
+        files_succeeded = files_succeeded + excluded.files_succeeded,
+        files_skipped = files_skipped + excluded.files_skipped,
+        total_duration_ms = total_duration_ms + excluded.total_duration_ms,
+        max_duration_ms = MAX(max_duration_ms, excluded.max_duration_ms)
+'''
+
+def _hour_bucket(iso_timestamp):
+    """'2024-05-01T13:45:00Z' -> '2024-05-01T13'."""
+    return iso_timestamp[:13]
+
+def record_rule_execution_stats(db_conn, rule_id, rule_version_id, status, start_dt, end_dt,
+                                files_matched, files_eligible, files_attempted, files_succeeded, files_skipped):
+    """Adds one finished rule execution to its hourly bucket. Queued on the log writer like the other execution logs."""
+    duration_ms = max(0, int((end_dt - start_dt).total_seconds() * 1000))
+    submit_write(db_conn, RULE_STATS_HOURLY_UPSERT_SQL, (
+        _hour_bucket(start_dt.isoformat()), rule_id, rule_version_id, status,
+        files_matched or 0, files_eligible or 0, files_attempted or 0, files_succeeded or 0, files_skipped or 0,
+        duration_ms, duration_ms
+    ))
+
+def _range_filter(start_iso, end_iso, all_time):
+    if all_time:
+        return "", []
+    return "AND s.hour >= ? AND s.hour <= ? ", [_hour_bucket(start_iso), _hour_bucket(end_iso)]
+
+def get_files_processed_per_rule(db_conn, start_iso, end_iso, all_time=False):
+    """
+    Successful file actions per rule for the time range, from rule_stats_hourly.
+    Returns rows with rule_id, rule_name_at_version, total_files_successfully_actioned.
+    """
+    range_sql, params = _range_filter(start_iso, end_iso, all_time)
+    query = f"""
+        SELECT s.rule_id, rv.rule_name_at_version, SUM(s.files_succeeded) AS total_files_successfully_actioned
+        FROM rule_stats_hourly s
+        JOIN rule_versions rv ON s.rule_version_id = rv.rule_version_id
+        WHERE {SUCCESS_STATUS_FILTER.replace('status', 's.status')} {range_sql}
+        GROUP BY s.rule_id, rv.rule_name_at_version
+        HAVING total_files_successfully_actioned > 0
+        ORDER BY total_files_successfully_actioned DESC
+    """
+    return db_conn.execute(query, tuple(params)).fetchall()
+
+def get_rule_stats_timeseries(db_conn, start_iso, end_iso, all_time=False, rule_id=None):
+    """
+    Per-day, per-rule totals for charts. Days are UTC 'YYYY-MM-DD'. rule_name is the name of the
+    rule's newest version. Rows are ordered by day, then rule_id.
+    """
+    range_sql, params = _range_filter(start_iso, end_iso, all_time)
+    if rule_id:
+        range_sql += "AND s.rule_id = ? "
+        params.append(rule_id)
+    query = f"""
+        SELECT substr(s.hour, 1, 10) AS day, s.rule_id,
+               (SELECT rv.rule_name_at_version FROM rule_versions rv WHERE rv.rule_id = s.rule_id
+                ORDER BY rv.version_timestamp DESC LIMIT 1) AS rule_name,
+               SUM(s.execution_count) AS executions,
+               SUM(CASE WHEN {SUCCESS_STATUS_FILTER.replace('status', 's.status')} THEN s.execution_count ELSE 0 END) AS successful_executions,
+               SUM(CASE WHEN {SUCCESS_STATUS_FILTER.replace('status', 's.status')} THEN 0 ELSE s.execution_count END) AS failed_executions,
+               SUM(s.files_matched) AS files_matched,
+               SUM(s.files_attempted) AS files_attempted,
+               SUM(s.files_succeeded) AS files_succeeded,
+               SUM(s.files_attempted - s.files_succeeded) AS files_failed,
+               SUM(s.files_skipped) AS files_skipped,
+               SUM(s.total_duration_ms) AS total_duration_ms,
+               MAX(s.max_duration_ms) AS max_duration_ms
+        FROM rule_stats_hourly s
+        WHERE 1 = 1 {range_sql}
+        GROUP BY day, s.rule_id
+        ORDER BY day, s.rule_id
+    """
+    return db_conn.execute(query, tuple(params)).fetchall()
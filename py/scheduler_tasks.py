@@ -1,46 +1,295 @@
 import logging
-from datetime import datetime, timedelta
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 import uuid # For run_id
 
+from apscheduler.events import EVENT_SCHEDULER_SHUTDOWN, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+from apscheduler.triggers.cron import CronTrigger
 from flask_apscheduler import APScheduler
 
 logger = logging.getLogger(__name__)
 scheduler = APScheduler()
 
+RULES_JOB_ID = 'run_all_rules_job'
+
+# Optional fields of a rule in rules.json giving it its own schedule: 'interval_seconds' (run at most
+# every N seconds) or 'cron' (a 5-field crontab expression in local time, e.g. "0 3 * * *"). Rules
+# without either run on every tick of the rules job. A schedule can't make a rule run more often than
+# the job ticks ('rule_interval_seconds').
+RULE_SCHEDULE_FIELDS = ('interval_seconds', 'cron')
+# Ticks don't start at exactly the same offset every time; an interval counts as elapsed this much early
+RULE_SCHEDULE_GRACE_SECONDS = 5
+
+# In-process state of the rules job, reported by get_rules_job_status(). 'current_interval_seconds'
+# is the delay used for the next run; in adaptive mode it moves between 'rule_interval_seconds' and
+# 'rule_interval_max_seconds' (see _next_adaptive_interval).
+_rules_job_state = {
+    "skipped_ticks": 0,
+    "last_skipped_at": None,
+    "last_skip_reason": None,
+    "runs_completed": 0,
+    "last_run_started_at": None,
+    "last_run_duration_seconds": None,
+    "last_run_files_acted_on": None,
+    "current_interval_seconds": None,
+}
+_rules_job_state_lock = threading.Lock()
+
+
+def _record_skipped_tick(reason):
+    with _rules_job_state_lock:
+        _rules_job_state["skipped_ticks"] += 1
+        _rules_job_state["last_skipped_at"] = datetime.utcnow().isoformat() + "Z"
+        _rules_job_state["last_skip_reason"] = reason
+        skipped_total = _rules_job_state["skipped_ticks"]
+    logger.warning(f"Scheduler: Rules job tick skipped ({reason}). {skipped_total} tick(s) skipped since startup.")
+
+
+def _next_adaptive_interval(settings, previous_interval, run_duration_seconds, files_acted_on):
+    """
+    Delay before the next run in adaptive mode. A run that acted on files halves the delay (down to
+    'rule_interval_seconds'); a run that found nothing to do doubles it (up to 'rule_interval_max_seconds').
+    A run that failed before processing rules (files_acted_on None) keeps the delay. The delay is never
+    shorter than the last run took, so runs never take more than about half of the time.
+    """
+    floor = max(1, settings.get('rule_interval_seconds', 0))
+    ceiling = max(floor, settings.get('rule_interval_max_seconds', 0))
+    interval = previous_interval or floor
+    if files_acted_on is None:
+        pass
+    elif files_acted_on > 0:
+        interval = interval / 2
+    else:
+        interval = interval * 2
+    interval = max(interval, floor, run_duration_seconds)
+    return int(min(interval, ceiling))
+
+
+def get_rules_job_status():
+    """
+    Snapshot of the rules job state (skipped ticks, last run, current interval, next run time) and of
+    the engine worker (queued and running jobs, heartbeat).
+    """
+    from database import get_db_read_connection
+    from engine_worker import get_engine_status, RUN_ALL_JOB_TYPES
+    with _rules_job_state_lock:
+        status = dict(_rules_job_state)
+    db_conn = get_db_read_connection()
+    try:
+        status["engine"] = get_engine_status(db_conn)
+    except (sqlite3.Error, ValueError) as e:
+        logger.error(f"Error reading the engine worker status: {e}")
+        status["engine"] = None
+    finally:
+        db_conn.close()
+    status["run_in_progress"] = bool(status["engine"]) and any(
+        job['status'] == 'running' and job['job_type'] in RUN_ALL_JOB_TYPES for job in status["engine"]["pending_jobs"])
+    job = scheduler.get_job(RULES_JOB_ID)
+    next_run_time = getattr(job, 'next_run_time', None) if job else None
+    status["next_run_time"] = next_run_time.isoformat() if next_run_time else None
+    return status
+
+
+def validate_rule_schedule(rule):
+    """Error message for an invalid 'interval_seconds'/'cron' schedule of a rule, or None if it is valid."""
+    interval_seconds = rule.get('interval_seconds')
+    cron = rule.get('cron')
+    if interval_seconds is not None and cron is not None:
+        return "A rule can have 'interval_seconds' or 'cron', not both."
+    if interval_seconds is not None and (isinstance(interval_seconds, bool) or not isinstance(interval_seconds, int) or interval_seconds <= 0):
+        return "'interval_seconds' must be a positive whole number of seconds."
+    if cron is not None:
+        if not isinstance(cron, str):
+            return "'cron' must be a crontab expression string."
+        try:
+            CronTrigger.from_crontab(cron)
+        except ValueError as e:
+            return f"Invalid 'cron' expression '{cron}': {e}"
+    return None
+
+
+def is_rule_due(rule, last_run_time_ms, now):
+    """
+    True if the scheduled job should run the rule at now (naive UTC). Rules without a schedule, rules
+    never run by the scheduler and rules with an invalid schedule are always due.
+    """
+    if rule.get('interval_seconds') is None and rule.get('cron') is None:
+        return True
+    if last_run_time_ms is None:
+        return True
+    schedule_error = validate_rule_schedule(rule)
+    if schedule_error:
+        logger.warning(f"Scheduler: Rule '{rule.get('name', rule.get('id'))}' has an invalid schedule ({schedule_error}). Running it on every tick.")
+        return True
+    last_run_time = datetime(1970, 1, 1) + timedelta(milliseconds=last_run_time_ms)
+    if rule.get('interval_seconds') is not None:
+        return (now - last_run_time).total_seconds() >= rule['interval_seconds'] - RULE_SCHEDULE_GRACE_SECONDS
+    # Due once a fire time of the cron expression has passed since the last run
+    next_fire_time = CronTrigger.from_crontab(rule['cron']).get_next_fire_time(None, last_run_time.replace(tzinfo=timezone.utc))
+    return next_fire_time is not None and next_fire_time <= now.replace(tzinfo=timezone.utc)
+
+
+def _on_rules_job_not_run(event):
+    """APScheduler listener: counts rules job ticks that APScheduler itself dropped."""
+    if event.job_id != RULES_JOB_ID:
+        return
+    if event.code == EVENT_JOB_MAX_INSTANCES:
+        _record_skipped_tick("the previous scheduled run was still running")
+    else:
+        _record_skipped_tick("the tick was missed by more than the misfire grace time")
+
+
 def run_all_rules_scheduled_job(app):
     """
-    Scheduled job function. Iterates through rules and executes them.
-    Manages DB connection and overall run logging.
+    Scheduled job function. Queues a 'scheduled_all' job for the engine worker (see engine_worker.py)
+    and waits for it, unless a run of all rules is already queued or running, in which case the tick
+    is counted as skipped. In adaptive mode it then schedules its own next run, also when the tick
+    failed (the error is raised to APScheduler after that): otherwise scheduled runs would end until
+    the next restart.
     Requires the Flask 'app' instance to create an app context.
     """
+    from database import get_db_connection, enqueue_engine_job
+    from engine_worker import wait_for_engine_job, RUN_ALL_JOB_TYPES
+    settings = app.config.get('HYDRUS_SETTINGS', {})
+    run_started = time.monotonic()
+    files_acted_on = None
+    run_duration_seconds = 0
+    try:
+        db_conn = get_db_connection()
+        try:
+            job_id = enqueue_engine_job(db_conn, 'scheduled_all', unless_pending_types=RUN_ALL_JOB_TYPES)
+        finally:
+            db_conn.close()
+        if job_id:
+            with _rules_job_state_lock:
+                _rules_job_state["last_run_started_at"] = datetime.utcnow().isoformat() + "Z"
+            # Waits on this scheduler thread (max_instances=1), never on a request thread
+            job = wait_for_engine_job(job_id)
+            if job and job['status'] in ('completed', 'cancelled'):
+                files_acted_on = (job.get('result') or {}).get('files_acted_on')
+            elif job and job['status'] in ('queued', 'running'): # The worker stopped responding (see wait_for_engine_job)
+                logger.warning(f"Scheduler: Gave up waiting for scheduled run job {job_id[:8]} (still {job['status']}).")
+            else:
+                logger.warning(f"Scheduler: Scheduled run job {job_id[:8]} ended with status '{job['status'] if job else 'unknown'}'.")
+            run_duration_seconds = time.monotonic() - run_started
+            with _rules_job_state_lock:
+                _rules_job_state["runs_completed"] += 1
+                _rules_job_state["last_run_duration_seconds"] = round(run_duration_seconds, 3)
+                _rules_job_state["last_run_files_acted_on"] = files_acted_on
+        elif job_id is False:
+            _record_skipped_tick("another run of all rules was queued or in progress")
+        else:
+            _record_skipped_tick("the run could not be queued because of a database error")
+    finally:
+        interval_seconds = settings.get('rule_interval_seconds', 0)
+        if settings.get('rule_interval_adaptive') and isinstance(interval_seconds, (int, float)) and interval_seconds > 0:
+            with _rules_job_state_lock:
+                next_interval = _next_adaptive_interval(settings, _rules_job_state["current_interval_seconds"], run_duration_seconds, files_acted_on)
+                _rules_job_state["current_interval_seconds"] = next_interval
+            next_run_time = datetime.now() + timedelta(seconds=next_interval)
+            logger.info(f"Scheduler: Adaptive interval is now {next_interval}s (last run: {run_duration_seconds:.1f}s, "
+                        f"files acted on: {files_acted_on}). Next run at {next_run_time.strftime('%Y-%m-%d %H:%M:%S')}.")
+            _add_rules_job(app, trigger='date', run_date=next_run_time)
+
+
+def _run_all_rules(app, stop_token=None, yield_point=None):
+    """
+    Iterates through rules and executes them. Manages DB connection and overall run logging.
+    Runs in the engine worker, for a 'scheduled_all' job queued by run_all_rules_scheduled_job.
+    stop_token (rule_processing.RunStopToken) stops the run early; what it did not get to is left
+    to the next scheduled run. yield_point (engine_worker.JobYieldPoint) lets manual jobs run between
+    two of its rules.
+    Returns the number of files actions were attempted on, or None if no rules were processed.
+    """
+    files_acted_on = None
     with app.app_context(): # Essential for accessing app.config, extensions, etc.
         # Now we can safely import and use app-dependent modules/functions
-        from rule_processing import execute_single_rule, _ensure_available_services
-        from database import get_db_connection
+        from rule_processing import execute_rules_in_conflict_order, _ensure_available_services, STOP_REASON_MESSAGES
+        from database import (
+            get_db_connection, claim_interrupted_run, start_run_progress,
+            checkpoint_run_progress, finish_run_progress, list_unfinished_runs,
+            get_rule_last_run_times, record_rule_last_run, epoch_ms
+        )
+        from log_writer import submit_write, flush_log_writer
         from app_config import load_rules as app_config_load_rules # Renamed to avoid conflict
+        from library_probe import select_rules_to_run, save_probe_result, record_probe_skip, rule_inputs_hash
 
         current_run_start_time = datetime.utcnow()
         current_run_id = str(uuid.uuid4())
         run_type = "scheduled_all"
 
-        logger.info(f"\n--- Scheduler: Starting Run ID {current_run_id[:8]} ({run_type}) at {current_run_start_time.strftime('%Y-%m-%d %H:%M:%S UTC')} ---")
-
         db_conn = None
         overall_run_status = "started"
         run_summary_message = f"Scheduled run ({current_run_id[:8]}) started."
         any_rule_had_processing_error = False
+        resumed_progress = None # run_progress row when this job finishes a run interrupted by a restart
+
+        # Rules with their own schedule (RULE_SCHEDULE_FIELDS) only run when due. A tick on which no
+        # rule is due and no interrupted run is waiting is not logged as a run.
+        # Due rules are then probed (see library_probe.py): those that can't have new work since their
+        # last run are skipped, and a tick on which that leaves nothing is only counted.
+        rules = app_config_load_rules() # From app_config.py, in running order
+        probe_signature, probe_skipped_rules = None, []
+        schedule_conn = get_db_connection()
+        try:
+            last_run_times = get_rule_last_run_times(schedule_conn)
+            has_interrupted_run = any(progress['status'] == 'interrupted' for progress in list_unfinished_runs(schedule_conn))
+            due_rules = [rule for rule in rules if is_rule_due(rule, last_run_times.get(rule.get('id')), current_run_start_time)]
+            if rules and not due_rules and not has_interrupted_run:
+                logger.info(f"Scheduler: None of the {len(rules)} rules is due at {current_run_start_time.strftime('%Y-%m-%d %H:%M:%S UTC')}. Nothing to run on this tick.")
+                return None
+            if not has_interrupted_run:
+                due_rules, probe_skipped_rules, probe_signature = select_rules_to_run(app.config, schedule_conn, due_rules, current_run_start_time)
+                if probe_skipped_rules and not due_rules:
+                    skipped_ticks = record_probe_skip(schedule_conn, current_run_start_time)
+                    logger.info(f"Scheduler: Library unchanged since the last run; all {len(probe_skipped_rules)} due rules skipped ({skipped_ticks} such tick(s) in total).")
+                    return 0
+        finally:
+            schedule_conn.close()
 
         try:
             db_conn = get_db_connection() # From database.py
-            cursor = db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO execution_runs (run_id, run_type, start_time, status, summary_message)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (current_run_id, run_type, current_run_start_time.isoformat() + "Z", overall_run_status, run_summary_message))
+            # A run that the previous process did not finish (see mark_interrupted_runs) is finished first,
+            # under its own run_id and starting after its last checkpointed rule, instead of a new run.
+            resumed_progress = claim_interrupted_run(db_conn)
+            if resumed_progress:
+                current_run_id = resumed_progress['run_id']
+                run_type = resumed_progress['run_type']
+                run_summary_message = (f"Run ({current_run_id[:8]}) resumed after an interruption "
+                                       f"({resumed_progress['rules_completed']}/{len(resumed_progress['rule_ids'])} rules were done).")
+                logger.info(f"\n--- Scheduler: Resuming interrupted Run ID {current_run_id[:8]} ({run_type}) at {current_run_start_time.strftime('%Y-%m-%d %H:%M:%S UTC')} ---")
+                submit_write(db_conn, '''
+                    UPDATE execution_runs SET end_time = NULL, status = ?, summary_message = ? WHERE run_id = ?
+                ''', (overall_run_status, run_summary_message, current_run_id))
+            else:
+                logger.info(f"\n--- Scheduler: Starting Run ID {current_run_id[:8]} ({run_type}) at {current_run_start_time.strftime('%Y-%m-%d %H:%M:%S UTC')} ---")
+                # Run bookkeeping goes through the background log writer when it is running
+                submit_write(db_conn, '''
+                    INSERT INTO execution_runs (run_id, run_type, start_time, status, summary_message)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (current_run_id, run_type, current_run_start_time.isoformat() + "Z", overall_run_status, run_summary_message))
             db_conn.commit()
             logger.info(f"Scheduler (Run ID {current_run_id[:8]}): Logged start to execution_runs table.")
 
-            rules = app_config_load_rules() # From app_config.py
+            # (position in the run, rule) pairs. Positions index the run's rule id list in run_progress
+            # and give execution_order_in_run, so a resumed run continues the numbering of its first part.
+            if resumed_progress:
+                rules_by_id = {rule.get('id'): rule for rule in rules}
+                run_plan = [(position, rules_by_id[rule_id])
+                            for position, rule_id in enumerate(resumed_progress['rule_ids'])
+                            if position >= resumed_progress['rules_completed'] and rule_id in rules_by_id]
+                skipped_count = len(resumed_progress['rule_ids']) - resumed_progress['rules_completed'] - len(run_plan)
+                if skipped_count:
+                    logger.info(f"Scheduler (Run ID {current_run_id[:8]}): {skipped_count} remaining rule(s) of the interrupted run no longer exist and are skipped.")
+                rules = [rule for _, rule in run_plan]
+            else:
+                if len(due_rules) < len(rules):
+                    logger.info(f"Scheduler (Run ID {current_run_id[:8]}): {len(due_rules)} of {len(rules)} rules are due"
+                                f"{f' and have possible new work ({len(probe_skipped_rules)} skipped by the library change probe)' if probe_skipped_rules else ''}.")
+                rules = due_rules
+                run_plan = list(enumerate(rules))
             current_settings = app.config['HYDRUS_SETTINGS'] # Access Flask app's config
 
             if not current_settings.get('api_address') or not current_settings.get('api_key'):
@@ -65,30 +314,58 @@ def run_all_rules_scheduled_job(app):
                     logger.info(f"Scheduler (Run ID {current_run_id[:8]}): {len(available_services)} services available. Processing {len(rules)} rules.")
                     total_rules_processed = 0
                     total_rules_with_errors_or_failures = 0
+                    rules_not_started = 0
+                    rules_stopped_early = 0
+                    files_acted_on = 0
+                    if not resumed_progress:
+                        start_run_progress(db_conn, current_run_id, run_type, [rule.get('id') for rule in rules])
 
-                    for i, rule in enumerate(rules):
+                    # Rules that don't conflict run concurrently (see execute_rules_in_conflict_order)
+                    for position, rule, exec_result, e_rule_proc, checkpoint in execute_rules_in_conflict_order(
+                        app.config, db_conn, run_plan, current_run_id, is_manual_run=False,
+                        max_workers=current_settings.get('rule_execution_workers', 1), stop_token=stop_token,
+                        yield_point=yield_point
+                    ):
+                        if e_rule_proc is None and exec_result.get('not_started'):
+                            # Keeps its last run: still due, and not skipped by the library change probe
+                            rules_not_started += 1
+                            continue
                         total_rules_processed += 1
                         rule_name_log = rule.get('name', rule.get('id', 'Unnamed'))
-                        logger.info(f"\nScheduler (Run ID {current_run_id[:8]}): Executing Rule {i+1}/{len(rules)}: '{rule_name_log}'")
-                        try:
-                            # Pass app.config to execute_single_rule
-                            exec_result = execute_single_rule(
-                                app.config, db_conn, rule,
-                                current_run_id, i + 1, is_manual_run=False
-                            )
+                        if e_rule_proc is None:
+                            files_acted_on += exec_result.get('files_action_attempted_on') or 0
                             if not exec_result.get('success', True):
                                 total_rules_with_errors_or_failures += 1
                                 logger.warning(f"Scheduler (Run ID {current_run_id[:8]}): Rule '{rule_name_log}' reported issues. Summary: {exec_result.get('message', 'N/A')}")
                             else:
                                 logger.info(f"Scheduler (Run ID {current_run_id[:8]}): Rule '{rule_name_log}' completed. Summary: {exec_result.get('message', 'OK')}")
-                        except Exception as e_rule_proc:
+                            if exec_result.get('stop_reason'):
+                                rules_stopped_early += 1
+                        else:
                             any_rule_had_processing_error = True
                             total_rules_with_errors_or_failures +=1
                             err_msg_crit = f"Scheduler (Run ID {current_run_id[:8]}): CRITICAL error processing rule '{rule_name_log}': {e_rule_proc}"
-                            logger.error(err_msg_crit, exc_info=True)
+                            logger.error(err_msg_crit, exc_info=e_rule_proc)
+                        # The rule's writes are committed (it flushes the log writer when it ends). Once every
+                        # rule up to it has finished too, a restart from here on resumes with the next rule.
+                        db_conn.commit()
+                        if checkpoint:
+                            checkpoint_run_progress(db_conn, current_run_id, *checkpoint)
+                        # The run's start time, not the rule's, so the rule's next due time doesn't drift by
+                        # the time rules before it took. An execution that left work behind is not skipped
+                        # by the library change probe next time.
+                        left_work_behind = (e_rule_proc is not None or not exec_result.get('success', True)
+                                            or bool(exec_result.get('files_skipped_due_to_recent_view'))
+                                            or bool(exec_result.get('stop_reason')))
+                        record_rule_last_run(db_conn, rule.get('id'), epoch_ms(current_run_start_time),
+                                             inputs_hash=rule_inputs_hash(rule), needs_rerun=left_work_behind)
                     
                     # Determine overall status after processing rules
-                    if any_rule_had_processing_error:
+                    run_stop_reason = stop_token.stop_reason() if stop_token is not None and (rules_not_started or rules_stopped_early) else None
+                    if run_stop_reason: # stopped_cancelled or stopped_run_time_budget (a rule's budget only stops that rule)
+                        overall_run_status = f"stopped_{run_stop_reason}"
+                        run_summary_message = f"Scheduled run ({current_run_id[:8]}) stopped early. Processed {total_rules_processed} rules, {total_rules_with_errors_or_failures} had issues."
+                    elif any_rule_had_processing_error:
                         overall_run_status = "completed_with_critical_rule_errors"
                         run_summary_message = f"Scheduled run ({current_run_id[:8]}) completed with critical rule errors."
                     elif total_rules_with_errors_or_failures > 0:
@@ -97,6 +374,20 @@ def run_all_rules_scheduled_job(app):
                     else:
                         overall_run_status = "completed_ok"
                         run_summary_message = f"Scheduled run ({current_run_id[:8]}) completed successfully. Processed {total_rules_processed} rules."
+                    if resumed_progress:
+                        run_summary_message += (f" Resumed after an interruption (resume #{resumed_progress['resume_count']}); "
+                                                f"the first {resumed_progress['rules_completed']} rule(s) ran before it.")
+                    if probe_skipped_rules:
+                        run_summary_message += f" {len(probe_skipped_rules)} due rule(s) skipped: library unchanged for them."
+                    if rules_not_started or rules_stopped_early:
+                        run_summary_message += (f" {rules_stopped_early} rule(s) stopped midway and {rules_not_started} not started"
+                                                f"{f' ({STOP_REASON_MESSAGES[run_stop_reason]})' if run_stop_reason else ''}; "
+                                                f"their remaining work is left to the next run.")
+                    # A rule that did not start has not seen the library as probed now, so the signature
+                    # is not stored: the next tick runs every due rule.
+                    if probe_signature is not None and not rules_not_started:
+                        save_probe_result(db_conn, probe_signature, current_run_start_time,
+                                          full_run=not probe_skipped_rules, files_acted_on=files_acted_on)
             
             if db_conn: # Commit all changes if db_conn was established
                 db_conn.commit()
@@ -116,13 +407,15 @@ def run_all_rules_scheduled_job(app):
             current_run_end_time = datetime.utcnow()
             if db_conn: # db_conn might be None if initial get_db_connection failed
                 try:
-                    cursor = db_conn.cursor() # Re-ensure cursor
-                    cursor.execute('''
+                    submit_write(db_conn, '''
                         UPDATE execution_runs SET end_time = ?, status = ?, summary_message = ?
                         WHERE run_id = ?
                     ''', (current_run_end_time.isoformat() + "Z", overall_run_status, run_summary_message, current_run_id))
                     db_conn.commit()
+                    flush_log_writer()
                     logger.info(f"Scheduler (Run ID {current_run_id[:8]}): Final status '{overall_run_status}' updated.")
+                    # The run ended here (even if it failed), so there is nothing to resume
+                    finish_run_progress(db_conn, current_run_id)
                 except sqlite3.Error as e_final:
                     logger.error(f"Scheduler (Run ID {current_run_id[:8]}): CRITICAL - Failed to update final run status: {e_final}")
                 finally:
@@ -130,6 +423,21 @@ def run_all_rules_scheduled_job(app):
                     logger.info(f"Scheduler (Run ID {current_run_id[:8]}): Database connection closed.")
             
             logger.info(f"--- Scheduler: Finished Run ID {current_run_id[:8]} ({run_type}) at {current_run_end_time.strftime('%Y-%m-%d %H:%M:%S UTC')} ---")
+    return files_acted_on
+
+
+def _add_rules_job(app, **trigger_args):
+    """(Re)adds the rules job. One instance at a time; ticks missed meanwhile collapse into one run."""
+    scheduler.add_job(
+        id=RULES_JOB_ID,
+        func=run_all_rules_scheduled_job,
+        args=[app], # Pass the Flask app instance
+        replace_existing=True,
+        misfire_grace_time=60,
+        max_instances=1,
+        coalesce=True,
+        **trigger_args
+    )
 
 
 def schedule_rules_job(app):
@@ -140,7 +448,7 @@ def schedule_rules_job(app):
     # Access HYDRUS_SETTINGS from the passed app's config
     settings = app.config.get('HYDRUS_SETTINGS', {})
     interval_seconds = settings.get('rule_interval_seconds', 0)
-    job_id = 'run_all_rules_job'
+    job_id = RULES_JOB_ID
     initial_delay_seconds = 20
 
     # Use the scheduler instance from this module
@@ -149,20 +457,285 @@ def schedule_rules_job(app):
         logger.info(f"Scheduler: Removing existing job '{job_id}'.")
         scheduler.remove_job(job_id)
 
-    if isinstance(interval_seconds, (int, float)) and interval_seconds > 0:
+    with _rules_job_state_lock:
+        _rules_job_state["current_interval_seconds"] = int(interval_seconds) if isinstance(interval_seconds, (int, float)) and interval_seconds > 0 else None
+
+    if isinstance(interval_seconds, (int, float)) and interval_seconds > 0 and settings.get('rule_interval_adaptive'):
+        # Adaptive mode: a one-off job that schedules the next one when its run ends
+        first_run_time = datetime.now() + timedelta(seconds=initial_delay_seconds)
+        logger.info(f"Scheduler: Scheduling job '{job_id}' to run first at {first_run_time.strftime('%Y-%m-%d %H:%M:%S')}, then adaptively every "
+                    f"{interval_seconds} to {max(interval_seconds, settings.get('rule_interval_max_seconds', 0))} seconds.")
+        # The first run resumes an interrupted run if there is one (see _run_all_rules)
+        _add_rules_job(app, trigger='date', run_date=first_run_time)
+    elif isinstance(interval_seconds, (int, float)) and interval_seconds > 0:
         first_run_time = datetime.now() + timedelta(seconds=initial_delay_seconds)
         logger.info(f"Scheduler: Scheduling job '{job_id}' to run first at {first_run_time.strftime('%Y-%m-%d %H:%M:%S')} and then every {interval_seconds} seconds.")
-        
-        # Pass the app instance to the job function
+        # The first run resumes an interrupted run if there is one (see _run_all_rules)
+        _add_rules_job(app, trigger='interval', seconds=int(interval_seconds), next_run_time=first_run_time)
+    elif _has_interrupted_runs():
+        # No periodic runs, but a run interrupted by the last shutdown is still finished once
+        first_run_time = datetime.now() + timedelta(seconds=initial_delay_seconds)
+        logger.info(f"Scheduler: Rule interval is {interval_seconds} seconds. Scheduling job '{job_id}' once at {first_run_time.strftime('%Y-%m-%d %H:%M:%S')} to resume an interrupted run.")
+        _add_rules_job(app, trigger='date', run_date=first_run_time)
+    else:
+        logger.info(f"Scheduler: Rule interval is {interval_seconds} seconds. Scheduled job will not be added.")
+
+
+def _has_interrupted_runs():
+    """True if run_progress holds a run interrupted by an earlier shutdown (see mark_interrupted_runs)."""
+    from database import get_db_connection, list_unfinished_runs
+    db_conn = get_db_connection()
+    try:
+        return any(progress['status'] == 'interrupted' for progress in list_unfinished_runs(db_conn))
+    finally:
+        db_conn.close()
+
+
+def _queue_maintenance_job(job_type):
+    """Queues a maintenance job for the engine worker unless one of the same type is already queued or running."""
+    from database import get_db_connection, enqueue_engine_job
+    db_conn = get_db_connection()
+    try:
+        job_id = enqueue_engine_job(db_conn, job_type, unless_pending_types=(job_type,))
+    finally:
+        db_conn.close()
+    if job_id:
+        logger.info(f"Scheduler: Queued {job_type} job {job_id[:8]} for the engine worker.")
+    elif job_id is False:
+        logger.info(f"Scheduler: {job_type} job not queued: the previous one is still queued or running.")
+    else:
+        logger.error(f"Scheduler: {job_type} job could not be queued because of a database error.")
+
+
+def run_override_gc_job(app):
+    """
+    Scheduled maintenance job: queues a 'maintenance_override_gc' job, which the engine worker runs
+    with _run_override_gc (see engine_worker.py). Doesn't wait for it.
+    """
+    _queue_maintenance_job('maintenance_override_gc')
+
+
+def _run_override_gc(app):
+    """
+    Garbage-collects conflict overrides for deleted files, stale rules and (optionally) expired
+    entries. Logged to execution_runs like a rule run. Runs in the engine worker.
+    Returns (overall_run_status, run_summary_message).
+    """
+    with app.app_context():
+        from rule_processing import garbage_collect_overrides
+        from database import get_db_connection
+        from app_config import load_rules as app_config_load_rules
+
+        current_run_start_time = datetime.utcnow()
+        current_run_id = str(uuid.uuid4())
+        run_type = "maintenance_override_gc"
+        logger.info(f"--- Scheduler: Starting Override GC Run ID {current_run_id[:8]} ---")
+
+        db_conn = None
+        overall_run_status = "started"
+        run_summary_message = f"Override GC ({current_run_id[:8]}) started."
+        try:
+            db_conn = get_db_connection()
+            cursor = db_conn.cursor()
+            cursor.execute('''
+                INSERT INTO execution_runs (run_id, run_type, start_time, status, summary_message)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (current_run_id, run_type, current_run_start_time.isoformat() + "Z", overall_run_status, run_summary_message))
+            db_conn.commit()
+
+            settings = app.config['HYDRUS_SETTINGS']
+            report = garbage_collect_overrides(
+                app.config, db_conn, app_config_load_rules(),
+                ttl_days=settings.get('override_ttl_days', 0)
+            )
+            overall_run_status = "completed_with_errors" if report["errors"] else "completed_ok"
+            run_summary_message = (f"Override GC ({current_run_id[:8]}) removed {report['total_rows_removed']} rows "
+                                   f"(stale rules: {report['removed_stale_rule_overrides']}, expired: {report['removed_expired_overrides']}, "
+                                   f"orphaned files: {report['removed_orphaned_file_overrides']}; {report['hashes_checked']} hashes checked). "
+                                   f"Reclaimed ~{report['reclaimed_bytes']} bytes.")
+            if report["errors"] or report["notes"]:
+                run_summary_message += f" Notes: {'; '.join(report['errors'] + report['notes'])}"
+        except sqlite3.Error as db_e:
+            overall_run_status = "failed_db_error"
+            run_summary_message = f"Override GC (Run ID {current_run_id[:8]}): DB error: {db_e}"
+            logger.error(run_summary_message, exc_info=True)
+            if db_conn: db_conn.rollback()
+        except Exception as global_e:
+            overall_run_status = "failed_global_error"
+            run_summary_message = f"Override GC (Run ID {current_run_id[:8]}): Global error: {global_e}"
+            logger.error(run_summary_message, exc_info=True)
+            if db_conn: db_conn.rollback()
+        finally:
+            current_run_end_time = datetime.utcnow()
+            if db_conn:
+                try:
+                    cursor = db_conn.cursor()
+                    cursor.execute('''
+                        UPDATE execution_runs SET end_time = ?, status = ?, summary_message = ?
+                        WHERE run_id = ?
+                    ''', (current_run_end_time.isoformat() + "Z", overall_run_status, run_summary_message, current_run_id))
+                    db_conn.commit()
+                except sqlite3.Error as e_final:
+                    logger.error(f"Override GC (Run ID {current_run_id[:8]}): CRITICAL - Failed to update final run status: {e_final}")
+                finally:
+                    db_conn.close()
+            logger.info(f"--- Scheduler: Finished Override GC Run ID {current_run_id[:8]}: {run_summary_message} ---")
+    return overall_run_status, run_summary_message
+
+
+def schedule_override_gc_job(app):
+    """
+    Manages the override garbage collection job based on the 'override_gc_interval_hours' setting.
+    """
+    settings = app.config.get('HYDRUS_SETTINGS', {})
+    interval_hours = settings.get('override_gc_interval_hours', 0)
+    job_id = 'override_gc_job'
+    initial_delay_seconds = 300 # Leave the first minutes after startup to the rules job
+
+    global scheduler
+    if scheduler.get_job(job_id):
+        logger.info(f"Scheduler: Removing existing job '{job_id}'.")
+        scheduler.remove_job(job_id)
+
+    if isinstance(interval_hours, (int, float)) and interval_hours > 0:
+        first_run_time = datetime.now() + timedelta(seconds=initial_delay_seconds)
+        logger.info(f"Scheduler: Scheduling job '{job_id}' to run first at {first_run_time.strftime('%Y-%m-%d %H:%M:%S')} and then every {interval_hours} hours.")
+        scheduler.add_job(
+            id=job_id,
+            func=run_override_gc_job,
+            args=[app],
+            trigger='interval',
+            hours=int(interval_hours),
+            next_run_time=first_run_time,
+            replace_existing=True,
+            misfire_grace_time=3600
+        )
+    else:
+        logger.info(f"Scheduler: Override GC interval is {interval_hours} hours. GC job will not be added.")
+
+
+def run_log_maintenance_job(app):
+    """
+    Scheduled maintenance job: queues a 'maintenance_log_storage' job, which the engine worker runs
+    with _run_log_maintenance (see engine_worker.py). Doesn't wait for it.
+    """
+    _queue_maintenance_job('maintenance_log_storage')
+
+
+def _run_log_maintenance(app):
+    """
+    Rolls up complete days of execution logs, moves past months of raw file_action_details into month
+    partition files and applies log retention (see log_storage.py). Logged to execution_runs like a
+    rule run. Runs in the engine worker.
+    Returns (overall_run_status, run_summary_message).
+    """
+    with app.app_context():
+        from log_storage import run_log_maintenance
+        from database import get_db_connection
+
+        current_run_start_time = datetime.utcnow()
+        current_run_id = str(uuid.uuid4())
+        run_type = "maintenance_log_storage"
+        logger.info(f"--- Scheduler: Starting Log Maintenance Run ID {current_run_id[:8]} ---")
+
+        db_conn = None
+        overall_run_status = "started"
+        run_summary_message = f"Log maintenance ({current_run_id[:8]}) started."
+        try:
+            db_conn = get_db_connection()
+            cursor = db_conn.cursor()
+            cursor.execute('''
+                INSERT INTO execution_runs (run_id, run_type, start_time, status, summary_message)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (current_run_id, run_type, current_run_start_time.isoformat() + "Z", overall_run_status, run_summary_message))
+            db_conn.commit()
+
+            settings = app.config['HYDRUS_SETTINGS']
+            report = run_log_maintenance(
+                db_conn,
+                retention_days=settings.get('log_retention_days', 0),
+                archive_expired=settings.get('log_retention_archive', True)
+            )
+            # Refreshes planner statistics (ANALYZE) of tables whose size changed a lot, e.g. after
+            # partitioning or retention, so the composite indexes keep being chosen.
+            db_conn.execute("PRAGMA optimize")
+            overall_run_status = "completed_with_errors" if report["errors"] else "completed_ok"
+            run_summary_message = (f"Log maintenance ({current_run_id[:8]}) rolled up {report['days_rolled_up']} day(s) "
+                                   f"(rollups now cover days before {report['rollup_watermark_day']}), moved {report['detail_rows_partitioned']} "
+                                   f"detail rows into {len(report['partitioned_months'])} month partition(s). Retention: "
+                                   f"{report['partitions_archived']} partition(s) archived, {report['partitions_deleted']} deleted, "
+                                   f"{report['expired_detail_rows']} detail rows, {report['expired_rule_executions']} rule executions "
+                                   f"and {report['expired_runs']} runs expired.")
+            if report["errors"] or report["notes"]:
+                run_summary_message += f" Notes: {'; '.join(report['errors'] + report['notes'])}"
+        except sqlite3.Error as db_e:
+            overall_run_status = "failed_db_error"
+            run_summary_message = f"Log maintenance (Run ID {current_run_id[:8]}): DB error: {db_e}"
+            logger.error(run_summary_message, exc_info=True)
+            if db_conn: db_conn.rollback()
+        except Exception as global_e:
+            overall_run_status = "failed_global_error"
+            run_summary_message = f"Log maintenance (Run ID {current_run_id[:8]}): Global error: {global_e}"
+            logger.error(run_summary_message, exc_info=True)
+            if db_conn: db_conn.rollback()
+        finally:
+            current_run_end_time = datetime.utcnow()
+            if db_conn:
+                try:
+                    cursor = db_conn.cursor()
+                    cursor.execute('''
+                        UPDATE execution_runs SET end_time = ?, status = ?, summary_message = ?
+                        WHERE run_id = ?
+                    ''', (current_run_end_time.isoformat() + "Z", overall_run_status, run_summary_message, current_run_id))
+                    db_conn.commit()
+                except sqlite3.Error as e_final:
+                    logger.error(f"Log maintenance (Run ID {current_run_id[:8]}): CRITICAL - Failed to update final run status: {e_final}")
+                finally:
+                    db_conn.close()
+            logger.info(f"--- Scheduler: Finished Log Maintenance Run ID {current_run_id[:8]}: {run_summary_message} ---")
+    return overall_run_status, run_summary_message
+
+
+def schedule_log_maintenance_job(app):
+    """
+    Manages the log rollup/partitioning/retention job based on the 'log_maintenance_interval_hours' setting.
+    """
+    settings = app.config.get('HYDRUS_SETTINGS', {})
+    interval_hours = settings.get('log_maintenance_interval_hours', 0)
+    job_id = 'log_maintenance_job'
+    initial_delay_seconds = 600 # After the rules job and the override GC have had their first turn
+
+    global scheduler
+    if scheduler.get_job(job_id):
+        logger.info(f"Scheduler: Removing existing job '{job_id}'.")
+        scheduler.remove_job(job_id)
+
+    if isinstance(interval_hours, (int, float)) and interval_hours > 0:
+        first_run_time = datetime.now() + timedelta(seconds=initial_delay_seconds)
+        logger.info(f"Scheduler: Scheduling job '{job_id}' to run first at {first_run_time.strftime('%Y-%m-%d %H:%M:%S')} and then every {interval_hours} hours.")
         scheduler.add_job(
             id=job_id,
-            func=run_all_rules_scheduled_job, # Target the new job function
-            args=[app], # Pass the Flask app instance
+            func=run_log_maintenance_job,
+            args=[app],
             trigger='interval',
-            seconds=int(interval_seconds),
+            hours=int(interval_hours),
             next_run_time=first_run_time,
             replace_existing=True,
-            misfire_grace_time=60
+            misfire_grace_time=3600
         )
     else:
-        logger.info(f"Scheduler: Rule interval is {interval_seconds} seconds. Scheduled job will not be added.")
\ No newline at end of file
+        logger.info(f"Scheduler: Log maintenance interval is {interval_hours} hours. Log maintenance job will not be added.")
+
+
+def _flush_log_writer_on_scheduler_shutdown(event):
+    """APScheduler listener: commit any queued execution log writes once the scheduler stops."""
+    from log_writer import flush_log_writer
+    logger.info("Scheduler: Shutdown detected. Flushing queued execution log writes...")
+    if not flush_log_writer(timeout=30):
+        logger.warning("Scheduler: Execution log writer did not finish flushing within 30s.")
+
+
+def register_scheduler_listeners():
+    """Registers scheduler event listeners. Call once after scheduler.init_app()."""
+    scheduler.add_listener(_flush_log_writer_on_scheduler_shutdown, EVENT_SCHEDULER_SHUTDOWN)
+    scheduler.add_listener(_on_rules_job_not_run, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
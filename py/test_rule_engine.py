@@ -0,0 +1,398 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import tempfile
+import logging
+import threading
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+# --- Rule Engine Tests ---
+# Behavioural checks of the rule engine against a scratch database and a fake Hydrus client:
+#   - execute_rules_in_conflict_order, one rule at a time and in parallel, and the checkpoints it yields,
+#   - a run of all rules giving way to a queued job of higher priority (engine_worker.JobYieldPoint),
+#   - log maintenance (log_storage.run_log_maintenance) moving rows into month partitions and applying
+#     the retention policy without leaving orphaned rows, and doing nothing more when run again.
+# The database is created in a temporary directory (HYDRUS_BUTLER_DB_DIR, read when database.py is
+# imported); call_hydrus_api is replaced by _fake_call_hydrus_api. Run from the py directory:
+#
+#     python -m unittest test_rule_engine      (or: python -m pytest test_rule_engine.py)
+
+_TEST_DB_DIR = tempfile.mkdtemp(prefix="hydrus_butler_test_")
+os.environ['HYDRUS_BUTLER_DB_DIR'] = _TEST_DB_DIR
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+
+import database
+import engine_worker
+import log_storage
+import rule_processing
+from database import (
+    init_conflict_db, get_db_connection, enqueue_engine_job, claim_next_engine_job, get_engine_job,
+    epoch_ms, epoch_ms_to_iso
+)
+from log_writer import start_log_writer, stop_log_writer, flush_log_writer
+from rule_processing import RunStopToken, execute_rules_in_conflict_order
+
+logger = logging.getLogger(__name__)
+
+FAKE_SERVICES = {
+    'loc1': {'name': 'my files', 'type': 2}, 'loc2': {'name': 'archive files', 'type': 2},
+    'tags1': {'name': 'my tags', 'type': 5}, 'rate1': {'name': 'favourites', 'type': 7},
+}
+FAKE_FILE_HASHES = ['%064x' % i for i in range(1, 301)]
+
+# In running order. 'Force' conflicts with 'Add' (both change file domains); 'Tag' and 'Rate' conflict with neither.
+TEST_RULES = [
+    {'id': 'r-add', 'name': 'Add', 'priority': 1, 'conditions': [{'type': 'boolean', 'operator': 'inbox', 'value': True}],
+     'action': {'type': 'add_to', 'destination_service_keys': ['loc2']}},
+    {'id': 'r-tag', 'name': 'Tag', 'priority': 2, 'conditions': [{'type': 'tags', 'operator': 'search_terms', 'value': ['a']}],
+     'action': {'type': 'add_tags', 'tag_service_key': 'tags1', 'tags_to_process': ['b']}},
+    {'id': 'r-force', 'name': 'Force', 'priority': 3, 'conditions': [{'type': 'boolean', 'operator': 'inbox', 'value': True}],
+     'action': {'type': 'force_in', 'destination_service_keys': ['loc1']}},
+    {'id': 'r-rate', 'name': 'Rate', 'priority': 4, 'conditions': [{'type': 'boolean', 'operator': 'inbox', 'value': True}],
+     'action': {'type': 'modify_rating', 'rating_service_key': 'rate1', 'rating_value': True}},
+]
+
+
+def _fake_call_hydrus_api(api_address, api_key, endpoint, method='GET', params=None, json_data=None, timeout=60):
+    """Stands in for hydrus_interface.call_hydrus_api: every search finds FAKE_FILE_HASHES, every action succeeds."""
+    time.sleep(0.01) # Lets rules that run concurrently overlap
+    if endpoint == '/get_services':
+        return {'success': True, 'data': {'services': FAKE_SERVICES}}, 200
+    if endpoint == '/get_files/search_files':
+        return {'success': True, 'data': {'hashes': list(FAKE_FILE_HASHES), 'file_ids': list(range(len(FAKE_FILE_HASHES)))}}, 200
+    if endpoint == '/get_files/file_metadata':
+        return {'success': True, 'data': {'metadata': [
+            {'hash': file_hash, 'file_id': 1, 'file_services': {'current': {'loc1': {}, 'loc2': {}}}}
+            for file_hash in json.loads(params['hashes'])
+        ]}}, 200
+    return {'success': True, 'message': 'ok'}, 200
+
+
+def _test_app_config(rule_execution_workers=1):
+    return {
+        'HYDRUS_SETTINGS': {
+            'api_address': 'http://hydrus.invalid', 'api_key': 'test', 'last_viewed_threshold_seconds': 60,
+            'log_overridden_actions': True, 'log_batch_size': 100, 'rule_execution_workers': rule_execution_workers,
+        },
+        'AVAILABLE_SERVICES': [],
+    }
+
+
+def _start_run(db_conn, run_type='test'):
+    """Inserts an execution_runs row for a run started now. Returns its run_id."""
+    run_id = str(uuid.uuid4())
+    now_iso = datetime.utcnow().isoformat() + "Z"
+    db_conn.execute("INSERT INTO execution_runs (run_id, run_type, start_time, end_time, status) VALUES (?, ?, ?, ?, 'completed_ok')",
+                    (run_id, run_type, now_iso, now_iso))
+    db_conn.commit()
+    return run_id
+
+
+def setUpModule():
+    init_conflict_db()
+
+
+def tearDownModule():
+    stop_log_writer()
+    shutil.rmtree(_TEST_DB_DIR, ignore_errors=True)
+
+
+class RecordingRuleExecutions:
+    """
+    Wraps execute_single_rule (in rule_processing and engine_worker) and records when each execution
+    starts and ends, and how many executions of the run (is_manual_run False) were in flight.
+    on_start(rule, is_manual_run) is called as an execution starts.
+    """
+    def __init__(self, on_start=None):
+        self.lock = threading.Lock()
+        self.events = [] # (event, rule_id, is_manual_run, run executions in flight)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.on_start = on_start
+        self._execute_single_rule = rule_processing.execute_single_rule
+        self._patches = [mock.patch.object(module, 'execute_single_rule', self._execute) for module in (rule_processing, engine_worker)]
+
+    def __enter__(self):
+        for patch in self._patches:
+            patch.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for patch in self._patches:
+            patch.stop()
+
+    def _record(self, event, rule, is_manual_run, change):
+        with self.lock:
+            if not is_manual_run:
+                self.in_flight += change
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.events.append((event, rule.get('id'), is_manual_run, self.in_flight))
+
+    def _execute(self, app_config, db_conn, rule, current_run_id, execution_order_in_run, is_manual_run=False, stop_token=None):
+        self._record('start', rule, is_manual_run, 1)
+        if self.on_start is not None:
+            self.on_start(rule, is_manual_run)
+        try:
+            return self._execute_single_rule(app_config, db_conn, rule, current_run_id, execution_order_in_run,
+                                             is_manual_run=is_manual_run, stop_token=stop_token)
+        finally:
+            self._record('end', rule, is_manual_run, -1)
+
+    def index_of(self, event, rule_id, is_manual_run=False):
+        return next(index for index, (e, r, manual, _) in enumerate(self.events) if (e, r, manual) == (event, rule_id, is_manual_run))
+
+
+@mock.patch.object(rule_processing, 'call_hydrus_api', _fake_call_hydrus_api)
+class ConflictOrderTests(unittest.TestCase):
+    def setUp(self):
+        start_log_writer(get_db_connection)
+        self.db_conn = get_db_connection()
+        self.addCleanup(self.db_conn.close)
+        self.addCleanup(stop_log_writer)
+
+    def _run(self, app_config, max_workers, stop_token=None, yield_point=None):
+        run_id = _start_run(self.db_conn)
+        yielded = list(execute_rules_in_conflict_order(
+            app_config, self.db_conn, list(enumerate(TEST_RULES)), run_id, max_workers=max_workers,
+            stop_token=stop_token, yield_point=yield_point))
+        self.db_conn.commit()
+        flush_log_writer()
+        return run_id, yielded
+
+    def _assert_all_rules_succeeded(self, yielded):
+        self.assertEqual(sorted(position for position, _, _, _, _ in yielded), list(range(len(TEST_RULES))))
+        for position, rule, exec_result, rule_error, _ in yielded:
+            self.assertIsNone(rule_error, rule['id'])
+            self.assertTrue(exec_result['success'], exec_result.get('message'))
+            self.assertFalse(exec_result.get('not_started'))
+
+    def _assert_checkpoints(self, yielded):
+        """Checkpoints only ever move forward and end with the last rule of the run."""
+        checkpoints = [checkpoint for _, _, _, _, checkpoint in yielded if checkpoint]
+        completed_counts = [rules_completed for rules_completed, _ in checkpoints]
+        self.assertEqual(completed_counts, sorted(set(completed_counts)))
+        self.assertEqual(checkpoints[-1], (len(TEST_RULES), TEST_RULES[-1]['id']))
+        for rules_completed, rule_id in checkpoints:
+            self.assertEqual(TEST_RULES[rules_completed - 1]['id'], rule_id)
+
+    def test_rules_run_one_at_a_time_in_order(self):
+        with RecordingRuleExecutions() as recorder:
+            run_id, yielded = self._run(_test_app_config(), max_workers=1)
+        self._assert_all_rules_succeeded(yielded)
+        self.assertEqual([position for position, _, _, _, _ in yielded], list(range(len(TEST_RULES))))
+        self.assertEqual([checkpoint for _, _, _, _, checkpoint in yielded],
+                         [(index + 1, rule['id']) for index, rule in enumerate(TEST_RULES)])
+        self.assertEqual(recorder.max_in_flight, 1)
+        executed = self.db_conn.execute('''
+            SELECT rei.rule_id FROM rule_executions_in_run rei JOIN execution_runs er ON er.run_key = rei.run_key
+            WHERE er.run_id = ? ORDER BY rei.execution_order_in_run
+        ''', (run_id,)).fetchall()
+        self.assertEqual([row[0] for row in executed], [rule['id'] for rule in TEST_RULES])
+
+    def test_parallel_run_keeps_conflicting_rules_in_order(self):
+        with RecordingRuleExecutions() as recorder:
+            _, yielded = self._run(_test_app_config(rule_execution_workers=2), max_workers=2)
+        self._assert_all_rules_succeeded(yielded)
+        self._assert_checkpoints(yielded)
+        self.assertEqual(recorder.max_in_flight, 2) # 'Add' and 'Tag' start together
+        self.assertGreater(recorder.index_of('start', 'r-force'), recorder.index_of('end', 'r-add'))
+
+    def test_parallel_run_without_log_writer_runs_one_at_a_time(self):
+        stop_log_writer()
+        with RecordingRuleExecutions() as recorder:
+            _, yielded = self._run(_test_app_config(rule_execution_workers=2), max_workers=2)
+        self._assert_all_rules_succeeded(yielded)
+        self.assertEqual(recorder.max_in_flight, 1)
+
+    def test_stopped_run_reports_rules_not_started(self):
+        stop_token = RunStopToken()
+        stop_token.cancel()
+        _, yielded = self._run(_test_app_config(rule_execution_workers=2), max_workers=2, stop_token=stop_token)
+        self.assertEqual(len(yielded), len(TEST_RULES))
+        for _, _, exec_result, rule_error, checkpoint in yielded:
+            self.assertIsNone(rule_error)
+            self.assertTrue(exec_result['not_started'])
+            self.assertEqual(exec_result['stop_reason'], 'cancelled')
+            self.assertIsNone(checkpoint)
+
+
+@mock.patch.object(rule_processing, 'call_hydrus_api', _fake_call_hydrus_api)
+class JobYieldPointTests(unittest.TestCase):
+    def setUp(self):
+        start_log_writer(get_db_connection)
+        self.addCleanup(stop_log_writer)
+        self.app = Flask(__name__)
+        self.app.config.update(_test_app_config(rule_execution_workers=2))
+        load_rules_patch = mock.patch.object(engine_worker, 'load_rules', lambda: [dict(rule) for rule in TEST_RULES])
+        load_rules_patch.start()
+        self.addCleanup(load_rules_patch.stop)
+
+    def _enqueue(self, job_type, rule_id=None):
+        db_conn = get_db_connection()
+        try:
+            return enqueue_engine_job(db_conn, job_type, rule_id=rule_id)
+        finally:
+            db_conn.close()
+
+    def _get_job(self, job_id):
+        db_conn = get_db_connection()
+        try:
+            return get_engine_job(db_conn, job_id)
+        finally:
+            db_conn.close()
+
+    def test_run_of_all_rules_gives_way_between_rules(self):
+        single_job = {}
+
+        def queue_single_job(rule, is_manual_run):
+            # Queued once the run's first rule is executing, so the run has to give way midway
+            if not is_manual_run and not single_job:
+                single_job['queued_at_event'] = len(recorder.events)
+                single_job['job_id'] = self._enqueue('manual_single', rule_id='r-rate')
+
+        run_job_id = self._enqueue('manual_all')
+        self.assertTrue(run_job_id)
+        db_conn = get_db_connection()
+        try:
+            run_job = claim_next_engine_job(db_conn, os.getpid())
+        finally:
+            db_conn.close()
+        self.assertEqual(run_job['job_id'], run_job_id)
+
+        with RecordingRuleExecutions(on_start=queue_single_job) as recorder:
+            engine_worker._run_claimed_job(self.app, run_job, {}, threading.Event())
+
+        self.assertTrue(single_job.get('job_id'))
+        self.assertEqual(self._get_job(single_job['job_id'])['status'], 'completed')
+        finished_run_job = self._get_job(run_job_id)
+        self.assertEqual(finished_run_job['status'], 'completed')
+        self.assertEqual(len(finished_run_job['result']['payload']['results_per_rule']), len(TEST_RULES))
+
+        # The single rule ran while none of the run's rules was executing, after at most
+        # max_workers of them finished, and before the run's last rule started.
+        single_start = recorder.index_of('start', 'r-rate', is_manual_run=True)
+        self.assertEqual(recorder.events[single_start][3], 0)
+        run_rules_ended_in_between = sum(
+            1 for event, _, is_manual_run, _ in recorder.events[single_job['queued_at_event']:single_start]
+            if event == 'end' and not is_manual_run)
+        self.assertLessEqual(run_rules_ended_in_between, 2)
+        self.assertLess(single_start, recorder.index_of('start', 'r-rate'))
+
+
+@mock.patch.object(rule_processing, 'call_hydrus_api', _fake_call_hydrus_api)
+class LogMaintenanceTests(unittest.TestCase):
+    # Maintenance runs "on" MAINTENANCE_NOW; rule runs are moved back in time to the days they should have run
+    MAINTENANCE_NOW = datetime(2026, 5, 20, 12, 0)
+    RETENTION_DAYS = 50 # -> Expires whole months before 2026-03
+
+    def setUp(self):
+        self.db_conn = get_db_connection()
+        self.addCleanup(self.db_conn.close)
+
+    def _run_rules_at(self, started_at, detail_delay=timedelta(0)):
+        """Runs TEST_RULES as one run and moves its rows back to started_at. Returns the run_id."""
+        run_id = _start_run(self.db_conn)
+        for index, rule in enumerate(TEST_RULES):
+            rule_processing.execute_single_rule(_test_app_config(), self.db_conn, rule, run_id, index + 1)
+        self.db_conn.commit()
+        run_key, first_start_ms = self.db_conn.execute('''
+            SELECT er.run_key, MIN(rei.start_time_ms) FROM execution_runs er JOIN rule_executions_in_run rei ON rei.run_key = er.run_key
+            WHERE er.run_id = ?
+        ''', (run_id,)).fetchone()
+        shift_ms = first_start_ms - epoch_ms(started_at)
+        self.db_conn.execute('''
+            UPDATE file_action_details SET action_time_ms = action_time_ms - ? + ?
+            WHERE rule_execution_key IN (SELECT rule_execution_key FROM rule_executions_in_run WHERE run_key = ?)
+        ''', (shift_ms, detail_delay // timedelta(milliseconds=1), run_key))
+        self.db_conn.execute('''
+            UPDATE rule_executions_in_run SET start_time_ms = start_time_ms - ?, end_time_ms = end_time_ms - ? WHERE run_key = ?
+        ''', (shift_ms, shift_ms, run_key))
+        self.db_conn.execute("UPDATE execution_runs SET start_time = ?, end_time = ? WHERE run_key = ?",
+                             (epoch_ms_to_iso(epoch_ms(started_at)), epoch_ms_to_iso(epoch_ms(started_at) + 60000), run_key))
+        self.db_conn.commit()
+        return run_id
+
+    def _run_maintenance(self):
+        report = log_storage.run_log_maintenance(self.db_conn, retention_days=self.RETENTION_DAYS, archive_expired=True,
+                                                 now=self.MAINTENANCE_NOW)
+        self.assertEqual(report['errors'], [])
+        return report
+
+    def _partition_rows(self, month_key, archived=False):
+        partition_conn = sqlite3.connect(log_storage.log_partition_path(month_key, archived=archived))
+        try:
+            return partition_conn.execute("SELECT log_id, rule_execution_key FROM file_action_details").fetchall()
+        finally:
+            partition_conn.close()
+
+    def _run_exists(self, run_id):
+        return self.db_conn.execute("SELECT 1 FROM execution_runs WHERE run_id = ?", (run_id,)).fetchone() is not None
+
+    def _assert_no_orphaned_rows(self):
+        """Every live detail row (main database or month partition) has its rule execution, and every execution its run."""
+        for month_key in log_storage.list_log_partition_months():
+            for _, rule_execution_key in self._partition_rows(month_key):
+                self.assertIsNotNone(self.db_conn.execute(
+                    "SELECT 1 FROM rule_executions_in_run WHERE rule_execution_key = ?", (rule_execution_key,)).fetchone(),
+                    f"Partition {month_key} has rows of a rule execution that expired")
+        self.assertEqual(self.db_conn.execute('''
+            SELECT COUNT(*) FROM file_action_details WHERE rule_execution_key NOT IN (SELECT rule_execution_key FROM rule_executions_in_run)
+        ''').fetchone()[0], 0)
+        self.assertEqual(self.db_conn.execute('''
+            SELECT COUNT(*) FROM rule_executions_in_run WHERE run_key NOT IN (SELECT run_key FROM execution_runs)
+        ''').fetchone()[0], 0)
+
+    def test_retention_expires_whole_months_without_orphans(self):
+        expired_run_id = self._run_rules_at(datetime(2026, 2, 10, 9, 0))
+        # Starts just before midnight; its detail rows land in March, which is kept
+        midnight_run_id = self._run_rules_at(datetime(2026, 2, 28, 23, 59, 50), detail_delay=timedelta(seconds=20))
+        partitioned_run_id = self._run_rules_at(datetime(2026, 4, 15, 9, 0))
+        recent_run_id = self._run_rules_at(datetime(2026, 5, 19, 9, 0))
+
+        report = self._run_maintenance()
+        self.assertGreater(report['detail_rows_partitioned'], 0)
+        self.assertGreater(report['expired_rule_executions'], 0)
+        self.assertGreater(report['expired_runs'], 0)
+        self.assertFalse(self._run_exists(expired_run_id))
+        for run_id in (midnight_run_id, partitioned_run_id, recent_run_id):
+            self.assertTrue(self._run_exists(run_id))
+        self.assertIn('2026_03', log_storage.list_log_partition_months())
+        self.assertIn('2026_04', log_storage.list_log_partition_months())
+        self.assertTrue(self._partition_rows('2026_02', archived=True))
+        self._assert_no_orphaned_rows()
+
+        # Everything is where it belongs: a second pass moves and expires nothing
+        report = self._run_maintenance()
+        for count_key in ('detail_rows_partitioned', 'expired_detail_rows', 'expired_rule_executions', 'expired_runs'):
+            self.assertEqual(report[count_key], 0, count_key)
+        self._assert_no_orphaned_rows()
+
+    def test_interrupted_partition_move_is_finished_by_the_next_run(self):
+        self._run_rules_at(datetime(2026, 4, 3, 9, 0))
+        self._run_maintenance()
+        partition_rows = self._partition_rows('2026_04')
+        self.assertTrue(partition_rows)
+
+        # A move whose copy was committed in the partition but whose delete was lost leaves the rows in both files
+        columns = ", ".join(database.FILE_ACTION_DETAILS_COLUMNS)
+        self.db_conn.execute("ATTACH DATABASE ? AS log_source", (log_storage.log_partition_path('2026_04'),))
+        self.db_conn.execute(f"INSERT INTO main.file_action_details ({columns}) SELECT {columns} FROM log_source.file_action_details")
+        self.db_conn.commit()
+        self.db_conn.execute("DETACH DATABASE log_source")
+
+        report = self._run_maintenance()
+        self.assertEqual(report['detail_rows_partitioned'], len(partition_rows))
+        self.assertEqual(sorted(self._partition_rows('2026_04')), sorted(partition_rows))
+        self._assert_no_orphaned_rows()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,12 +2,14 @@ import os
 import sqlite3 # Added for specific exception handling if needed, though get_db_connection handles general
 from flask import (
     Blueprint, render_template, request, jsonify, flash, redirect, url_for,
-    current_app, send_from_directory
+    current_app, send_from_directory, Response, stream_with_context
 )
+import io
+import csv
 import json
 import uuid
+import zlib
 from datetime import datetime
-from urllib.parse import unquote
 
 # Imports from our new modules
 from app_config import (
@@ -17,16 +19,33 @@ from app_config import (
 )
 from database import (
     get_db_connection,
+    get_db_read_connection, # query_only connections for the log views
     remove_overrides_for_rule, # Still used for targeted update override removal
-    get_or_create_active_rule_version
+    get_or_create_active_rule_version,
+    unpack_file_hashes, get_log_code_names, epoch_ms_to_iso, iso_to_epoch_ms, decode_execution_details,
+    enqueue_engine_job, get_engine_job, list_pending_engine_jobs, request_engine_job_cancel
 )
 from hydrus_interface import call_hydrus_api
-from rule_processing import execute_single_rule, _ensure_available_services, _parse_time_range_for_logs
-from scheduler_tasks import schedule_rules_job
+from log_storage import attach_log_partitions_for_range
+from log_search import (
+    build_log_search_query, build_log_entry_query, _encode_log_cursor, APPROXIMATE_COUNT_CAP, LOG_ENTRY_TYPES
+)
+from rule_stats import get_files_processed_per_rule, get_rule_stats_timeseries
+from log_query_cache import get_log_query_cache
+from rule_processing import _ensure_available_services, _parse_time_range_for_logs
+from scheduler_tasks import (
+    schedule_rules_job, schedule_override_gc_job, schedule_log_maintenance_job,
+    get_rules_job_status, validate_rule_schedule, RULE_SCHEDULE_FIELDS
+)
+from engine_worker import RUN_ALL_JOB_TYPES, ENGINE_JOB_RETENTION_DAYS, is_engine_worker_alive
 
 # Create a Blueprint
 views_bp = Blueprint('views', __name__)
 
+AGGREGATE_HASH_PREVIEW_LIMIT = 20 # Hashes of a skip aggregate returned by /logs/search
+LOG_EXPORT_FETCH_ROWS = 1000 # Rows per fetchmany() and per streamed chunk of /logs/export
+LOG_EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"} # format -> content type
+
 # --- Route Handlers ---
 
 @views_bp.route('/')
@@ -51,12 +70,21 @@ def handle_save_settings():
         'api_address': request.form.get('api_address', '').strip(),                       
         'api_key': request.form.get('api_key', '').strip(),                             
         'rule_interval_seconds': request.form.get('rule_interval_seconds'),             
+        'rule_interval_adaptive': request.form.get('rule_interval_adaptive'),
+        'rule_interval_max_seconds': request.form.get('rule_interval_max_seconds'),
+        'run_time_budget_seconds': request.form.get('run_time_budget_seconds'),
+        'rule_time_budget_seconds': request.form.get('rule_time_budget_seconds'),
         'last_viewed_threshold_seconds': request.form.get('last_viewed_threshold_seconds'), 
         'show_run_notifications': request.form.get('show_run_notifications'),           
         'show_run_all_notifications': request.form.get('show_run_all_notifications'),   
         'theme': request.form.get('theme'),                                             
         'butler_name': request.form.get('butler_name', '').strip(),                     
-        'log_overridden_actions': request.form.get('log_overridden_actions')          
+        'log_overridden_actions': request.form.get('log_overridden_actions'),
+        'override_gc_interval_hours': request.form.get('override_gc_interval_hours'),
+        'override_ttl_days': request.form.get('override_ttl_days'),
+        'log_maintenance_interval_hours': request.form.get('log_maintenance_interval_hours'),
+        'log_retention_days': request.form.get('log_retention_days'),
+        'log_retention_archive': request.form.get('log_retention_archive')
     }
     current_app.logger.info(f"Processed form data for save: {submitted_data}")
 
@@ -65,7 +93,9 @@ def handle_save_settings():
     if save_success and saved_settings_dict:
         current_app.logger.info("Settings successfully saved to file and app config updated by save_settings_to_file.")
         schedule_rules_job(current_app._get_current_object())
-        current_app.logger.info("Scheduler job re-evaluated based on new settings.")
+        schedule_override_gc_job(current_app._get_current_object())
+        schedule_log_maintenance_job(current_app._get_current_object())
+        current_app.logger.info("Scheduler jobs re-evaluated based on new settings.")
 
         fetch_message = ""
         if saved_settings_dict.get('api_address'):
@@ -188,6 +218,10 @@ def add_rule_route():
     else:
         current_app.logger.warning(f"Unsupported action type for validation: {action_type_value}")
         return jsonify({"success": False, "message": f"Unsupported action type: {action_type_value}."}), 400
+    schedule_error = validate_rule_schedule(rule_data_from_payload)
+    if schedule_error:
+        current_app.logger.warning(schedule_error)
+        return jsonify({"success": False, "message": schedule_error}), 400
     # --- End of Validation ---
 
     # Load current rules from file to form the basis of the new rules list
@@ -241,6 +275,13 @@ def add_rule_route():
                 rule_data_for_db_and_list['name'] = submitted_name_update
             final_rule_name_to_return = rule_data_for_db_and_list['name']
 
+            # The rule editor doesn't show schedules (set in rules.json); keep the existing one unless the
+            # payload sets one itself.
+            if not any(field in rule_data_for_db_and_list for field in RULE_SCHEDULE_FIELDS):
+                for field in RULE_SCHEDULE_FIELDS:
+                    if field in rules_list_for_save[found_idx]:
+                        rule_data_for_db_and_list[field] = rules_list_for_save[found_idx][field]
+
             rules_list_for_save[found_idx] = rule_data_for_db_and_list # Update in the list for saving
 
         # Version the rule (new or updated)
@@ -324,229 +365,104 @@ def delete_rule_route(rule_id):
 
 @views_bp.route('/run_rule/<rule_id_from_path>', methods=['POST'])
 def run_single_rule_route(rule_id_from_path):
-    run_start_time = datetime.utcnow()
-    run_id = str(uuid.uuid4())
-    run_type = "manual_single"
-    rule_name_log = f"Rule ID {rule_id_from_path}"
-    current_app.logger.info(f"\n--- Manual Single Rule Trigger (views.py): Run ID {run_id[:8]} for {rule_name_log} ---")
-
+    """Queues a manual run of one rule for the engine worker. Its result is read from /engine_jobs/<job_id>."""
     db_conn = None
-    overall_run_status = "started"
-    run_summary = f"Manual run for {rule_name_log} (ID {run_id[:8]}) started."
-    exec_result_response = {}
-
     try:
         db_conn = get_db_connection()
-        cursor = db_conn.cursor()
-        cursor.execute("INSERT INTO execution_runs (run_id, run_type, start_time, status, summary_message) VALUES (?, ?, ?, ?, ?)",
-                       (run_id, run_type, run_start_time.isoformat() + "Z", overall_run_status, run_summary))
-        db_conn.commit()
+        job_id = enqueue_engine_job(db_conn, 'manual_single', rule_id=rule_id_from_path)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"DB error queueing a manual run of rule {rule_id_from_path}: {e}", exc_info=True)
+        job_id = None
+    finally:
+        if db_conn: db_conn.close()
+    if not job_id:
+        return jsonify({"success": False, "message": "Could not queue the run. Check the logs.", "rule_id": rule_id_from_path}), 500
+    current_app.logger.info(f"Manual run of rule {rule_id_from_path} queued as engine job {job_id[:8]}.")
+    return jsonify({"success": True, "queued": True, "job_id": job_id, "rule_id": rule_id_from_path,
+                    "message": "Run queued.", "status_url": url_for('views.engine_job_route', job_id=job_id)}), 202
 
-        # Load rules using app_config_load_rules to ensure consistency with how app.config is populated
-        rules_in_system = app_config_load_rules() # This loads from file and sorts
-        rule_to_run = next((r for r in rules_in_system if r.get('id') == rule_id_from_path), None)
 
-        if not rule_to_run:
-            run_summary = f"Rule ID {rule_id_from_path} not found in current rules. Manual run aborted."
-            overall_run_status = "failed_early_rule_not_found"
-            # exec_result_response will be built in finally or if error caught by general Exception
-        else:
-            rule_name_log = rule_to_run.get('name', rule_id_from_path) # Update rule_name_log
-            settings = current_app.config.get('HYDRUS_SETTINGS', {})
-            if not settings.get('api_address') or not settings.get('api_key'):
-                 run_summary = f"Hydrus API not configured. Manual run for '{rule_name_log}' aborted."
-                 overall_run_status = "failed_early_config"
-                 raise Exception(run_summary)
-
-            if not _ensure_available_services(current_app.config, f"Manual_Single_Run_{rule_id_from_path[:8]}"):
-                run_summary = f"Could not fetch Hydrus services. Manual run for '{rule_name_log}' aborted."
-                overall_run_status = "failed_early_services"
-                raise Exception(run_summary)
-
-            exec_result_response = execute_single_rule(
-                current_app.config, db_conn, rule_to_run,
-                run_id, 1, is_manual_run=True # is_manual_run=True bypasses override checks for this specific rule
-            )
-            if exec_result_response.get('success'):
-                overall_run_status = "completed_ok"
-                run_summary = f"Manual run for '{rule_name_log}' complete. Rule: {exec_result_response.get('message','OK')}"
-            else:
-                overall_run_status = "completed_with_rule_failures"
-                run_summary = f"Manual run for '{rule_name_log}' failed. Rule: {exec_result_response.get('message','Failed')}"
-            db_conn.commit()
-            current_app.logger.info(f"Manual Single Run (ID {run_id[:8]}): Rule execution DB changes committed.")
-            
-    except Exception as e:
-        current_app.logger.error(f"Global error in run_single_rule_route for {rule_name_log}: {e}", exc_info=True)
-        # Update run_summary if it was still the initial "started" message
-        if "started" in run_summary and overall_run_status == "started":
-             run_summary = f"Manual run for '{rule_name_log}' failed globally: {str(e)}"
-        # Update overall_run_status if it hasn't been set to a more specific failure
-        if overall_run_status == "started":
-            overall_run_status = "failed_global_error"
-        
-        if db_conn: db_conn.rollback() # Rollback any partial DB changes from this try block
-        
-        # Ensure exec_result_response is populated for the final jsonify
-        if not exec_result_response:
-            exec_result_response = {"success": False, "message": run_summary, "rule_id": rule_id_from_path, 
-                                    "details": {"critical_error_in_view": str(e)}}
-        elif "message" not in exec_result_response or not exec_result_response["message"]:
-            exec_result_response["message"] = run_summary
-    finally:
-        run_end_time = datetime.utcnow()
-        if db_conn:
-            try:
-                cursor = db_conn.cursor()
-                # Ensure summary reflects the most accurate state before DB update
-                if "message" in exec_result_response and exec_result_response["message"] and "Rule:" not in run_summary:
-                     run_summary = f"Manual run for '{rule_name_log}' outcome. Rule: {exec_result_response.get('message', 'Final state unknown')}"
-                elif "started" in run_summary and overall_run_status != "started": # Generic update if specific exec_result_response message not available
-                     run_summary = f"Manual run for '{rule_name_log}' finished with status: {overall_run_status}."
-
-                cursor.execute("UPDATE execution_runs SET end_time = ?, status = ?, summary_message = ? WHERE run_id = ?",
-                               (run_end_time.isoformat() + "Z", overall_run_status, run_summary, run_id))
-                db_conn.commit()
-            except Exception as e_final_db:
-                current_app.logger.error(f"CRITICAL: Failed to update final status for manual single run {run_id}: {e_final_db}")
-            finally:
-                db_conn.close()
-        current_app.logger.info(f"--- Manual Single Rule (views.py): Finished Run ID {run_id[:8]} ---")
-
-    # Ensure these keys are always present in the response payload
-    exec_result_response["overall_run_id_for_log"] = run_id
-    exec_result_response["overall_run_status_for_log"] = overall_run_status
-    if "success" not in exec_result_response: # Should be set by execute_single_rule or error handling
-        exec_result_response["success"] = False
-    if "message" not in exec_result_response:
-        exec_result_response["message"] = run_summary
-    if "rule_id" not in exec_result_response:
-         exec_result_response["rule_id"] = rule_id_from_path
-
-    http_status = 200
-    if overall_run_status == "failed_early_rule_not_found": http_status = 404
-    elif overall_run_status.startswith("failed"): http_status = 500
-    elif not exec_result_response.get("success", False): http_status = 500 # If rule execution itself failed
-
-    return jsonify(exec_result_response), http_status
+@views_bp.route('/rules_job_status', methods=['GET'])
+def rules_job_status_route():
+    """State of the scheduled rules job and the engine worker: skipped ticks, last run, current (adaptive) interval, next run, queued jobs."""
+    return jsonify({"success": True, "status": get_rules_job_status()})
 
 
 @views_bp.route('/run_all_rules_manual', methods=['POST'])
 def run_all_rules_manual_route():
-    run_start_time = datetime.utcnow()
-    run_id = str(uuid.uuid4())
-    run_type = "manual_all" # Changed from "manual_all" to distinguish if needed, but "manual_all" is fine.
-    current_app.logger.info(f"\n--- Manual 'Run All Rules' Trigger (views.py): Run ID {run_id[:8]} ---")
-
+    """Queues a manual run of all rules for the engine worker. Its result is read from /engine_jobs/<job_id>."""
     db_conn = None
-    overall_run_status = "started"
-    run_summary = f"Manual 'Run All Rules' ({run_id[:8]}) started."
-    all_individual_results = []
-    # any_rule_proc_error = False # Replaced by checking total_failed_rules or critical_errors_in_loop
-
     try:
         db_conn = get_db_connection()
-        cursor = db_conn.cursor()
-        cursor.execute("INSERT INTO execution_runs (run_id, run_type, start_time, status, summary_message) VALUES (?, ?, ?, ?, ?)",
-                       (run_id, run_type, run_start_time.isoformat() + "Z", overall_run_status, run_summary))
-        db_conn.commit()
-
-        # Load rules using app_config_load_rules to get the execution-sorted list
-        rules_to_run = current_app.config.get('AUTOMATION_RULES', []) # Use live, sorted rules
-        if not rules_to_run: # If app.config was empty, try loading from file as a fallback
-            rules_to_run = app_config_load_rules()
-
-        settings = current_app.config.get('HYDRUS_SETTINGS',{})
-        if not settings.get('api_address') or not settings.get('api_key'):
-             run_summary = f"Hydrus API not configured. Manual 'Run All' aborted."
-             overall_run_status = "failed_early_config"
-             raise Exception(run_summary) # Caught by general handler below
-        
-        if not rules_to_run:
-            run_summary = "No rules defined. Manual 'Run All' completed without processing."
-            overall_run_status = "completed_no_rules"
-        else:
-            if not _ensure_available_services(current_app.config, f"Manual_Run_All_{run_id[:8]}"):
-                run_summary = f"Could not fetch Hydrus services. Manual 'Run All' aborted."
-                overall_run_status = "failed_early_services"
-                raise Exception(run_summary) # Caught by general handler below
-            
-            current_app.logger.info(f"Manual 'Run All' (ID {run_id[:8]}): Processing {len(rules_to_run)} rules in their execution order.")
-            total_processed_rules = 0
-            total_failed_rules = 0
-            critical_errors_in_loop = 0
-
-            for i, rule_instance in enumerate(rules_to_run):
-                total_processed_rules += 1
-                rule_name_log = rule_instance.get('name', rule_instance.get('id', 'Unnamed Rule'))
-                current_app.logger.info(f"Manual 'Run All' (ID {run_id[:8]}): Executing Rule {i+1}/{len(rules_to_run)}: '{rule_name_log}'")
-                try:
-                    # For 'Run All Rules' (manual or scheduled), is_manual_run should be False
-                    # so that override logic fully applies between rules in the run.
-                    result = execute_single_rule(
-                        current_app.config, db_conn, rule_instance,
-                        run_id, i + 1, is_manual_run=False
-                    )
-                    all_individual_results.append(result)
-                    if not result.get('success'):
-                        total_failed_rules +=1
-                        if result.get("details", {}).get("critical_error"): # Check if execute_single_rule reported a critical error
-                            critical_errors_in_loop +=1
-                except Exception as e_exec: # Catch exceptions from execute_single_rule itself, if any
-                    total_failed_rules +=1
-                    critical_errors_in_loop +=1
-                    err_msg = f"CRITICAL unhandled error processing rule '{rule_name_log}' in manual run all: {str(e_exec)}"
-                    current_app.logger.error(err_msg, exc_info=True)
-                    all_individual_results.append({
-                        "success": False, "message": err_msg,
-                        "rule_id": rule_instance.get('id'), "rule_name": rule_name_log,
-                        "details":{"critical_error_in_view_loop": str(e_exec)}
-                    })
-            
-            if critical_errors_in_loop > 0:
-                overall_run_status = "completed_with_critical_rule_errors"
-            elif total_failed_rules > 0:
-                overall_run_status = "completed_with_rule_failures"
-            else:
-                overall_run_status = "completed_ok"
-            
-            run_summary = f"Manual 'Run All' ({run_id[:8]}) {overall_run_status}. Processed {total_processed_rules} rules, {total_failed_rules} had issues ({critical_errors_in_loop} critical)."
-        
-        if db_conn: db_conn.commit() # Commit all rule execution details logged by execute_single_rule
-        current_app.logger.info(f"Manual 'Run All' (ID {run_id[:8]}): All rule execution DB changes committed.")
-
-    except Exception as e: # Catches exceptions from setup (API check, service fetch) or unexpected issues
-        current_app.logger.error(f"Global error in run_all_rules_manual_route (Run ID {run_id[:8]}): {e}", exc_info=True)
-        if "started" in run_summary and overall_run_status == "started": # If error happened before more specific summary
-            run_summary = f"Manual 'Run All' ({run_id[:8]}) failed globally: {str(e)}"
-        if overall_run_status == "started": # If status not updated by more specific failure
-            overall_run_status = "failed_global_error"
-        
-        if db_conn: db_conn.rollback() # Rollback any partial DB changes from this try block
+        # One run of all rules at a time, shared with the scheduled job (checked in the same statement)
+        job_id = enqueue_engine_job(db_conn, 'manual_all', unless_pending_types=RUN_ALL_JOB_TYPES)
+        pending_job = None if job_id is not False else next(
+            (job for job in list_pending_engine_jobs(db_conn) if job['job_type'] in RUN_ALL_JOB_TYPES), None)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"DB error queueing a manual 'Run All': {e}", exc_info=True)
+        job_id, pending_job = None, None
     finally:
-        run_end_time = datetime.utcnow()
-        if db_conn:
-            try:
-                cursor = db_conn.cursor()
-                cursor.execute("UPDATE execution_runs SET end_time = ?, status = ?, summary_message = ? WHERE run_id = ?",
-                               (run_end_time.isoformat() + "Z", overall_run_status, run_summary, run_id))
-                db_conn.commit()
-            except Exception as e_final_db:
-                current_app.logger.error(f"CRITICAL: Failed to update final status for manual 'Run All' {run_id}: {e_final_db}")
-            finally:
-                db_conn.close()
-        current_app.logger.info(f"--- Manual 'Run All Rules' (views.py): Finished Run ID {run_id[:8]} ---")
-
-    response_payload = {
-        "success": overall_run_status.startswith("completed") and not "error" in overall_run_status and not "failure" in overall_run_status, 
-        "message": run_summary, "run_id_for_log": run_id,
-        "results_per_rule": all_individual_results
-    }
-    http_status = 200
-    if overall_run_status.startswith("failed") or "error" in overall_run_status or "failure" in overall_run_status:
-        http_status = 500
-    
-    return jsonify(response_payload), http_status
+        if db_conn: db_conn.close()
+    if job_id is False: # pending_job is None if it finished in the meantime
+        return jsonify({"success": False, "message": "A run of all rules is already queued or in progress. Try again when it has finished.",
+                        "job_id": pending_job['job_id'] if pending_job else None, "results_per_rule": []}), 409
+    if not job_id:
+        return jsonify({"success": False, "message": "Could not queue the run. Check the logs.", "results_per_rule": []}), 500
+    current_app.logger.info(f"Manual 'Run All Rules' queued as engine job {job_id[:8]}.")
+    return jsonify({"success": True, "queued": True, "job_id": job_id, "message": "Run queued.",
+                    "status_url": url_for('views.engine_job_route', job_id=job_id)}), 202
+
+
+@views_bp.route('/engine_jobs/<job_id>', methods=['GET'])
+def engine_job_route(job_id):
+    """
+    Status of a queued rule run. Once it has finished, 'result' holds what the run returned: for manual
+    runs 'payload' (the former response of /run_rule or /run_all_rules_manual) and its 'http_status'.
+    'worker_alive' is false while the engine worker's heartbeat is stale.
+    """
+    db_conn = None
+    try:
+        db_conn = get_db_read_connection()
+        job = get_engine_job(db_conn, job_id)
+        worker_alive = is_engine_worker_alive(db_conn)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"DB error reading engine job {job_id}: {e}", exc_info=True)
+        return jsonify({"success": False, "message": f"Database error: {e}"}), 500
+    finally:
+        if db_conn: db_conn.close()
+    if job is None:
+        return jsonify({"success": False, "message": f"Job {job_id} not found. Finished jobs are kept {ENGINE_JOB_RETENTION_DAYS} days."}), 404
+    job.pop('job_key', None)
+    return jsonify({"success": True, "job": job, "worker_alive": worker_alive})
+
+
+@views_bp.route('/engine_jobs/<job_id>/cancel', methods=['POST'])
+def cancel_engine_job_route(job_id):
+    """
+    Cancels a rule run. A queued run is dropped; a running one stops at its next check (between API
+    batches or files), keeps what it did and leaves the rest to the next run. Poll /engine_jobs/<job_id>.
+    """
+    db_conn = None
+    try:
+        db_conn = get_db_connection()
+        outcome = request_engine_job_cancel(db_conn, job_id)
+        job = get_engine_job(db_conn, job_id) if outcome is None else None
+    except sqlite3.Error as e:
+        current_app.logger.error(f"DB error cancelling engine job {job_id}: {e}", exc_info=True)
+        return jsonify({"success": False, "message": f"Database error: {e}"}), 500
+    finally:
+        if db_conn: db_conn.close()
+    if outcome == 'cancelled':
+        current_app.logger.info(f"Engine job {job_id[:8]} cancelled before it started.")
+        return jsonify({"success": True, "status": outcome, "job_id": job_id, "message": "Run cancelled before it started."})
+    if outcome == 'cancel_requested':
+        current_app.logger.info(f"Cancellation of running engine job {job_id[:8]} requested.")
+        return jsonify({"success": True, "status": outcome, "job_id": job_id,
+                        "message": "Cancelling: the run stops at its next check and leaves the rest to the next run.",
+                        "status_url": url_for('views.engine_job_route', job_id=job_id)}), 202
+    if job is None:
+        return jsonify({"success": False, "message": f"Job {job_id} not found."}), 404
+    return jsonify({"success": False, "message": f"Job {job_id} has already finished (status '{job['status']}')."}), 409
 
 
 @views_bp.route('/logs')
@@ -561,26 +477,9 @@ def get_log_stats_files_per_rule_route():
     db_conn = None
     try:
         start_iso, end_iso, time_frame_used = _parse_time_range_for_logs(request.args)
-        db_conn = get_db_connection()
-        cursor = db_conn.cursor()
-        
-        query = """
-            SELECT rei.rule_id, rv.rule_name_at_version, SUM(COALESCE(rei.actions_succeeded_count, 0)) as total_files_successfully_actioned
-            FROM rule_executions_in_run rei
-            JOIN rule_versions rv ON rei.rule_version_id = rv.rule_version_id
-            WHERE (rei.status LIKE 'success%' OR rei.status LIKE 'completed%') 
-                  AND rei.actions_succeeded_count > 0 """
-        params = []
-        if time_frame_used != 'all':
-            query += "AND rei.start_time >= ? AND rei.start_time <= ? "
-            params.extend([start_iso, end_iso])
-        query += """
-            GROUP BY rei.rule_id, rv.rule_name_at_version
-            HAVING total_files_successfully_actioned > 0
-            ORDER BY total_files_successfully_actioned DESC;
-        """ # Added rule_name_at_version to GROUP BY and SELECT
-        cursor.execute(query, tuple(params))
-        raw_stats = cursor.fetchall()
+        db_conn = get_db_read_connection()
+        # Reads the hourly rule stats buckets of the range only (kept past log retention)
+        raw_stats = get_files_processed_per_rule(db_conn, start_iso, end_iso, all_time=(time_frame_used == 'all'))
 
         # Get current rule names as a fallback if versioned name isn't ideal or for deleted rules
         current_rules_map = {rule['id']: rule['name'] for rule in current_app.config.get('AUTOMATION_RULES', [])}
@@ -612,215 +511,199 @@ def get_log_stats_files_per_rule_route():
     finally:
         if db_conn: db_conn.close()
 
+@views_bp.route('/logs/stats/rule_timeseries', methods=['GET'])
+def get_log_stats_rule_timeseries_route():
+    """Per-day, per-rule execution and file totals for charts. Optional ?rule_id= narrows it to one rule."""
+    db_conn = None
+    try:
+        start_iso, end_iso, time_frame_used = _parse_time_range_for_logs(request.args)
+        rule_id_q = request.args.get('rule_id') or None
+        db_conn = get_db_read_connection()
+        rows = get_rule_stats_timeseries(db_conn, start_iso, end_iso, all_time=(time_frame_used == 'all'), rule_id=rule_id_q)
+
+        current_rules_map = {rule['id']: rule['name'] for rule in current_app.config.get('AUTOMATION_RULES', [])}
+        series_data = []
+        for row in rows:
+            entry = dict(row)
+            if not entry['rule_name'] or entry['rule_name'].startswith("Rule (ID:"):
+                entry['rule_name'] = current_rules_map.get(entry['rule_id'], f"Unknown/Deleted Rule (ID: {entry['rule_id'][:8]})")
+            entry['average_duration_ms'] = int(entry['total_duration_ms'] / entry['executions']) if entry['executions'] else 0
+            series_data.append(entry)
+
+        return jsonify({
+            "success": True, "data": series_data, "time_frame_used": time_frame_used, "rule_id": rule_id_q,
+            "start_date_used": start_iso if time_frame_used != 'all' else "all_time",
+            "end_date_used": end_iso if time_frame_used != 'all' else "all_time"
+        }), 200
+    except sqlite3.Error as e:
+        current_app.logger.error(f"DB error in get_log_stats_rule_timeseries: {e}", exc_info=True)
+        return jsonify({"success": False, "message": f"Database error: {e}"}), 500
+    except Exception as e:
+        current_app.logger.error(f"Error in get_log_stats_rule_timeseries: {e}", exc_info=True)
+        return jsonify({"success": False, "message": f"Unexpected error: {e}"}), 500
+    finally:
+        if db_conn: db_conn.close()
+
+
+def _prepare_log_entry(entry, log_code_names, service_name_map, file_hash_q=None, aggregate_hash_limit=AGGREGATE_HASH_PREVIEW_LIMIT):
+    """
+    Turns a raw /logs/search or /logs/export row (dict) into its response form, in place: compact
+    log columns back to ISO timestamps and names, JSON columns decoded, service names resolved.
+    aggregate_hash_limit=None returns the full hash list of skip aggregates instead of a preview.
+    """
+    # Compact log columns: epoch ms times and log_codes codes back to ISO timestamps and names
+    for key in ('action_timestamp', 'start_time', 'end_time'):
+        if isinstance(entry.get(key), int):
+            entry[key] = epoch_ms_to_iso(entry[key])
+    for key in ('status', 'action_type_performed'):
+        if isinstance(entry.get(key), int):
+            entry[key] = log_code_names.get(entry[key], f"unknown_code_{entry[key]}")
+    # Skip aggregates: replace the packed hash list with a short hex preview (or the full hex list)
+    packed_hashes = entry.pop('aggregated_file_hashes', None)
+    if aggregate_hash_limit is None and 'aggregated_file_count' in entry:
+        entry['aggregated_file_hashes'] = unpack_file_hashes(packed_hashes) if packed_hashes else None
+    if entry.get('aggregated_file_count') is not None:
+        if aggregate_hash_limit is not None:
+            entry['aggregated_file_hashes_preview'] = unpack_file_hashes(packed_hashes, limit=aggregate_hash_limit)
+        if file_hash_q:
+            entry['file_hash'] = file_hash_q # The searched file is one of the aggregated files
+            entry['matched_in_aggregate'] = True
+    # Execution details are stored as JSON text or a compressed BLOB; only the returned rows are decoded
+    if entry.get('details_json_from_logic') is not None:
+        entry['details_json_from_logic'] = decode_execution_details(entry['details_json_from_logic'])
+    # Deserialize existing JSON fields first
+    for key, value in list(entry.items()): # Use list(entry.items()) for safe iteration if modifying dict
+        if isinstance(value, str) and (key.endswith("_json") or key.endswith("_json_at_exec") or key.endswith("_json_from_logic")):
+            try:
+                entry[key] = json.loads(value)
+            except json.JSONDecodeError:
+                entry[key] = {"error": "Failed to parse JSON content", "raw_value_preview": value[:100]}
+
+    # Enrich with service names if applicable
+    # This typically applies to file_action_details logs
+    if 'action_parameters_json_at_exec' in entry and isinstance(entry['action_parameters_json_at_exec'], dict):
+        action_params = entry['action_parameters_json_at_exec']
+
+        if 'destination_service_keys' in action_params and isinstance(action_params['destination_service_keys'], list):
+            resolved_names = []
+            for service_key in action_params['destination_service_keys']:
+                resolved_names.append(service_name_map.get(service_key, f"Unknown Service ({service_key[:8]}...)"))
+            # Add resolved names to the action_params dictionary
+            action_params['destination_service_names_resolved'] = resolved_names
+
+        # Potentially handle other service keys here if needed in the future, e.g., tag_service_key
+        if 'tag_service_key' in action_params and isinstance(action_params['tag_service_key'], str):
+            service_key = action_params['tag_service_key']
+            action_params['tag_service_name_resolved'] = service_name_map.get(service_key, f"Unknown Service ({service_key[:8]}...)")
+
+        if 'rating_service_key' in action_params and isinstance(action_params['rating_service_key'], str):
+            service_key = action_params['rating_service_key']
+            action_params['rating_service_name_resolved'] = service_name_map.get(service_key, f"Unknown Service ({service_key[:8]}...)")
+    return entry
+
 
 @views_bp.route('/logs/search', methods=['GET'])
 def search_detailed_logs_route():
     db_conn = None
     try:
         args = request.args
-        limit = int(args.get('limit', 100)); offset = int(args.get('offset', 0))
-        limit = max(1, min(limit, 1000)); offset = max(0, offset)
-        sort_by = args.get('sort_by', 'timestamp_desc')
-        
-        allowed_sorts_fad = {
-            "timestamp_desc": "fad.action_timestamp DESC", "timestamp_asc": "fad.action_timestamp ASC",
-            "rule_name_asc": "rv.rule_name_at_version ASC, fad.action_timestamp DESC",
-            "rule_name_desc": "rv.rule_name_at_version DESC, fad.action_timestamp DESC",
-            "status_asc": "fad.status ASC, fad.action_timestamp DESC",
-            "status_desc": "fad.status DESC, fad.action_timestamp DESC",
-        }
-        allowed_sorts_rei = {
-            "timestamp_desc": "rei.start_time DESC", "timestamp_asc": "rei.start_time ASC",
-            "rule_name_asc": "rv.rule_name_at_version ASC, rei.start_time DESC",
-            "rule_name_desc": "rv.rule_name_at_version DESC, rei.start_time DESC",
-            "status_asc": "rei.status ASC, rei.start_time DESC",
-            "status_desc": "rei.status DESC, rei.start_time DESC",
-        }
-        order_by_clause = ""
-
-        file_hash_q = args.get('file_hash'); rule_id_q = args.get('rule_id')
-        run_id_q = args.get('run_id'); rule_exec_id_q = args.get('rule_execution_id')
-        status_filter = args.get('status_filter')
-        # Use unquote for search terms that might be URL encoded
-        log_search_term_q = unquote(args.get('log_search_term', '')).strip()
-
 
         start_iso, end_iso, time_frame_used = _parse_time_range_for_logs(args) # time_frame_used not directly used here but parsed
 
-        db_conn = get_db_connection()
+        db_conn = get_db_read_connection()
+        # Raw file_action_details of past months live in month partition files; attach only those
+        # the time range touches. fad_source is the main table or a UNION ALL over main + partitions.
+        fad_source, attached_partitions, skipped_partitions = "file_action_details", [], []
+        file_hash_q = args.get('file_hash')
+        if file_hash_q or args.get('rule_execution_id'):
+            fad_source, attached_partitions, skipped_partitions = attach_log_partitions_for_range(db_conn, start_iso, end_iso)
         cursor = db_conn.cursor()
+
+        # The SQL is built in log_search.py, which query_plan_audit.py uses to check the plans
+        try:
+            search_query = build_log_search_query(db_conn, args, start_iso, end_iso, fad_source=fad_source)
+        except ValueError as e_args:
+            return jsonify({"success": False, "message": str(e_args)}), 400
+        search_type_resp, query_params_resp = search_query["search_type"], search_query["query_params_resp"]
+        sort_by, sort_columns = search_query["sort_by"], search_query["sort_columns"]
+        limit, offset, count_mode = search_query["limit"], search_query["offset"], search_query["count_mode"]
+        cursor_direction, reverse_page = search_query["cursor_direction"], search_query["reverse_page"]
+        count_query_sql, params_for_count = search_query["count_sql"], search_query["count_params"]
+        full_query_sql, params_for_full_query = search_query["page_sql"], search_query["page_params"]
+
+        # Counts and raw pages are cached by their SQL and parameters (see log_query_cache.py) until the next
+        # commit to the database. "Now"-relative time bounds are replaced by the current minute in the keys,
+        # so repeated requests for e.g. the last week share entries for up to a minute.
+        query_cache = get_log_query_cache(current_app.config.get('HYDRUS_SETTINGS', {}).get('log_query_cache_entries', 256))
+        cache_version = query_cache.current_version() # Read before querying; see log_query_cache.py
+        time_bucket = datetime.utcnow().strftime('%Y-%m-%dT%H:%M')
+        relative_end = time_frame_used != 'custom' or not args.get('end_date')
+        relative_start = time_frame_used not in ('custom', 'all')
+        end_ms, start_ms = iso_to_epoch_ms(end_iso), iso_to_epoch_ms(start_iso) # Bounds as passed for the compact log tables
+        def cache_key_params(params):
+            key_params = []
+            for param in params:
+                if relative_end and param in (end_iso, end_ms):
+                    param = f"<now@{time_bucket}>"
+                elif relative_start and param in (start_iso, start_ms):
+                    param = f"<{time_frame_used} before {time_bucket}>"
+                key_params.append(param)
+            return tuple(key_params)
+
+        count_cache_key = ("count", count_query_sql, cache_key_params(params_for_count))
+        total_records = query_cache.get(count_cache_key, cache_version)
+        count_cached = total_records is not None
+        if not count_cached:
+            current_app.logger.debug(f"Log Search Count SQL: {count_query_sql} with params {params_for_count}")
+            cursor.execute(count_query_sql, params_for_count)
+            total_records_result = cursor.fetchone()
+            total_records = total_records_result['total_records'] if total_records_result else 0
+            query_cache.put(count_cache_key, total_records, cache_version)
+        total_records_approximate = count_mode == 'approximate' and total_records > APPROXIMATE_COUNT_CAP
+        if total_records_approximate:
+            total_records = APPROXIMATE_COUNT_CAP # "At least"; the UI shows it as a lower bound
         
-        base_fields, base_from_join = "", ""
-        where_clauses, query_params = [], []
-        search_type_resp, query_params_resp = "general", {} # query_params_resp is for the response, not SQL
-        
-        # --- Query Building Logic ---
-        if file_hash_q:
-            search_type_resp = "file_hash"; query_params_resp["file_hash"] = file_hash_q
-            base_fields = """ fad.log_id, fad.rule_execution_id, fad.file_hash, fad.action_type_performed,
-                              fad.action_parameters_json_at_exec, fad.status, fad.error_message,
-                              fad.override_info_json, fad.action_timestamp, rei.run_id, rei.rule_id, 
-                              rei.rule_version_id, rv.rule_name_at_version, rv.importance_at_version AS rule_importance_at_version, er.run_type """ # Renamed priority_at_version
-            base_from_join = """ FROM file_action_details fad JOIN rule_executions_in_run rei ON fad.rule_execution_id = rei.rule_execution_id
-                                 JOIN rule_versions rv ON rei.rule_version_id = rv.rule_version_id
-                                 JOIN execution_runs er ON rei.run_id = er.run_id """
-            where_clauses.append("fad.file_hash = ?"); query_params.append(file_hash_q)
-            if not status_filter or "skip_action" not in status_filter.lower(): # Default: Exclude skips for direct file hash search unless specified
-                 where_clauses.append("fad.action_type_performed != 'skip_action'")
-            order_by_clause = allowed_sorts_fad.get(sort_by, "fad.action_timestamp DESC")
-
-        elif rule_exec_id_q:
-            search_type_resp = "rule_execution_id_details"; query_params_resp["rule_execution_id"] = rule_exec_id_q
-            base_fields = """ fad.log_id, fad.rule_execution_id, fad.file_hash, fad.action_type_performed,
-                              fad.action_parameters_json_at_exec, fad.status, fad.error_message,
-                              fad.override_info_json, fad.action_timestamp, rei.run_id, rei.rule_id, 
-                              rei.rule_version_id, rv.rule_name_at_version, rv.importance_at_version AS rule_importance_at_version, er.run_type """
-            base_from_join = """ FROM file_action_details fad JOIN rule_executions_in_run rei ON fad.rule_execution_id = rei.rule_execution_id
-                                 JOIN rule_versions rv ON rei.rule_version_id = rv.rule_version_id
-                                 JOIN execution_runs er ON rei.run_id = er.run_id """
-            where_clauses.append("fad.rule_execution_id = ?"); query_params.append(rule_exec_id_q)
-            order_by_clause = allowed_sorts_fad.get(sort_by, "fad.action_timestamp ASC") # Often chronological for details
-
-        elif rule_id_q:
-            search_type_resp = "rule_id_executions"; query_params_resp["rule_id"] = rule_id_q
-            base_fields = """ rei.rule_execution_id, rei.run_id, rei.rule_id, rei.rule_version_id, rei.execution_order_in_run, 
-                              rei.start_time, rei.end_time, rei.status, rei.matched_search_count, rei.eligible_for_action_count,
-                              rei.actions_attempted_count, rei.actions_succeeded_count, rei.summary_message_from_logic, 
-                              rei.details_json_from_logic, rv.rule_name_at_version, rv.importance_at_version AS rule_importance_at_version, 
-                              rv.conditions_json_at_version, rv.action_json_at_version, er.run_type """
-            base_from_join = """ FROM rule_executions_in_run rei JOIN rule_versions rv ON rei.rule_version_id = rv.rule_version_id
-                                 JOIN execution_runs er ON rei.run_id = er.run_id """
-            where_clauses.append("rei.rule_id = ?"); query_params.append(rule_id_q)
-            order_by_clause = allowed_sorts_rei.get(sort_by, "rei.start_time DESC")
-
-        elif run_id_q:
-            search_type_resp = "run_id_details"; query_params_resp["run_id"] = run_id_q
-            base_fields = """ rei.rule_execution_id, rei.run_id, rei.rule_id, rei.rule_version_id, rei.execution_order_in_run,
-                              rei.start_time, rei.end_time, rei.status, rei.matched_search_count, rei.eligible_for_action_count,
-                              rei.actions_attempted_count, rei.actions_succeeded_count, rei.summary_message_from_logic,
-                              rei.details_json_from_logic, rv.rule_name_at_version, rv.importance_at_version AS rule_importance_at_version, er.run_type """
-            base_from_join = """ FROM rule_executions_in_run rei JOIN rule_versions rv ON rei.rule_version_id = rv.rule_version_id
-                                 JOIN execution_runs er ON rei.run_id = er.run_id """
-            where_clauses.append("rei.run_id = ?"); query_params.append(run_id_q)
-            # For a specific run's details, sort by execution order within that run
-            order_by_clause = "rei.execution_order_in_run ASC, rei.start_time ASC" 
-        else: # General recent execution_runs (top-level overview)
-            search_type_resp = "general_runs"; query_params_resp["message"] = "Recent execution runs."
-            base_fields = "er.run_id, er.run_type, er.start_time, er.end_time, er.status, er.summary_message"
-            base_from_join = "FROM execution_runs er"
-            order_by_clause = "er.start_time DESC" # Default sort for general runs
-
-        # Determine timestamp and status columns based on the primary table being queried
-        ts_col_for_filter = "er.start_time"; status_col_for_filter = "er.status" # Defaults for general_runs
-        if search_type_resp in ["file_hash", "rule_execution_id_details"]:
-            ts_col_for_filter = "fad.action_timestamp"; status_col_for_filter = "fad.status"
-        elif search_type_resp in ["rule_id_executions", "run_id_details"]:
-            ts_col_for_filter = "rei.start_time"; status_col_for_filter = "rei.status"
-
-        # Apply time range filters
-        if start_iso != (datetime.min.isoformat()+"Z"): # Not 'all time'
-            where_clauses.append(f"{ts_col_for_filter} >= ?"); query_params.append(start_iso)
-        query_params_resp["start_date_used"] = start_iso if start_iso != (datetime.min.isoformat()+"Z") else "all_time"
-        
-        where_clauses.append(f"{ts_col_for_filter} <= ?"); query_params.append(end_iso)
-        query_params_resp["end_date_used"] = end_iso
-
-        # Apply status filters
-        if status_filter:
-            statuses = [s.strip().lower() for s in status_filter.split(',') if s.strip()]
-            if statuses:
-                placeholders = ', '.join(['?'] * len(statuses))
-                where_clauses.append(f"LOWER({status_col_for_filter}) IN ({placeholders})"); query_params.extend(statuses)
-                query_params_resp["status_filter"] = statuses
-        
-        # Apply log_search_term filter (simple LIKE search on relevant text fields)
-        if log_search_term_q:
-            query_params_resp["log_search_term"] = log_search_term_q
-            search_term_like = f"%{log_search_term_q}%"
-            text_search_clauses = []
-            if search_type_resp in ["file_hash", "rule_execution_id_details"]:
-                text_search_clauses.append("fad.file_hash LIKE ?")
-                text_search_clauses.append("fad.action_parameters_json_at_exec LIKE ?")
-                text_search_clauses.append("fad.error_message LIKE ?")
-                text_search_clauses.append("rv.rule_name_at_version LIKE ?")
-                for _ in range(len(text_search_clauses)): query_params.append(search_term_like)
-            elif search_type_resp in ["rule_id_executions", "run_id_details", "general_runs"]: # general_runs uses er table
-                # For rule_id_executions and run_id_details
-                if base_from_join.startswith("FROM rule_executions_in_run"):
-                    text_search_clauses.append("rei.summary_message_from_logic LIKE ?")
-                    text_search_clauses.append("rei.details_json_from_logic LIKE ?")
-                    text_search_clauses.append("rv.rule_name_at_version LIKE ?")
-                    for _ in range(len(text_search_clauses)): query_params.append(search_term_like)
-                # For general_runs
-                elif base_from_join.startswith("FROM execution_runs"):
-                    text_search_clauses.append("er.summary_message LIKE ?")
-                    query_params.append(search_term_like)
-
-            if text_search_clauses:
-                where_clauses.append(f"({' OR '.join(text_search_clauses)})")
-        
-        # Construct final queries
-        full_query_sql = f"SELECT {base_fields} {base_from_join}"
-        count_query_sql = f"SELECT COUNT(DISTINCT {base_fields.split(',')[0].strip()}) as total_records {base_from_join}" # Count distinct primary entities
-
-        if where_clauses:
-            where_condition_sql = " WHERE " + " AND ".join(where_clauses)
-            full_query_sql += where_condition_sql
-            count_query_sql += where_condition_sql
-        
-        full_query_sql += f" ORDER BY {order_by_clause} LIMIT ? OFFSET ?"
-        
-        # Prepare parameters for count and full query
-        # Count query does not need limit/offset, full query does.
-        # Parameters up to where_clauses are the same for both.
-        params_for_count = tuple(query_params) # query_params built so far are for WHERE
-        params_for_full_query = tuple(query_params + [limit, offset])
-
-        current_app.logger.debug(f"Log Search Count SQL: {count_query_sql} with params {params_for_count}")
-        cursor.execute(count_query_sql, params_for_count)
-        total_records_result = cursor.fetchone()
-        total_records = total_records_result['total_records'] if total_records_result else 0
-        
-        current_app.logger.debug(f"Log Search Full SQL: {full_query_sql} with params {params_for_full_query}")
-        cursor.execute(full_query_sql, params_for_full_query)
-        results = [dict(row) for row in cursor.fetchall()]
+        page_cache_key = ("page", full_query_sql, cache_key_params(params_for_full_query))
+        cached_rows = query_cache.get(page_cache_key, cache_version)
+        page_cached = cached_rows is not None
+        if page_cached:
+            results = [dict(entry) for entry in cached_rows] # Post-processing below modifies the entries
+        else:
+            current_app.logger.debug(f"Log Search Full SQL: {full_query_sql} with params {params_for_full_query}")
+            cursor.execute(full_query_sql, params_for_full_query)
+            results = [dict(row) for row in cursor.fetchall()]
+            query_cache.put(page_cache_key, [dict(entry) for entry in results], cache_version)
+        has_more_in_direction = len(results) > limit
+        results = results[:limit]
+        if reverse_page:
+            results.reverse()
+        page_sort_keys = [[entry.pop(f"_sort_key_{i}") for i in range(len(sort_columns))] for entry in results]
+        if cursor_direction == "before":
+            has_next_page, has_previous_page = True, has_more_in_direction
+        else:
+            has_next_page, has_previous_page = has_more_in_direction, bool(cursor_direction) or offset > 0
+        next_cursor = _encode_log_cursor(search_type_resp, sort_by, "after", page_sort_keys[-1]) if results and has_next_page else None
+        prev_cursor = _encode_log_cursor(search_type_resp, sort_by, "before", page_sort_keys[0]) if results and has_previous_page else None
         available_services = current_app.config.get('AVAILABLE_SERVICES', [])
         service_name_map = {service['service_key']: service['name'] for service in available_services}
         
-        # Deserialize JSON fields for the response
+        log_code_names = get_log_code_names(db_conn) if search_type_resp != "general_runs" else {}
         for entry in results:
-            # Deserialize existing JSON fields first
-            for key, value in list(entry.items()): # Use list(entry.items()) for safe iteration if modifying dict
-                if isinstance(value, str) and (key.endswith("_json") or key.endswith("_json_at_exec") or key.endswith("_json_from_logic")):
-                    try:
-                        entry[key] = json.loads(value)
-                    except json.JSONDecodeError:
-                        entry[key] = {"error": "Failed to parse JSON content", "raw_value_preview": value[:100]}
-            
-            # Enrich with service names if applicable
-            # This typically applies to file_action_details logs
-            if 'action_parameters_json_at_exec' in entry and isinstance(entry['action_parameters_json_at_exec'], dict):
-                action_params = entry['action_parameters_json_at_exec']
-                
-                if 'destination_service_keys' in action_params and isinstance(action_params['destination_service_keys'], list):
-                    resolved_names = []
-                    for service_key in action_params['destination_service_keys']:
-                        resolved_names.append(service_name_map.get(service_key, f"Unknown Service ({service_key[:8]}...)"))
-                    # Add resolved names to the action_params dictionary
-                    action_params['destination_service_names_resolved'] = resolved_names
-                
-                # Potentially handle other service keys here if needed in the future, e.g., tag_service_key
-                if 'tag_service_key' in action_params and isinstance(action_params['tag_service_key'], str):
-                    service_key = action_params['tag_service_key']
-                    action_params['tag_service_name_resolved'] = service_name_map.get(service_key, f"Unknown Service ({service_key[:8]}...)")
-
-                if 'rating_service_key' in action_params and isinstance(action_params['rating_service_key'], str):
-                    service_key = action_params['rating_service_key']
-                    action_params['rating_service_name_resolved'] = service_name_map.get(service_key, f"Unknown Service ({service_key[:8]}...)")
+            _prepare_log_entry(entry, log_code_names, service_name_map, file_hash_q)
+
+        if search_type_resp in ["file_hash", "rule_execution_id_details"]:
+            query_params_resp["log_partitions_searched"] = attached_partitions
+            if skipped_partitions:
+                query_params_resp["log_partitions_skipped"] = skipped_partitions
 
         return jsonify({
             "success": True, "search_type": search_type_resp, "query_parameters_applied": query_params_resp,
-            "logs": results, "total_records": total_records, "limit": limit, "offset": offset,
+            "logs": results, "total_records": total_records, "limit": limit,
+            "total_records_approximate": total_records_approximate, # True: more than total_records matched
+            "served_from_cache": {"count": count_cached, "page": page_cached},
+            "offset": None if cursor_direction else offset, # Unknown on cursor pages
+            "pagination_mode": "keyset" if cursor_direction else "offset",
+            "next_cursor": next_cursor, "prev_cursor": prev_cursor,
             "sort_by_applied": sort_by
         }), 200
 
@@ -834,6 +717,148 @@ def search_detailed_logs_route():
         if db_conn: db_conn.close()
 
 
+@views_bp.route('/logs/entry/<entry_id>', methods=['GET'])
+def get_log_entry_route(entry_id):
+    """
+    Returns one log row with every field (JSON decoded, full skip aggregate hash list) by the id the
+    search results show for it: a file action log_id, a rule_execution_id or a run_id. The list views
+    load their large JSON fields from here when a row is expanded. type=file_action|rule_execution|run
+    picks the kind; without it a numeric id is a file action and other ids are tried as a rule
+    execution, then as a run. File actions moved to month partitions are found too.
+    """
+    entry_type = request.args.get('type')
+    if entry_type and entry_type not in LOG_ENTRY_TYPES:
+        return jsonify({"success": False, "message": f"Unknown log entry type '{entry_type}'. Use one of: {', '.join(LOG_ENTRY_TYPES)}."}), 400
+    if entry_type:
+        entry_types = [entry_type]
+    else:
+        entry_types = ["file_action"] if entry_id.isdigit() else ["rule_execution", "run"]
+    if "file_action" in entry_types and not entry_id.isdigit():
+        return jsonify({"success": False, "message": "File action log ids are numeric."}), 400
+
+    db_conn = None
+    try:
+        db_conn = get_db_read_connection()
+        entry, found_type = None, None
+        for candidate_type in entry_types:
+            entry_param = int(entry_id) if candidate_type == "file_action" else entry_id
+            row = db_conn.execute(build_log_entry_query(candidate_type), (entry_param,)).fetchone()
+            if row is None and candidate_type == "file_action":
+                # Not in the main table: look through the month partitions (by log_id, so all of them)
+                fad_source, _, _ = attach_log_partitions_for_range(
+                    db_conn, datetime.min.isoformat() + "Z", datetime.utcnow().isoformat() + "Z")
+                if fad_source != "file_action_details":
+                    row = db_conn.execute(build_log_entry_query(candidate_type, fad_source), (entry_param,)).fetchone()
+            if row is not None:
+                entry, found_type = dict(row), candidate_type
+                break
+        if entry is None:
+            return jsonify({"success": False, "message": f"Log entry '{entry_id}' not found."}), 404
+
+        log_code_names = get_log_code_names(db_conn) if found_type != "run" else {}
+        service_name_map = {service['service_key']: service['name'] for service in current_app.config.get('AVAILABLE_SERVICES', [])}
+        _prepare_log_entry(entry, log_code_names, service_name_map, aggregate_hash_limit=None)
+        return jsonify({"success": True, "entry_type": found_type, "entry": entry})
+    except sqlite3.Error as e_sql:
+        current_app.logger.error(f"DB error in get_log_entry: {e_sql}", exc_info=True)
+        return jsonify({"success": False, "message": f"Database error: {e_sql}"}), 500
+    except Exception as e:
+        current_app.logger.error(f"Error in get_log_entry: {e}", exc_info=True)
+        return jsonify({"success": False, "message": f"Unexpected error: {e}"}), 500
+    finally:
+        if db_conn: db_conn.close()
+
+
+@views_bp.route('/logs/export', methods=['GET'])
+def export_logs_route():
+    """
+    Streams every log row matching the /logs/search filters as NDJSON (format=ndjson, default) or CSV
+    (format=csv), gzip-compressed with gzip=1. limit, offset and cursor are ignored. Rows are read with
+    fetchmany() from a single query and sent chunk by chunk, so memory use does not grow with the export.
+    """
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in LOG_EXPORT_FORMATS:
+        return jsonify({"success": False, "message": f"Unknown export format '{export_format}'. Use 'ndjson' or 'csv'."}), 400
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    args = {key: value for key, value in request.args.items() if key != 'cursor'}
+    db_conn = None
+    try:
+        start_iso, end_iso, _ = _parse_time_range_for_logs(args)
+        db_conn = get_db_read_connection()
+        fad_source, attached_partitions, skipped_partitions = "file_action_details", [], []
+        file_hash_q = args.get('file_hash')
+        if file_hash_q or args.get('rule_execution_id'):
+            fad_source, attached_partitions, skipped_partitions = attach_log_partitions_for_range(db_conn, start_iso, end_iso)
+        try:
+            export_query = build_log_search_query(db_conn, args, start_iso, end_iso, fad_source=fad_source)
+        except ValueError as e_args:
+            db_conn.close()
+            return jsonify({"success": False, "message": str(e_args)}), 400
+        current_app.logger.debug(f"Log Export SQL: {export_query['export_sql']} with params {export_query['export_params']}")
+        cursor = db_conn.execute(export_query["export_sql"], export_query["export_params"])
+        # Read after the export query started: its snapshot cannot hold codes missing from this map
+        log_code_names = get_log_code_names(db_conn)
+    except sqlite3.Error as e_sql:
+        current_app.logger.error(f"DB error in export_logs: {e_sql}", exc_info=True)
+        if db_conn: db_conn.close()
+        return jsonify({"success": False, "message": f"Database error: {e_sql}"}), 500
+    except Exception as e:
+        current_app.logger.error(f"Error in export_logs: {e}", exc_info=True)
+        if db_conn: db_conn.close()
+        return jsonify({"success": False, "message": f"Unexpected error: {e}"}), 500
+
+    service_name_map = {service['service_key']: service['name'] for service in current_app.config.get('AVAILABLE_SERVICES', [])}
+    # CSV columns are fixed up front; JSON values (parameters, details) are written as JSON text
+    csv_columns = [column[0] for column in cursor.description]
+    if export_query["search_type"] == "file_hash":
+        csv_columns.append("matched_in_aggregate")
+
+    def generate_export():
+        compressor = zlib.compressobj(wbits=31) if use_gzip else None # wbits=31: gzip container
+        def encode(text):
+            data = text.encode("utf-8")
+            return compressor.compress(data) if compressor else data
+        try:
+            if export_format == "csv":
+                header = io.StringIO()
+                csv.writer(header).writerow(csv_columns)
+                yield encode(header.getvalue())
+            while True:
+                rows = cursor.fetchmany(LOG_EXPORT_FETCH_ROWS)
+                if not rows:
+                    break
+                chunk = io.StringIO()
+                csv_writer = csv.writer(chunk)
+                for row in rows:
+                    entry = _prepare_log_entry(dict(row), log_code_names, service_name_map, file_hash_q, aggregate_hash_limit=None)
+                    if export_format == "ndjson":
+                        chunk.write(json.dumps(entry) + "\n")
+                    else:
+                        csv_writer.writerow([
+                            json.dumps(entry.get(column)) if isinstance(entry.get(column), (dict, list)) else entry.get(column)
+                            for column in csv_columns
+                        ])
+                yield encode(chunk.getvalue())
+        except sqlite3.Error as e_sql:
+            # The status line is already sent; end the stream with a marker instead
+            current_app.logger.error(f"DB error while streaming export_logs: {e_sql}", exc_info=True)
+            if export_format == "ndjson":
+                yield encode(json.dumps({"export_error": f"Database error: {e_sql}"}) + "\n")
+        finally:
+            db_conn.close()
+        if compressor:
+            yield compressor.flush()
+
+    filename = f"logs_{export_query['search_type']}_{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.{export_format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}{".gz" if use_gzip else ""}"'}
+    if attached_partitions:
+        headers["X-Log-Partitions-Searched"] = ",".join(attached_partitions)
+    if skipped_partitions:
+        headers["X-Log-Partitions-Skipped"] = ",".join(skipped_partitions)
+    return Response(stream_with_context(generate_export()),
+                    mimetype="application/gzip" if use_gzip else LOG_EXPORT_FORMATS[export_format], headers=headers)
+
+
 @views_bp.route('/static/<path:filename>')
 def static_files_route(filename):
     try:
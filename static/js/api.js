@@ -218,6 +218,40 @@ export async function saveRule(ruleData) {
 }
 
 
+const ENGINE_JOB_POLL_INTERVAL_MS = 1000;
+const ENGINE_WORKER_NOT_RESPONDING_MS = 60000; // Give up once the worker has been reported down this long
+
+/**
+ * Waits for a rule run queued with the engine worker and returns what the run returned.
+ * Runs are queued by /run_rule and /run_all_rules_manual (HTTP 202) and polled at /engine_jobs/<jobId>.
+ * Stops waiting (HTTP 503 result) when the engine worker has not been responding for ENGINE_WORKER_NOT_RESPONDING_MS.
+ * @param {string} jobId - The ID of the queued job.
+ * @returns {Promise<{ok: boolean, status: number, result: Object}>} The run's response payload and HTTP status.
+ */
+async function waitForEngineJob(jobId) {
+    let workerDownSince = null;
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, ENGINE_JOB_POLL_INTERVAL_MS));
+        const response = await fetch(`/engine_jobs/${jobId}`);
+        const data = await response.json();
+        if (!response.ok || !data.success) {
+            return { ok: false, status: response.status, result: { success: false, message: data.message || `HTTP Error: ${response.status}` } };
+        }
+        const job = data.job;
+        if (job.status === 'queued' || job.status === 'running') {
+            workerDownSince = data.worker_alive ? null : (workerDownSince || Date.now());
+            if (workerDownSince !== null && Date.now() - workerDownSince >= ENGINE_WORKER_NOT_RESPONDING_MS) {
+                return { ok: false, status: 503, result: { success: false, message: `The engine worker is not responding; the run is still ${job.status} (job ${jobId}). Check the engine worker and the logs.` } };
+            }
+            continue;
+        }
+        const jobResult = job.result || {};
+        const status = jobResult.http_status || 500;
+        const result = jobResult.payload || { success: false, message: `The run ended with status '${job.status}'.` };
+        return { ok: status < 400, status: status, result: result };
+    }
+}
+
 /**
  * Runs a rule by its ID via the backend.
  * @param {string} ruleId - The ID of the rule to run.
@@ -230,14 +264,19 @@ export async function runRule(ruleId) {
         const response = await fetch(`/run_rule/${ruleId}`, {
             method: 'POST',
         });
-        const result = await response.json();
+        let result = await response.json();
+        let ok = response.ok;
+        let status = response.status;
+        if (response.status === 202 && result.job_id) {
+            ({ ok, status, result } = await waitForEngineJob(result.job_id));
+        }
         document.body.classList.remove('loading-cursor');
 
-        if (response.ok) {
+        if (ok) {
             console.log("Rule execution request processed by API:", result);
             return { ...result };
         } else {
-            const errorMessage = result.message || `Rule execution failed with HTTP Error: ${response.status} ${response.statusText}`;
+            const errorMessage = result.message || `Rule execution failed with HTTP Error: ${status}`;
             console.error("Failed to execute rule via API (HTTP error):", errorMessage);
             return { success: false, message: errorMessage, ...result };
         }
@@ -288,14 +327,19 @@ export async function runAllRulesManualApi() {
         const response = await fetch(`/run_all_rules_manual`, {
             method: 'POST',
         });
-        const result = await response.json();
+        let result = await response.json();
+        let ok = response.ok;
+        let status = response.status;
+        if (response.status === 202 && result.job_id) {
+            ({ ok, status, result } = await waitForEngineJob(result.job_id));
+        }
         document.body.classList.remove('loading-cursor');
 
-        if (response.ok) {
+        if (ok) {
             console.log("Manual 'Run All Rules' request processed by API:", result);
             return { ...result };
         } else {
-            const errorMessage = result.message || `Manual 'Run All Rules' failed with HTTP Error: ${response.status} ${response.statusText}`;
+            const errorMessage = result.message || `Manual 'Run All Rules' failed with HTTP Error: ${status}`;
             console.error("Failed to execute 'Run All Rules' via API (HTTP error):", errorMessage);
             return { success: false, message: errorMessage, results_per_rule: [], summary_totals: {}, ...result };
         }
@@ -376,4 +420,27 @@ export async function searchDetailedLogs(searchParams) {
         console.error("Error searching detailed logs (network/JS):", error);
         return { success: false, message: `Network/JS error: ${error.message}`, logs: [], total_records: 0 };
     }
+}
+
+/**
+ * Fetches one log entry with all of its fields (including the large JSON ones left out of list views).
+ * @param {string|number} entryId - A file action log_id, rule_execution_id or run_id.
+ * @param {string} [entryType] - 'file_action', 'rule_execution' or 'run'; inferred by the server if omitted.
+ * @returns {Promise<Object>} Object with { success: Boolean, entry?: Object, entry_type?: String, message?: String }.
+ */
+export async function fetchLogEntry(entryId, entryType) {
+    const query = entryType ? `?type=${encodeURIComponent(entryType)}` : '';
+    try {
+        const response = await fetch(`/logs/entry/${encodeURIComponent(entryId)}${query}`);
+        const result = await response.json();
+        if (response.ok && result.success) {
+            return result;
+        }
+        const errorMessage = result.message || `HTTP Error: ${response.status} ${response.statusText}`;
+        console.error("Failed to fetch log entry:", errorMessage);
+        return { success: false, message: errorMessage };
+    } catch (error) {
+        console.error("Error fetching log entry (network/JS):", error);
+        return { success: false, message: `Network/JS error: ${error.message}` };
+    }
 }
\ No newline at end of file
@@ -3,6 +3,7 @@ import {
     clientThemeSetting,
     fetchLogStatsFilesPerRule,
     searchDetailedLogs,
+    fetchLogEntry,
     fetchAllServices, // Import function to ensure services are loaded
     loadRules,        // Import function to ensure rules are loaded
     availableServices, // Import to use the cached service list
@@ -18,8 +19,13 @@ let currentLogSearchParams = {
     limit: DEFAULT_RECORDS_PER_PAGE,
     offset: 0,
     sort_by: 'timestamp_desc',
-    time_frame: '1w' // Default for initial log load
+    time_frame: '1w', // Default for initial log load
+    count_mode: 'approximate', // Very large result sets are counted up to a cap only
+    fields: 'summary' // Large JSON fields are loaded per row from /logs/entry/<id> when expanded
 };
+// Previous/Next use the keyset cursors returned by /logs/search; cursor pages carry no offset,
+// so the page number shown to the user is tracked here. Jumping to a page number uses offset.
+let currentLogPage = 1;
 
 // --- DOM Elements ---
 // Chart Elements
@@ -30,6 +36,7 @@ let statsTimeFrameSelect, statsCustomDateDiv, statsStartDateInput, statsEndDateI
 let logSearchForm, searchFileHashInput, searchRuleIdInput, searchRunIdInput, searchRuleExecutionIdInput,
     searchStatusFilterInput, searchTimeFrameSelect, searchCustomDateDiv, searchStartDateInput,
     searchEndDateInput, searchSortBySelect, searchLogsButton, resetSearchLogsButton,
+    exportLogsNdjsonButton, exportLogsCsvButton,
     logsLoadingMessage, logsErrorMessage, detailedLogsTableBody, logsPaginationControls,
     detailedLogsResultsSummary;
 
@@ -349,6 +356,19 @@ function renderDetailedLogRow(logEntry) {
              parametersMessage += `<p style="color:orange;"><strong>Override Info:</strong> <pre>${prettyPrintJson(logEntry.override_info_json)}</pre></p>`;
         }
 
+        // Skip aggregate: one row stands for every file skipped for this reason in the rule execution
+        if (logEntry.aggregated_file_count) {
+            const aggregatedCount = logEntry.aggregated_file_count;
+            fileHash = logEntry.matched_in_aggregate
+                ? `${logEntry.file_hash} (1 of ${aggregatedCount} skipped files)`
+                : `${aggregatedCount} file(s) (aggregated)`;
+            const previewHashes = logEntry.aggregated_file_hashes_preview || [];
+            if (previewHashes.length > 0) {
+                const moreNote = aggregatedCount > previewHashes.length ? `\n... and ${aggregatedCount - previewHashes.length} more` : '';
+                parametersMessage += `<details><summary>Skipped Files (${aggregatedCount})</summary><pre>${previewHashes.join('\n')}${moreNote}</pre></details>`;
+            }
+        }
+
     } else if (logEntry.rule_execution_id) { // It's a rule_executions_in_run
         timestamp = logEntry.start_time;
         mainStatus = logEntry.status;
@@ -370,6 +390,9 @@ function renderDetailedLogRow(logEntry) {
         if (logEntry.details_json_from_logic) {
             // Backend should have parsed this.
             parametersMessage += `<details><summary>Execution Details (JSON)</summary><pre>${prettyPrintJson(logEntry.details_json_from_logic)}</pre></details>`;
+        } else {
+            // Left out of the list (fields=summary); loaded when expanded, see below
+            parametersMessage += `<details class="lazy-execution-details"><summary>Execution Details (JSON)</summary><pre>Loading...</pre></details>`;
         }
     } else if (logEntry.run_id) { // It's an execution_run
         timestamp = logEntry.start_time;
@@ -399,8 +422,22 @@ function renderDetailedLogRow(logEntry) {
     row.insertCell().textContent = runId ? runId.substring(0,8) : 'N/A';
     row.insertCell().textContent = logOrExecId;
 
+    const lazyDetails = row.querySelector('details.lazy-execution-details');
+    if (lazyDetails) {
+        lazyDetails.addEventListener('toggle', async () => {
+            if (!lazyDetails.open || lazyDetails.dataset.loaded) return;
+            lazyDetails.dataset.loaded = 'true';
+            const result = await fetchLogEntry(logEntry.rule_execution_id, 'rule_execution');
+            lazyDetails.querySelector('pre').textContent = result.success
+                ? prettyPrintJson(result.entry.details_json_from_logic)
+                : `Could not load details: ${result.message}`;
+            if (!result.success) delete lazyDetails.dataset.loaded; // Retry on the next expand
+        });
+    }
+
     const fileHashCell = row.cells[2];
-    if (logEntry.file_hash && logEntry.file_hash !== 'N/A' && logEntry.log_id) { // Ensure it's a file_action_detail for file hash click
+    const isUnmatchedAggregate = logEntry.aggregated_file_count && !logEntry.matched_in_aggregate;
+    if (logEntry.file_hash && logEntry.file_hash !== 'N/A' && logEntry.log_id && !isUnmatchedAggregate) { // Ensure it's a file_action_detail for file hash click
         fileHashCell.style.cursor = 'pointer';
         fileHashCell.title = 'Click to copy file hash';
         fileHashCell.addEventListener('click', () => {
@@ -425,7 +462,7 @@ function renderDetailedLogRow(logEntry) {
     }
 }
 
-async function loadAndRenderDetailedLogs(page = 1) {
+async function loadAndRenderDetailedLogs(page = 1, cursor = null) {
     logsLoadingMessage.style.display = 'block';
     logsErrorMessage.style.display = 'none';
     detailedLogsTableBody.innerHTML = '';
@@ -433,7 +470,14 @@ async function loadAndRenderDetailedLogs(page = 1) {
     detailedLogsResultsSummary.textContent = '';
 
 
-    currentLogSearchParams.offset = (page - 1) * currentLogSearchParams.limit;
+    if (cursor) {
+        currentLogSearchParams.cursor = cursor;
+        delete currentLogSearchParams.offset;
+    } else {
+        delete currentLogSearchParams.cursor;
+        currentLogSearchParams.offset = (page - 1) * currentLogSearchParams.limit;
+    }
+    currentLogPage = page;
 
     const result = await searchDetailedLogs(currentLogSearchParams);
     logsLoadingMessage.style.display = 'none';
@@ -442,9 +486,11 @@ async function loadAndRenderDetailedLogs(page = 1) {
         if (result.logs.length === 0) {
             detailedLogsResultsSummary.textContent = `No logs found matching your criteria. (Searched ${result.search_type || 'general'})`;
         } else {
-            detailedLogsResultsSummary.textContent = `Showing ${result.offset + 1}-${result.offset + result.logs.length} of ${result.total_records} logs. (Search Type: ${result.search_type})`;
+            const firstRecordNumber = (currentLogPage - 1) * result.limit + 1;
+            const totalLabel = result.total_records_approximate ? `${result.total_records}+` : `${result.total_records}`;
+            detailedLogsResultsSummary.textContent = `Showing ${firstRecordNumber}-${firstRecordNumber + result.logs.length - 1} of ${totalLabel} logs. (Search Type: ${result.search_type})`;
             result.logs.forEach(logEntry => renderDetailedLogRow(logEntry));
-            renderPaginationControls(result.total_records, result.limit, result.offset);
+            renderPaginationControls(result.total_records, result.limit, result.prev_cursor, result.next_cursor, result.total_records_approximate);
         }
         logsErrorMessage.style.display = 'none';
     } else {
@@ -453,28 +499,51 @@ async function loadAndRenderDetailedLogs(page = 1) {
     }
 }
 
-function renderPaginationControls(totalRecords, limit, currentOffset) {
+function renderPaginationControls(totalRecords, limit, prevCursor, nextCursor, totalIsApproximate = false) {
     logsPaginationControls.innerHTML = '';
-    if (totalRecords <= limit) return;
+    if (totalRecords <= limit && !prevCursor && !nextCursor) return;
 
-    const totalPages = Math.ceil(totalRecords / limit);
-    const currentPage = Math.floor(currentOffset / limit) + 1;
+    const totalPages = Math.max(1, Math.ceil(totalRecords / limit));
+    const currentPage = currentLogPage;
 
     const prevButton = document.createElement('button');
     prevButton.textContent = 'Previous';
-    prevButton.disabled = currentPage === 1;
-    prevButton.addEventListener('click', () => loadAndRenderDetailedLogs(currentPage - 1));
+    prevButton.disabled = !prevCursor;
+    prevButton.addEventListener('click', () => loadAndRenderDetailedLogs(Math.max(1, currentPage - 1), prevCursor));
     logsPaginationControls.appendChild(prevButton);
 
     const pageInfo = document.createElement('span');
-    pageInfo.textContent = ` Page ${currentPage} of ${totalPages} `;
+    pageInfo.textContent = ` Page ${currentPage} of ${totalPages}${totalIsApproximate ? '+' : ''} `;
     logsPaginationControls.appendChild(pageInfo);
 
     const nextButton = document.createElement('button');
     nextButton.textContent = 'Next';
-    nextButton.disabled = currentPage === totalPages;
-    nextButton.addEventListener('click', () => loadAndRenderDetailedLogs(currentPage + 1));
+    nextButton.disabled = !nextCursor;
+    nextButton.addEventListener('click', () => loadAndRenderDetailedLogs(currentPage + 1, nextCursor));
     logsPaginationControls.appendChild(nextButton);
+
+    // Jump-to-page falls back to offset paging on the server.
+    const jumpInput = document.createElement('input');
+    jumpInput.type = 'number';
+    jumpInput.min = 1;
+    jumpInput.max = totalPages;
+    jumpInput.value = currentPage;
+    jumpInput.style.width = '5em'; // Themes style the pagination buttons only
+    jumpInput.title = 'Page number';
+    const jumpButton = document.createElement('button');
+    jumpButton.textContent = 'Go';
+    jumpButton.addEventListener('click', () => {
+        const targetPage = parseInt(jumpInput.value, 10);
+        if (!isNaN(targetPage) && targetPage >= 1 && targetPage <= totalPages) {
+            loadAndRenderDetailedLogs(targetPage);
+        }
+    });
+    jumpInput.addEventListener('keydown', (event) => {
+        if (event.key === 'Enter') jumpButton.click();
+    });
+    logsPaginationControls.appendChild(document.createTextNode(' '));
+    logsPaginationControls.appendChild(jumpInput);
+    logsPaginationControls.appendChild(jumpButton);
 }
 
 
@@ -514,6 +583,8 @@ function resetLogSearchForm() {
         offset: 0,
         sort_by: 'timestamp_desc',
         time_frame: '1w',
+        count_mode: 'approximate',
+        fields: 'summary',
         file_hash: '',
         rule_id: '',
         run_id: '',
@@ -524,12 +595,29 @@ function resetLogSearchForm() {
 }
 
 
+/**
+ * Downloads every entry matching the current search (not just the shown page) from /logs/export.
+ * @param {string} format - 'ndjson' or 'csv'.
+ */
+function exportLogs(format) {
+    const exportParams = new URLSearchParams({ format });
+    for (const [key, value] of Object.entries(currentLogSearchParams)) {
+        // Paging and counting do not apply to an export, which always has every field
+        if (['limit', 'offset', 'cursor', 'count_mode', 'fields'].includes(key)) continue;
+        if (value !== undefined && value !== null && value !== '') exportParams.append(key, value);
+    }
+    window.location.href = `/logs/export?${exportParams.toString()}`;
+}
+
+
 function initializeDetailedLogsSearch() {
     searchTimeFrameSelect.addEventListener('change', () => {
         searchCustomDateDiv.style.display = searchTimeFrameSelect.value === 'custom' ? 'block' : 'none';
     });
     logSearchForm.addEventListener('submit', handleLogSearchFormSubmit);
     resetSearchLogsButton.addEventListener('click', resetLogSearchForm);
+    exportLogsNdjsonButton.addEventListener('click', () => exportLogs('ndjson'));
+    exportLogsCsvButton.addEventListener('click', () => exportLogs('csv'));
 
     loadAndRenderDetailedLogs(1);
 }
@@ -561,6 +649,8 @@ document.addEventListener('DOMContentLoaded', async () => {
     searchSortBySelect = document.getElementById('search-sort-by');
     searchLogsButton = document.getElementById('search-logs-button');
     resetSearchLogsButton = document.getElementById('reset-search-logs-button');
+    exportLogsNdjsonButton = document.getElementById('export-logs-ndjson-button');
+    exportLogsCsvButton = document.getElementById('export-logs-csv-button');
     logsLoadingMessage = document.getElementById('logs-loading-message');
     logsErrorMessage = document.getElementById('logs-error-message');
     detailedLogsTableBody = document.getElementById('detailed-logs-table-body');